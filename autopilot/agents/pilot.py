@@ -208,7 +208,9 @@ class Pilot(Agent):
                              upstream = self.name,
                              port = prefs.get('MSGPORT'),
                              listens = self.listens,
-                             instance=False)
+                             instance=False,
+                             # these block for as long as they're running, handle them in their own threads
+                             dispatch_policies = {'BANDWIDTH': 'thread', 'STREAM_VIDEO': 'thread'})
         self.logger.debug('pilot networking initialized')
 
         # if we need to set pins pulled up or down, do that now
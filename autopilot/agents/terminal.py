@@ -41,6 +41,7 @@ if __name__ == '__main__':
     prefs.init(prefs_file)
 
 from autopilot.data.subject import Subject
+from autopilot.data.service import Subject_Service, Subject_Dict, Subject_Proxy
 from autopilot.gui.plots.plot import Plot_Widget
 from autopilot.networking import Net_Node, Terminal_Station
 from autopilot.utils.invoker import get_invoker
@@ -90,6 +91,9 @@ class Terminal(QtWidgets.QMainWindow):
     | `'HANDSHAKE'` | :meth:`~.Terminal.l_handshake` | Pilot first contact, telling us it's alive and its IP  |
     +---------------+--------------------------------+--------------------------------------------------------+
 
+    ``'CAMERA_STATS'`` messages with timing statistics from cameras are handled by :meth:`~.Terminal.l_camera_stats`,
+    and the framerate and dropped frames of each camera are shown in its pilot's plot (see :meth:`.Plot.l_camera_stats` )
+
 
     .. note::
 
@@ -103,7 +107,9 @@ class Terminal(QtWidgets.QMainWindow):
     Attributes:
         node (:class:`~.networking.Net_Node`): Our Net_Node we use to communicate with our main networking object
         networking (:class:`~.networking.Terminal_Station`): Our networking object to communicate with the outside world
-        subjects (dict): A dictionary mapping subject ID to :class:`~.subject.Subject` object.
+        subjects (dict): A dictionary mapping subject ID to :class:`~.subject.Subject` object,
+            or to :class:`~.data.service.Subject_Proxy` objects if the ``SUBJECT_SERVICE`` pref is set.
+        subject_service (:class:`~.data.service.Subject_Service`): Process that owns subject files, if enabled.
         layout (:class:`QtWidgets.QGridLayout`): Layout used to organize widgets
         control_panel (:class:`~.gui.Control_Panel`): Control Panel to manage pilots and subjects
         data_panel (:class:`~.plots.Plot_Widget`): Plots for each pilot and subject.
@@ -134,7 +140,14 @@ class Terminal(QtWidgets.QMainWindow):
         self.heartbeat_dur = 10 # check every n seconds whether our pis are around still
 
         # data
-        self.subjects = {}  # Dict of our open subject objects
+        # if enabled, subject files are owned by a storage process and self.subjects holds proxies to them
+        self.subject_service = None
+        if prefs.get('SUBJECT_SERVICE'):
+            self.subject_service = Subject_Service()
+            self.subject_service.start()
+            self.subjects = Subject_Dict(self.subject_service)
+        else:
+            self.subjects = {}  # Dict of our open subject objects
 
         # gui
         self.layout = None
@@ -148,6 +161,9 @@ class Terminal(QtWidgets.QMainWindow):
         # property private attributes
         self._pilots = None
 
+        # latest :meth:`.Camera.stats` from each pilot's cameras, by (pilot, camera)
+        self.camera_stats = {} # type: typing.Dict[typing.Tuple[str, str], dict]
+
         # logging
         self.logger = init_logger(self)
 
@@ -159,7 +175,8 @@ class Terminal(QtWidgets.QMainWindow):
             'DATA' : self.l_data,
             'CONTINUOUS': self.l_data, # handle continuous data same way as other data
             'STREAM': self.l_data,
-            'HANDSHAKE': self.l_handshake # a pi is making first contact, telling us its IP
+            'HANDSHAKE': self.l_handshake, # a pi is making first contact, telling us its IP
+            'CAMERA_STATS': self.l_camera_stats # a camera is reporting its timing statistics
         }
 
         # Make invoker object to send GUI events back to the main thread
@@ -439,6 +456,20 @@ class Terminal(QtWidgets.QMainWindow):
         return self._pilots
 
 
+    def open_subject(self, name: str) -> typing.Union[Subject, Subject_Proxy]:
+        """
+        Open a subject, from the :class:`.Subject_Service` if ``SUBJECT_SERVICE`` is enabled.
+
+        Args:
+            name (str): subject ID
+
+        Returns:
+            :class:`.Subject` or :class:`.Subject_Proxy`
+        """
+        if self.subject_service is not None:
+            return self.subject_service.subject(name)
+        return Subject(name)
+
     @property
     def protocols(self) -> list:
         """
@@ -464,7 +495,7 @@ class Terminal(QtWidgets.QMainWindow):
         subjects_protocols = {}
         for subject in subjects:
             if subject not in self.subjects.keys():
-                self.subjects[subject] = Subject(subject)
+                self.subjects[subject] = self.open_subject(subject)
 
             try:
                 subjects_protocols[subject] = [self.subjects[subject].protocol.protocol_name, self.subjects[subject].protocol.step]
@@ -534,7 +565,7 @@ class Terminal(QtWidgets.QMainWindow):
             if ok:
                 # Ope'nr up if she aint
                 if subject not in self.subjects.keys():
-                    self.subjects[subject] = Subject(subject)
+                    self.subjects[subject] = self.open_subject(subject)
 
 
                 self.subjects[subject].update_weights(start=float(start_weight))
@@ -637,6 +668,29 @@ class Terminal(QtWidgets.QMainWindow):
         self.pilots[value['pilot']]['state'] = value['state']
         self.control_panel.panels[value['pilot']].button.set_state(value['state'])
 
+    def l_camera_stats(self, value):
+        """
+        A camera sent its timing statistics (see :meth:`.Camera.stats` ), keep the latest in :attr:`.camera_stats`
+        and warn if it dropped frames since the last report.
+
+        Args:
+            value (dict): camera stats, with ``pilot`` and ``camera`` names
+        """
+        key = (value.get('pilot'), value.get('camera'))
+        previous = self.camera_stats.get(key)
+        self.camera_stats[key] = value
+
+        dropped = value.get('dropped', {})
+        if previous is not None:
+            new_drops = {stage: n - previous.get('dropped', {}).get(stage, 0) for stage, n in dropped.items()}
+        else:
+            new_drops = dict(dropped)
+        new_drops = {stage: n for stage, n in new_drops.items() if n > 0}
+        if new_drops:
+            self.logger.warning(f'Camera {key[1]} on {key[0]} dropped frames: {new_drops}, fps: {value.get("fps")}')
+        else:
+            self.logger.debug(f'Camera {key[1]} on {key[0]} stats: {value}')
+
     def l_handshake(self, value):
         """
         Pilot is sending its IP and state on startup.
@@ -751,7 +805,7 @@ class Terminal(QtWidgets.QMainWindow):
         # open objects if not already
         for subject in subjects:
             if subject not in self.subjects.keys():
-                self.subjects[subject] = Subject(subject)
+                self.subjects[subject] = self.open_subject(subject)
 
         # for each subject, get weight
         weights = []
@@ -776,7 +830,7 @@ class Terminal(QtWidgets.QMainWindow):
         subjects = self.subject_list
         for subject in subjects:
             if subject not in self.subjects.keys():
-                self.subjects[subject] = Subject(subject)
+                self.subjects[subject] = self.open_subject(subject)
 
             protocol_bool = [self.subjects[subject].protocol_name == os.path.splitext(p)[0] for p in protocols]
             if any(protocol_bool):
@@ -880,14 +934,14 @@ class Terminal(QtWidgets.QMainWindow):
             _ = pop_dialog("Vizualisation function couldn't be imported!", "error", VIZ_ERROR)
             return
 
-        psychometric_dialog = Psychometric(self.subject_protocols)
+        psychometric_dialog = Psychometric(self.subject_protocols, open_subject=self.open_subject)
         psychometric_dialog.exec_()
 
         # if user cancels, return
         if psychometric_dialog.result() != 1:
             return
 
-        chart = viz.plot_psychometric(psychometric_dialog.plot_params)
+        chart = viz.plot_psychometric(psychometric_dialog.plot_params, open_subject=self.open_subject)
 
         text, ok = QtGui.QInputDialog.getText(self, 'save plot?', 'what to call this thing')
         if ok:
@@ -928,9 +982,13 @@ class Terminal(QtWidgets.QMainWindow):
         # TODO: Check if any subjects are currently running, pop dialog asking if we want to stop
 
         # Close all subjects files
-        for m in self.subjects.values():
-            if m.running is True:
-                m.stop_run()
+        if self.subject_service is not None:
+            # stops any running subjects after the data already sent is saved
+            self.subject_service.stop()
+        else:
+            for m in self.subjects.values():
+                if m.running is True:
+                    m.stop_run()
 
         # Stop networking
         # send message to kill networking process
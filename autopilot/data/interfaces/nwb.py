@@ -111,14 +111,25 @@ Sketch of the problem:
 
 from autopilot.root import Autopilot_Type
 from autopilot.data.models.biography import Biography
+from autopilot.data.writer import to_epoch
+import os
+import uuid
+import functools
 import typing
-from typing import List, Optional
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from typing import List, Optional, Callable, Dict, Union
 from pathlib import Path
 if typing.TYPE_CHECKING:
     from autopilot.data.subject import Subject
 
-from pynwb import NWBFile
+import numpy as np
+import tables
+from tqdm import tqdm
+from pynwb import NWBFile, NWBHDF5IO, TimeSeries
 from pynwb.file import Subject as NWBSubject
+from hdmf.backends.hdf5.h5_utils import H5DataIO
+from hdmf.data_utils import GenericDataChunkIterator
 
 
 def make_biography(bio:Biography) -> NWBSubject:
@@ -149,21 +160,373 @@ def make_biography(bio:Biography) -> NWBSubject:
     return NWBSubject(**kwargs)
 
 
-class NWB_Interface(Autopilot_Type):
-    biography: Biography
+def _iso_to_seconds(timestamps: np.ndarray, start: float) -> np.ndarray:
+    """
+    Convert isoformatted bytes timestamps to seconds since ``start`` (epoch)
+    """
+    return np.fromiter((to_epoch(t) - start for t in timestamps), dtype=np.float64, count=len(timestamps))
+
+
+def _timestamped_rows(table: tables.Table, column: str,
+                      buffer_rows: int = 2 ** 16) -> typing.Tuple[Optional[np.ndarray], Optional[float]]:
+    """
+    Find the rows of a table that have an isoformatted timestamp, since NWB timestamps must be finite and ascending.
 
-    def make(self, sub: 'Subject', out_dir: Path) -> NWBFile:
+    The timestamp column is read a buffer at a time.
+
+    Args:
+        table (:class:`tables.Table`): table to check
+        column (str): timestamp column
+        buffer_rows (int): rows to read at a time
+
+    Returns:
+        tuple: indices of the rows with timestamps, or ``None`` if every row has one,
+        and the first timestamp (epoch), or ``None`` if no row has one.
+
+    Raises:
+        ValueError: if the timestamps aren't ascending
+    """
+    rows = []
+    missing = False
+    first = None
+    last = -np.inf
+    for start in range(0, table.nrows, buffer_rows):
+        timestamps = table.read(start, min(start + buffer_rows, table.nrows), field=column)
+        has_time = np.fromiter((len(t) > 0 for t in timestamps), dtype=bool, count=len(timestamps))
+        missing = missing or not has_time.all()
+        rows.append(np.flatnonzero(has_time) + start)
+
+        seconds = _iso_to_seconds(timestamps[has_time], 0)
+        if len(seconds) == 0:
+            continue
+        if first is None:
+            first = seconds[0]
+        if seconds[0] < last or np.any(np.diff(seconds) < 0):
+            raise ValueError(f"Timestamps in {table._v_pathname}.{column} aren't ascending")
+        last = seconds[-1]
+
+    if not missing:
+        return None, first
+    return np.concatenate(rows), first
+
+
+def _epoch_to_seconds(timestamps: np.ndarray, start: float) -> np.ndarray:
+    return timestamps - start
+
+
+class H5_Chunk_Iterator(GenericDataChunkIterator):
+    """
+    Read an array, or a column of a table, from a pytables file one buffer at a time while it is written to NWB.
+
+    The file is opened read-only when the first buffer is read, and closed by :meth:`.close` .
+
+    Args:
+        file (:class:`pathlib.Path`): hdf5 file
+        path (str): path of the :class:`tables.Array` or :class:`tables.Table`
+        column (str): column to read, if ``path`` is a table
+        transform (callable): applied to each buffer before it is written, eg. to convert timestamps
+        dtype (:class:`numpy.dtype`): dtype after ``transform`` , if it changes it
+        rows (:class:`numpy.ndarray`): indices of the rows to read, or ``None`` for all of them
+        **kwargs: passed to :class:`hdmf.data_utils.GenericDataChunkIterator` , eg. ``buffer_gb``
+    """
+
+    def __init__(self, file: Path, path: str, column: Optional[str] = None,
+                 transform: Optional[Callable[[np.ndarray], np.ndarray]] = None,
+                 dtype: Optional[np.dtype] = None, rows: Optional[np.ndarray] = None, **kwargs):
+        self.file = Path(file)
+        self.path = path
+        self.column = column
+        self.transform = transform
+        self.rows = rows
+        self._h5f = None # type: Optional[tables.File]
+
+        # only keep the file open while buffers are being read,
+        # rather than holding a handle for every iterator made before the NWB file is written
+        try:
+            node = self._node()
+            if column is None:
+                self._source_shape = tuple(node.shape)
+                self._source_dtype = node.dtype
+            else:
+                coldescr = node.coldescrs[column]
+                self._source_shape = (node.nrows, *coldescr.shape)
+                self._source_dtype = coldescr.dtype
+        finally:
+            self.close()
+        if dtype is not None:
+            self._source_dtype = np.dtype(dtype)
+        if rows is not None:
+            self._source_shape = (len(rows), *self._source_shape[1:])
+
+        super(H5_Chunk_Iterator, self).__init__(**kwargs)
+
+    def _node(self) -> tables.Node:
+        if self._h5f is None or not self._h5f.isopen:
+            self._h5f = tables.open_file(str(self.file), mode='r')
+        return self._h5f.get_node(self.path)
+
+    def _get_data(self, selection: typing.Tuple[slice, ...]) -> np.ndarray:
+        node = self._node()
+        if self.rows is not None:
+            coords = self.rows[selection[0]]
+            if self.column is None:
+                data = node[coords][(slice(None),) + tuple(selection[1:])]
+            else:
+                data = node.read_coordinates(coords, field=self.column)[(slice(None),) + tuple(selection[1:])]
+        elif self.column is None:
+            data = node[selection]
+        else:
+            rows = selection[0]
+            data = node.read(rows.start, rows.stop, field=self.column)[(slice(None),) + tuple(selection[1:])]
+        if self.transform is not None:
+            data = self.transform(data)
+        return data
+
+    def _get_maxshape(self) -> typing.Tuple[int, ...]:
+        return self._source_shape
+
+    def _get_dtype(self) -> np.dtype:
+        return self._source_dtype
+
+    def close(self):
+        if self._h5f is not None and self._h5f.isopen:
+            self._h5f.close()
+        self._h5f = None
+
+
+class NWB_Interface(Autopilot_Type):
+    """
+    Export a :class:`.Subject` 's data to an NWB file.
+
+    Every protocol and step in the subject's file is exported, whether or not its task is available:
+
+    * Each protocol gets a processing module.
+    * Each numeric or boolean column of a step's trial data becomes a :class:`pynwb.TimeSeries`
+      named ``{step}_{column}`` . Its timestamps come from the step's isoformatted timestamp column
+      (``timestamp`` , or the last column ending in ``timestamp`` ). Steps without a timestamp column,
+      or whose timestamps aren't ascending, are skipped, as are rows without a timestamp.
+    * Each channel of continuous data in each session becomes a TimeSeries named ``{step}_{session}_{channel}`` .
+
+    Data are copied in buffers of at most ``buffer_mb`` and compressed with :class:`hdmf.backends.hdf5.h5_utils.H5DataIO` ,
+    so memory use doesn't grow with the length of the subject's history.
+
+    Attributes:
+        biography (:class:`.Biography`): set to the subject's biography by :meth:`.make`
+        compression (str): hdf5 compression filter for each dataset, or ``None``
+        compression_opts (int): compression level
+        buffer_mb (float): maximum size of each buffer read from the subject file
+        chunk_mb (float): size of hdf5 chunks in the NWB file
+        progress (bool): show a progress bar for each TimeSeries as it's written
+    """
+    biography: Optional[Biography] = None
+    compression: Optional[str] = 'gzip'
+    compression_opts: Optional[int] = 4
+    buffer_mb: float = 64.0
+    chunk_mb: float = 1.0
+    progress: bool = False
+
+    def make(self, sub: 'Subject', out_dir: Path) -> Path:
+        """
+        Write a subject's data to ``{out_dir}/{subject}.nwb``
+
+        Args:
+            sub (:class:`.Subject`): subject to export
+            out_dir (:class:`pathlib.Path`): directory to write to
+
+        Returns:
+            :class:`pathlib.Path`: the NWB file
+        """
+        out_dir = Path(out_dir)
         assert(out_dir.is_dir())
+        self._init_logger()
+        logger = self._logger
 
         # get biography object from subject
-        bio = make_biography(sub.info)
+        self.biography = sub.info
+        bio = make_biography(self.biography)
+
+        # find everything to export and when the first sample was
+        series = [] # type: List[dict]
+        starts = []
+        with tables.open_file(str(sub.file), mode='r') as h5f:
+            if '/data' in h5f:
+                for protocol in h5f.get_node('/data')._f_iter_nodes('Group'):
+                    for step in protocol._f_iter_nodes('Group'):
+                        if 'trial_data' in step:
+                            self._trial_series(step.trial_data, protocol._v_name, step._v_name, series, starts, logger)
+                        if 'continuous_data' in step:
+                            self._continuous_series(step.continuous_data, protocol._v_name, step._v_name, series, starts, logger)
+
+        start = min(starts) if len(starts) > 0 else os.path.getmtime(sub.file)
+
+        nwbfile = NWBFile(
+            session_description=f"Autopilot data for {sub.name}",
+            identifier=str(uuid.uuid4()),
+            session_start_time=datetime.fromtimestamp(start).astimezone(),
+            subject=bio
+        )
+
+        iterators = []
+        modules = {}
+        try:
+            for spec in series:
+                if spec['module'] not in modules:
+                    modules[spec['module']] = nwbfile.create_processing_module(
+                        name=spec['module'], description=f"Data from protocol {spec['module']}")
+
+                data = self._iterator(sub.file, spec['path'], spec['column'], rows=spec.get('rows'))
+                timestamps = self._iterator(sub.file, spec['time_path'], spec['time_column'],
+                                            transform=functools.partial(spec['time_transform'], start=start),
+                                            dtype=np.float64, rows=spec.get('rows'))
+                iterators.extend([data, timestamps])
+                modules[spec['module']].add(TimeSeries(
+                    name=spec['name'],
+                    data=self._wrap(data),
+                    timestamps=self._wrap(timestamps),
+                    unit='n/a',
+                    description=spec['description']
+                ))
+
+            out_file = out_dir / f"{sub.name}.nwb"
+            with NWBHDF5IO(str(out_file), mode='w') as io:
+                io.write(nwbfile)
+        finally:
+            for iterator in iterators:
+                iterator.close()
+
+        logger.info(f"Exported {len(series)} series from {sub.name} to {out_file}")
+        return out_file
+
+    def _iterator(self, file: Path, path: str, column: Optional[str], **kwargs) -> H5_Chunk_Iterator:
+        return H5_Chunk_Iterator(file, path, column,
+                                 buffer_gb=self.buffer_mb / 1024, chunk_mb=self.chunk_mb,
+                                 display_progress=self.progress, **kwargs)
+
+    def _wrap(self, iterator: H5_Chunk_Iterator) -> Union[H5DataIO, H5_Chunk_Iterator]:
+        if self.compression is None:
+            return H5DataIO(iterator)
+        return H5DataIO(iterator, compression=self.compression, compression_opts=self.compression_opts)
+
+    def _trial_series(self, table: tables.Table, protocol: str, step: str,
+                      series: List[dict], starts: List[float], logger):
+        time_cols = [col for col in table.colnames if col == 'timestamp'] or \
+                    [col for col in table.colnames if col.endswith('timestamp')]
+        if table.nrows == 0:
+            return
+        if len(time_cols) == 0:
+            logger.warning(f"No timestamp column in {table._v_pathname}, not exporting its trial data")
+            return
+        time_col = time_cols[-1]
+
+        try:
+            rows, first = _timestamped_rows(table, time_col)
+        except ValueError as e:
+            logger.warning(f"{e}, not exporting trial data from {table._v_pathname}")
+            return
+        if first is None:
+            logger.warning(f"No timestamps in {table._v_pathname}, not exporting its trial data")
+            return
+        if rows is not None:
+            logger.warning(f"Skipping {table.nrows - len(rows)} rows without timestamps in {table._v_pathname}")
+        starts.append(first)
+
+        for col in table.colnames:
+            if col == time_col or table.coldtypes[col].kind not in 'biuf':
+                continue
+            series.append({
+                'module': protocol,
+                'name': f"{step}_{col}",
+                'path': table._v_pathname,
+                'column': col,
+                'time_path': table._v_pathname,
+                'time_column': time_col,
+                'time_transform': _iso_to_seconds,
+                'rows': rows,
+                'description': f"Trial data column {col} of step {step}"
+            })
+
+    def _continuous_series(self, group: tables.Group, protocol: str, step: str,
+                           series: List[dict], starts: List[float], logger):
+        for session in group._f_iter_nodes('Group'):
+            for channel in session._f_iter_nodes():
+                name = f"{step}_{session._v_name}_{channel._v_name}"
+                if isinstance(channel, tables.Table):
+                    # stored by a previous version, one row per sample
+                    try:
+                        rows, first = _timestamped_rows(channel, 'timestamp')
+                    except ValueError as e:
+                        logger.warning(f"{e}, not exporting {channel._v_pathname}")
+                        continue
+                    if first is None:
+                        continue
+                    starts.append(first)
+                    key = [col for col in channel.colnames if col != 'timestamp'][0]
+                    spec = {'path': channel._v_pathname, 'column': key,
+                            'time_path': channel._v_pathname, 'time_column': 'timestamp',
+                            'time_transform': _iso_to_seconds, 'rows': rows}
+                elif isinstance(channel, tables.Group) and 'data' in channel and 'timestamp' in channel:
+                    if channel.timestamp.nrows == 0:
+                        continue
+                    starts.append(float(channel.timestamp[0]))
+                    spec = {'path': channel.data._v_pathname, 'column': None,
+                            'time_path': channel.timestamp._v_pathname, 'time_column': None,
+                            'time_transform': _epoch_to_seconds}
+                else:
+                    logger.warning(f"Don't know how to export continuous data in {channel._v_pathname}, skipping")
+                    continue
+
+                spec.update({'module': protocol, 'name': name,
+                             'description': f"Continuous data {channel._v_name} from step {step}, {session._v_name}"})
+                series.append(spec)
+
+
+class _Subject_File(typing.NamedTuple):
+    """
+    The parts of a :class:`.Subject` that :meth:`.NWB_Interface.make` uses
+    """
+    name: str
+    file: Path
+    info: Biography
 
-        # TODO: Get rest of tables as dataframes and use
-        # .add_scratch to add them
 
-        # for each session, create a BehavioralEvents object and create_timeseries
-        # for each of the columns.
-        # try to extract stim params and
+def _export_subject(file: Path, out_dir: Path, options: dict) -> Path:
+    # read the biography directly, rather than making a Subject that could open the file for writing
+    # while another process (eg. a running session) has it
+    with tables.open_file(str(file), mode='r') as h5f:
+        attrs = h5f.get_node('/info')._v_attrs
+        info = Biography(**{k: attrs[k] for k in attrs._f_list()})
+    return NWB_Interface(**options).make(_Subject_File(name=file.stem, file=file, info=info), out_dir)
 
 
+def export_subjects(data_dir: Path, out_dir: Path,
+                    which: Optional[List[str]] = None,
+                    processes: Optional[int] = None,
+                    **options) -> Dict[str, Union[Path, Exception]]:
+    """
+    Export every subject in a directory to NWB, one subject per process.
 
+    Args:
+        data_dir (:class:`pathlib.Path`): directory of subject .h5 files
+        out_dir (:class:`pathlib.Path`): directory to write ``{subject}.nwb`` files to
+        which (list): only export these subjects
+        processes (int): number of worker processes, default the number of CPUs
+        **options: passed to :class:`.NWB_Interface` , eg. ``compression`` or ``buffer_mb``
+
+    Returns:
+        dict: subject name to the NWB file, or the exception that stopped it from being exported
+    """
+    data_dir, out_dir = Path(data_dir), Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    files = sorted(data_dir.glob('*.h5'))
+    if which is not None:
+        files = [file for file in files if file.stem in which]
+
+    results = {}
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        futures = {pool.submit(_export_subject, file, out_dir, options): file.stem for file in files}
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            try:
+                results[futures[future]] = future.result()
+            except Exception as e:
+                results[futures[future]] = e
+    return results
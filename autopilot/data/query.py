@@ -0,0 +1,277 @@
+"""
+Reading selected rows and columns of trial data tables.
+
+Filters on sessions, trial numbers, and times are compiled to a single :meth:`tables.Table.read_where`
+condition so they are evaluated by PyTables (using the indexes made by :meth:`.Subject._index_trial_table`
+where they exist) rather than by reading the whole table into pandas first. Rows are returned as numpy
+structured arrays, and :func:`.rows_to_frame` and :func:`.rows_to_arrow` convert them column by column,
+decoding string columns in bulk, without making intermediate lists of records.
+"""
+
+import datetime
+import typing
+
+import numpy as np
+import pandas as pd
+import tables
+
+if typing.TYPE_CHECKING:
+    import pyarrow
+
+_TimeType = typing.Union[str, datetime.date, datetime.datetime, None]
+
+
+class Trial_Query:
+    """
+    A selection of rows and columns from a trial data table.
+
+    Time filters compare against an isoformatted timestamp column, so are only available for
+    tables that have one (eg. ``timestamp`` or ``DC_timestamp`` ).
+
+    Args:
+        columns (list): names of columns to read, default all
+        session (int, list): session number or list of session numbers
+        session_uuid (str): uuid of a single session
+        trials (tuple): ``(first, last)`` trial numbers, inclusive. Either can be ``None`` for an open range.
+        start (str, :class:`datetime.date`, :class:`datetime.datetime`): only trials at or after this time
+        stop (str, :class:`datetime.date`, :class:`datetime.datetime`): only trials before this time.
+            A date without a time selects trials before the start of that day.
+        time_col (str): name of the timestamp column to use for ``start`` and ``stop`` .
+            If ``None`` , ``timestamp`` or the last column that ends with ``timestamp`` .
+    """
+
+    def __init__(self,
+                 columns: typing.Optional[typing.List[str]] = None,
+                 session: typing.Union[int, typing.List[int], None] = None,
+                 session_uuid: typing.Optional[str] = None,
+                 trials: typing.Optional[typing.Tuple[typing.Optional[int], typing.Optional[int]]] = None,
+                 start: _TimeType = None,
+                 stop: _TimeType = None,
+                 time_col: typing.Optional[str] = None):
+        self.columns = list(columns) if columns is not None else None
+        self.session = session
+        self.session_uuid = session_uuid
+        self.trials = trials
+        self.start = start
+        self.stop = stop
+        self.time_col = time_col
+
+    def condition(self, table: tables.Table) -> typing.Tuple[typing.Optional[str], dict]:
+        """
+        Make a :meth:`tables.Table.read_where` condition for ``table``
+
+        Args:
+            table (:class:`tables.Table`): table to be queried, to check its columns
+
+        Returns:
+            tuple: (condition string or ``None`` if there are no filters, condvars)
+
+        Raises:
+            ValueError: if a filter needs a column ``table`` doesn't have
+        """
+        terms = []
+        condvars = {}
+
+        def _need(col: str):
+            if col not in table.colnames:
+                raise ValueError(f"Table {table._v_pathname} has no {col} column to filter by")
+
+        if self.session is not None:
+            _need('session')
+            sessions = [self.session] if isinstance(self.session, (int, np.integer)) else list(self.session)
+            if len(sessions) == 0:
+                raise ValueError('Need at least one session to select')
+            session_terms = []
+            for i, session in enumerate(sessions):
+                condvars[f'_session_{i}'] = int(session)
+                session_terms.append(f'(session == _session_{i})')
+            terms.append('(' + ' | '.join(session_terms) + ')')
+
+        if self.session_uuid is not None:
+            _need('session_uuid')
+            condvars['_session_uuid'] = _to_bytes(self.session_uuid)
+            terms.append('(session_uuid == _session_uuid)')
+
+        if self.trials is not None:
+            _need('trial_num')
+            first, last = self.trials
+            if first is not None:
+                condvars['_trial_first'] = int(first)
+                terms.append('(trial_num >= _trial_first)')
+            if last is not None:
+                condvars['_trial_last'] = int(last)
+                terms.append('(trial_num <= _trial_last)')
+
+        if self.start is not None or self.stop is not None:
+            time_col = self._time_col(table)
+            if self.start is not None:
+                condvars['_time_start'] = _to_bytes(_isoformat(self.start))
+                terms.append(f'({time_col} >= _time_start)')
+            if self.stop is not None:
+                condvars['_time_stop'] = _to_bytes(_isoformat(self.stop))
+                terms.append(f'({time_col} < _time_stop)')
+
+        if len(terms) == 0:
+            return None, condvars
+        return ' & '.join(terms), condvars
+
+    def read(self, table: tables.Table,
+             start: typing.Optional[int] = None,
+             stop: typing.Optional[int] = None) -> np.ndarray:
+        """
+        Read the selected rows and columns of ``table`` , optionally only searching a range of row numbers.
+
+        Args:
+            table (:class:`tables.Table`): table to read
+            start (int): first row number to search
+            stop (int): row number to stop searching before
+
+        Returns:
+            :class:`numpy.ndarray` : structured array of the selected columns
+        """
+        columns = self._columns(table)
+        condition, condvars = self.condition(table)
+        if condition is None:
+            if columns is not None and len(columns) == 1:
+                # a single field can be read without reading the other columns
+                rows = table.read(start, stop, field=columns[0])
+                return _as_struct(rows, columns[0])
+            rows = table.read(start, stop)
+        else:
+            rows = table.read_where(condition, condvars, start=start, stop=stop)
+
+        if columns is not None:
+            rows = _select(rows, columns)
+        return rows
+
+    def iter(self, table: tables.Table, chunksize: int) -> typing.Generator[np.ndarray, None, None]:
+        """
+        Read the selected rows of ``table`` a chunk of ``chunksize`` table rows at a time.
+
+        Chunks where no rows match the filters are skipped, so the yielded arrays can be shorter than
+        ``chunksize`` but are never empty.
+
+        Args:
+            table (:class:`tables.Table`): table to read
+            chunksize (int): number of table rows to search for each chunk
+
+        Yields:
+            :class:`numpy.ndarray` : structured arrays of the selected columns
+        """
+        if chunksize < 1:
+            raise ValueError(f'chunksize must be at least 1, got {chunksize}')
+        nrows = table.nrows
+        for start in range(0, nrows, chunksize):
+            rows = self.read(table, start, min(start + chunksize, nrows))
+            if len(rows) > 0:
+                yield rows
+
+    def _columns(self, table: tables.Table) -> typing.Optional[typing.List[str]]:
+        if self.columns is None:
+            return None
+        missing = [col for col in self.columns if col not in table.colnames]
+        if len(missing) > 0:
+            raise ValueError(f"Table {table._v_pathname} has no columns {missing}")
+        return self.columns
+
+    def _time_col(self, table: tables.Table) -> str:
+        if self.time_col is not None:
+            if self.time_col not in table.colnames:
+                raise ValueError(f"Table {table._v_pathname} has no {self.time_col} column to filter by")
+            return self.time_col
+        if 'timestamp' in table.colnames:
+            return 'timestamp'
+        time_cols = [col for col in table.colnames if col.endswith('timestamp')]
+        if len(time_cols) == 0:
+            raise ValueError(f"Table {table._v_pathname} has no timestamp column to filter by, pass time_col")
+        return time_cols[-1]
+
+
+def _to_bytes(value: typing.Union[str, bytes]) -> bytes:
+    if isinstance(value, str):
+        return value.encode('utf-8')
+    return value
+
+
+def _isoformat(value: _TimeType) -> str:
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return str(value)
+
+
+def _as_struct(values: np.ndarray, name: str) -> np.ndarray:
+    """Wrap a single column read with ``field=`` into a structured array"""
+    rows = np.empty(values.shape[0], dtype=[(name, values.dtype, values.shape[1:])])
+    rows[name] = values
+    return rows
+
+
+def _select(rows: np.ndarray, columns: typing.List[str]) -> np.ndarray:
+    """Copy ``columns`` out of a structured array so the other columns can be freed"""
+    selected = np.empty(rows.shape[0], dtype=[(col, rows.dtype.fields[col][0]) for col in columns])
+    for col in columns:
+        selected[col] = rows[col]
+    return selected
+
+
+def _decode(values: np.ndarray) -> np.ndarray:
+    """Decode a bytes column to str, all at once"""
+    return np.char.decode(values, 'utf-8')
+
+
+def rows_to_frame(rows: np.ndarray) -> pd.DataFrame:
+    """
+    Convert a structured array of table rows to a :class:`pandas.DataFrame`
+
+    Bytes columns are decoded to ``str`` , and multidimensional columns become object columns
+    of arrays, one per row.
+
+    Args:
+        rows (:class:`numpy.ndarray` ): structured array
+
+    Returns:
+        :class:`pandas.DataFrame`
+    """
+    columns = {}
+    for name in rows.dtype.names:
+        values = rows[name]
+        if values.dtype.kind == 'S':
+            values = _decode(values)
+        if values.ndim > 1:
+            column = np.empty(values.shape[0], dtype=object)
+            column[:] = list(values)
+            values = column
+        columns[name] = values
+    return pd.DataFrame(columns, columns=list(rows.dtype.names))
+
+
+def rows_to_arrow(rows: np.ndarray) -> 'pyarrow.Table':
+    """
+    Convert a structured array of table rows to a :class:`pyarrow.Table` .
+
+    Requires ``pyarrow`` , which is not installed with autopilot.
+
+    Bytes columns become ``string`` columns, and multidimensional columns become fixed size list columns.
+
+    Args:
+        rows (:class:`numpy.ndarray` ): structured array
+
+    Returns:
+        :class:`pyarrow.Table`
+    """
+    try:
+        import pyarrow as pa
+    except ImportError as e: # pragma: no cover - optional dependency
+        raise ImportError('pyarrow is needed to return trial data as arrow tables, install it with pip install pyarrow') from e
+
+    arrays = []
+    for name in rows.dtype.names:
+        values = rows[name]
+        if values.dtype.kind == 'S':
+            arrays.append(pa.array(_decode(values)))
+        elif values.ndim > 1:
+            flat = np.ascontiguousarray(values).reshape(-1)
+            arrays.append(pa.FixedSizeListArray.from_arrays(pa.array(flat), int(np.prod(values.shape[1:]))))
+        else:
+            arrays.append(pa.array(values))
+    return pa.Table.from_arrays(arrays, names=list(rows.dtype.names))
@@ -0,0 +1,318 @@
+"""
+A process that owns all :class:`.Subject` files for the Terminal.
+
+Rather than each GUI action and networking listen thread making its own :class:`.Subject` and
+opening its hdf5 file under that object's lock, a :class:`.Subject_Service` keeps one :class:`.Subject`
+object per subject in a separate process for as long as the Terminal runs, and the Terminal uses
+:class:`.Subject_Proxy` objects that forward attribute access and method calls to it over a queue.
+
+Requests are handled in order, in batches, by the service process, so only one process ever writes
+to a subject's file.
+
+.. note::
+
+    The service keeps :class:`.Subject` objects, not open files: each request still opens and closes
+    the subject's file as the :class:`.Subject` would (see :meth:`.Subject._h5f` ), except for trial data,
+    which is written by the subject's data thread through the file it keeps open while running.
+    Keeping files open between requests would mean sharing one handle with that thread. Data from :meth:`.Subject.save_data` is sent without waiting for a reply,
+and the service tells the proxies when a subject has graduated so that
+:attr:`.Subject_Proxy.did_graduate` can be checked without a round trip.
+
+Enabled in the Terminal with the ``SUBJECT_SERVICE`` pref.
+"""
+
+import inspect
+import itertools
+import multiprocessing
+import pickle
+import threading
+import typing
+from concurrent.futures import Future
+from pathlib import Path
+from queue import Empty
+
+from autopilot.data.subject import Subject
+from autopilot.utils.loggers import init_logger
+
+
+class Subject_Service(multiprocessing.Process):
+    """
+    Process that owns :class:`.Subject` objects and serves requests to them.
+
+    Requests are tuples of ``(request_id, subject, kind, attr, args, kwargs)`` , where ``kind`` is
+    ``'get'`` , ``'set'`` , or ``'call'`` . Replies are pickled ``(request_id, ok, result)`` tuples, or
+    ``(None, 'graduated', subject)`` when a running subject graduates. Requests with a
+    ``request_id`` of ``None`` get no reply.
+
+    Use :meth:`.subject` to get a :class:`.Subject_Proxy` after the service is started.
+
+    Args:
+        dir (:class:`pathlib.Path`): directory of subject files, if ``None`` , ``prefs.get('DATADIR')``
+        timeout (float): default seconds to wait for replies to requests
+
+    Attributes:
+        requests (:class:`multiprocessing.Queue`): requests to the service
+        replies (:class:`multiprocessing.Queue`): replies and notifications from the service
+        closing (:class:`multiprocessing.Event`): set to stop the service
+    """
+    batch_size = 256 # maximum number of queued requests to handle before checking for graduation
+    poll_interval = 0.5 # seconds to wait for requests before checking for graduation again
+
+    def __init__(self, dir: typing.Optional[Path] = None, timeout: float = 30.0):
+        super(Subject_Service, self).__init__(daemon=True)
+        self.dir = dir
+        self.timeout = timeout
+        self.requests = multiprocessing.Queue()
+        self.replies = multiprocessing.Queue()
+        self.closing = multiprocessing.Event()
+
+        # client-side state, made in start() so it isn't sent to the service process
+        self._pending = None # type: typing.Optional[typing.Dict[int, Future]]
+        self._events = None # type: typing.Optional[typing.Dict[str, threading.Event]]
+        self._ids = None
+        self._reply_thread = None # type: typing.Optional[threading.Thread]
+
+    # --------------------------------------------------
+    # Service process
+    # --------------------------------------------------
+
+    def run(self):
+        self.logger = init_logger(self)
+        self.subjects = {} # type: typing.Dict[str, Subject]
+        self._graduated = set() # type: typing.Set[str]
+
+        try:
+            while not self.closing.is_set():
+                try:
+                    batch = [self.requests.get(timeout=self.poll_interval)]
+                except Empty:
+                    batch = []
+
+                # drain whatever else has queued up while we were busy
+                while 0 < len(batch) < self.batch_size:
+                    try:
+                        batch.append(self.requests.get_nowait())
+                    except Empty:
+                        break
+
+                for request in batch:
+                    if request is None:
+                        self.closing.set()
+                        break
+                    self._handle(request)
+
+                self._check_graduation()
+        finally:
+            for name, sub in self.subjects.items():
+                if sub.running:
+                    try:
+                        sub.stop_run()
+                    except Exception as e:
+                        self.logger.exception(f'Could not stop subject {name} while closing, got {e}')
+
+    def _subject(self, name: str) -> Subject:
+        """
+        Get the :class:`.Subject` object for a subject, making it the first time it's used.
+        The object is kept, but its file is only open while it's being used.
+        """
+        sub = self.subjects.get(name)
+        if sub is None:
+            sub = Subject(name, dir=self.dir)
+            self.subjects[name] = sub
+        return sub
+
+    def _handle(self, request: tuple):
+        request_id, name, kind, attr, args, kwargs = request
+        try:
+            sub = self._subject(name)
+            if kind == 'get':
+                result = getattr(sub, attr)
+            elif kind == 'set':
+                setattr(sub, attr, args[0])
+                result = None
+            else:
+                if attr == 'prepare_run':
+                    self._graduated.discard(name)
+                result = getattr(sub, attr)(*args, **kwargs)
+            ok = True
+        except Exception as e:
+            if request_id is None:
+                self.logger.exception(f'Exception handling {kind} {attr} for subject {name}, got {e}')
+            ok = False
+            result = e
+
+        if request_id is None:
+            return
+        # pickle here rather than in the queue's feeder thread, so an unpicklable result
+        # gets an error reply instead of none at all
+        try:
+            reply = pickle.dumps((request_id, ok, result))
+        except Exception as e:
+            reply = pickle.dumps((request_id, False, RuntimeError(f'Could not return {kind} {attr}: {result!r} ({e})')))
+        self.replies.put(reply)
+
+    def _check_graduation(self):
+        for name, sub in self.subjects.items():
+            if name not in self._graduated and sub.running and sub.did_graduate.is_set():
+                self._graduated.add(name)
+                self.replies.put(pickle.dumps((None, 'graduated', name)))
+
+    # --------------------------------------------------
+    # Client
+    # --------------------------------------------------
+
+    def start(self):
+        """
+        Start the service process, and a thread in this process to receive its replies.
+        """
+        super(Subject_Service, self).start()
+        self._pending = {}
+        self._events = {}
+        self._ids = itertools.count()
+        self._reply_thread = threading.Thread(target=self._receive, daemon=True)
+        self._reply_thread.start()
+
+    def _receive(self):
+        while not self.closing.is_set() or not self.replies.empty():
+            try:
+                reply = self.replies.get(timeout=self.poll_interval)
+            except Empty:
+                continue
+            request_id, ok, result = pickle.loads(reply)
+
+            if request_id is None:
+                if ok == 'graduated':
+                    self.graduated(result).set()
+                continue
+
+            future = self._pending.pop(request_id, None)
+            if future is None:
+                continue
+            if ok:
+                future.set_result(result)
+            else:
+                future.set_exception(result)
+
+    def graduated(self, name: str) -> threading.Event:
+        """
+        Event that is set when a subject graduates, see :attr:`.Subject.did_graduate`
+        """
+        event = self._events.get(name)
+        if event is None:
+            event = self._events.setdefault(name, threading.Event())
+        return event
+
+    def request(self, name: str, kind: str, attr: str,
+                args: tuple = (), kwargs: typing.Optional[dict] = None,
+                wait: bool = True, timeout: typing.Optional[float] = None):
+        """
+        Send a request to the service.
+
+        Args:
+            name (str): subject ID
+            kind (str): ``'get'`` an attribute, ``'set'`` an attribute to ``args[0]`` , or ``'call'`` a method
+            attr (str): attribute or method name
+            args (tuple): method arguments
+            kwargs (dict): method keyword arguments
+            wait (bool): if ``False`` , send the request without waiting for (or getting) a reply
+            timeout (float): seconds to wait for the reply, default :attr:`.timeout`
+
+        Returns:
+            the attribute or the method's return value, or ``None`` if not waiting
+
+        Raises:
+            Exception: any exception raised by the subject in the service process
+            concurrent.futures.TimeoutError: if no reply came within ``timeout``
+        """
+        if kwargs is None:
+            kwargs = {}
+        if not wait:
+            self.requests.put((None, name, kind, attr, args, kwargs))
+            return None
+
+        request_id = next(self._ids)
+        future = Future()
+        self._pending[request_id] = future
+        self.requests.put((request_id, name, kind, attr, args, kwargs))
+        try:
+            return future.result(timeout=self.timeout if timeout is None else timeout)
+        finally:
+            self._pending.pop(request_id, None)
+
+    def subject(self, name: str) -> 'Subject_Proxy':
+        """
+        Get a proxy to a subject in the service
+        """
+        return Subject_Proxy(self, name)
+
+    def stop(self, timeout: float = 10.0):
+        """
+        Stop the service after it finishes the requests already sent, stopping any running subjects.
+        """
+        self.requests.put(None)
+        self.join(timeout)
+        self.closing.set()
+
+
+class Subject_Proxy:
+    """
+    Stand-in for a :class:`.Subject` owned by a :class:`.Subject_Service` .
+
+    Properties of :class:`.Subject` are gotten and set, and its methods are called, in the service process,
+    waiting for the result. Methods in :attr:`.async_methods` are sent without waiting.
+
+    Args:
+        service (:class:`.Subject_Service`): started service
+        name (str): subject ID
+    """
+    async_methods = ('save_data',) # methods that are sent without waiting for them to return
+
+    def __init__(self, service: Subject_Service, name: str):
+        object.__setattr__(self, 'service', service)
+        object.__setattr__(self, 'name', name)
+
+    @property
+    def did_graduate(self) -> threading.Event:
+        """
+        Set by the service when the subject graduates, see :attr:`.Subject.did_graduate`
+        """
+        return self.service.graduated(self.name)
+
+    def prepare_run(self) -> dict:
+        self.did_graduate.clear()
+        return self.service.request(self.name, 'call', 'prepare_run')
+
+    def __getattr__(self, attr: str):
+        static = inspect.getattr_static(Subject, attr, None)
+        if callable(static) and not isinstance(static, property):
+            wait = attr not in self.async_methods
+
+            def _call(*args, **kwargs):
+                return self.service.request(self.name, 'call', attr, args, kwargs, wait=wait)
+            _call.__name__ = attr
+            return _call
+
+        return self.service.request(self.name, 'get', attr)
+
+    def __setattr__(self, attr: str, value):
+        self.service.request(self.name, 'set', attr, (value,))
+
+    def __repr__(self) -> str:
+        return f'Subject_Proxy({self.name})'
+
+
+class Subject_Dict(dict):
+    """
+    Dictionary of subject ID to :class:`.Subject_Proxy` that replaces any :class:`.Subject` put in it
+    (eg. one that was just made with :meth:`.Subject.new` ) with a proxy, so that only
+    the service keeps using the subject's file.
+    """
+
+    def __init__(self, service: Subject_Service):
+        super(Subject_Dict, self).__init__()
+        self.service = service
+
+    def __setitem__(self, key: str, value):
+        if isinstance(value, Subject):
+            value = self.service.subject(value.name)
+        super(Subject_Dict, self).__setitem__(key, value)
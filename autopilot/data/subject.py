@@ -12,11 +12,12 @@ from contextlib import contextmanager
 from pathlib import Path
 import shutil
 import queue
+from queue import Empty
+from copy import deepcopy
 
 import pandas as pd
 import numpy as np
 import tables
-from tables.tableextension import Row
 from tables.nodes import filenode
 
 import autopilot
@@ -25,6 +26,8 @@ from autopilot.data.modeling.base import Table
 from autopilot.data.models.subject import Subject_Structure, Protocol_Status, Hashes, History, Weights
 from autopilot.data.models.biography import Biography
 from autopilot.data.models.protocol import Protocol_Group
+from autopilot.data.writer import Trial_Writer, Continuous_Writer, Journal, read_journal, journal_in_use, read_continuous
+from autopilot.data.query import Trial_Query, rows_to_frame, rows_to_arrow
 from autopilot.utils.loggers import init_logger
 
 if typing.TYPE_CHECKING:
@@ -47,6 +50,8 @@ class Subject(object):
         |         |--- S##_step_name
         |         |    |--- trial_data
         |         |    |--- continuous_data
+        |         |         |--- session_# (group)
+        |         |              |--- channel (group) - see :class:`.Continuous_Writer`
         |         |--- ...
         |--- history (group)
         |    |--- hashes - history of git commit hashes
@@ -64,8 +69,25 @@ class Subject(object):
         running (bool): Flag that signals whether the subject is currently running a task or not.
         data_queue (:class:`queue.Queue`): Queue to dump data while running task
         did_graduate (:class:`threading.Event`): Event used to signal if the subject has graduated the current step
+        journal (:class:`pathlib.Path`): :class:`.Journal` of trial data received in the current session
+            that hasn't been written to the file yet. Journals left by sessions that didn't stop cleanly
+            are recovered when the subject is opened, and by :meth:`.prepare_run` .
     """
     _VERSION = 1
+    trial_flush_rows = 32 # completed trials to buffer before writing them to the trial table
+    trial_flush_interval = 5.0 # maximum seconds to buffer completed trials before writing them
+    trial_indexes = ('trial_num', 'session_uuid') # columns of trial tables to make pytables indexes for
+    journal_sync_interval = 0.5 # maximum seconds between fsyncs of the trial data journal
+    _GENERATION_ATTR = 'generation'
+    """
+    Attribute of the protocol group incremented whenever the protocol status is written,
+    used to tell if our cached :attr:`.protocol` is stale when the file has been modified.
+    """
+    _GRADUATION_ATTR = 'graduation_checkpoint'
+    """
+    Attribute of a trial table with the :meth:`.Graduation.checkpoint` from the end of the last session
+    run with it, used by :meth:`.prepare_run` instead of reading the trial history when it's current.
+    """
 
 
 
@@ -109,6 +131,12 @@ class Subject(object):
         self.name = name
         self.logger = init_logger(self)
         self.file = file
+        self.journal = None # type: Optional[Path]
+        self._journal = None # type: Optional[Journal]
+
+        # cached (generation, protocol status), and the (mtime, size) of the file when it was checked
+        self._protocol_cache = None # type: Optional[typing.Tuple[int, Optional[Protocol_Status]]]
+        self._protocol_stamp = None # type: Optional[typing.Tuple[int, int]]
 
         if not self.file.exists():
             raise FileNotFoundError(f"Subject file {str(self.file)} does not exist!")
@@ -127,6 +155,9 @@ class Subject(object):
         self.data_queue = None
         self._thread = None
         self.did_graduate = threading.Event()
+        self.graduation = None # type: Optional['Graduation']
+        self._graduation_spec = None # type: Optional[dict]
+        self._graduation_rows = 0
 
         with self._h5f() as h5f:
             # Every time we are initialized we stash the git hash
@@ -150,10 +181,16 @@ class Subject(object):
             except Exception as e:
                 self.logger.exception(f"Unable to update! Got exception:\n{e}")
 
-        if self.protocol:
+        if self._protocol_status():
             self.logger.debug("Attempting to update protocol")
             self._check_protocol_changed()
 
+        # replay trial data from sessions that crashed before it was written
+        try:
+            self._recover_journal()
+        except Exception as e:
+            self.logger.exception(f"Could not recover journaled trial data, will try again before the next session. Got exception:\n{e}")
+
     @contextmanager
     def _h5f(self, lock:bool=True) -> tables.file.File:
         """
@@ -228,42 +265,34 @@ class Subject(object):
 
         A property with an accompanying setter. When assigned to, stashes the details of the old
         protocol, and remakes the table structure to support the new task.
-        """
-        with self._h5f(lock=False) as h5f:
-            protocol = h5f.get_node(self.structure.protocol.path)
-            protocoldict = {}
-            for k in protocol._v_attrs._f_list():
 
-                protocoldict[k] = protocol._v_attrs[k]
-
-            if 'protocol' in protocol:
-                protocol_node = h5f.get_node(self.structure.protocol.path + '/protocol')
-                protocol_node = filenode.open_node(protocol_node)
-                protocoldict['protocol'] = json.loads(protocol_node.readall())
-                protocol_node.close()
-
-        if len(protocoldict) == 0:
+        The status is cached, and only read from the file again when it has been modified
+        by some other object, see :meth:`._protocol_status` . A copy is returned, so changes
+        aren't saved unless it is assigned back.
+        """
+        protocol = self._protocol_status()
+        if protocol is None:
             return None
-        else:
-            return Protocol_Status(**protocoldict)
+        return protocol.copy(deep=True)
 
     @protocol.setter
     def protocol(self, protocol:Protocol_Status):
-        if self.protocol is not None and protocol.protocol != self.protocol.protocol:
-            archive_name = f"{self._get_timestamp(simple=True)}_{self.protocol_name}"
+        current = self._protocol_status()
+        if current is not None and protocol.protocol != current.protocol:
+            archive_name = f"{self._get_timestamp(simple=True)}_{current.protocol_name}"
             # make the group
-            self._write_attrs('/history/past_protocols/' + archive_name, self.protocol.dict())
+            self._write_attrs('/history/past_protocols/' + archive_name, current.dict())
             self.logger.debug(f"Stashed old protocol details in {'/history/past_protocols/' + archive_name}")
 
         # check for differences
         diffs = []
-        if self.protocol is None:
+        if current is None:
             diffs.append('protocol')
             diffs.append('step')
         else:
-            if protocol.protocol_name != self.protocol_name:
+            if protocol.protocol_name != current.protocol_name:
                 diffs.append('protocol')
-            if protocol.step != self.step:
+            if protocol.step != current.step:
                 diffs.append('step')
 
         for diff in diffs:
@@ -272,29 +301,107 @@ class Subject(object):
             elif diff == 'step':
                 self.update_history('step', name=protocol.protocol[protocol.step]['step_name'],
                                     value=protocol.step)
+
+        attrs = protocol.dict()
+        # only rewrite the protocol filenode if it has changed
+        if current is not None and protocol.protocol == current.protocol:
+            del attrs['protocol']
+        self._write_protocol_attrs(attrs, status=protocol.copy(deep=True))
+
+        # make sure that we have the required protocol structure
+        if current is None or 'protocol' in diffs or protocol.protocol != current.protocol:
+            try:
+                self._make_protocol_structure(protocol.protocol_name, protocol.protocol)
+            except ValueError as e:
+                if 'Could not find subclass of' in str(e):
+                    task_name = str(e).split(' ')[-1].rstrip('!')
+                    self.logger.error(f"When attempting to make protocol data structure, could not find the task type {task_name}. If it's in a plugin, make sure that the plugin is in your plugin directory. The protocol has been assigned, but you will need to have the task code present to run it.")
+                else:
+                    raise e
+
+        self.logger.info(f"Saved new protocol status {protocol}")
+
+    def _file_stamp(self) -> Optional[typing.Tuple[int, int]]:
+        try:
+            stat = self.file.stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _protocol_status(self) -> Union[Protocol_Status, None]:
+        """
+        The cached protocol status, which should not be modified in place.
+
+        If the file's modification time or size has changed since we last checked, the generation
+        counter of the protocol group is read, and the full status (including the protocol filenode)
+        is only reloaded if some other object has written it since we cached it.
+        """
+        stamp = self._file_stamp()
+        if self._protocol_cache is not None and stamp == self._protocol_stamp:
+            return self._protocol_cache[1]
+
+        with self._h5f(lock=False) as h5f:
+            protocol = h5f.get_node(self.structure.protocol.path)
+            generation = protocol._v_attrs[self._GENERATION_ATTR] \
+                if self._GENERATION_ATTR in protocol._v_attrs else 0
+
+            if self._protocol_cache is not None and self._protocol_cache[0] == generation:
+                self._protocol_stamp = stamp
+                return self._protocol_cache[1]
+
+            protocoldict = {}
+            for k in protocol._v_attrs._f_list():
+                if k == self._GENERATION_ATTR:
+                    continue
+                protocoldict[k] = protocol._v_attrs[k]
+
+            if 'protocol' in protocol:
+                protocol_node = h5f.get_node(self.structure.protocol.path + '/protocol')
+                protocol_node = filenode.open_node(protocol_node)
+                protocoldict['protocol'] = json.loads(protocol_node.readall())
+                protocol_node.close()
+
+        if len(protocoldict) == 0:
+            status = None
+        else:
+            status = Protocol_Status(**protocoldict)
+
+        self._protocol_cache = (generation, status)
+        self._protocol_stamp = stamp
+        return status
+
+    def _write_protocol_attrs(self, attrs: dict, status: Optional[Protocol_Status] = None):
+        """
+        Write attributes of the protocol status, and update the cached status to match.
+
+        Args:
+            attrs (dict): attributes of :class:`.Protocol_Status` to write. If ``'protocol'``
+                is included, the protocol filenode is rewritten.
+            status (:class:`.Protocol_Status`): The complete new status, if ``None`` , update the cached status with ``attrs``
+        """
+        if status is None:
+            # shallow, so the protocol list is shared with the old status rather than copied for every trial
+            status = self._protocol_status().copy(update=attrs)
+
         with self._h5f() as h5f:
             protocol_node = h5f.get_node(self.structure.protocol.path)
-            for k, v in protocol.dict().items():
+            for k, v in attrs.items():
                 if k == 'protocol':
                     if 'protocol' in protocol_node:
                         h5f.remove_node(self.structure.protocol.path + '/protocol')
                     protocol_filenode = filenode.new_node(h5f, where=self.structure.protocol.path, name='protocol')
                     protocol_filenode.write(json.dumps(v).encode('utf-8'))
+                    protocol_filenode.close()
 
                 else:
                     protocol_node._v_attrs[k] = v
 
-        # make sure that we have the required protocol structure
-        try:
-            self._make_protocol_structure(protocol.protocol_name, protocol.protocol)
-        except ValueError as e:
-            if 'Could not find subclass of' in str(e):
-                task_name = str(e).split(' ')[-1].rstrip('!')
-                self.logger.error(f"When attempting to make protocol data structure, could not find the task type {task_name}. If it's in a plugin, make sure that the plugin is in your plugin directory. The protocol has been assigned, but you will need to have the task code present to run it.")
-            else:
-                raise e
+            generation = protocol_node._v_attrs[self._GENERATION_ATTR] + 1 \
+                if self._GENERATION_ATTR in protocol_node._v_attrs else 1
+            protocol_node._v_attrs[self._GENERATION_ATTR] = generation
 
-        self.logger.info(f"Saved new protocol status {protocol}")
+        self._protocol_cache = (generation, status)
+        self._protocol_stamp = self._file_stamp()
 
     @property
     def protocol_name(self) -> str:
@@ -303,7 +410,7 @@ class Subject(object):
 
         Convenience accessor for  :attr:`.Subject.protocol.protocol_name`
         """
-        return self.protocol.protocol_name
+        return self._protocol_status().protocol_name
 
     @property
     def current_trial(self) -> int:
@@ -314,13 +421,11 @@ class Subject(object):
 
         Has Setter (can be assigned to)
         """
-        return self.protocol.current_trial
+        return self._protocol_status().current_trial
 
     @current_trial.setter
     def current_trial(self, current_trial:int):
-        protocol = self.protocol
-        protocol.current_trial = current_trial
-        self.protocol = protocol
+        self._write_protocol_attrs({'current_trial': int(current_trial)})
 
     @property
     def session(self) -> int:
@@ -331,13 +436,11 @@ class Subject(object):
 
         Has setter (can be assigned to)
         """
-        return self.protocol.session
+        return self._protocol_status().session
 
     @session.setter
     def session(self, session: int):
-        protocol = self.protocol
-        protocol.session = session
-        self.protocol = protocol
+        self._write_protocol_attrs({'session': int(session)})
 
     @property
     def step(self) -> int:
@@ -348,20 +451,23 @@ class Subject(object):
 
         Has setter (can be assigned to) to manually promote/demote subject to different steps of the protocol.
         """
-        return self.protocol.step
+        return self._protocol_status().step
 
     @step.setter
     def step(self, step: int):
-        protocol = self.protocol
-        protocol.step = step
-        self.protocol = protocol
+        step = int(step)
+        protocol = self._protocol_status()
+        if step != protocol.step:
+            self.update_history('step', name=protocol.protocol[step]['step_name'], value=step)
+        self._write_protocol_attrs({'step': step})
 
     @property
     def task(self) -> dict:
         """
         Protocol dictionary for the current step
         """
-        return self.protocol.protocol[self.step]
+        protocol = self._protocol_status()
+        return deepcopy(protocol.protocol[protocol.step])
 
     @property
     def session_uuid(self) -> str:
@@ -422,15 +528,30 @@ class Subject(object):
 
             h5f.flush()
 
-    def _read_table(self, path:str, table:typing.Type[Table]) -> typing.Union[Table,pd.DataFrame]:
+    def _read_table(self, path:str, table:Optional[typing.Type[Table]],
+                    query:Optional[Trial_Query]=None,
+                    validate:bool=True) -> typing.Union[Table,pd.DataFrame]:
+        """
+        Read a table, optionally only the rows and columns selected by a :class:`.Trial_Query` ,
+        and validate it with a :class:`.Table` model.
+
+        Args:
+            path (str): path of the table in the file
+            table (:class:`.Table`): model to validate with, or ``None`` to not validate
+            query (:class:`.Trial_Query`): rows and columns to read, default all
+            validate (bool): if ``False`` , return the dataframe without validating it
+
+        Returns:
+            :class:`.Table` , or :class:`pandas.DataFrame` if not validated or validation failed
+        """
+        if query is None:
+            query = Trial_Query()
         with self._h5f(lock=False) as h5f:
-            tab = h5f.get_node(path).read() # type: np.ndarray
+            rows = query.read(h5f.get_node(path)) # type: np.ndarray
 
-        # unpack table to a dataframe
-        df = pd.DataFrame.from_records(tab)
-        for col in df.columns:
-            if df[col].dtype == 'O':
-                df[col] = df[col].str.decode("utf-8")
+        df = rows_to_frame(rows)
+        if not validate or table is None:
+            return df
 
         try:
             return table(**df.to_dict(orient='list'))
@@ -543,9 +664,10 @@ class Subject(object):
             self.logger.warning(f"Could not find protocol file to update internal representation of it. Got exception {e}")
             return
 
-        if disk_protocol != self.protocol.protocol:
+        protocol = self._protocol_status()
+        if disk_protocol != protocol.protocol:
             self.logger.info('Protocol on disk changed from stored protocol. Updating')
-            self.assign_protocol(disk_protocol, step_n=self.protocol.step, pilot=self.protocol.pilot, protocol_name=prot_name)
+            self.assign_protocol(disk_protocol, step_n=protocol.step, pilot=protocol.pilot, protocol_name=prot_name)
 
     def _find_protocol(self, protocol:typing.Union[Path, str, typing.List[dict]],
                        protocol_name: Optional[str]=None) -> typing.Tuple[str, typing.List[dict]]:
@@ -598,6 +720,18 @@ class Subject(object):
         )
         with self._h5f() as h5f:
             protocol_structure.make(h5f)
+            for step in protocol_structure.steps:
+                self._index_trial_table(h5f.get_node(step.path, 'trial_data'))
+
+    def _index_trial_table(self, trial_table: tables.table.Table):
+        """
+        Make sure the columns in :attr:`.trial_indexes` of a trial table are indexed,
+        so that rows can be found without scanning the whole table.
+        """
+        for col in self.trial_indexes:
+            if col in trial_table.colnames and not trial_table.colindexed[col]:
+                self.logger.debug(f"Indexing column {col} of {trial_table._v_pathname}")
+                trial_table.colinstances[col].create_index()
 
     def assign_protocol(self, protocol:typing.Union[Path, str, typing.List[dict]],
                         step_n:int=0,
@@ -630,18 +764,19 @@ class Subject(object):
         protocol_name, protocol = self._find_protocol(protocol, protocol_name)
 
         # check if this is the same protocol as we already have so we don't reset session number
-        if self.protocol is not None and (protocol_name == self.protocol_name) and (step_n == self.step):
-            session = self.session
-            current_trial = self.current_trial
+        current = self._protocol_status()
+        if current is not None and (protocol_name == current.protocol_name) and (step_n == current.step):
+            session = current.session
+            current_trial = current.current_trial
 
             self.logger.debug("Keeping existing session and current_trial counts")
         else:
             session = 0
             current_trial = 0
 
-        if self.protocol is not None and pilot is None:
+        if current is not None and pilot is None:
             self.logger.debug("Using pilot from previous assignation")
-            pilot = self.protocol.pilot
+            pilot = current.pilot
 
         status = Protocol_Status(
             current_trial=current_trial,
@@ -671,34 +806,44 @@ class Subject(object):
             Dict: the parameters for the current step, with subject id, step number,
                 current trial, and session number included.
         """
-        if self.protocol is None:
+        if self._protocol_status() is None:
             e = RuntimeError('No task assigned to subject, cant prepare_run. use Subject.assign_protocol or protocol reassignment wizard in the terminal GUI')
             self.logger.exception(f"{e}")
             raise e
 
         protocol_groups = Protocol_Group(
             protocol_name = self.protocol_name,
-            protocol = self.protocol.protocol,
+            protocol = self._protocol_status().protocol,
             structure = self.structure
         )
         group_path = protocol_groups.steps[self.step].path
         trial_table_path = "/".join([group_path, 'trial_data'])
 
         # Get current task parameters and handles to tables
-        task_params = self.protocol.protocol[self.step]
+        task_params = self.task
+
+        # store any trial data that was received but not written the last time we ran
+        self.graduation = None
+        self._recover_journal()
 
         # increment session and clear session_uuid to ensure uniqueness
         self.session += 1
         self._session_uuid = None
+        self.journal = self.file.with_name(f"{self.file.name}.{self.session_uuid}.journal")
+        self._journal = Journal(
+            self.journal,
+            context={'trial_table': trial_table_path, 'session': int(self.session), 'session_uuid': self.session_uuid},
+            sync_interval=self.journal_sync_interval
+        )
 
         ##############################
-        trial_tab = self._trim_trial_to_session(group_path)
-        trial_tab_keys = tuple(trial_tab.dtype.fields.keys())
+        nrows, last_row = self._last_trial_row(trial_table_path)
+        trial_tab_keys = tuple(last_row.dtype.fields.keys())
 
         # get last trial number from trial_table
         try:
-            self.current_trial = trial_tab['trial_num'][-1]+1
-        except IndexError:
+            self.current_trial = last_row['trial_num'][-1]+1
+        except (IndexError, ValueError):
             if 'trial_num' not in trial_tab_keys:
                 self.logger.warning('No trial_num column detected in trial data! this is a basic indexing column for trialwise data and should always be present! You might experience unexpected behavior in your data, make sure you check everyhing is as it should be!')
             self.logger.info('Using current_trial = 0')
@@ -709,9 +854,10 @@ class Subject(object):
         # --------------------------------------------------
         # prepare graduation object
 
-        self.graduation = None
+        # new trial rows are counted as they're given to the graduation object
+        self._graduation_rows = nrows
         if 'graduation' in task_params.keys():
-            self.graduation = self._prepare_graduation(task_params, trial_tab)
+            self.graduation = self._prepare_graduation(task_params, group_path, nrows)
 
         # spawn thread to accept data
         self.data_queue = queue.Queue()
@@ -729,11 +875,31 @@ class Subject(object):
         task_params['session'] = int(self.session)
         return task_params
 
-    def _trim_trial_to_session(self, group_path:str) -> tables.table.Table:
+    def _last_trial_row(self, trial_table_path:str) -> typing.Tuple[int, np.ndarray]:
+        """
+        Number of rows in a trial table, and its last row (or no rows if it's empty)
+        """
+        with self._h5f(lock=False) as h5f:
+            trial_table = h5f.get_node(trial_table_path) # type: tables.Table
+            return trial_table.nrows, trial_table.read(start=max(trial_table.nrows - 1, 0))
+
+    def _trim_trial_to_session(self, group_path:str, cols:typing.Iterable[str]) -> typing.Dict[str, np.ndarray]:
+        """
+        Read columns of the trial table from the current contiguous run of sessions
+        to give to graduation objects.
+
+        Args:
+            group_path (str): path of the step group
+            cols (list): columns to read. Columns the table doesn't have are omitted.
+
+        Returns:
+            dict: of column name to array
+        """
 
         with self._h5f(lock=False) as h5f:
             # tasks without TrialData will have some default table, so this should always be present
             trial_table = h5f.get_node(group_path, 'trial_data') # type: tables.Table
+            cols = [col for col in cols if col in trial_table.colnames]
 
             ##################################3
             # try to filter rows based on contiguous session numbers
@@ -745,39 +911,73 @@ class Subject(object):
             slice_start = 0
 
             if trial_table.nrows == 0:
-                return trial_table.read()
+                return {col: trial_table.read(field=col) for col in cols}
 
             try:
-                sessions = trial_table.col('session')
-
                 # first check if our current session is the same or +1 the previous session
                 # otherwise, we have been reassigned and haven't done any trials yet.
-                if len(sessions)>0 and abs(self.session - sessions[-1])>1:
-                    slice_start = len(sessions)
+                last_session = trial_table.read(start=trial_table.nrows - 1, field='session')[-1]
+                if abs(self.session - last_session)>1:
+                    slice_start = trial_table.nrows
 
                 else:
                     # find any discontinuities
                     # normally continuous sessions should have a diff of 0 or 1 (same or incremented session)
-                    discontinuities = np.where(np.logical_or(np.diff(sessions)<0,np.diff(sessions) > 1))
-                    if len(discontinuities) == 0:
-                        # fine, use the whole thing
-                        pass
-                    else:
+                    session_diff = np.diff(trial_table.col('session'))
+                    discontinuities = np.where(np.logical_or(session_diff < 0, session_diff > 1))[0]
+                    if len(discontinuities) > 0:
                         slice_start = int(discontinuities[-1]+1)
 
             except Exception as e:
                 self.logger.exception(
                     f"Couldnt trim data given to graduation objects to current set of sessions, using full data history. got exception\n {e}")
-
-
-            if not slice_start and slice_start != 0:
-                self.logger.info(f"Could not trim trial data, full trial table given to graduation objects")
                 slice_start = 0
-            elif not isinstance(slice_start, int):
-                slice_start = slice_start[0]
+
             self.logger.debug(f"Trimming trial table with slice_start: {slice_start}")
-            trial_tab = trial_table.read(start=slice_start)
-            return trial_tab
+            return {col: trial_table.read(start=slice_start, field=col) for col in cols}
+
+    def _graduation_checkpoint(self, trial_table_path:str, graduation:dict, nrows:int) -> Optional[dict]:
+        """
+        Get the graduation checkpoint saved at the end of the last session, if it's still current:
+        made with the same graduation parameters, from all the rows in the trial table,
+        from the previous or same session.
+        """
+        with self._h5f(lock=False) as h5f:
+            attrs = h5f.get_node(trial_table_path)._v_attrs
+            if self._GRADUATION_ATTR not in attrs:
+                return None
+            try:
+                checkpoint = json.loads(attrs[self._GRADUATION_ATTR])
+            except (TypeError, ValueError):
+                return None
+
+        if checkpoint.get('graduation') != json.dumps(graduation, sort_keys=True, default=str) \
+                or checkpoint.get('nrows') != nrows \
+                or abs(self.session - checkpoint.get('session', -2)) > 1:
+            return None
+        return checkpoint
+
+    def _save_graduation_checkpoint(self, trial_table:tables.Table):
+        """
+        Save the state of the graduation object to the trial table at the end of a run,
+        see :attr:`._GRADUATION_ATTR`
+        """
+        # rows written when the writer was closed (eg. a partial last trial)
+        # haven't been given to the graduation object yet
+        if trial_table.nrows > self._graduation_rows:
+            for row in trial_table.read(start=self._graduation_rows):
+                self.graduation.update(dict(zip(row.dtype.names, row.tolist())))
+            self._graduation_rows = trial_table.nrows
+
+        state = self.graduation.checkpoint()
+        if state is None:
+            return
+        trial_table._v_attrs[self._GRADUATION_ATTR] = json.dumps({
+            'graduation': json.dumps(self._graduation_spec, sort_keys=True, default=str),
+            'nrows': int(trial_table.nrows),
+            'session': int(self.session),
+            'state': state
+        })
 
     def _prepare_continuous_data(self, task_params: dict, group_path:str) -> str:
         # --------------------------------------------------
@@ -799,8 +999,13 @@ class Subject(object):
 
         return continuous_group_path
 
-    def _prepare_graduation(self, task_params:dict, trial_tab:tables.table.Table) -> 'Graduation':
+    def _prepare_graduation(self, task_params:dict, group_path:str, nrows:int) -> 'Graduation':
+        """
+        Make the step's graduation object, restoring it from its checkpoint if that's current,
+        or else giving it the columns it needs from the trial table.
+        """
         try:
+            self._graduation_spec = task_params['graduation']
             grad_type = task_params['graduation']['type']
             grad_params = task_params['graduation']['value'].copy()
 
@@ -817,15 +1022,25 @@ class Subject(object):
                     if hasattr(self, param) and param not in grad_params.keys():
                         grad_params.update({param: getattr(self, param)})
 
+            checkpoint = None
             if grad_obj.COLS:
-                # give requested columns in trial table to graduation object
-                for col in grad_obj.COLS:
-                    try:
-                        grad_params.update({col: trial_tab[col]})
-                    except KeyError:
-                        self.logger.exception(f'Graduation object requested column {col}, but it was not found in the trial table. Graduation will likely be inaccurate!')
+                checkpoint = self._graduation_checkpoint(group_path + '/trial_data', task_params['graduation'], nrows)
+
+                if checkpoint is not None:
+                    # state is restored below
+                    grad_params.update({col: [] for col in grad_obj.COLS})
+                else:
+                    # give requested columns in trial table to graduation object
+                    trial_tab = self._trim_trial_to_session(group_path, grad_obj.COLS)
+                    for col in grad_obj.COLS:
+                        try:
+                            grad_params.update({col: trial_tab[col]})
+                        except KeyError:
+                            self.logger.exception(f'Graduation object requested column {col}, but it was not found in the trial table. Graduation will likely be inaccurate!')
 
             grad_instance = grad_obj(**grad_params)
+            if checkpoint is not None:
+                grad_instance.restore(checkpoint['state'])
             self.did_graduate.clear()
             return grad_instance
         except Exception as e:
@@ -847,6 +1062,10 @@ class Subject(object):
         each dict given to the queue should have the `trial_num`, and this method can
         properly store data without passing `TRIAL_END` if so. I recommend being explicit, however.
 
+        Trial data is appended to the :attr:`.journal` by :meth:`.save_data` , buffered by a :class:`.Trial_Writer` ,
+        and written to the trial table every :attr:`.trial_flush_rows` trials, or :attr:`.trial_flush_interval` seconds,
+        and when the run is stopped, after which it is discarded from the journal.
+
         Checks graduation state at the end of each trial.
 
         Args:
@@ -856,73 +1075,174 @@ class Subject(object):
         with self._h5f() as h5f:
 
             trial_table = h5f.get_node(trial_table_path)
-            trial_row = trial_table.row
-
-            # try to get continuous data table if any
-            cont_tables = {}
-            cont_rows = {}
+            # files made before trial tables were indexed are indexed the first time they're run
+            self._index_trial_table(trial_table)
+            session = {'session': int(self.session), 'session_uuid': self.session_uuid}
+            journal = self._journal
+            writer = Trial_Writer(
+                trial_table,
+                defaults=session,
+                journal=journal,
+                max_rows=self.trial_flush_rows,
+                max_interval=self.trial_flush_interval,
+                index='trial_num',
+                scope=('session_uuid',)
+            )
+
+            # continuous data channels are made as they are received
+            cont_writer = Continuous_Writer(h5f, continuous_group_path)
 
-            # start getting data
-            # stop when 'END' gets put in the queue
-            for data in iter(queue.get, 'END'):
-                # wrap everything in try because this thread shouldn't crash
-                try:
-                    if 'continuous' in data.keys():
-                        cont_tables, cont_rows = self._save_continuous_data(
-                            h5f, data, continuous_group_path, cont_tables, cont_rows
-                        )
-                        # continue, the rest is for handling trial data
+            try:
+                # start getting data
+                # stop when 'END' gets put in the queue
+                while True:
+                    timeouts = [t for t in (writer.flush_due(), journal.sync_due()) if t is not None]
+                    try:
+                        data = queue.get(timeout=min(timeouts) if timeouts else None)
+                    except Empty:
+                        # make sure the last data we got survives a crash even if no more comes
+                        if journal.sync_due() == 0:
+                            journal.sync()
+                        if writer.flush_due() == 0:
+                            writer.flush()
                         continue
 
-                    # If we get trial data out of order, try and write it back in the correct row.
-                    if 'trial_num' in data.keys() and 'trial_num' in trial_row:
-                        trial_row = self._sync_trial_row(data['trial_num'], trial_row, trial_table)
-                        del data['trial_num']
+                    if isinstance(data, str) and data == 'END':
+                        break
 
-                    self._save_trial_data(data, trial_row, trial_table)
+                    # wrap everything in try because this thread shouldn't crash
+                    try:
+                        if isinstance(data, tuple):
+                            # already journaled by save_data
+                            seq, data = data
+                            writer.journaled(seq)
+                            self._store_trial_data(data, writer)
+                            continue
+
+                        if 'continuous' in data.keys():
+                            self._save_continuous_data(data, cont_writer)
+                            # continue, the rest is for handling trial data
+                            continue
+
+                        writer.journal(data)
+                        self._store_trial_data(data, writer)
+
+                    except Exception as e:
+                        # we shouldn't throw any exception in this thread, just log it and move on
+                        self.logger.exception(f'exception in data thread: {e}')
+            finally:
+                writer.close()
+                # removed if everything in it was stored
+                journal.close(remove=True)
+                if self.graduation is not None:
+                    try:
+                        self._save_graduation_checkpoint(trial_table)
+                    except Exception as e:
+                        self.logger.exception(f'Could not save graduation checkpoint: {e}')
 
-                except Exception as e:
-                    # we shouldn't throw any exception in this thread, just log it and move on
-                    self.logger.exception(f'exception in data thread: {e}')
+    def _store_trial_data(self, data:dict, writer:Trial_Writer):
+        # If we get trial data out of order, try and write it back in the correct row.
+        if 'trial_num' in data.keys() and 'trial_num' in writer.names:
+            self._sync_trial_row(data['trial_num'], writer)
+            del data['trial_num']
 
-    def _save_continuous_data(self,
-                              h5f: tables.File,
-                              data: dict,
-                              continuous_group_path:str,
-                              cont_tables: typing.Dict[str, tables.table.Table],
-                              cont_rows:typing.Dict[str, Row]) -> typing.Tuple[typing.Dict[str, tables.table.Table], typing.Dict[str, Row]]:
-        for k, v in data.items():
+        self._save_trial_data(data, writer)
 
-            # if we haven't made a table yet, do it
-            if k not in cont_tables.keys():
-                new_cont_table = self._make_continuous_table(h5f, continuous_group_path, k, v)
-                cont_tables[k] = new_cont_table
-                cont_rows[k] = new_cont_table.row
+    def _recover_journal(self):
+        """
+        Write trial data left in :class:`.Journal` s by sessions that didn't stop cleanly to the trial table.
 
-            cont_rows[k][k] = v
-            cont_rows[k]['timestamp'] = data.get('timestamp', datetime.datetime.now().isoformat())
-            cont_rows[k].append()
+        Journals that are still open (eg. by a running session in another process) are left alone.
 
-        return cont_tables, cont_rows
+        A session may have crashed after writing some of its journaled trials to the table but before
+        discarding them from the journal, so data for trials already in the table only fills in
+        columns those rows don't have yet, rather than being written again.
+        """
+        journals = [path for path in self.file.parent.glob(f"{self.file.name}*.journal")
+                    if not journal_in_use(path)]
+        if len(journals) == 0:
+            return
 
-    def _make_continuous_table(self, h5f:tables.file.File,
-                               continuous_group_path:str,
-                               key:str,
-                               value:typing.Any) -> tables.table.Table:
-        # make atom for this data
-        try:
-            # if it's a numpy array...
-            col_atom = tables.Atom.from_type(value.dtype.name, value.shape)
-        except AttributeError:
-            temp_array = np.array(value)
-            col_atom = tables.Atom.from_type(temp_array.dtype.name, temp_array.shape)
-
-        return h5f.create_table(continuous_group_path, key, description={
-            key: tables.Col.from_atom(col_atom),
-            'timestamp': tables.StringCol(256)
-        })
+        with self._h5f() as h5f:
+            for path in journals:
+                self.logger.warning(f'Found unsaved trial data in {path}, recovering')
+                for header, datas in read_journal(path):
+                    if len(datas) == 0:
+                        continue
+                    try:
+                        trial_table = h5f.get_node(header['trial_table'])
+                    except (KeyError, tables.NoSuchNodeError):
+                        self.logger.exception(f'Could not find trial table for journaled trial data, dropping:\n{datas}')
+                        continue
+
+                    writer = Trial_Writer(
+                        trial_table,
+                        defaults={'session': header['session'], 'session_uuid': header['session_uuid']},
+                        max_rows=len(datas),
+                        index='trial_num',
+                        scope=('session_uuid',)
+                    )
+                    stored = self._stored_trials(trial_table, header['session_uuid'])
+                    for data in datas:
+                        try:
+                            if data.get('trial_num') in stored:
+                                self._merge_trial_data(data, writer)
+                            else:
+                                self._store_trial_data(data, writer)
+                        except Exception as e:
+                            self.logger.exception(f'exception recovering trial data: {e}')
+                    writer.close()
+                    self.logger.info(f"Recovered {writer.counters['rows']} trials from session {header['session']}")
+
+                path.unlink()
+
+    def _stored_trials(self, trial_table: tables.Table, session_uuid: str) -> typing.Set[int]:
+        """
+        Trial numbers already in a trial table for a session.
+        """
+        if 'trial_num' not in trial_table.colnames or 'session_uuid' not in trial_table.colnames:
+            return set()
+        trial_nums = trial_table.read_where('session_uuid == _uuid',
+                                            condvars={'_uuid': session_uuid.encode('utf-8')},
+                                            field='trial_num')
+        return set(trial_nums.tolist())
+
+    def _merge_trial_data(self, data: dict, writer: Trial_Writer):
+        """
+        Fill in columns of a trial already in the table that haven't been set,
+        without overwriting anything or making a new row.
+        """
+        if writer.returned:
+            writer.append()
+        n_matches = writer.seek('trial_num', data['trial_num'])
+        if n_matches != 1:
+            self.logger.warning(f"Found {n_matches} rows with trial_num {data['trial_num']}, not recovering: {data}")
+            return
+
+        for k, v in data.items():
+            if k in ('trial_num', 'TRIAL_END') or writer.is_set(k):
+                continue
+            try:
+                writer.set(k, v)
+            except KeyError:
+                continue
+        # write the row back and return to the one being filled
+        writer.append()
+
+    def _save_continuous_data(self, data: dict, writer: Continuous_Writer):
+        """
+        Store continuous data, either a single sample or a batch of them from
+        a ``STREAM`` (with the samples in ``data['payload']`` ).
+        """
+        if 'payload' in data.keys():
+            samples = [sample for sample in data['payload'] if isinstance(sample, dict)]
+            if len(samples) < len(data['payload']):
+                self.logger.warning(f"Continuous data dropped, samples in a stream should be dicts")
+            writer.extend(samples)
+        else:
+            writer.append(data)
 
-    def _save_trial_data(self, data:dict, trial_row:Row, trial_table:tables.table.Table):
+    def _save_trial_data(self, data:dict, writer:Trial_Writer):
 
         for k, v in data.items():
             # some bug where some columns are not always detected,
@@ -931,11 +1251,11 @@ class Subject(object):
                 continue
 
             try:
-                if trial_row[k] not in (None, b'', 0) and k != 'trial_num':
+                if writer.is_set(k) and k != 'trial_num':
                     self.logger.warning(
-                        f"Received two values for key, making new row.: {k} and trial row: {trial_row.nrow}, existing value: {trial_row[k]}, new value: {v}")
-                    self._increment_trial(trial_row)
-                trial_row[k] = v
+                        f"Received two values for key, making new row.: {k}, existing value: {writer.get(k)}, new value: {v}")
+                    self._increment_trial(writer)
+                writer.set(k, v)
             except KeyError:
                 # TODO: expand trial_table!
                 if k in ('pilot', 'subject'):
@@ -943,74 +1263,78 @@ class Subject(object):
                     continue
                 self.logger.exception(f"Trial data dropped because no column for key: {k}, value: {v}")
 
-        if 'TRIAL_END' in data.keys() or all([v is not None for v in trial_row.fetch_all_fields()]):
-            self._increment_trial(trial_row)
+        if 'TRIAL_END' in data.keys() or writer.complete:
+            self._increment_trial(writer)
 
-        # always flush so that our row iteration routines above will find what they're looking for
-        trial_table.flush()
+    def _sync_trial_row(self, trial_num:int, writer:Trial_Writer):
+        if writer.is_set('trial_num') and trial_num == writer.get('trial_num'):
+            # fine! we're on the right one
+            return
 
-    def _sync_trial_row(self, trial_num:int, trial_row:Row, trial_table:tables.table.Table) -> Row:
-        if trial_row['trial_num'] in (None, b''):
-            trial_row['trial_num'] = trial_num
+        if writer.returned:
+            # we went back to a previous trial's row, and this data is for another,
+            # so go back to the current one
+            writer.append()
+            return self._sync_trial_row(trial_num, writer)
 
-        elif trial_num == trial_row['trial_num'] + 1:
-            self._increment_trial(trial_row)
-            trial_row['trial_num'] = trial_num
+        if not writer.is_set('trial_num'):
+            writer.set('trial_num', trial_num)
 
-        elif trial_num == trial_row['trial_num']:
-            # fine! we're on the right one
-            pass
+        elif trial_num == writer.get('trial_num') + 1:
+            self._increment_trial(writer)
+            writer.set('trial_num', trial_num)
 
         else:
             # we're on the wrong row somehow!
 
-            # find row with this trial number if it exists
-            # this will return a list of rows with matching trial_num.
-            # if it's empty, we didn't receive a TRIAL_END and should create a new row
-            # FIXME: this should also ensure that the trial_num comes from a row with a matching session_uuid
+            # find row with this trial number in this session if it exists, among buffered rows and the table.
+            # if there isn't one, we didn't receive a TRIAL_END and should create a new row
+            n_matches = writer.seek('trial_num', trial_num)
 
-            other_row = [r for r in trial_table.where(f"trial_num == {trial_num}")]
-
-            if len(other_row) == 0:
+            if n_matches == 0:
                 # proceed to fill the row below, we got trial data discontinuously somehow
                 self.logger.warning(f"Got discontinuous trial data")
-                self._increment_trial(trial_row)
-                trial_row['trial_num'] = trial_num
+                self._increment_trial(writer)
+                writer.set('trial_num', trial_num)
 
-            elif len(other_row) == 1:
-                # return the other row! (if an overwrite is attempted, append and go to next row anyway)
-                trial_row = other_row[0]
+            elif n_matches == 1:
+                # the writer has returned to the other row! (if an overwrite is attempted, go to next row anyway)
+                pass
 
             else:
                 # we have more than one row with this trial_num.
                 # shouldn't happen, but we dont' want to throw any data away
                 self.logger.warning(f'Found multiple rows with same trial_num: {trial_num}')
                 # continue just for data conservancy's sake
-                self._increment_trial(trial_row)
-                trial_row['trial_num'] = trial_num
-
-            return trial_row
+                self._increment_trial(writer)
+                writer.set('trial_num', trial_num)
 
-    def _increment_trial(self, trial_row: Row):
+    def _increment_trial(self, writer:Trial_Writer):
         self.logger.debug('Trial Incremented')
-        trial_row['session'] = self.session
-        trial_row['session_uuid'] = self.session_uuid
-        if self.graduation:
+        returned = writer.returned
+        row = writer.append()
+        if not returned:
+            self._graduation_rows += 1
+        if self.graduation and not returned:
             # set our graduation flag, the terminal will get the rest rolling
-            did_graduate = self.graduation.update(trial_row)
+            did_graduate = self.graduation.update(dict(zip(row.dtype.names, row.tolist())))
             if did_graduate is True:
                 self.did_graduate.set()
-        trial_row.append()
 
     def save_data(self, data):
         """
-        Alternate and equivalent method of putting data in the queue as `Subject.data_queue.put(data)`
+        Append trial data to the :attr:`.journal` and put it in the :attr:`.data_queue` to be stored.
+
+        Data can also be put in the queue directly, in which case it is journaled when the data thread gets it.
 
         Args:
             data (dict): trial data. each should have a 'trial_num', and a dictionary with key
                 'TRIAL_END' should be passed at the end of each trial.
         """
-        self.data_queue.put(data)
+        if self._journal is not None and 'continuous' not in data.keys():
+            self.data_queue.put((self._journal.append(data), data))
+        else:
+            self.data_queue.put(data)
 
     def stop_run(self):
         """
@@ -1019,6 +1343,7 @@ class Subject(object):
         self.data_queue.put('END')
         self._thread.join(5)
         self.running = False
+        self._journal = None
         if self._thread.is_alive():
             self.logger.warning('Data thread did not exit')
 
@@ -1027,11 +1352,22 @@ class Subject(object):
     # --------------------------------------------------
 
     def get_trial_data(self,
-                       step: typing.Union[int, list, str, None] = None
+                       step: typing.Union[int, list, str, None] = None,
+                       columns: Optional[typing.List[str]] = None,
+                       session: typing.Union[int, typing.List[int], None] = None,
+                       session_uuid: Optional[str] = None,
+                       trials: Optional[typing.Tuple[Optional[int], Optional[int]]] = None,
+                       start: typing.Union[str, datetime.date, None] = None,
+                       stop: typing.Union[str, datetime.date, None] = None,
+                       validate: bool = True,
+                       output: typing.Literal['pandas', 'arrow'] = 'pandas'
                        ) -> Union[typing.List[pd.DataFrame], pd.DataFrame]:
         """
         Get trial data from the current task.
 
+        Filters are evaluated by PyTables while reading the table (see :class:`.Trial_Query` ),
+        so only the matching rows are loaded.
+
         Args:
             step (int, list, str, None): Step that should be returned, can be one of
 
@@ -1041,17 +1377,75 @@ class Subject(object):
                 * list: of step numbers or step names (excluding S##_)
                 * string: the name of a step (excluding S##_)
 
+            columns (list): names of columns to return, default all
+            session (int, list): only trials from this session or these sessions
+            session_uuid (str): only trials from the session with this uuid
+            trials (tuple): only trials with ``trial_num`` between ``(first, last)`` , inclusive.
+                Either can be ``None`` for an open range.
+            start (str, :class:`datetime.date`): only trials at or after this time (isoformatted or date/datetime)
+            stop (str, :class:`datetime.date`): only trials before this time
+            validate (bool): If ``True`` (default), validate the data with the step's
+                :class:`~.models.protocol.Trial_Data` model. Validation is skipped if ``columns`` omits
+                fields the model requires. ``False`` is much faster for large tables.
+            output ('pandas', 'arrow'): return :class:`pandas.DataFrame` s (default) or
+                :class:`pyarrow.Table` s (requires pyarrow, and is not validated)
+
         Returns:
             :class:`pandas.DataFrame`: DataFrame of requested steps' trial data (or list of dataframes).
         """
+        query = Trial_Query(columns=columns, session=session, session_uuid=session_uuid,
+                            trials=trials, start=start, stop=stop)
+        steps, groups = self._resolve_steps(step)
 
+        ret = [self._get_step_data(i, groups, query, validate, output) for i in steps]
+        if len(ret) == 1:
+            return ret[0]
+        else:
+            return ret
+
+    def iter_trial_data(self,
+                        step: typing.Union[int, str] = -1,
+                        chunksize: int = 10000,
+                        columns: Optional[typing.List[str]] = None,
+                        output: typing.Literal['pandas', 'arrow'] = 'pandas',
+                        **filters) -> typing.Generator[pd.DataFrame, None, None]:
+        """
+        Iterate over one step's trial data in chunks, without loading the whole table at once.
+
+        Chunks are not validated.
+
+        Args:
+            step (int, str): step number or name, default the current step
+            chunksize (int): number of table rows to read at a time. Filtered chunks may be smaller.
+            columns (list): names of columns to return, default all
+            output ('pandas', 'arrow'): type of chunks to yield, see :meth:`.get_trial_data`
+            **filters: ``session`` , ``session_uuid`` , ``trials`` , ``start`` , or ``stop`` ,
+                see :meth:`.get_trial_data`
+
+        Yields:
+            :class:`pandas.DataFrame` or :class:`pyarrow.Table` chunks
+        """
+        query = Trial_Query(columns=columns, **filters)
+        steps, groups = self._resolve_steps(step)
+        path, _ = self._step_table(steps[0], groups)
+        convert = rows_to_arrow if output == 'arrow' else rows_to_frame
+
+        with self._h5f(lock=False) as h5f:
+            for rows in query.iter(h5f.get_node(path), chunksize):
+                yield convert(rows)
+
+    def _resolve_steps(self, step: typing.Union[int, list, str, None]) -> typing.Tuple[typing.List[int], Optional[Protocol_Group]]:
+        """
+        Convert a ``step`` argument of :meth:`.get_trial_data` to a list of step numbers,
+        and get the protocol group to find their tables with.
+        """
         try:
-            groups = Protocol_Group(self.protocol_name, self.protocol.protocol)
+            groups = Protocol_Group(self.protocol_name, self._protocol_status().protocol)
         except ValueError:
             self.logger.warning(f"Could not recreate data descriptions from protocol, likely because a plugin is missing or has not been imported. Attempting to recreate from pytables description, but this might not be fully accurate. check AUTOPLUGIN and that the plugin is in the plugin directory.")
             groups = None
 
-        step_names = [s['step_name'].lower() for s in self.protocol.protocol]
+        step_names = [s['step_name'].lower() for s in self._protocol_status().protocol]
 
         # convert input into a list of integers
         if isinstance(step, int):
@@ -1073,37 +1467,96 @@ class Subject(object):
             steps = [step_names.index(step.lower())]
         else:
             # get all steps
-            steps = list(range(len(self.protocol.protocol)))
+            steps = list(range(len(self._protocol_status().protocol)))
 
-        ret = [self._get_step_data(i, groups) for i in steps]
-        if len(ret) == 1:
-            return ret[0]
-        else:
-            return ret
+        return steps, groups
 
-    def _get_step_data(self, step:int, groups:Optional[Protocol_Group]=None) -> pd.DataFrame:
+    def _step_table(self, step:int, groups:Optional[Protocol_Group]=None,
+                    model:bool=True) -> typing.Tuple[str, Optional[typing.Type[Table]]]:
         """
-        Get individual step data, using the protocol group if given, otherwise try and recover from pytables description
+        Find the path of a step's trial data table, and its :class:`.Table` model
+        from the protocol group if given, otherwise recovered from its pytables description
+        (if ``model`` ).
         """
-        # find the table
         if groups:
-            path = groups.steps[step].path + '/trial_data'
-            data_table = groups.steps[step].trial_data
-        else:
-            group_path = f"/data/{self.protocol_name}"
+            return groups.steps[step].path + '/trial_data', groups.steps[step].trial_data
+
+        group_path = f"/data/{self.protocol_name}"
+        with self._h5f(lock=False) as h5f:
+            step_groups = sorted(h5f.get_node(group_path)._v_children.keys())
+            path = f"{group_path}/{step_groups[step]}/trial_data"
+            if not model:
+                return path, None
+            data_node = h5f.get_node(path) # type: tables.table.Table
+            return path, Table.from_pytables_description(data_node.description)
+
+    def _get_step_data(self, step:int, groups:Optional[Protocol_Group]=None,
+                       query:Optional[Trial_Query]=None,
+                       validate:bool=True,
+                       output:str='pandas') -> pd.DataFrame:
+        """
+        Get individual step data, using the protocol group if given, otherwise try and recover from pytables description
+        """
+        if output == 'arrow':
+            validate = False
+        path, data_table = self._step_table(step, groups, model=validate)
+
+        if output == 'arrow':
+            if query is None:
+                query = Trial_Query()
             with self._h5f(lock=False) as h5f:
-                step_groups = sorted(h5f.get_node(group_path)._v_children.keys())
-                path = f"{group_path}/{step_groups[step]}/trial_data"
-                data_node = h5f.get_node(path) # type: tables.table.Table
-                data_table = Table.from_pytables_description(data_node.description)
+                return rows_to_arrow(query.read(h5f.get_node(path)))
+
+        if validate and query is not None and query.columns is not None:
+            # a subset of columns can't be validated by a model that requires the others
+            validate = all(name in query.columns
+                           for name, field in data_table.__fields__.items() if field.required)
 
         # get the data from the table!
-        data = self._read_table(path, data_table)
+        data = self._read_table(path, data_table, query, validate)
         if isinstance(data, Table):
             data = data.to_df()
+            if query is not None and query.columns is not None:
+                data = data[query.columns]
         return data
 
 
+    def get_continuous_data(self,
+                            key: str,
+                            session: Optional[int] = None,
+                            step: Optional[int] = None,
+                            start: Union[str, float, datetime.datetime, None] = None,
+                            stop: Union[str, float, datetime.datetime, None] = None) -> typing.Tuple[np.ndarray, np.ndarray]:
+        """
+        Get one channel of continuous data, optionally only between two times.
+
+        Only the chunks of the file that contain the requested samples are read.
+
+        Args:
+            key (str): name of the channel
+            session (int): session number, if ``None`` , the most recent session with this channel.
+            step (int): step of the current protocol, if ``None`` , the current step.
+            start (str, float, :class:`datetime.datetime`): first time to read, isoformatted, epoch, or datetime.
+            stop (str, float, :class:`datetime.datetime`): last time to read
+
+        Returns:
+            tuple: (float64 epoch timestamps, samples)
+        """
+        if step is None:
+            step = self.step
+        groups = Protocol_Group(self.protocol_name, self._protocol_status().protocol)
+        cont_path = groups.steps[step].path + '/continuous_data'
+
+        with self._h5f(lock=False) as h5f:
+            if session is None:
+                sessions = [int(name.split('_')[-1]) for name, node in h5f.get_node(cont_path)._v_children.items()
+                            if name.startswith('session_') and key in node]
+                if len(sessions) == 0:
+                    raise ValueError(f"No continuous data for {key} found in {cont_path}")
+                session = max(sessions)
+
+            return read_continuous(h5f, f"{cont_path}/session_{session}/{key}", start, stop)
+
     def _get_timestamp(self, simple=False):
         # type: (bool) -> str
         """
@@ -1220,8 +1673,9 @@ class Subject(object):
         """
         Increase the current step by one, unless it is the last step.
         """
-        if len(self.protocol.protocol)<=self.step+1:
-            self.logger.warning('Tried to _graduate from the last step!\n Task has {} steps and we are on {}'.format(len(self.protocol.protocol), self.step+1))
+        n_steps = len(self._protocol_status().protocol)
+        if n_steps<=self.step+1:
+            self.logger.warning('Tried to _graduate from the last step!\n Task has {} steps and we are on {}'.format(n_steps, self.step+1))
             return
 
         # increment step, update_history should handle the rest
@@ -0,0 +1,769 @@
+"""
+Buffered writing of trial and continuous data to hdf5 files.
+
+Rather than setting fields of a :class:`tables.tableextension.Row` and flushing the table
+after every piece of data, :class:`.Trial_Writer` fills rows of a preallocated numpy structured array
+and appends them to the table in bulk. Every piece of data is also written to an append-only
+:class:`.Journal` before it is buffered, and the journal is compacted once the rows it describes
+have been flushed, so data that was received before a crash can be recovered with :func:`.read_journal` .
+
+:class:`.Continuous_Writer` stores each channel of continuous data as a pair of chunked, compressed
+:class:`tables.EArray` s - one of samples and one of float64 epoch timestamps - appending batches of
+samples at once, and :func:`.read_continuous` reads only the chunks within a range of times.
+"""
+
+import json
+import os
+import struct
+import threading
+import time
+import typing
+import zlib
+from collections import deque
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import tables
+
+try:
+    import fcntl
+except ImportError: # pragma: no cover - windows
+    fcntl = None
+
+
+def _json_default(obj):
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    elif isinstance(obj, np.generic):
+        return obj.item()
+    elif isinstance(obj, bytes):
+        return obj.decode('utf-8')
+    return str(obj)
+
+
+def _lock(file) -> bool:
+    """
+    Take an exclusive advisory lock on an open file without blocking.
+
+    Returns:
+        bool: ``True`` if we got the lock, or if locking isn't available on this platform
+    """
+    if fcntl is None: # pragma: no cover - windows
+        return True
+    try:
+        fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except OSError:
+        return False
+
+
+def journal_in_use(path: Path) -> bool:
+    """
+    Whether a :class:`.Journal` is still open and being written to, possibly by another process.
+
+    Always ``False`` on platforms without :mod:`fcntl` .
+    """
+    if fcntl is None: # pragma: no cover - windows
+        return False
+    try:
+        with open(path, 'rb') as jfile:
+            if not _lock(jfile):
+                return True
+            # the journal may have been compacted (replaced) after we opened it
+            return os.fstat(jfile.fileno()).st_ino != os.stat(path).st_ino
+    except FileNotFoundError:
+        return False
+
+
+class Journal:
+    """
+    Append-only log of trial data, written before the data is stored so it can be recovered after a crash.
+
+    The file starts with :attr:`.MAGIC` , then each record is a little-endian ``(payload length, crc32, sequence number)``
+    header followed by a JSON payload. The first record is a ``{'header': context}`` , and the rest are
+    ``{'data': data}`` . A record torn by a crash fails its checksum, and it and anything after it is ignored by
+    :func:`.read_journal` .
+
+    Every record is written through to the operating system when it is appended, so it survives the process
+    crashing, and the file is ``fsync`` ed at most every ``sync_interval`` seconds, so records older than that
+    also survive the computer crashing. Appending only syncs records older than that, so the owner should also
+    call :meth:`.sync` when :meth:`.sync_due` says so, rather than leave the last records unsynced until the next append.
+
+    Once records have been stored, they are dropped with :meth:`.discard` , which writes the remaining
+    records to a new file and replaces the journal with it. The journal is locked while open (where :mod:`fcntl` is available)
+    so other processes can tell it is in use with :func:`.journal_in_use` .
+
+    Appending and discarding are thread safe.
+
+    Args:
+        path (:class:`pathlib.Path`): journal file, replaced if it exists
+        context (dict): JSON serializable header, eg. which table the data is for
+        sync_interval (float): maximum seconds between ``fsync`` s
+
+    Attributes:
+        counters (dict): ``records`` appended, ``syncs`` , and ``compactions``
+    """
+    MAGIC = b'AUTOPILOT-JOURNAL-1\n'
+    _RECORD = struct.Struct('<IIQ')
+
+    def __init__(self, path: Path, context: typing.Optional[dict] = None, sync_interval: float = 0.5):
+        self.path = Path(path)
+        self.context = context if context is not None else {}
+        self.sync_interval = sync_interval
+        self.counters = {'records': 0, 'syncs': 0, 'compactions': 0}
+
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._records = deque() # type: typing.Deque[typing.Tuple[int, bytes]]
+        self._file = None # type: typing.Optional[typing.BinaryIO]
+        self._last_sync = time.monotonic()
+        self._unsynced = False
+        self._rewrite()
+
+    @property
+    def empty(self) -> bool:
+        """
+        Whether all appended records have been discarded
+        """
+        return len(self._records) == 0
+
+    def _frame(self, seq: int, entry: dict) -> bytes:
+        payload = json.dumps(entry, default=_json_default).encode('utf-8')
+        return self._RECORD.pack(len(payload), zlib.crc32(payload), seq) + payload
+
+    def append(self, data: dict) -> int:
+        """
+        Append a piece of data
+
+        Returns:
+            int: the record's sequence number, increasing from 1
+        """
+        with self._lock:
+            if self._file is None:
+                raise ValueError(f'Journal {self.path} is closed')
+            self._seq += 1
+            record = self._frame(self._seq, {'data': data})
+            self._file.write(record)
+            self._file.flush()
+            self._records.append((self._seq, record))
+            self.counters['records'] += 1
+            self._unsynced = True
+            if time.monotonic() - self._last_sync > self.sync_interval:
+                self._sync()
+            return self._seq
+
+    def sync_due(self, now: typing.Optional[float] = None) -> typing.Optional[float]:
+        """
+        Seconds until appended records should be ``fsync`` ed, or ``None`` if they all have been.
+        """
+        if not self._unsynced:
+            return None
+        if now is None:
+            now = time.monotonic()
+        return max(self._last_sync + self.sync_interval - now, 0.0)
+
+    def sync(self):
+        """
+        ``fsync`` the journal now
+        """
+        with self._lock:
+            self._sync()
+
+    def _sync(self):
+        if self._file is None:
+            return
+        os.fsync(self._file.fileno())
+        self._last_sync = time.monotonic()
+        self._unsynced = False
+        self.counters['syncs'] += 1
+
+    def discard(self, before: int):
+        """
+        Drop records with sequence numbers less than ``before`` , which have been stored.
+        """
+        with self._lock:
+            if len(self._records) == 0 or self._records[0][0] >= before:
+                return
+            while len(self._records) > 0 and self._records[0][0] < before:
+                self._records.popleft()
+            self._rewrite()
+            self.counters['compactions'] += 1
+
+    def _rewrite(self):
+        # write the remaining records to a locked temporary file and swap it in,
+        # so a crash while compacting leaves either the old or the new journal intact
+        tmp_path = self.path.with_name(self.path.name + '.tmp')
+        new_file = open(tmp_path, 'wb')
+        _lock(new_file)
+        new_file.write(self.MAGIC)
+        new_file.write(self._frame(0, {'header': self.context}))
+        for _, record in self._records:
+            new_file.write(record)
+        new_file.flush()
+        os.fsync(new_file.fileno())
+        os.replace(tmp_path, self.path)
+
+        old_file, self._file = self._file, new_file
+        if old_file is not None:
+            old_file.close()
+        self._last_sync = time.monotonic()
+        self._unsynced = False
+
+    def close(self, remove: bool = True):
+        """
+        Close the journal.
+
+        Args:
+            remove (bool): remove the file if all its records have been discarded
+        """
+        with self._lock:
+            if self._file is None:
+                return
+            self._sync()
+            self._file.close()
+            self._file = None
+            if remove and len(self._records) == 0:
+                os.remove(self.path)
+
+
+def read_journal(path: Path) -> typing.List[typing.Tuple[dict, typing.List[dict]]]:
+    """
+    Read the entries of a :class:`.Journal` (or a JSON lines journal made by a previous version).
+
+    Records that can't be decoded (eg. a partially written last record) are skipped.
+
+    Args:
+        path (:class:`pathlib.Path`): journal file
+
+    Returns:
+        list: of ``(header, [data, ...])`` tuples, where ``header`` is the ``context`` the journal was created with
+    """
+    with open(path, 'rb') as jfile:
+        contents = jfile.read()
+
+    if contents.startswith(Journal.MAGIC):
+        lines = []
+        offset = len(Journal.MAGIC)
+        header_size = Journal._RECORD.size
+        while offset + header_size <= len(contents):
+            length, crc, _ = Journal._RECORD.unpack_from(contents, offset)
+            payload = contents[offset + header_size:offset + header_size + length]
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                # torn write, nothing after it was written intact
+                break
+            lines.append(payload)
+            offset += header_size + length
+    else:
+        lines = contents.splitlines()
+
+    entries = []
+    for line in lines:
+        try:
+            entry = json.loads(line)
+        except (json.decoder.JSONDecodeError, UnicodeDecodeError):
+            continue
+
+        if 'header' in entry:
+            entries.append((entry['header'], []))
+        elif 'data' in entry and len(entries) > 0:
+            entries[-1][1].append(entry['data'])
+    return entries
+
+
+class Trial_Writer:
+    """
+    Buffer rows of trial data and append them to a table in bulk.
+
+    The current row is filled with :meth:`.set` , and completed with :meth:`.append` , which
+    fills in the ``defaults`` and moves on to the next row. Completed rows are written to the table
+    when ``max_rows`` have accumulated, ``max_interval`` seconds have passed since the oldest one was
+    completed (checked by :meth:`.flush_due` ), or the writer is closed.
+
+    Rows that were already completed can be returned to with :meth:`.seek` , eg. when
+    data for a previous trial arrives out of order. The rows this writer completed are found
+    by the value of their ``index`` column without searching, and other rows are searched for
+    with :meth:`tables.Table.get_where_list` , which uses the table's column indexes if it has them.
+
+    Args:
+        table (:class:`tables.Table`): table to write to
+        defaults (dict): values to set in every row when it is completed, eg. ``session`` .
+            Only keys that are columns of the table are used.
+        journal (:class:`.Journal`, :class:`pathlib.Path`): If given, the journal that every piece of data
+            is appended to (by :meth:`.journal` or before being passed to :meth:`.journaled` ) before it is stored.
+            Records are discarded once they have been flushed. If a path, a :class:`.Journal` is opened there,
+            and removed when the writer is closed.
+        context (dict): JSON serializable header of a ``journal`` opened from a path, so it can be replayed.
+        max_rows (int): Number of completed rows to buffer before writing them
+        max_interval (float): Seconds to hold completed rows before writing them
+        index (str): Column to keep a map from value to row number of the rows this writer completed, for :meth:`.seek`
+        index_size (int): Number of the most recently completed rows to keep in the ``index`` map
+        scope (tuple): Columns in ``defaults`` that rows in the table must match to be returned to by :meth:`.seek` ,
+            eg. ``('session_uuid',)`` to only return to rows from this session.
+
+    Attributes:
+        names (tuple): column names of the table
+        counters (dict): ``rows`` , ``flushes`` , and ``modified`` (rows that were already written and changed) counts
+    """
+
+    def __init__(self,
+                 table: tables.Table,
+                 defaults: typing.Optional[dict] = None,
+                 journal: typing.Optional[Path] = None,
+                 context: typing.Optional[dict] = None,
+                 max_rows: int = 64,
+                 max_interval: float = 5.0,
+                 index: typing.Optional[str] = None,
+                 index_size: int = 10000,
+                 scope: typing.Sequence[str] = ()):
+        self.table = table
+        self.names = tuple(table.colnames)
+        self._names = set(self.names)
+        self.defaults = {k: v for k, v in (defaults or {}).items() if k in self._names}
+        self._required = self._names.difference(self.defaults)
+        self.max_rows = max(int(max_rows), 1)
+        self.max_interval = max_interval
+        self.counters = {'rows': 0, 'flushes': 0, 'modified': 0}
+
+        self.index = index if index in self._names else None
+        self.index_size = index_size
+        self._recent = {} # type: typing.Dict[typing.Any, int]
+
+        # condition and variables to restrict searches for rows to return to
+        self._scope = ''
+        self._scope_vars = {}
+        for i, k in enumerate(k for k in scope if k in self.defaults):
+            value = self.defaults[k]
+            self._scope += f' & ({k} == _scope_{i})'
+            self._scope_vars[f'_scope_{i}'] = value.encode('utf-8') if isinstance(value, str) else value
+
+        # one extra row for the one being filled
+        self._buffer = np.zeros(self.max_rows + 1, dtype=table.dtype)
+        self._n = 0
+        self._oldest = None # type: typing.Optional[float]
+
+        # the row being filled, either in our buffer or a copy of a row already in the table
+        self._target = self._buffer
+        self._index = 0
+        self._table_row = None # type: typing.Optional[int]
+        self._set = set() # type: typing.Set[str]
+        self._resume_set = set() # type: typing.Set[str]
+
+        # sequence numbers of the first journal record for the row being filled, and the last one received
+        self._row_seq = None # type: typing.Optional[int]
+        self._last_seq = 0
+        self._own_journal = journal is not None and not isinstance(journal, Journal)
+        if self._own_journal:
+            journal = Journal(journal, context)
+        self._journal = journal # type: typing.Optional[Journal]
+
+    @property
+    def row(self) -> np.void:
+        """
+        The row currently being filled, as a numpy record (changes to it are not kept, use :meth:`.set` )
+        """
+        return self._target[self._index].copy()
+
+    @property
+    def pending(self) -> int:
+        """
+        Number of completed rows that haven't been written to the table
+        """
+        return self._n
+
+    @property
+    def returned(self) -> bool:
+        """
+        Whether we have returned to a completed row with :meth:`.seek`
+        """
+        return self._target is not self._buffer or self._index != self._n
+
+    @property
+    def complete(self) -> bool:
+        """
+        Whether every column besides the :attr:`.defaults` has been set in the current row
+        """
+        return self._required.issubset(self._set)
+
+    def is_set(self, key: str) -> bool:
+        """
+        Whether ``key`` has been set in the current row
+        """
+        return key in self._set
+
+    def get(self, key: str):
+        """
+        Value of ``key`` in the current row
+        """
+        return self._target[key][self._index]
+
+    def set(self, key: str, value):
+        """
+        Set a column in the current row.
+
+        Raises:
+            KeyError: if ``key`` isn't a column in the table
+        """
+        if key not in self._names:
+            raise KeyError(key)
+        self._target[key][self._index] = value
+        self._set.add(key)
+
+    def journal(self, data: dict):
+        """
+        Append a piece of data to the journal before it is stored, if we have one.
+        """
+        if self._journal is None:
+            return
+        self.journaled(self._journal.append(data))
+
+    def journaled(self, seq: int):
+        """
+        Note that the data about to be stored was already appended to the journal as record ``seq`` .
+        """
+        if self._row_seq is None:
+            self._row_seq = seq
+        self._last_seq = seq
+
+    def append(self) -> np.void:
+        """
+        Complete the current row, filling in :attr:`.defaults` , and start a new one.
+
+        If the current row was returned to with :meth:`.seek` , it is written back in place,
+        and the next row is the one that was being filled before.
+
+        Returns:
+            :class:`numpy.void` : the completed row
+        """
+        for k, v in self.defaults.items():
+            self._target[k][self._index] = v
+        row = self._target[self._index].copy()
+
+        if self._table_row is not None:
+            self.table.modify_rows(self._table_row, self._table_row + 1, rows=self._target)
+            self.counters['modified'] += 1
+
+        if self._target is self._buffer and self._index == self._n:
+            if self.index is not None and self.index in self._set:
+                self._recent[row[self.index].item()] = self.table.nrows + self._n
+                if len(self._recent) > self.index_size:
+                    del self._recent[next(iter(self._recent))]
+            self._n += 1
+            self.counters['rows'] += 1
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            self._buffer[self._n] = np.zeros(1, dtype=self._buffer.dtype)[0]
+            self._set = set()
+            # the journal only needs to keep data for the row being filled,
+            # which was this one unless we had returned to a previous row.
+            self._row_seq = None
+        else:
+            self._set = self._resume_set
+
+        self._target, self._index, self._table_row = self._buffer, self._n, None
+        if self._n >= self.max_rows:
+            self.flush()
+        return row
+
+    def seek(self, key: str, value) -> int:
+        """
+        Return to a completed row where ``key == value`` , so it can be filled further.
+
+        The row that was being filled is left as it is, and is returned to after :meth:`.append` .
+
+        Args:
+            key (str): column to match
+            value: value to match
+
+        Returns:
+            int: number of matching rows. The current row is only changed if exactly one matched.
+        """
+        if key == self.index and value in self._recent:
+            nrow = self._recent[value]
+            if nrow >= self.table.nrows:
+                buffered, in_table = [nrow - self.table.nrows], []
+            else:
+                buffered, in_table = [], [nrow]
+        else:
+            buffered = np.flatnonzero(self._buffer[key][:self._n] == value)
+            in_table = self.table.get_where_list(f'({key} == _value){self._scope}',
+                                                 condvars={'_value': value, **self._scope_vars})
+        n_matches = len(buffered) + len(in_table)
+        if n_matches != 1:
+            return n_matches
+
+        if self._target is self._buffer and self._index == self._n:
+            self._resume_set = self._set
+        elif self._table_row is not None:
+            # keep what was set in the row we had already returned to
+            self.table.modify_rows(self._table_row, self._table_row + 1, rows=self._target)
+
+        if len(buffered) == 1:
+            self._target, self._index, self._table_row = self._buffer, int(buffered[0]), None
+        else:
+            nrow = int(in_table[0])
+            self._target, self._index, self._table_row = self.table.read(nrow, nrow + 1), 0, nrow
+
+        default = np.zeros(1, dtype=self._target.dtype)[0]
+        row = self._target[self._index]
+        self._set = {k for k in self.names if k not in self.defaults and np.any(row[k] != default[k])}
+        return 1
+
+    def flush_due(self, now: typing.Optional[float] = None) -> typing.Optional[float]:
+        """
+        Seconds until the completed rows should be written, or ``None`` if there aren't any.
+        """
+        if self._oldest is None:
+            return None
+        if now is None:
+            now = time.monotonic()
+        return max(self._oldest + self.max_interval - now, 0.0)
+
+    def flush(self):
+        """
+        Write completed rows to the table and truncate the journal,
+        keeping only the data for the row that is still being filled.
+        """
+        if self._n > 0:
+            start = self.table.nrows
+            current = self._buffer[self._n].copy()
+            self.table.append(self._buffer[:self._n])
+            if self._target is self._buffer and self._index < self._n:
+                # we had returned to a row that is now in the table
+                nrow = start + self._index
+                self._target, self._index, self._table_row = self.table.read(nrow, nrow + 1), 0, nrow
+            else:
+                self._index = 0
+            self._buffer[0] = current
+            self._n = 0
+            self.counters['flushes'] += 1
+        self.table.flush()
+        self._oldest = None
+
+        if self._journal is not None:
+            # keep the data for the row being filled, and anything journaled that we haven't gotten yet
+            self._journal.discard(self._row_seq if self._row_seq is not None else self._last_seq + 1)
+
+    def close(self):
+        """
+        Complete the current row if anything has been set in it, write all completed rows,
+        and close and remove the journal if we opened it.
+        """
+        if self.returned:
+            self.append()
+        if len(self._set) > 0:
+            self.append()
+        self.flush()
+        if self._own_journal:
+            self._journal.close(remove=True)
+        self._journal = None
+
+
+CONTINUOUS_META = ('continuous', 'timestamp', 'subject', 'pilot')
+"""
+Keys of continuous data that describe a sample, rather than being channels to store.
+"""
+
+
+def to_epoch(timestamp: typing.Union[str, float, int, datetime, None]) -> float:
+    """
+    Convert a timestamp to seconds since the epoch.
+
+    Args:
+        timestamp (str, float, :class:`datetime.datetime`, None): isoformatted string, datetime,
+            or epoch time already. If ``None`` , the current time.
+
+    Returns:
+        float
+    """
+    if timestamp is None:
+        return time.time()
+    elif isinstance(timestamp, (float, int, np.number)):
+        return float(timestamp)
+    elif isinstance(timestamp, bytes):
+        timestamp = timestamp.decode('utf-8')
+    if isinstance(timestamp, str):
+        timestamp = datetime.fromisoformat(timestamp)
+    return timestamp.timestamp()
+
+
+class Continuous_Writer:
+    """
+    Append samples of continuous data to per-channel :class:`tables.EArray` s.
+
+    Each key of a sample besides those in :data:`.CONTINUOUS_META` is a channel, stored in a group
+    beneath ``group_path`` ::
+
+        group_path
+        |--- key (group)
+        |    |--- data - EArray of samples, the first dimension is time
+        |    |--- timestamp - EArray of float64 epoch timestamps
+
+    Channels are created when they are first received, with an atom made from the first sample.
+    Channels that were stored as a table by previous versions continue to be appended to as one.
+
+    Args:
+        h5f (:class:`tables.File`): open file to write to
+        group_path (str): group to make channels in, created if it doesn't exist
+        chunk_rows (int): maximum number of samples in each chunk
+        chunk_bytes (int): maximum size of each chunk of samples, for channels with large samples like video frames
+        filters (:class:`tables.Filters`): compression to use, by default inherited from the group
+
+    Attributes:
+        counters (dict): number of samples stored for each channel
+    """
+
+    def __init__(self, h5f: tables.File, group_path: str,
+                 chunk_rows: int = 1024,
+                 chunk_bytes: int = 2 ** 20,
+                 filters: typing.Optional[tables.Filters] = None):
+        self.h5f = h5f
+        self.group_path = group_path
+        self.chunk_rows = chunk_rows
+        self.chunk_bytes = chunk_bytes
+        self.filters = filters
+        self.counters = {} # type: typing.Dict[str, int]
+        self._channels = {} # type: typing.Dict[str, typing.Tuple[tables.Node, typing.Optional[tables.EArray]]]
+
+    def append(self, sample: dict):
+        """
+        Store a single sample, see :meth:`.extend`
+        """
+        self.extend([sample])
+
+    def extend(self, samples: typing.List[dict]):
+        """
+        Store a batch of samples, appending all the values of each channel at once.
+
+        Args:
+            samples (list): of dicts, each with a ``timestamp`` (see :func:`.to_epoch` ) and one or more channels
+        """
+        channels = {} # type: typing.Dict[str, typing.Tuple[list, list]]
+        for sample in samples:
+            timestamp = to_epoch(sample.get('timestamp', None))
+            for k, v in sample.items():
+                if k in CONTINUOUS_META:
+                    continue
+                values, timestamps = channels.setdefault(k, ([], []))
+                values.append(v)
+                timestamps.append(timestamp)
+
+        for k, (values, timestamps) in channels.items():
+            data, timestamp = self._channel(k, values[0])
+            if timestamp is None:
+                # a table made by a previous version
+                data.append([(v, datetime.fromtimestamp(t).isoformat()) if data.colnames[0] == k else
+                             (datetime.fromtimestamp(t).isoformat(), v) for v, t in zip(values, timestamps)])
+            else:
+                data.append(np.asarray(values, dtype=data.atom.dtype).reshape((-1, *data.atom.shape)))
+                timestamp.append(np.asarray(timestamps, dtype=np.float64))
+            self.counters[k] = self.counters.get(k, 0) + len(values)
+
+    def _channel(self, key: str, value) -> typing.Tuple[tables.Node, typing.Optional[tables.EArray]]:
+        if key in self._channels:
+            return self._channels[key]
+
+        path = '/'.join([self.group_path, key])
+        try:
+            node = self.h5f.get_node(path)
+        except tables.NoSuchNodeError:
+            node = None
+
+        if isinstance(node, tables.Table):
+            channel = (node, None)
+        elif node is not None:
+            channel = (node.data, node.timestamp)
+        else:
+            value = np.asarray(value)
+            if value.dtype.kind in ('U', 'S', 'O'):
+                atom = tables.StringAtom(itemsize=256)
+            else:
+                atom = tables.Atom.from_dtype(value.dtype)
+            chunk_rows = int(min(self.chunk_rows, max(self.chunk_bytes // max(atom.size * value.size, 1), 1)))
+            group = self.h5f.create_group(self.group_path, key, createparents=True, filters=self.filters)
+            data = self.h5f.create_earray(group, 'data', atom=atom, shape=(0, *value.shape),
+                                          chunkshape=(chunk_rows, *value.shape))
+            timestamp = self.h5f.create_earray(group, 'timestamp', atom=tables.Float64Atom(), shape=(0,),
+                                               chunkshape=(self.chunk_rows,))
+            channel = (data, timestamp)
+
+        self._channels[key] = channel
+        return channel
+
+    def flush(self):
+        """
+        Flush the file
+        """
+        self.h5f.flush()
+
+
+def read_continuous(h5f: tables.File, path: str,
+                    start: typing.Union[str, float, datetime, None] = None,
+                    stop: typing.Union[str, float, datetime, None] = None) -> typing.Tuple[np.ndarray, np.ndarray]:
+    """
+    Read the samples of a channel made by :class:`.Continuous_Writer` between two times.
+
+    Timestamps are bisected a chunk at a time to find the range of samples (see :func:`.search_sorted` ),
+    and only the chunks with those samples are read and decompressed.
+
+    Args:
+        h5f (:class:`tables.File`): open file
+        path (str): path of the channel
+        start: first time to read (see :func:`.to_epoch` ), or from the first sample if ``None``
+        stop: last time to read, or until the last sample if ``None``
+
+    Returns:
+        tuple: (float64 epoch timestamps, samples)
+    """
+    node = h5f.get_node(path)
+    if isinstance(node, tables.Table):
+        # stored by a previous version
+        rows = node.read()
+        key = [name for name in node.colnames if name != 'timestamp'][0]
+        timestamps = np.array([to_epoch(t) for t in rows['timestamp']], dtype=np.float64)
+        mask = np.ones(len(timestamps), dtype=bool)
+        if start is not None:
+            mask &= timestamps >= to_epoch(start)
+        if stop is not None:
+            mask &= timestamps <= to_epoch(stop)
+        return timestamps[mask], rows[key][mask]
+
+    timestamps = node.timestamp
+    first = 0 if start is None else search_sorted(timestamps, to_epoch(start), side='left')
+    last = timestamps.nrows if stop is None else search_sorted(timestamps, to_epoch(stop), side='right')
+    last = max(first, last)
+    return timestamps.read(first, last), node.data.read(first, last)
+
+
+def search_sorted(array: tables.EArray, value: float, side: str = 'left') -> int:
+    """
+    Find where ``value`` would be inserted into a sorted 1D array on disk, like :func:`numpy.searchsorted` ,
+    bisecting on the first element of each chunk and then searching the one chunk ``value`` falls in,
+    so only ``log2(n_chunks) + 1`` chunks are read rather than the whole array.
+
+    Args:
+        array (:class:`tables.EArray`): sorted 1D array
+        value (float): value to search for
+        side (str): ``'left'`` for the first suitable index, ``'right'`` for the last
+
+    Returns:
+        int: index
+    """
+    n_rows = array.nrows
+    chunk = array.chunkshape[0]
+
+    # number of chunks whose first element goes before value
+    lo, hi = 0, (n_rows + chunk - 1) // chunk
+    while lo < hi:
+        mid = (lo + hi) // 2
+        first = array[mid * chunk]
+        if first < value or (side == 'right' and first == value):
+            lo = mid + 1
+        else:
+            hi = mid
+
+    if lo == 0:
+        return 0
+    start = (lo - 1) * chunk
+    block = array.read(start, min(start + chunk, n_rows))
+    return start + int(np.searchsorted(block, value, side=side))
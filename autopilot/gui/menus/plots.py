@@ -1,4 +1,5 @@
 import copy
+import typing
 
 import numpy as np
 from PySide6 import QtWidgets, QtGui
@@ -14,15 +15,19 @@ class Psychometric(QtWidgets.QDialog):
 
     Args:
         subjects_protocols (dict): The Terminals :attr:`.Terminal.subjects_protocols` dict
+        open_subject (callable): Called with a subject ID to open it, eg. :meth:`.Terminal.open_subject` ,
+            so subject files are read through the :class:`.Subject_Service` if it's running
+            rather than opened again by the GUI. (default: :class:`.Subject` )
 
     Attributes:
         plot_params (list): A list of tuples, each consisting of (subject_id, step, variable) to be given to :func:`.viz.plot_psychometric`
     """
 
-    def __init__(self, subjects_protocols):
+    def __init__(self, subjects_protocols, open_subject: typing.Callable = Subject):
         super(Psychometric, self).__init__()
 
         self.subjects = subjects_protocols
+        self.open_subject = open_subject
         # self.protocols = protocols
         # self.protocol_dir = prefs.get('PROTOCOLDIR')
         self.subject_objects = {}
@@ -122,7 +127,7 @@ class Psychometric(QtWidgets.QDialog):
             step_box.removeItem(0)
 
         # open the subject file and use 'current' to get step names
-        asub = Subject(subject)
+        asub = self.open_subject(subject)
 
         step_list = []
         for s in asub.current:
@@ -145,7 +150,7 @@ class Psychometric(QtWidgets.QDialog):
             var_box.removeItem(0)
 
         # open the subjet's file and get a description of the data for this
-        this_subject = Subject(subject)
+        this_subject = self.open_subject(subject)
         step_data = this_subject.get_trial_data(step=step_ind, what="variables")
         # should only have one step, so denest
         step_data = step_data[step_data.keys()[0]]
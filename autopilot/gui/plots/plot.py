@@ -105,17 +105,19 @@ class Plot(QtWidgets.QWidget):
 
     **listens**
 
-    +-------------+------------------------+-------------------------+
-    | Key         | Method                 | Description             |
-    +=============+========================+=========================+
-    | **'START'** | :meth:`~.Plot.l_start` | starting a new task     |
-    +-------------+------------------------+-------------------------+
-    | **'DATA'**  | :meth:`~.Plot.l_data`  | getting a new datapoint |
-    +-------------+------------------------+-------------------------+
-    | **'STOP'**  | :meth:`~.Plot.l_stop`  | stop the task           |
-    +-------------+------------------------+-------------------------+
-    | **'PARAM'** | :meth:`~.Plot.l_param` | change some parameter   |
-    +-------------+------------------------+-------------------------+
+    +--------------------+-------------------------------+-------------------------+
+    | Key                | Method                        | Description             |
+    +====================+===============================+=========================+
+    | **'START'**        | :meth:`~.Plot.l_start`        | starting a new task     |
+    +--------------------+-------------------------------+-------------------------+
+    | **'DATA'**         | :meth:`~.Plot.l_data`         | getting a new datapoint |
+    +--------------------+-------------------------------+-------------------------+
+    | **'STOP'**         | :meth:`~.Plot.l_stop`         | stop the task           |
+    +--------------------+-------------------------------+-------------------------+
+    | **'PARAM'**        | :meth:`~.Plot.l_param`        | change some parameter   |
+    +--------------------+-------------------------------+-------------------------+
+    | **'CAMERA_STATS'** | :meth:`~.Plot.l_camera_stats` | a camera's timing stats |
+    +--------------------+-------------------------------+-------------------------+
 
     **Plot Parameters**
 
@@ -140,6 +142,7 @@ class Plot(QtWidgets.QWidget):
             * 'Session' : :class:`QtWidgets.QLabel`,
             * 'Protocol': :class:`QtWidgets.QLabel`,
             * 'Step'    : :class:`QtWidgets.QLabel`
+            * 'Camera {name}' : :class:`QtWidgets.QLabel`, added for each camera that sends its stats
 
         plot (:class:`pyqtgraph.PlotWidget`): The widget where we draw our plots
         plot_params (dict): A dictionary of plot parameters we receive from the Task class
@@ -197,7 +200,8 @@ class Plot(QtWidgets.QWidget):
             'CONTINUOUS': self.l_data,
             'STOP' : self.l_stop,
             'PARAM': self.l_param, # changing some param
-            'STATE': self.l_state
+            'STATE': self.l_state,
+            'CAMERA_STATS': self.l_camera_stats # a camera's timing stats
         }
 
         self.node = Net_Node(id='P_{}'.format(self.pilot),
@@ -456,6 +460,26 @@ class Plot(QtWidgets.QWidget):
         """
         pass
 
+    @gui_event
+    def l_camera_stats(self, value):
+        """
+        A camera is reporting its timing statistics (see :meth:`.Camera.stats` ),
+        show its framerate and dropped frames in the infobox.
+
+        Args:
+            value (dict): camera stats, with ``pilot`` and ``camera`` names
+        """
+        label = 'Camera {}'.format(value.get('camera'))
+        if label not in self.info.keys():
+            self.info[label] = QtWidgets.QLabel()
+            self.infobox.addRow(label, self.info[label])
+
+        fps = value.get('fps')
+        fps = '-' if fps is None else '{:.1f}'.format(fps)
+        dropped = sum(value.get('dropped', {}).values())
+        self.info[label].setText('{} fps, {} dropped'.format(fps, dropped))
+        self.info[label].setToolTip(', '.join('{}: {}'.format(stage, n) for stage, n in value.get('dropped', {}).items()))
+
     def l_state(self, value):
         """
         Pilot letting us know its state has changed. Mostly for the case where
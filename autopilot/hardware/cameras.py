@@ -6,10 +6,14 @@ import csv
 from skvideo import io
 from datetime import datetime
 import multiprocessing as mp
+from multiprocessing import shared_memory
 from tqdm.auto import tqdm
 import inspect
 import typing
+import functools
+import math
 import shutil
+import tempfile
 
 import time
 import traceback
@@ -18,10 +22,16 @@ import warnings
 import subprocess
 
 from queue import Queue, Empty, Full
+from collections import deque
 import logging
 from ctypes import c_char_p
 import numpy as np
 
+try:
+    from multiprocessing import resource_tracker
+except ImportError: # pragma: no cover - windows
+    resource_tracker = None
+
 try:
     import PySpin
     PYSPIN = True
@@ -43,6 +53,7 @@ except:
 
 from autopilot import prefs
 from autopilot.hardware import Hardware
+from autopilot.utils.loggers import init_logger
 
 OPENCV_LAST_INIT_TIME = mp.Value('d', 0.0)
 """
@@ -56,6 +67,347 @@ The workaround seems to be relatively simple, we just wait ~2 seconds if another
 """
 LAST_INIT_LOCK = mp.Lock()
 
+class Timing_Histogram(object):
+    """
+    Histogram of durations in log-spaced bins, cheap enough to add to once per frame.
+
+    Bins span :attr:`.min_time` to ``min_time * 10**decades`` seconds with :attr:`.bins_per_decade` bins per
+    factor of 10, durations outside are counted in the first or last bin.
+
+    Attributes:
+        counts (list): count of durations in each bin
+        count (int): number of durations
+        total (float): sum of durations
+        max (float): longest duration
+    """
+    min_time = 1e-6 # shortest duration resolved, in seconds
+    decades = 7 # number of factors of 10 spanned by the bins
+    bins_per_decade = 10
+
+    def __init__(self):
+        self.n_bins = self.decades * self.bins_per_decade
+        self._log_min = math.log10(self.min_time)
+        self.reset()
+
+    def reset(self):
+        self.counts = [0] * self.n_bins
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float):
+        """
+        Count a duration
+
+        Args:
+            seconds (float): duration
+        """
+        if seconds > 0:
+            idx = int((math.log10(seconds) - self._log_min) * self.bins_per_decade)
+            idx = min(max(idx, 0), self.n_bins - 1)
+        else:
+            idx = 0
+        self.counts[idx] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    @property
+    def edges(self) -> typing.List[float]:
+        """
+        Bin edges in seconds, one more than the number of bins
+        """
+        return [self.min_time * 10 ** (i / self.bins_per_decade) for i in range(self.n_bins + 1)]
+
+    def percentile(self, q: float) -> typing.Optional[float]:
+        """
+        Estimate a percentile, as the upper edge of the bin it falls in
+
+        Args:
+            q (float): percentile, 0-100
+
+        Returns:
+            float: duration in seconds, or ``None`` if nothing has been counted
+        """
+        if self.count == 0:
+            return None
+        target = self.count * q / 100
+        cumulative = 0
+        for idx, n in enumerate(self.counts):
+            cumulative += n
+            if cumulative >= target and n > 0:
+                return min(self.min_time * 10 ** ((idx + 1) / self.bins_per_decade), self.max)
+        return self.max
+
+    def summary(self, histogram: bool = False) -> dict:
+        """
+        Returns:
+            dict: ``count`` , and ``mean_ms`` , ``max_ms`` , ``p50_ms`` , ``p95_ms`` , ``p99_ms`` durations in milliseconds
+            (``None`` if nothing has been counted), and if ``histogram`` , the bin ``counts``
+        """
+        def _ms(seconds):
+            return seconds * 1000 if seconds is not None else None
+
+        summary = {
+            'count': self.count,
+            'mean_ms': _ms(self.total / self.count) if self.count > 0 else None,
+            'max_ms': _ms(self.max) if self.count > 0 else None,
+            'p50_ms': _ms(self.percentile(50)),
+            'p95_ms': _ms(self.percentile(95)),
+            'p99_ms': _ms(self.percentile(99))
+        }
+        if histogram:
+            summary['counts'] = list(self.counts)
+        return summary
+
+
+class Camera_Stats(object):
+    """
+    Timing and dropped frame statistics for a :class:`.Camera` , see :meth:`.Camera.stats`
+
+    Each of the :attr:`.STAGES` of handling a frame is timed into a :class:`.Timing_Histogram` :
+
+    * ``grab`` - :meth:`.Camera._grab` , including the ``timestamp``
+    * ``timestamp`` - :meth:`.Camera._timestamp` , for cameras whose grab calls it
+    * ``stream`` - appending the frame to the stream queue
+    * ``write`` - :meth:`.Camera._write_frame` , copying the frame into the writer's ring or queue
+    * ``queue`` - putting the frame in :attr:`.Camera.q`
+
+    Args:
+        fps (float): expected framerate, used to estimate frames missed between grabs
+
+    Attributes:
+        frames (int): number of frames handled
+        dropped (dict): frames lost at each stage. ``grab`` - failed grabs,
+            ``queue`` - not put in a full :attr:`.Camera.q` , ``gaps`` - estimated frames missed by the camera,
+            from intervals between frames longer than 1.5 frame periods.
+    """
+    STAGES = ('grab', 'timestamp', 'stream', 'write', 'queue')
+    fps_window = 2.0 # seconds of recent frames to compute the effective framerate over
+
+    def __init__(self, fps: typing.Optional[float] = None):
+        self.histograms = {stage: Timing_Histogram() for stage in self.STAGES}
+        self.reset(fps)
+
+    def reset(self, fps: typing.Optional[float] = None):
+        """
+        Clear all statistics, eg. at the start of a capture
+        """
+        self.fps = fps
+        for histogram in self.histograms.values():
+            histogram.reset()
+        self.frames = 0
+        self.dropped = {'grab': 0, 'queue': 0, 'gaps': 0}
+        self._first = None # type: typing.Optional[float]
+        self._last = None # type: typing.Optional[float]
+        self._recent = deque()
+
+    def time(self, stage: str, seconds: float):
+        """
+        Add the duration of a stage
+        """
+        self.histograms[stage].add(seconds)
+
+    def timer(self, stage: str, fn: typing.Callable) -> typing.Callable:
+        """
+        Wrap a function to time each call as a stage
+        """
+        histogram = self.histograms[stage]
+
+        @functools.wraps(fn)
+        def _timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                histogram.add(time.perf_counter() - start)
+        return _timed
+
+    def frame(self, now: typing.Optional[float] = None):
+        """
+        Count a frame arriving at :func:`time.monotonic` time ``now``
+        """
+        if now is None:
+            now = time.monotonic()
+        if self._last is not None and self.fps:
+            periods = (now - self._last) * self.fps
+            if periods > 1.5:
+                self.dropped['gaps'] += int(round(periods)) - 1
+        if self._first is None:
+            self._first = now
+        self._last = now
+        self.frames += 1
+
+        self._recent.append(now)
+        while now - self._recent[0] > self.fps_window:
+            self._recent.popleft()
+
+    def drop(self, stage: str):
+        """
+        Count a frame dropped at a stage
+        """
+        self.dropped[stage] += 1
+
+    @property
+    def effective_fps(self) -> typing.Optional[float]:
+        """
+        Framerate over the last :attr:`.fps_window` seconds
+        """
+        if len(self._recent) < 2 or self._recent[-1] == self._recent[0]:
+            return None
+        return (len(self._recent) - 1) / (self._recent[-1] - self._recent[0])
+
+    def summary(self, histograms: bool = False) -> dict:
+        """
+        Returns:
+            dict: ``frames`` , ``fps`` (effective, recent), ``mean_fps`` (since reset), ``target_fps`` ,
+            ``dropped`` counts, and ``stages`` - :meth:`.Timing_Histogram.summary` for each stage.
+            If ``histograms`` , also each stage's bin ``counts`` and the ``bin_edges_ms`` .
+        """
+        mean_fps = None
+        if self._first is not None and self._last > self._first:
+            mean_fps = (self.frames - 1) / (self._last - self._first)
+        summary = {
+            'frames': self.frames,
+            'fps': self.effective_fps,
+            'mean_fps': mean_fps,
+            'target_fps': self.fps,
+            'dropped': dict(self.dropped),
+            'stages': {stage: histogram.summary(histograms) for stage, histogram in self.histograms.items()}
+        }
+        if histograms:
+            summary['bin_edges_ms'] = [edge * 1000 for edge in Timing_Histogram().edges]
+        return summary
+
+
+class Stream_Preview(object):
+    """
+    Make a cheaper version of a :class:`.Camera` 's frames to stream, eg. for previewing in the Terminal,
+    while full frames are still written and queued.
+
+    Frames are decimated to at most ``fps`` (or every ``every`` th frame), then cropped to ``roi`` ,
+    scaled by ``scale`` , and converted to grayscale. Frames that aren't sent aren't processed at all.
+
+    Scaling uses :func:`cv2.resize` if OpenCV is available, otherwise frames are subsampled by the nearest integer factor.
+
+    Args:
+        fps (float): maximum rate of frames to send
+        every (int): send every nth frame, if ``fps`` isn't given
+        scale (float, tuple): fraction of the (cropped) frame size, or ``(width, height)`` in pixels
+        roi (tuple): ``(x, y, width, height)`` of the region to send, like :attr:`.Camera.crop`
+        grayscale (bool): if True, send color frames as grayscale.
+        color_order (str): ``'RGB'`` (default) or ``'BGR'`` , the order of the channels of color frames,
+            eg. ``'BGR'`` for :class:`.Camera_CV` (see :attr:`.Camera.color_order` ).
+
+    Attributes:
+        sent (int): number of frames sent
+        skipped (int): number of frames skipped by decimation
+    """
+
+    def __init__(self, fps: typing.Optional[float] = None, every: typing.Optional[int] = None,
+                 scale: typing.Union[float, typing.Tuple[int, int], None] = None,
+                 roi: typing.Optional[typing.Tuple[int, int, int, int]] = None,
+                 grayscale: bool = False, color_order: str = 'RGB'):
+        if fps is not None and fps <= 0:
+            raise ValueError(f'fps must be positive, got {fps}')
+        if every is not None and every < 1:
+            raise ValueError(f'every must be at least 1, got {every}')
+        if color_order not in ('RGB', 'BGR'):
+            raise ValueError(f"color_order must be 'RGB' or 'BGR', got {color_order}")
+        self.fps = fps
+        self.every = every
+        self.scale = scale
+        self.roi = roi
+        self.grayscale = grayscale
+        self.color_order = color_order
+
+        self.sent = 0
+        self.skipped = 0
+        self._n = 0
+        self._next = None # type: typing.Optional[float]
+
+    def due(self, now: typing.Optional[float] = None) -> bool:
+        """
+        Whether the current frame should be sent, counting it as skipped if not
+
+        Args:
+            now (float): :func:`time.monotonic` time of the frame, default now
+        """
+        send = True
+        if self.fps is not None:
+            if now is None:
+                now = time.monotonic()
+            if self._next is not None and now < self._next:
+                send = False
+            else:
+                # step from the last scheduled time so the rate doesn't drift, unless we've fallen behind
+                period = 1.0 / self.fps
+                if self._next is None or self._next + period <= now:
+                    self._next = now + period
+                else:
+                    self._next += period
+        elif self.every is not None:
+            send = self._n % self.every == 0
+            self._n += 1
+
+        if send:
+            self.sent += 1
+        else:
+            self.skipped += 1
+        return send
+
+    def process(self, frame: np.ndarray) -> np.ndarray:
+        """
+        Crop, scale, and convert a frame
+
+        Args:
+            frame (:class:`numpy.ndarray`): full frame
+
+        Returns:
+            :class:`numpy.ndarray` : contiguous processed frame
+        """
+        if self.roi is not None:
+            x, y, width, height = self.roi
+            frame = frame[y:y + height, x:x + width]
+
+        if self.scale is not None:
+            frame = self._resize(frame)
+
+        if self.grayscale and frame.ndim == 3 and frame.shape[2] >= 3:
+            bgr = self.color_order == 'BGR'
+            if OPENCV and frame.dtype == np.uint8:
+                frame = cv2.cvtColor(np.ascontiguousarray(frame[..., :3]),
+                                     cv2.COLOR_BGR2GRAY if bgr else cv2.COLOR_RGB2GRAY)
+            else:
+                weights = np.array([0.114, 0.587, 0.299] if bgr else [0.299, 0.587, 0.114])
+                frame = (frame[..., :3] @ weights).astype(frame.dtype)
+
+        return np.ascontiguousarray(frame)
+
+    def _resize(self, frame: np.ndarray) -> np.ndarray:
+        height, width = frame.shape[:2]
+        if isinstance(self.scale, (int, float)):
+            size = (max(int(width * self.scale), 1), max(int(height * self.scale), 1))
+        else:
+            size = (int(self.scale[0]), int(self.scale[1]))
+        if size == (width, height):
+            return frame
+
+        if OPENCV:
+            return cv2.resize(np.ascontiguousarray(frame), size, interpolation=cv2.INTER_AREA)
+        step_x = max(int(round(width / size[0])), 1)
+        step_y = max(int(round(height / size[1])), 1)
+        return frame[::step_y, ::step_x]
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            dict: ``sent`` and ``skipped`` frame counts
+        """
+        return {'sent': self.sent, 'skipped': self.skipped}
+
+
 class Camera(Hardware):
     """
     Metaclass for Camera objects. Should not be instantiated on its own.
@@ -94,8 +446,11 @@ class Camera(Hardware):
 
     Attributes:
         frame (tuple): The current captured frame as a tuple (timestamp, frame).
+        frame_seq (int): Sequence number of the current frame, if captured by a :class:`.Capture_Coordinator`
+        frame_tick_time (float): :func:`time.monotonic` time of the coordinator's tick the current frame was captured on
         shape (tuple): Shape of captured frames (height, width, channels)
         blosc (bool): If True (default), use blosc compression when
+        shm (bool): If True (default), pass frames to the :class:`.Video_Writer` through a :class:`.Frame_Ring`
         cam: The object used to interact with the camera
         fps (int): Framerate of video capture
         timed (bool, int, float): If False (default), camera captures indefinitely. If int or float, captures for this many seconds
@@ -114,6 +469,9 @@ class Camera(Hardware):
     input = True #: test documenting input
     type = "CAMERA" #: (str): what are we anyway?
     trigger = False
+    writer_timeout = 10 #: (float): seconds to wait for the :class:`.Video_Writer` to finish after capture ends
+    stats_interval = 5.0 #: (float): seconds between ``CAMERA_STATS`` messages while streaming, ``None`` to not send them
+    color_order = 'RGB' #: (str): order of the channels of color frames, ``'RGB'`` or ``'BGR'``
 
     def __init__(self, fps=None, timed=False, crop=None, rotate:int=0, **kwargs):
         """
@@ -133,17 +491,25 @@ class Camera(Hardware):
         self._capture_thread = None
         self._writer = None
         self._write_q = None
+        self._ring = None # type: typing.Optional[Frame_Ring]
+        self._ring_stats = None # type: typing.Optional[dict]
         self._stream_q = None
+        self._preview = None # type: typing.Optional[Stream_Preview]
         self._indicator = None
         self._resolution = None
 
         self.frame = None
         self.shape = None
         self.frame_n = 0
+        self.frame_seq = None # type: typing.Optional[int]
+        self.frame_tick_time = None # type: typing.Optional[float]
         self.crop = crop
         self.rotate = rotate
 
         self.blosc = True
+        self.shm = True
+        self.ring_slots = None
+        self.ring_overwrite = False
 
         #self.fps = fps
         self.timed = timed
@@ -173,6 +539,11 @@ class Camera(Hardware):
         self.indicating = threading.Event()
         self.indicating.clear()
 
+        # time each stage of handling a frame, see stats()
+        self._stats = Camera_Stats()
+        self._next_stats = None # type: typing.Optional[float]
+        self._timestamp = self._stats.timer('timestamp', self._timestamp)
+
         # initialize args passed by kwargs
         if 'stream' in kwargs.keys():
             self.stream(**kwargs['stream'])
@@ -222,13 +593,7 @@ class Camera(Hardware):
         * :meth:`~.Camera.capture_deinit` - any required routine to stop acquisition but not release the camera instance.
         """
 
-        self.capturing.set()
-        self.stopping.clear()
-
-        self.capture_init()
-
-        if self.streaming.is_set():
-            self.node.send(key='STATE', value='CAPTURING')
+        self._start_capture()
 
         try:
             self._process()
@@ -247,66 +612,204 @@ class Camera(Hardware):
                 self.frame_n += 1
 
         finally:
-            self.logger.info('Capture Ending')
+            self._end_capture()
 
-            try:
-                if self.streaming.is_set():
-                    self.node.send(key='STATE', value='STOPPING')
-                    self._stream_q.append('END')
-            except Exception as e:
-                self.logger.exception('Failed to end stream, error message: {}'.format(e))
+    def _start_capture(self):
+        """
+        Set :attr:`.capturing` , call :meth:`.capture_init` and tell any stream recipient we're capturing.
 
-            try:
-                if self.writing.is_set():
-                    self._write_deinit()
+        Used by :meth:`._capture` , and by :class:`.Capture_Coordinator` when it does the grabbing.
+        """
+        self.capturing.set()
+        self.stopping.clear()
 
-            except Exception as e:
-                self.logger.exception('Failed to end writer, error message: {}'.format(e))
+        self.capture_init()
 
-            if self.indicating.is_set():
-                try:
-                    self._indicator.close()
-                except:
-                    pass
+        try:
+            fps = self.fps
+        except Exception:
+            fps = None
+        self._stats.reset(fps)
+        if self.stats_interval is not None:
+            self._next_stats = time.monotonic() + self.stats_interval
 
-            self.capturing.clear()
-            self.capture_deinit()
-            #self.release()
-            #self.logger.info('Camera Released')
+        if self.streaming.is_set():
+            self.node.send(key='STATE', value='CAPTURING')
+
+    def _end_capture(self):
+        """
+        End the stream, the writer, and the indicator, then call :meth:`.capture_deinit`
+        """
+        self.logger.info('Capture Ending')
+
+        try:
+            if self.streaming.is_set():
+                self.node.send(key='STATE', value='STOPPING')
+                self._stream_q.append('END')
+        except Exception as e:
+            self.logger.exception('Failed to end stream, error message: {}'.format(e))
+
+        try:
+            if self.writing.is_set():
+                self._write_deinit()
+
+        except Exception as e:
+            self.logger.exception('Failed to end writer, error message: {}'.format(e))
+
+        if self.indicating.is_set():
+            try:
+                self._indicator.close()
+            except:
+                pass
+
+        self._send_stats()
+
+        self.capturing.clear()
+        self.capture_deinit()
+        #self.release()
+        #self.logger.info('Camera Released')
 
     def _process(self):
         """
         A full frame capture cycle.
 
-        :meth:`~Camera._grab`s the :attr:`.frame`, then handles streaming, writing, queueing, and indicating
-        according to :meth:`~Camera.stream`, :meth:`~Camera.write`, :meth:`~Camera.queue`, and :attr:`~Camera.indicating`, respectively.
+        :meth:`~Camera._grab`s the :attr:`.frame`, then handles it with :meth:`~Camera._dispatch`
+
+        """
+        frame = self._timed_grab()
+        if frame is not None:
+            self.frame = frame
+        self._dispatch()
 
+    def _timed_grab(self) -> tuple:
         """
+        :meth:`~Camera._grab` a frame, timing it and counting failed grabs.
 
+        Returns:
+            tuple: the grabbed (timestamp, frame), or ``None`` if the grab raised an exception
+        """
+        start = time.perf_counter()
+        frame = None
         try:
-            self.frame = self._grab()
+            frame = self._grab()
+            if frame is None or frame[1] is False:
+                self._stats.drop('grab')
         except Exception as e:
+            self._stats.drop('grab')
             self.logger.exception(e)
+        self._stats.time('grab', time.perf_counter() - start)
+        return frame
 
-        if self.streaming.is_set():
+    def _dispatch(self):
+        """
+        Handle streaming, writing, queueing, and indicating the current :attr:`.frame`
+        according to :meth:`~Camera.stream`, :meth:`~Camera.write`, :meth:`~Camera.queue`, and :attr:`~Camera.indicating`, respectively.
+
+        If the frame was grabbed by a :class:`.Capture_Coordinator` , its sequence number
+        :attr:`.frame_seq` and the coordinator's :attr:`.frame_tick_time` are streamed along with it
+        as ``seq`` and ``tick_time`` .
+
+        Each stage is timed, see :meth:`.stats`
+        """
+        self._stats.frame()
+
+        if self.streaming.is_set() and self._stream_due():
+            start = time.perf_counter()
             try:
-                self._stream_q.append({'timestamp': self.frame[0],
-                                           self.name  : self.frame[1]})
+                self._stream_frame(self.frame[1])
             except Full:
                 self.logger.exception(f"queue was full for frame captured at {self.frame[0]}")
+            self._stats.time('stream', time.perf_counter() - start)
 
         if self.writing.is_set():
+            start = time.perf_counter()
             self._write_frame()
+            self._stats.time('write', time.perf_counter() - start)
 
         if self.queueing.is_set():
-            self.q.put_nowait(self.frame)
+            start = time.perf_counter()
+            try:
+                self.q.put_nowait(self.frame)
+            except Full:
+                self._stats.drop('queue')
+            self._stats.time('queue', time.perf_counter() - start)
 
         if self.indicating.is_set():
             if not self._indicator:
                 self._indicator = tqdm()
             self._indicator.update()
 
-    def stream(self, to='T', ip=None, port=None, min_size=5, **kwargs):
+        self._report_stats()
+
+    def _stream_due(self) -> bool:
+        """
+        Whether to stream the current frame, see :class:`.Stream_Preview`
+        """
+        return self._preview is None or self._preview.due()
+
+    def _stream_frame(self, frame):
+        """
+        Put a frame, processed by the :class:`.Stream_Preview` if streaming a preview, in the stream queue
+        with the current :attr:`.frame` 's timestamp
+        """
+        if self._preview is not None and isinstance(frame, np.ndarray):
+            frame = self._preview.process(frame)
+        value = {'timestamp': self.frame[0],
+                 self.name  : frame}
+        if self.frame_seq is not None:
+            value['seq'] = self.frame_seq
+            value['tick_time'] = self.frame_tick_time
+        self._stream_q.append(value)
+
+    def stats(self, histograms: bool = False) -> dict:
+        """
+        Timing and dropped frame statistics since capture started.
+
+        Returns:
+            dict: :meth:`.Camera_Stats.summary` -- ``frames`` , effective ``fps`` over the last few seconds, ``mean_fps`` ,
+            ``target_fps`` , timing summaries of each stage of handling a frame in ``stages`` (see :class:`.Camera_Stats` ),
+            and ``dropped`` frames at each stage, including ``stream`` (dropped from a full stream queue),
+            and ``write`` (dropped or overwritten in the writer's :class:`.Frame_Ring` , see :attr:`.write_stats` ).
+            While streaming, also ``stream_stats`` , see :meth:`.Stream_Stats.as_dict` , and if streaming a preview,
+            ``preview`` - :meth:`.Stream_Preview.stats` .
+            If ``histograms`` , each stage's histogram bin ``counts`` and the ``bin_edges_ms`` .
+        """
+        stats = self._stats.summary(histograms=histograms)
+        write_stats = self.write_stats
+        stats['dropped']['write'] = write_stats['dropped'] + write_stats['overruns']
+        stats['dropped']['stream'] = getattr(self._stream_q, 'dropped', 0)
+        stream_stats = getattr(self._stream_q, 'stats', None)
+        if stream_stats is not None:
+            stats['stream_stats'] = stream_stats.as_dict()
+        if self._preview is not None:
+            stats['preview'] = self._preview.stats()
+        return stats
+
+    def _report_stats(self):
+        """
+        Send ``CAMERA_STATS`` every :attr:`.stats_interval` seconds while streaming
+        """
+        if self._next_stats is None or not self.streaming.is_set():
+            return
+        now = time.monotonic()
+        if now >= self._next_stats:
+            self._next_stats = now + self.stats_interval
+            self._send_stats()
+
+    def _send_stats(self):
+        """
+        Send :meth:`.stats` , with their histograms, to the Terminal as ``CAMERA_STATS``
+        """
+        if not self.streaming.is_set() or self.stats_interval is None:
+            return
+        try:
+            value = self.stats(histograms=True)
+            value.update({'pilot': prefs.get('NAME'), 'camera': self.name})
+            self.node.send(to='T', key='CAMERA_STATS', value=value, flags={'NOLOG': True})
+        except Exception as e:
+            self.logger.exception(f'Could not send camera stats: {e}')
+
+    def stream(self, to='T', ip=None, port=None, min_size=5, max_latency=None, adaptive=False, preview=None, **kwargs):
         """
         Enable streaming frames on capture.
 
@@ -321,6 +824,15 @@ class Camera(Hardware):
             port (int, str): Port of recipient socket. If None (default), ``prefs.get('MSGPORT')``. If None and ``to`` is 'T', ``prefs.get('TERMINALPORT')``.
             min_size (int): Number of frames to collect before sending (default: 5). use 1 to send frames as soon as they are available,
                 sacrificing the efficiency from compressing multiple frames together
+            max_latency (float): Maximum time (in ms) to wait for ``min_size`` frames before sending what we have.
+                If None (default), always wait for ``min_size`` frames.
+            adaptive (bool): If True, tune the number of frames per message and their compression
+                from the measured frame rate and link throughput (see :meth:`.Net_Node.get_stream` ).
+                Statistics are reported by the stream queue's :attr:`~.Stream_Queue.stats` .
+            preview (dict, :class:`.Stream_Preview`): if given, stream a decimated, cropped, downscaled,
+                and/or grayscale version of frames rather than full frames, eg. ``{'fps': 10, 'scale': 0.25}`` .
+                Frames are still written and queued at full resolution and rate. See :class:`.Stream_Preview` ,
+                whose ``color_order`` defaults to the camera's :attr:`.color_order` .
             **kwargs: passed to :meth:`.Hardware.init_networking` and thus to :class:`.Net_Node`
 
         """
@@ -355,10 +867,14 @@ class Camera(Hardware):
             self.logger.warning('nothing found for prefs.get(\'SUBJECT\'), probably running outside of task context')
             subject = None
 
+        if isinstance(preview, dict):
+            preview = Stream_Preview(**{'color_order': self.color_order, **preview})
+        self._preview = preview
+
         self._stream_q = self.node.get_stream(
             'stream', 'CONTINUOUS', upstream=to,
             ip=ip, port=port, subject=subject,
-            min_size=min_size
+            min_size=min_size, max_latency=max_latency, adaptive=adaptive
         )
 
         self.streaming.set()
@@ -383,50 +899,96 @@ class Camera(Hardware):
 
 
 
-    def write(self, output_filename = None, timestamps=True, blosc=True):
+    def write(self, output_filename = None, timestamps=True, blosc=True,
+              shm=True, ring_slots=None, ring_overwrite=False,
+              encoder='pipe', codec='x264', preview=None, **kwargs):
         """
         Enable writing frames locally on capture
 
         Spawns a :class:`.Video_Writer` to encode video, sets :attr:`.writing`
 
+        By default, frames are copied into a :class:`.Frame_Ring` in shared memory and only their slot
+        in the ring is put in the :attr:`._write_q` , rather than compressing and pickling each frame.
+        If the writer falls a full ring behind, frames are dropped (or overwritten, if ``ring_overwrite`` ),
+        and counted in :attr:`.write_stats` .
+
         Args:
             output_filename (str): path and filename of the output video. extension should be ``.mp4``,
                 as videos are encoded with libx264 by default.
             timestamps (bool): if True, (timestamp, frame) tuples will be put in the :attr:`._write_q`.
                 if False, timestamps will be generated by :class:`.Video_Writer` (not recommended at all).
             blosc (bool): if true, compress frames with :func:`blosc.pack_array` before putting in :attr:`._write_q`.
+                Not used if ``shm`` is True.
+            shm (bool): if True (default), pass frames through a :class:`.Frame_Ring`
+            ring_slots (int): number of frames in the ring, if None, see :attr:`.Frame_Ring.ring_mb`
+            ring_overwrite (bool): if True, overwrite frames the writer hasn't read yet when the ring is full
+                rather than dropping new frames.
+            encoder (str): name of the :class:`.Encoder` to use, see :class:`.Video_Writer`
+            codec (str, list): name of a codec in :data:`.CODECS` , or a list of ffmpeg output arguments
+            preview (dict): options for a smaller preview video, see :class:`.Encoder`
+            **kwargs: passed to the :class:`.Encoder`
         """
         if output_filename is None:
             output_filename = self.output_filename
         else:
             self._output_filename = output_filename
 
-        self.blosc = blosc
+        if self._ring is not None:
+            self._ring.close()
+        # the ring is made when the first frame tells us its shape
+        self._ring = None
+        self._ring_stats = None
+        self.shm = shm
+        self.ring_slots = ring_slots
+        self.ring_overwrite = ring_overwrite
+        self.blosc = blosc and not shm
+
         self._write_q = mp.Queue()
-        self.writer = Video_Writer(self._write_q, output_filename, self.fps, timestamps=timestamps, blosc=blosc)
+        self.writer = Video_Writer(self._write_q, output_filename, self.fps, timestamps=timestamps, blosc=self.blosc,
+                                   encoder=encoder, codec=codec, preview=preview, **kwargs)
         self.writer.start()
         self.writing.set()
         self.logger.info('Writing initialized, writing to {}'.format(output_filename))
 
     def _write_frame(self):
         """
-        Put :attr:`.frame` into the :attr:`._write_q`, optionally compressing it with :func:`blosc.pack_array`
+        Put :attr:`.frame` into the :attr:`._write_q` .
+
+        If :attr:`.shm` , copy the frame into the :class:`.Frame_Ring` and put its ``(slot, seq, timestamp)`` in the queue,
+        otherwise put the frame itself, optionally compressing it with :func:`blosc.pack_array`
         """
         try:
-            if self.blosc:
+            if self.shm:
+                frame = self.frame[1]
+                if not isinstance(frame, np.ndarray):
+                    # failed grab
+                    return
+                if self._ring is None:
+                    self._ring = Frame_Ring(frame.shape, frame.dtype,
+                                            slots=self.ring_slots, overwrite=self.ring_overwrite)
+                    self._write_q.put_nowait(self._ring.spec)
+                    self.logger.debug(f'Writing frames through a ring of {self._ring.slots} frames')
+
+                slot = self._ring.put(frame)
+                if slot is None:
+                    if self._ring.stats()['dropped'] == 1:
+                        self.logger.warning('Writer is a full ring of frames behind, dropping frames')
+                    return
+                self._write_q.put_nowait((slot[0], slot[1], self.frame[0]))
+
+            elif self.blosc:
                 self._write_q.put_nowait((self.frame[0], blosc.pack_array(self.frame[1])))
             else:
                 self._write_q.put_nowait(self.frame)
         except Full:
             self.logger.exception('Frame {} could not be written, queue full'.format(self.frame_n))
 
-
-
     def _write_deinit(self):
         """
         End the :class:`.Video_Writer`.
 
-        Blocks until the :attr:`._write_q` is empty, holding the release of the object.
+        Blocks until the :attr:`._write_q` is empty, holding the release of the object,
+        and then until the writer finishes or :attr:`.writer_timeout` passes before closing the :class:`.Frame_Ring` .
         """
         self._write_q.put_nowait('END')
         checked_empty = False
@@ -436,8 +998,35 @@ class Camera(Hardware):
                     'Writer still has ~{} frames, waiting on it to finish'.format(self._write_q.qsize()))
                 checked_empty = True
             time.sleep(0.1)
+
+        if self._ring is not None:
+            self.writer.join(self.writer_timeout)
+            self._ring.close()
+            self._ring_stats = self._ring.stats()
+            self._ring = None
+            if self._ring_stats['dropped'] > 0 or self._ring_stats['overruns'] > 0:
+                self.logger.warning(
+                    f"Writer missed frames - dropped: {self._ring_stats['dropped']}, overwritten: {self._ring_stats['overruns']}")
         self.logger.info('Writer finished, closing')
 
+    @property
+    def write_stats(self) -> dict:
+        """
+        Counters for the :class:`.Frame_Ring` used to pass frames to the :class:`.Video_Writer` ,
+        see :meth:`.Frame_Ring.stats` .
+
+        Frames are ``dropped`` when the ring is full, or ``overruns`` if they were overwritten before the writer read them.
+        After writing ends, the counts from the last recording.
+
+        Returns:
+            dict: ``written`` , ``read`` , ``dropped`` , and ``overruns`` counts (all 0 if not writing through a ring)
+        """
+        if self._ring is not None:
+            return self._ring.stats()
+        if self._ring_stats is not None:
+            return dict(self._ring_stats)
+        return {'written': 0, 'read': 0, 'dropped': 0, 'overruns': 0}
+
     def queue(self, queue_size = 128):
         """
         Enable stashing frames in a queue for a local consumer.
@@ -889,6 +1478,8 @@ class PiCamera(Camera):
 
 
 class Camera_CV(Camera):
+    color_order = 'BGR' #: (str): OpenCV captures frames in BGR order
+
     def __init__(self, camera_idx = 0, **kwargs):
         """
         Capture Video from a webcam with OpenCV
@@ -1301,33 +1892,50 @@ class Camera_Spinnaker(Camera):
 
         More details on the differences are given in the :meth:`_write_frame`,
         """
+        frame = self._timed_grab()
+        if frame is not None:
+            self.frame = frame
+        self._dispatch()
+
+    def _dispatch(self):
+        """
+        Modification of :meth:`.Camera._dispatch` that converts the PySpin image to an array
+        only if it is streamed or queued, and releases the image afterwards.
+        """
         frame_array = None
-        try:
-            self.frame = self._grab()
-        except Exception as e:
-            self.logger.exception(e)
+        self._stats.frame()
 
         #self._frame[:] = self.frame[1].GetNDArray()
 
         if self.writing.is_set():
+            start = time.perf_counter()
             self._write_frame()
+            self._stats.time('write', time.perf_counter() - start)
 
-        if self.streaming.is_set():
-            if not frame_array:
+        if self.streaming.is_set() and self._stream_due():
+            start = time.perf_counter()
+            if frame_array is None:
                 frame_array = np.rot90(self.frame[1].GetNDArray(), axes=(1,0), k=self.rotate)
-            self._stream_q.append({'timestamp': self.frame[0],
-                                       self.name  : frame_array})
+            self._stream_frame(frame_array)
+            self._stats.time('stream', time.perf_counter() - start)
 
         if self.queueing.is_set():
-            if not frame_array:
+            start = time.perf_counter()
+            if frame_array is None:
                 frame_array = np.rot90(self.frame[1].GetNDArray(), axes=(1,0), k=self.rotate)
-            self.q.put_nowait((self.frame[0], frame_array))
+            try:
+                self.q.put_nowait((self.frame[0], frame_array))
+            except Full:
+                self._stats.drop('queue')
+            self._stats.time('queue', time.perf_counter() - start)
 
         if self.indicating.is_set():
             if self._indicator is None:
                 self._indicator = tqdm()
             self._indicator.update()
 
+        self._report_stats()
+
 
         self.frame[1].Release()
 
@@ -1796,6 +2404,368 @@ class Camera_Spinnaker(Camera):
 
 
 
+class Capture_Coordinator(object):
+    """
+    Capture from several :class:`.Camera` s on a shared clock.
+
+    Rather than each camera grabbing frames in its own :meth:`.Camera._capture` thread as fast as it can,
+    a clock thread ticks at :attr:`.fps` and every camera grabs one frame per tick in its own grab thread.
+    Frames from the same tick are collected into a bundle tagged with the tick's sequence number,
+    :func:`time.monotonic` time, and wall clock time, which is emitted once every camera has delivered its frame, or
+    :attr:`.tolerance` seconds after the tick if some haven't.
+
+    Bundles are emitted in order by a dispatch thread, which gives each frame to its camera's
+    writer, stream, and queue (as set up by :meth:`.Camera.write` , :meth:`.Camera.stream` , and :meth:`.Camera.queue` )
+    with the bundle's timestamp, so the timestamps of all videos line up, and streams include the bundle's ``seq``
+    and ``tick_time`` .
+    Whole bundles can also be taken from :attr:`.q` after calling :meth:`.queue` .
+
+    A camera that is still grabbing when a tick comes skips it, and that tick's bundle won't have its frame.
+    Frames that arrive after their bundle was emitted are discarded and counted as ``late`` .
+    See :meth:`.stats` for per-camera dropped frame counts and the skew between cameras.
+
+    Cameras that don't support external triggers still expose frames at their own rate, so
+    their skew is up to a frame period -- set each camera's framerate at or above the coordinator's.
+
+    Args:
+        cameras (dict, list): cameras to coordinate, as a dict of ``{name: camera}`` or a list of cameras with names
+        fps (float): rate of the shared clock. If ``None`` , the slowest framerate of the ``cameras``
+        timed (bool, int, float): If False (default), capture indefinitely. If numeric, capture for this many seconds
+        tolerance (float): seconds after a tick to wait for all frames before emitting its bundle without them.
+            If ``None`` , one clock period.
+        skew_window (int): number of recent bundles to compute skew statistics over
+
+    Attributes:
+        q (:class:`queue.Queue`): bundles, if :meth:`.queue` has been called. Bundles are dicts with
+            ``seq`` , ``timestamp`` (the tick's wall clock time, in seconds since the epoch),
+            ``tick_time`` (the tick's :func:`time.monotonic` time), ``frames`` ( ``{name: frame}`` , frames as returned from
+            each camera's :meth:`~.Camera._grab` , without the cameras whose frame missed the bundle),
+            ``timestamps`` (each camera's own timestamp), and ``grab_times`` (monotonic time each grab finished).
+            Frames from :class:`.Camera_Spinnaker` are PySpin images that are released after dispatch,
+            so should not be queued.
+        capturing (:class:`threading.Event`): set while capturing
+        stopping (:class:`threading.Event`): set to stop capturing
+    """
+
+    def __init__(self, cameras: typing.Union[typing.Dict[str, Camera], typing.List[Camera]],
+                 fps: typing.Optional[float] = None, timed: typing.Union[bool, int, float] = False,
+                 tolerance: typing.Optional[float] = None, skew_window: int = 1000):
+        if isinstance(cameras, dict):
+            self.cameras = dict(cameras)
+        else:
+            self.cameras = {cam.name: cam for cam in cameras}
+        if len(self.cameras) == 0:
+            raise ValueError('Need at least one camera to coordinate')
+
+        if fps is None:
+            rates = [cam.fps for cam in self.cameras.values() if cam.fps]
+            if len(rates) == 0:
+                raise ValueError('None of the cameras have an fps, need to pass one')
+            fps = min(rates)
+        self.fps = float(fps)
+        self.period = 1.0 / self.fps
+        self.timed = timed
+        self.tolerance = self.period if tolerance is None else tolerance
+
+        self.logger = init_logger(self)
+
+        self.q = None # type: typing.Optional[Queue]
+        self.queueing = threading.Event()
+        self.capturing = threading.Event()
+        self.stopping = threading.Event()
+
+        self._tick = -1
+        self._start = 0.0
+        self._wall_start = 0.0
+        self._tick_times = {} # type: typing.Dict[int, float]
+        self._tick_cond = threading.Condition()
+        self._pending = {} # type: typing.Dict[int, dict]
+        self._emitted = -1
+        self._lock = threading.Lock()
+        self._ready = Queue()
+        self._stop_lock = threading.Lock()
+
+        self._threads = [] # type: typing.List[threading.Thread]
+        self._skews = deque(maxlen=skew_window)
+        self._counters = {}
+        self._reset_stats()
+
+    def _reset_stats(self):
+        self._skews.clear()
+        self._counters = {
+            'bundles': 0,
+            'incomplete': 0,
+            'queue_full': 0,
+            'cameras': {name: {'grabbed': 0, 'dropped': 0, 'late': 0, 'latency': 0.0}
+                        for name in self.cameras.keys()}
+        }
+
+    def queue(self, queue_size: int = 128):
+        """
+        Put bundles in :attr:`.q` as they're emitted
+
+        Args:
+            queue_size (int): max number of bundles that can be held in :attr:`.q` , further bundles aren't queued
+        """
+        self.q = Queue(maxsize=queue_size)
+        self.queueing.set()
+
+    def capture(self, timed: typing.Union[bool, int, float, None] = None):
+        """
+        Prepare each camera, and start the clock, grab, and dispatch threads.
+
+        Args:
+            timed (None, int, float): if None, capture according to :attr:`.timed` . If numeric, capture for ``timed`` seconds.
+        """
+        if self.capturing.is_set():
+            self.logger.warning('Already Capturing!')
+            return
+        if timed:
+            self.timed = timed
+
+        self.stopping.clear()
+        self._tick = -1
+        self._tick_times = {}
+        self._pending = {}
+        self._emitted = -1
+        self._reset_stats()
+
+        for cam in self.cameras.values():
+            if cam.capturing.is_set():
+                raise RuntimeError(f'Camera {cam.name} is already capturing on its own, stop it first')
+            cam.frame_n = 0
+            cam._start_capture()
+
+        self.capturing.set()
+        self._threads = [threading.Thread(target=self._dispatch_loop, daemon=True)]
+        self._threads.extend([threading.Thread(target=self._grab_loop, args=(name,), daemon=True)
+                              for name in self.cameras.keys()])
+        self._threads.append(threading.Thread(target=self._clock, daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def _clock(self):
+        start = self._start = time.monotonic()
+        self._wall_start = time.time()
+        end = None
+        if self.timed and not isinstance(self.timed, bool):
+            end = start + self.timed
+
+        seq = 0
+        while not self.stopping.is_set():
+            tick_time = start + seq * self.period
+            if end is not None and tick_time >= end:
+                # stop() joins this thread, so can't be called from it
+                threading.Thread(target=self.stop, daemon=True).start()
+                break
+
+            delay = tick_time - time.monotonic()
+            if delay > 0 and self.stopping.wait(delay):
+                break
+
+            with self._tick_cond:
+                self._tick_times[seq] = tick_time
+                self._tick = seq
+                self._tick_cond.notify_all()
+
+            self._emit_ready()
+            seq += 1
+
+        with self._tick_cond:
+            self._tick_cond.notify_all()
+
+    def _grab_loop(self, name: str):
+        cam = self.cameras[name]
+        counters = self._counters['cameras'][name]
+        last = -1
+        while not self.stopping.is_set():
+            with self._tick_cond:
+                self._tick_cond.wait_for(lambda: self._tick > last or self.stopping.is_set(), timeout=1)
+                seq = self._tick
+            if self.stopping.is_set():
+                break
+            if seq <= last:
+                continue
+            last = seq
+
+            frame = cam._timed_grab()
+            if frame is None or frame[1] is False:
+                # failed grab, already counted by the camera
+                continue
+            grab_time = time.monotonic()
+            counters['grabbed'] += 1
+            counters['latency'] += grab_time - (self._start + seq * self.period)
+            self._deliver(seq, name, frame, grab_time)
+
+    def _deliver(self, seq: int, name: str, frame: tuple, grab_time: float):
+        with self._lock:
+            if seq <= self._emitted:
+                self._counters['cameras'][name]['late'] += 1
+                self._discard(frame)
+                return
+            bundle = self._pending.get(seq)
+            if bundle is None:
+                bundle = self._bundle(seq, self._tick_times[seq])
+                self._pending[seq] = bundle
+            bundle['timestamps'][name] = frame[0]
+            bundle['frames'][name] = frame[1]
+            bundle['grab_times'][name] = grab_time
+        if len(bundle['frames']) == len(self.cameras):
+            self._emit_ready()
+
+    def _emit_ready(self, flush: bool = False):
+        """
+        Emit pending bundles, in order, that are complete or past their :attr:`.tolerance`
+        """
+        now = time.monotonic()
+        with self._lock:
+            while True:
+                seq = self._emitted + 1
+                tick_time = self._tick_times.get(seq)
+                if tick_time is None:
+                    break
+                bundle = self._pending.get(seq)
+                complete = bundle is not None and len(bundle['frames']) == len(self.cameras)
+                if not (complete or flush or now >= tick_time + self.tolerance):
+                    break
+
+                self._pending.pop(seq, None)
+                self._tick_times.pop(seq, None)
+                self._emitted = seq
+                if bundle is None:
+                    bundle = self._bundle(seq, tick_time)
+                self._count_bundle(bundle)
+                self._ready.put(bundle)
+
+    def _bundle(self, seq: int, tick_time: float) -> dict:
+        # timestamps are wall clock times so they can be compared with other data,
+        # but are computed from the tick time so they line up exactly between cameras
+        return {'seq': seq, 'timestamp': self._wall_start + (tick_time - self._start), 'tick_time': tick_time,
+                'frames': {}, 'timestamps': {}, 'grab_times': {}}
+
+    def _count_bundle(self, bundle: dict):
+        self._counters['bundles'] += 1
+        if len(bundle['frames']) < len(self.cameras):
+            self._counters['incomplete'] += 1
+            for name in self.cameras.keys():
+                if name not in bundle['frames']:
+                    self._counters['cameras'][name]['dropped'] += 1
+        if len(bundle['grab_times']) > 1:
+            grab_times = bundle['grab_times'].values()
+            self._skews.append(max(grab_times) - min(grab_times))
+
+    def _dispatch_loop(self):
+        while True:
+            bundle = self._ready.get()
+            if bundle is None:
+                break
+            for name, frame in bundle['frames'].items():
+                cam = self.cameras[name]
+                cam.frame = (bundle['timestamp'], frame)
+                cam.frame_seq = bundle['seq']
+                cam.frame_tick_time = bundle['tick_time']
+                try:
+                    cam._dispatch()
+                except Exception as e:
+                    cam.logger.exception(f'Exception handling frame {bundle["seq"]}: {e}')
+                cam.frame_n += 1
+
+            if self.queueing.is_set():
+                try:
+                    self.q.put_nowait(bundle)
+                except Full:
+                    self._counters['queue_full'] += 1
+
+    @staticmethod
+    def _discard(frame: tuple):
+        # PySpin images have to be released
+        release = getattr(frame[1], 'Release', None)
+        if release is not None:
+            try:
+                release()
+            except Exception:
+                pass
+
+    def stats(self) -> dict:
+        """
+        Capture statistics since :meth:`.capture` was called
+
+        Returns:
+            dict: with keys
+
+            * ``bundles`` - number of bundles emitted
+            * ``incomplete`` - number of bundles missing at least one camera's frame
+            * ``queue_full`` - number of bundles that couldn't be put in :attr:`.q`
+            * ``skew`` - ``mean`` and ``max`` difference in seconds between the first and last grab in recent bundles
+            * ``cameras`` - for each camera, ``grabbed`` frames, ``dropped`` (bundles without its frame),
+              ``late`` (frames that missed their bundle), and mean ``latency`` in seconds from tick to finished grab.
+        """
+        with self._lock:
+            skews = list(self._skews)
+            stats = {
+                'bundles': self._counters['bundles'],
+                'incomplete': self._counters['incomplete'],
+                'queue_full': self._counters['queue_full'],
+                'skew': {'mean': float(np.mean(skews)) if skews else None,
+                         'max': float(np.max(skews)) if skews else None},
+                'cameras': {}
+            }
+            for name, counters in self._counters['cameras'].items():
+                cam_stats = dict(counters)
+                cam_stats['latency'] = counters['latency'] / counters['grabbed'] if counters['grabbed'] else None
+                stats['cameras'][name] = cam_stats
+        return stats
+
+    def stop(self):
+        """
+        Stop the clock and grab threads, emit the remaining bundles, and end each camera's capture
+        (closing its writer and stream).
+        """
+        with self._stop_lock:
+            if not self.capturing.is_set():
+                return
+            self._stop()
+
+    def _stop(self):
+        self.stopping.set()
+        with self._tick_cond:
+            self._tick_cond.notify_all()
+
+        dispatcher, workers = self._threads[0], self._threads[1:]
+        for thread in workers:
+            if thread is threading.current_thread():
+                continue
+            thread.join(1)
+            if thread.is_alive():
+                self.logger.warning(f'Grab thread {thread.name} still running after stopping')
+
+        self._emit_ready(flush=True)
+        self._ready.put(None)
+        dispatcher.join()
+
+        for cam in self.cameras.values():
+            try:
+                cam._end_capture()
+            except Exception as e:
+                self.logger.exception(f'Failed to end capture for {cam.name}: {e}')
+            cam.frame_seq = None
+            cam.frame_tick_time = None
+
+        self.capturing.clear()
+        self.logger.info(f'Capture ended, stats: {self.stats()}')
+
+    def release(self):
+        """
+        :meth:`.stop` capturing and release each camera
+        """
+        self.stop()
+        for cam in self.cameras.values():
+            try:
+                cam.release()
+            except Exception as e:
+                self.logger.exception(f'Could not release camera {cam.name}: {e}')
+
+
 #
 # class Camera_Picam(Camera):
 #     """
@@ -1830,6 +2800,184 @@ class Camera_Spinnaker(Camera):
 #             raise IOError(msg)
 
 
+class Frame_Ring(object):
+    """
+    Preallocated ring of frames in shared memory, used to hand frames from a :class:`.Camera`
+    to a :class:`.Video_Writer` without compressing or pickling them.
+
+    The camera copies each frame into the next slot with :meth:`.put` and sends the
+    ``(slot, seq, timestamp)`` it returns through the writer's queue, and the writer
+    gets the frame back out with :meth:`.get` and then :meth:`.release` s it.
+
+    The first block of the shared memory holds counters (see :meth:`.stats` ) and the sequence number
+    of the frame in each slot, so both processes can see them, and so the writer can tell if
+    a slot was overwritten before it read it.
+
+    When the writer falls a full ring behind, either new frames are dropped (default), or
+    if ``overwrite`` is ``True`` the oldest unread frames are overwritten and the writer skips them.
+
+    Only the process that created a ring puts frames in it, other processes :meth:`.attach` to it with its :attr:`.spec` .
+
+    Args:
+        shape (tuple): shape of each frame
+        dtype (str, :class:`numpy.dtype`): dtype of each frame
+        slots (int): number of frames in the ring. If ``None`` , as many as fit in :attr:`.ring_mb` (at least 2).
+        overwrite (bool): if ``True`` , overwrite unread frames when the ring is full rather than dropping new ones.
+        name (str): name of an existing ring's shared memory block to attach to, see :meth:`.attach`
+
+    Attributes:
+        shm (:class:`multiprocessing.shared_memory.SharedMemory`): The shared memory block
+        frames (:class:`numpy.ndarray`): ``(slots, *shape)`` array of frames in :attr:`.shm`
+    """
+    ring_mb = 128 # default size of the ring in MB, if the number of slots isn't given
+    _WRITTEN, _READ, _DROPPED, _OVERRUNS = range(4) # positions of counters in the header
+    _N_COUNTERS = 4
+
+    def __init__(self, shape: typing.Tuple[int, ...], dtype='uint8',
+                 slots: typing.Optional[int] = None, overwrite: bool = False,
+                 name: typing.Optional[str] = None):
+        self.shape = tuple(int(dim) for dim in shape)
+        self.dtype = np.dtype(dtype)
+        frame_bytes = max(int(np.prod(self.shape)) * self.dtype.itemsize, 1)
+        if slots is None:
+            slots = max((self.ring_mb * 2**20) // frame_bytes, 2)
+        self.slots = int(slots)
+        self.overwrite = overwrite
+
+        # keep frames 64-byte aligned after the header
+        header_bytes = (self._N_COUNTERS + self.slots) * 8
+        header_bytes += -header_bytes % 64
+
+        self.owner = name is None
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=header_bytes + frame_bytes * self.slots)
+        else:
+            # processes started by multiprocessing (like the :class:`.Video_Writer` ) share the camera's
+            # resource tracker, but otherwise it would unlink the block when this process exits
+            shared_tracker = resource_tracker is not None and \
+                getattr(getattr(resource_tracker, '_resource_tracker', None), '_fd', None) is not None
+            self.shm = shared_memory.SharedMemory(name=name)
+            if resource_tracker is not None and not shared_tracker:
+                try:
+                    resource_tracker.unregister(self.shm._name, 'shared_memory')
+                except Exception:
+                    pass
+        self.name = self.shm.name
+
+        self._header = np.ndarray((self._N_COUNTERS + self.slots,), dtype=np.int64, buffer=self.shm.buf)
+        self._counters = self._header[:self._N_COUNTERS]
+        self._seqs = self._header[self._N_COUNTERS:]
+        self.frames = np.ndarray((self.slots,) + self.shape, dtype=self.dtype,
+                                 buffer=self.shm.buf, offset=header_bytes)
+        if self.owner:
+            self._header[:] = 0
+            self._seqs[:] = -1
+
+    @property
+    def spec(self) -> dict:
+        """
+        Arguments to :meth:`.attach` to this ring from another process
+        """
+        return {'name': self.name, 'shape': self.shape, 'dtype': self.dtype.str,
+                'slots': self.slots, 'overwrite': self.overwrite}
+
+    @classmethod
+    def attach(cls, name: str, shape: typing.Tuple[int, ...], dtype: str,
+               slots: int, overwrite: bool = False) -> 'Frame_Ring':
+        """
+        Attach to a ring made in another process from its :attr:`.spec`
+        """
+        return cls(shape, dtype, slots=slots, overwrite=overwrite, name=name)
+
+    def put(self, frame: np.ndarray) -> typing.Optional[typing.Tuple[int, int]]:
+        """
+        Copy a frame into the next slot.
+
+        Args:
+            frame (:class:`numpy.ndarray`): frame with the ring's :attr:`.shape`
+
+        Returns:
+            tuple: ``(slot, seq)`` of the frame, or ``None`` if it was dropped because the ring is full
+        """
+        seq = int(self._counters[self._WRITTEN])
+        if seq - self._counters[self._READ] >= self.slots and not self.overwrite:
+            self._counters[self._DROPPED] += 1
+            return None
+
+        slot = seq % self.slots
+        # mark the slot as being written so the writer doesn't take a partial frame
+        self._seqs[slot] = -1
+        self.frames[slot] = frame
+        self._seqs[slot] = seq
+        self._counters[self._WRITTEN] = seq + 1
+        return slot, seq
+
+    def get(self, slot: int, seq: int) -> typing.Optional[np.ndarray]:
+        """
+        Get a frame put in the ring.
+
+        Unless the ring :attr:`.overwrite` s unread frames, the frame is a view into the slot rather than a copy,
+        and it isn't overwritten until it's :meth:`.release` d.
+
+        Args:
+            slot (int): slot returned by :meth:`.put`
+            seq (int): sequence number returned by :meth:`.put`
+
+        Returns:
+            :class:`numpy.ndarray` : the frame, or ``None`` if it was overwritten before it could be read
+        """
+        if self._seqs[slot] != seq:
+            self._counters[self._OVERRUNS] += 1
+            return None
+        if not self.overwrite:
+            return self.frames[slot]
+
+        frame = self.frames[slot].copy()
+        if self._seqs[slot] != seq:
+            # overwritten while we were copying it
+            self._counters[self._OVERRUNS] += 1
+            return None
+        return frame
+
+    def release(self, seq: int):
+        """
+        Mark frames up to and including ``seq`` as read, so their slots can be reused.
+        """
+        self._counters[self._READ] = seq + 1
+
+    def stats(self) -> dict:
+        """
+        Counters for the ring
+
+        Returns:
+            dict: ``written`` , ``read`` , ``dropped`` (frames not put in the ring because it was full),
+            and ``overruns`` (frames overwritten before they could be read) counts
+        """
+        if self._counters is None:
+            return dict(self._final_stats)
+        return {'written': int(self._counters[self._WRITTEN]),
+                'read': int(self._counters[self._READ]),
+                'dropped': int(self._counters[self._DROPPED]),
+                'overruns': int(self._counters[self._OVERRUNS])}
+
+    def close(self):
+        """
+        Close the shared memory block, and unlink it if this process made it
+        """
+        if self._counters is None:
+            return
+        self._final_stats = self.stats()
+        # views into the buffer have to be gone before it can be closed
+        self.frames = None
+        self._header = self._counters = self._seqs = None
+        try:
+            self.shm.close()
+            if self.owner:
+                self.shm.unlink()
+        except (FileNotFoundError, BufferError):
+            pass
+
+
 class Directory_Writer(object):
     IMG_EXTS = ('.png', '.jpg')
     def __init__(self, dir, fps, ext='.png', ffmpeg_bin='ffmpeg'):
@@ -1906,8 +3054,351 @@ class Directory_Writer(object):
 
 
 
+CODECS = {
+    'x264': {
+        'args': ['-c:v', 'libx264', '-preset', 'ultrafast', '-pix_fmt', 'yuv420p'],
+        'containers': ('.mp4', '.mkv', '.avi')
+    },
+    'ffv1': {
+        'args': ['-c:v', 'ffv1', '-level', '3', '-g', '1', '-slices', '4', '-slicecrc', '1'],
+        'containers': ('.mkv', '.avi')
+    },
+    'mjpeg': {
+        'args': ['-c:v', 'mjpeg', '-q:v', '3', '-pix_fmt', 'yuvj420p'],
+        'containers': ('.avi', '.mkv')
+    },
+    'v4l2m2m': {
+        'args': ['-c:v', 'h264_v4l2m2m', '-b:v', '10M', '-pix_fmt', 'yuv420p'],
+        'containers': ('.mp4', '.mkv', '.avi')
+    },
+    'nvenc': {
+        'args': ['-c:v', 'h264_nvenc', '-preset', 'p1', '-pix_fmt', 'yuv420p'],
+        'containers': ('.mp4', '.mkv', '.avi')
+    },
+}
+"""
+Named sets of ffmpeg output arguments for :class:`.Encoder` s, and the containers they can be written to.
+
+* ``x264`` - ``libx264`` , ``ultrafast`` preset (the default)
+* ``ffv1`` - lossless ``ffv1`` , every frame a keyframe
+* ``mjpeg`` - motion jpeg, cheap to encode but large
+* ``v4l2m2m`` - hardware h264 encoder on the Raspberry Pi
+* ``nvenc`` - hardware h264 encoder on nvidia GPUs
+"""
+
+
+def _input_pix_fmt(shape: typing.Tuple[int, ...], dtype: np.dtype) -> str:
+    """ffmpeg ``rawvideo`` pixel format for frames of a given shape and dtype"""
+    channels = 1 if len(shape) == 2 else shape[2]
+    formats = {
+        np.dtype('uint8'): {1: 'gray', 3: 'rgb24', 4: 'rgba'},
+        np.dtype('uint16'): {1: 'gray16le', 3: 'rgb48le', 4: 'rgba64le'}
+    }
+    try:
+        return formats[np.dtype(dtype)][channels]
+    except KeyError:
+        raise ValueError(f'No ffmpeg pixel format for frames with shape {shape} and dtype {dtype}, pass input_pix_fmt')
+
+
+class Encoder(object):
+    """
+    Metaclass for video encoders used by :class:`.Video_Writer` . Should not be instantiated on its own.
+
+    Encoders are opened with the shape and dtype of the first frame given to :meth:`.write` .
+
+    Args:
+        path (str): output path of the video. If the ``codec`` can't be written to its container,
+            the extension is changed to the codec's first container, see :attr:`.path` .
+        fps (int): framerate of the video
+        codec (str, list): name of a codec in :data:`.CODECS` , or a list of ffmpeg output arguments
+        preview (dict): if not ``None`` , also encode a smaller preview video, if the encoder supports it. Keys are
+
+            * ``path`` - output path, default ``{path}_preview.mp4``
+            * ``scale`` - fraction of the full frame size (default ``0.25`` )
+            * ``fps`` - framerate of the preview, default the same as the video
+            * ``codec`` - codec of the preview, default ``x264``
+
+        input_pix_fmt (str): ffmpeg pixel format of the frames, if ``None`` , inferred from their shape and dtype
+            (eg. ``rgb24`` for 3-channel ``uint8`` frames, but frames from OpenCV are ``bgr24`` ).
+        ffmpeg_bin (str): ffmpeg binary to use
+
+    Attributes:
+        path (str): output path of the video
+        n_frames (int): number of frames written
+    """
+    supports_preview = False
+
+    def __init__(self, path: str, fps: int, codec: typing.Union[str, typing.List[str]] = 'x264',
+                 preview: typing.Optional[dict] = None,
+                 input_pix_fmt: typing.Optional[str] = None,
+                 ffmpeg_bin: str = 'ffmpeg'):
+        self.fps = fps
+        self.codec = codec
+        self.codec_args = self._codec_args(codec)
+        self.path = self._container(path, codec)
+        self.preview = self._preview(preview)
+        self.input_pix_fmt = input_pix_fmt
+        self.ffmpeg_bin = ffmpeg_bin
+        self.shape = None
+        self.dtype = None
+        self.n_frames = 0
+
+        if self.preview is not None and not self.supports_preview:
+            warnings.warn(f'{self.__class__.__name__} does not support preview videos, not writing one')
+            self.preview = None
+
+    @staticmethod
+    def _codec_args(codec: typing.Union[str, typing.List[str]]) -> typing.List[str]:
+        if isinstance(codec, str):
+            if codec not in CODECS:
+                raise ValueError(f'Unknown codec {codec}, use one of {list(CODECS.keys())} or a list of ffmpeg arguments')
+            return list(CODECS[codec]['args'])
+        return [str(arg) for arg in codec]
+
+    @staticmethod
+    def _container(path: str, codec: typing.Union[str, typing.List[str]]) -> str:
+        if not isinstance(codec, str):
+            return path
+        base, ext = os.path.splitext(path)
+        containers = CODECS[codec]['containers']
+        if ext.lower() not in containers:
+            warnings.warn(f'Codec {codec} cannot be written to a {ext} file, writing to {base + containers[0]}')
+            path = base + containers[0]
+        return path
+
+    def _preview(self, preview: typing.Optional[dict]) -> typing.Optional[dict]:
+        if preview is None:
+            return None
+        preview = dict(preview)
+        codec = preview.get('codec', 'x264')
+        if preview.get('path') is None:
+            preview['path'] = os.path.splitext(self.path)[0] + '_preview.mp4'
+        preview['path'] = self._container(preview['path'], codec)
+        preview['codec_args'] = self._codec_args(codec)
+        preview.setdefault('scale', 0.25)
+        preview.setdefault('fps', None)
+        return preview
+
+    def open(self, shape: typing.Tuple[int, ...], dtype: np.dtype):
+        """
+        Start encoding frames of a given shape and dtype.
+
+        Must be overridden by subclass.
+        """
+        raise NotImplementedError('open must be overwritten by encoder subclass!')
+
+    def write(self, frame: np.ndarray):
+        """
+        Encode a frame, opening the encoder with its shape and dtype if it is the first
+
+        Args:
+            frame (:class:`numpy.ndarray`): frame to encode
+        """
+        if self.shape is None:
+            self.shape = frame.shape
+            self.dtype = frame.dtype
+            self.open(frame.shape, frame.dtype)
+        self._write(frame)
+        self.n_frames += 1
+
+    def _write(self, frame: np.ndarray):
+        raise NotImplementedError('_write must be overwritten by encoder subclass!')
+
+    def close(self):
+        """
+        Finish encoding
+        """
+        pass
+
+
+class FFmpeg_Pipe_Encoder(Encoder):
+    """
+    Encode frames by writing their raw bytes to the stdin of an ffmpeg process.
+
+    Frames are written directly from their buffers, without any conversion or copy unless they aren't contiguous.
+
+    If a ``preview`` is requested, the same ffmpeg process splits the input and scales it
+    to encode the preview alongside the full video.
+    """
+    supports_preview = True
+
+    def __init__(self, *args, **kwargs):
+        super(FFmpeg_Pipe_Encoder, self).__init__(*args, **kwargs)
+        self.proc = None # type: typing.Optional[subprocess.Popen]
+
+    def command(self, shape: typing.Tuple[int, ...], dtype: np.dtype) -> typing.List[str]:
+        """
+        The ffmpeg command to encode frames of a given shape and dtype
+
+        Returns:
+            list: command arguments
+        """
+        pix_fmt = self.input_pix_fmt
+        if pix_fmt is None:
+            pix_fmt = _input_pix_fmt(shape, dtype)
+
+        cmd = [self.ffmpeg_bin, '-y', '-loglevel', 'warning',
+               '-f', 'rawvideo', '-pix_fmt', pix_fmt,
+               '-s', f'{shape[1]}x{shape[0]}', '-r', str(self.fps),
+               '-i', '-']
+
+        if self.preview is None:
+            cmd += self.codec_args + ['-r', str(self.fps), self.path]
+            return cmd
+
+        preview_filter = f"scale=trunc(iw*{self.preview['scale']}/2)*2:-2"
+        if self.preview['fps'] is not None:
+            preview_filter += f",fps={self.preview['fps']}"
+        cmd += ['-filter_complex', f'[0:v]split=2[full][preview];[preview]{preview_filter}[small]',
+                '-map', '[full]'] + self.codec_args + ['-r', str(self.fps), self.path]
+        cmd += ['-map', '[small]'] + self.preview['codec_args'] + [self.preview['path']]
+        return cmd
+
+    def open(self, shape: typing.Tuple[int, ...], dtype: np.dtype):
+        self.proc = subprocess.Popen(self.command(shape, dtype), stdin=PIPE, stdout=subprocess.DEVNULL)
+
+    def _write(self, frame: np.ndarray):
+        if frame.shape != self.shape:
+            raise ValueError(f'Frame shape {frame.shape} does not match the shape of the video {self.shape}')
+        self.proc.stdin.write(np.ascontiguousarray(frame, dtype=self.dtype).data)
+
+    def close(self, timeout: float = 60):
+        """
+        Close ffmpeg's stdin and wait for it to finish encoding
+
+        Args:
+            timeout (float): seconds to wait for ffmpeg before killing it
+        """
+        if self.proc is None:
+            return
+        try:
+            self.proc.stdin.close()
+        except BrokenPipeError:
+            pass
+        try:
+            returncode = self.proc.wait(timeout)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+            raise
+        finally:
+            self.proc = None
+        if returncode != 0:
+            raise RuntimeError(f'ffmpeg exited with code {returncode} while writing {self.path}')
+
+
+class SKVideo_Encoder(Encoder):
+    """
+    Encode frames with :class:`skvideo.io.FFmpegWriter` , as :class:`.Video_Writer` did before encoders were pluggable.
+
+    Doesn't support preview videos.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(SKVideo_Encoder, self).__init__(*args, **kwargs)
+        self.writer = None # type: typing.Optional[io.FFmpegWriter]
+
+    def open(self, shape: typing.Tuple[int, ...], dtype: np.dtype):
+        inputdict = {'-r': str(self.fps)}
+        if self.input_pix_fmt is not None:
+            inputdict['-pix_fmt'] = self.input_pix_fmt
+        outputdict = dict(zip(self.codec_args[::2], self.codec_args[1::2]))
+        outputdict['-r'] = str(self.fps)
+        self.writer = io.FFmpegWriter(self.path, inputdict=inputdict, outputdict=outputdict, verbosity=1)
+
+    def _write(self, frame: np.ndarray):
+        self.writer.writeFrame(frame)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+ENCODERS = {
+    'pipe': FFmpeg_Pipe_Encoder,
+    'skvideo': SKVideo_Encoder
+}
+"""
+:class:`.Encoder` s that can be selected by name in :class:`.Video_Writer`
+"""
+
+
+def benchmark_encoders(shape: typing.Tuple[int, ...] = (720, 1280, 3),
+                       n_frames: int = 300, fps: int = 30,
+                       encoders: typing.Iterable[str] = ('pipe', 'skvideo'),
+                       codecs: typing.Iterable[str] = ('x264', 'ffv1'),
+                       preview: typing.Optional[dict] = None,
+                       out_dir: typing.Optional[str] = None) -> typing.List[dict]:
+    """
+    Time each combination of encoder and codec on synthetic frames.
+
+    Frames are a moving gradient with some noise, made before timing starts, and are written
+    as fast as the encoder will take them. Codecs that ffmpeg wasn't built with are reported as failed.
+
+    Args:
+        shape (tuple): shape of frames
+        n_frames (int): number of frames to encode
+        fps (int): framerate of the videos
+        encoders (list): names of encoders in :data:`.ENCODERS`
+        codecs (list): names of codecs in :data:`.CODECS`
+        preview (dict): preview video options (see :class:`.Encoder` ), for encoders that support it
+        out_dir (str): directory to write the videos to, if ``None`` , a temporary directory that is removed afterwards
+
+    Returns:
+        list: a dict for each combination with ``encoder`` , ``codec`` , ``seconds`` , ``fps`` (frames encoded per second),
+        ``bytes`` (size of the video), and ``error`` ( ``None`` if it succeeded).
+    """
+    _check_ffmpeg()
+
+    rng = np.random.default_rng(0)
+    gradient = np.linspace(0, 255, shape[1], dtype=np.float32)[None, :]
+    if len(shape) > 2:
+        gradient = gradient[..., None]
+    frames = []
+    for i in range(16):
+        frame = np.roll(gradient, i * shape[1] // 16, axis=1) + rng.normal(0, 8, shape)
+        frames.append(np.clip(frame, 0, 255).astype(np.uint8))
+
+    tmp_dir = None
+    if out_dir is None:
+        tmp_dir = tempfile.mkdtemp()
+        out_dir = tmp_dir
+
+    results = []
+    try:
+        for encoder_name in encoders:
+            for codec in codecs:
+                path = os.path.join(out_dir, f'benchmark_{encoder_name}_{codec}{CODECS[codec]["containers"][0]}')
+                with warnings.catch_warnings():
+                    warnings.simplefilter('ignore')
+                    encoder = ENCODERS[encoder_name](path, fps, codec=codec, preview=preview)
+                result = {'encoder': encoder_name, 'codec': codec, 'seconds': None,
+                          'fps': None, 'bytes': None, 'error': None}
+                start = time.perf_counter()
+                try:
+                    for i in range(n_frames):
+                        encoder.write(frames[i % len(frames)])
+                    encoder.close()
+                    result['seconds'] = time.perf_counter() - start
+                    result['fps'] = n_frames / result['seconds']
+                    result['bytes'] = os.path.getsize(encoder.path)
+                except Exception as e:
+                    result['error'] = str(e)
+                    try:
+                        encoder.close()
+                    except Exception:
+                        pass
+                results.append(result)
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    return results
+
+
 class Video_Writer(mp.Process):
-    def __init__(self, q, path, fps=None, timestamps=True, blosc=True):
+    def __init__(self, q, path, fps=None, timestamps=True, blosc=True,
+                 encoder='pipe', codec='x264', preview=None, **kwargs):
         """
         Encode frames as they are acquired in a separate process.
 
@@ -1915,7 +3406,7 @@ class Video_Writer(mp.Process):
 
         Encoding continues until 'END' is put in :attr:`~Video_Writer.q`.
 
-        Timestamps are saved in a .csv file with the same path as the video.
+        Timestamps are saved in a .csv file with the same path as the video, a row is written as each frame is encoded.
 
         Args:
             q (:class:`~queue.Queue`): Queue into which frames will be dumped
@@ -1924,10 +3415,19 @@ class Video_Writer(mp.Process):
             timestamps (bool): if True (default), input will be of form (timestamp, frame). if False,
                 input will just be frames and timestamps will be generated as the frame is encoded (**not recommended**)
             blosc (bool): if True, frames in the :attr:`~Video_Writer.q` will be compresed with blosc. if False, uncompressed
+            encoder (str): name of the :class:`.Encoder` in :data:`.ENCODERS` to use, default ``'pipe'`` for :class:`.FFmpeg_Pipe_Encoder`
+            codec (str, list): name of a codec in :data:`.CODECS` (default ``'x264'`` ), or a list of ffmpeg output arguments.
+                Use ``'ffv1'`` for lossless video.
+            preview (dict): options for a smaller preview video encoded alongside the full video, see :class:`.Encoder`
+            **kwargs: passed to the :class:`.Encoder`
 
-        Attributes:
-            timestamps (list): Timestamps for frames, written to .csv on completion of encoding
+        If the :attr:`.Frame_Ring.spec` of a :class:`.Frame_Ring` is put in the queue, subsequent
+        ``(slot, seq, timestamp)`` tuples are read from the ring (see :meth:`.Camera.write` ).
 
+        Attributes:
+            encoder (:class:`.Encoder`): encoder for the video. Its ``path`` is the actual output path,
+                which has a different extension than ``path`` if the codec can't be written to it.
+            n_frames (int): number of frames encoded
         """
 
         super(Video_Writer, self).__init__()
@@ -1939,75 +3439,89 @@ class Video_Writer(mp.Process):
         self.path = path
         self.fps = fps
         self.given_timestamps = timestamps
-        self.timestamps = []
         self.blosc = blosc
+        self.ring = None # type: typing.Optional[Frame_Ring]
+        self.n_frames = 0
 
 
         if fps is None:
             warnings.warn('No FPS given, using 30fps by default')
             self.fps = 30
 
+        if encoder not in ENCODERS:
+            raise ValueError(f'Unknown encoder {encoder}, use one of {list(ENCODERS.keys())}')
+        self.encoder = ENCODERS[encoder](path, self.fps, codec=codec, preview=preview, **kwargs) # type: Encoder
+
+    def _unpack(self, input) -> typing.Optional[tuple]:
+        """
+        Get the (timestamp, frame) from an item in the :attr:`.q` , or ``None`` if the frame was lost from the ring
+        """
+        if self.ring is not None:
+            slot, seq, timestamp = input
+            frame = self.ring.get(slot, seq)
+            if frame is None:
+                self.ring.release(seq)
+                return None
+            return timestamp, frame
+
+        if self.given_timestamps:
+            timestamp, frame = input
+        else:
+            timestamp, frame = datetime.now().isoformat(), input
+
+        if self.blosc:
+            frame = blosc.unpack_array(frame)
+        return timestamp, frame
+
     def run(self):
         """
-        Open a :class:`skvideo.io.FFmpegWriter` and begin processing frames from :attr:`~Video_Writer.q`
+        Encode frames from :attr:`~Video_Writer.q` with the :attr:`.encoder` , writing their timestamps as they are encoded.
 
         Should not be called by itself, overwrites the :meth:`multiprocessing.Process.run` method,
         so should call :meth:`Video_Writer.start`
 
         Continue encoding until 'END' put in queue.
         """
+        self.n_frames = 0
 
-        self.timestamps = []
-
-
-        out_vid_fn = self.path
-        vid_out = io.FFmpegWriter(out_vid_fn,
-        #vid_out = FastWriter(out_vid_fn,
-            inputdict={
-                '-r': str(self.fps),
-        },
-            outputdict={
-                '-vcodec': 'libx264',
-                '-pix_fmt': 'yuv420p',
-                '-r': str(self.fps),
-                '-preset': 'ultrafast',
-            },
-            verbosity=1
-        )
+        ts_path = os.path.splitext(self.path)[0] + '.csv'
+        ts_file = open(ts_path, 'w', newline='')
+        csv_writer = csv.writer(ts_file)
 
         try:
 
             for input in iter(self.q.get, 'END'):
                 try:
-
-                    if self.given_timestamps:
-                        self.timestamps.append(input[0])
-                        if self.blosc:
-                            vid_out.writeFrame(blosc.unpack_array(input[1]))
-                        else:
-                            vid_out.writeFrame(input[1])
-                    else:
-                        self.timestamps.append(datetime.now().isoformat())
-                        if self.blosc:
-                            vid_out.writeFrame(blosc.unpack_array(input))
-                        else:
-                            vid_out.writeFrame(input)
+                    if isinstance(input, dict):
+                        if self.ring is not None:
+                            self.ring.close()
+                        self.ring = Frame_Ring.attach(**input)
+                        continue
+
+                    unpacked = self._unpack(input)
+                    if unpacked is None:
+                        continue
+                    timestamp, frame = unpacked
+
+                    self.encoder.write(frame)
+                    if self.ring is not None:
+                        self.ring.release(input[1])
+                    csv_writer.writerow([timestamp])
+                    self.n_frames += 1
 
                 except Exception as e:
                     print(e)
-                    traceback.print_tb()
+                    traceback.print_exc()
                     # TODO: Too general
                     break
 
         finally:
-            vid_out.close()
-
-            # save timestamps as .csv
-            ts_path = os.path.splitext(self.path)[0] + '.csv'
-            with open(ts_path, 'w') as ts_file:
-                csv_writer = csv.writer(ts_file)
-                for ts in self.timestamps:
-                    csv_writer.writerow([ts])
+            try:
+                self.encoder.close()
+            finally:
+                if self.ring is not None:
+                    self.ring.close()
+                ts_file.close()
 
 
 
@@ -24,6 +24,16 @@ and the final frame is the serialized message. Note that the ``to`` field of a
 :class:`~autopilot.networking.Message` object will always be the final recipient
 even if a list is passed for ``to`` when sending. This lets :class:`~.networking.Station`
 objects efficiently forward messages without deserializing them at every hop.
+
+Peers that advertise the ``BINARY`` flag can instead receive messages whose numpy arrays
+are sent as separate raw frames rather than base64 encoded in the JSON body::
+
+    [hop_0, ... hop_n, final_recipient, buffer_0, ... buffer_n, header]
+
+where the ``header`` is prefixed with :data:`.message.FRAME_MAGIC` and the number of buffers,
+so :func:`.message.split_frames` can separate the routing frames from the message.
+Messages are converted back to the JSON format when forwarded to peers that haven't advertised support,
+so older agents can still be mixed in the same swarm.
 """
 
 
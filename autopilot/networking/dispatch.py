@@ -0,0 +1,244 @@
+"""
+Dispatch received messages to their listen methods with a bounded pool of worker threads.
+
+Rather than spawning a new :class:`threading.Thread` for every message, :class:`.Net_Node` and
+:class:`.Station` objects submit them to a :class:`.Dispatcher` . Each message has an ``order_key``
+(typically its :attr:`.Message.sender` ), and all messages with the same ``order_key`` are handled
+by the same worker, in the order they were received, so eg. ``STATE`` and ``DATA`` messages from one
+pilot can't overtake each other.
+
+What happens when a worker's queue is full depends on the policy for the message's key:
+
+* ``'block'`` - wait for space in the queue, applying backpressure to the socket the message came from
+* ``'drop'`` - drop the new message
+* ``'drop_oldest'`` - drop the oldest queued message with the same key and ``order_key`` to make
+  room for the new one, or the new message if there isn't one
+* ``'thread'`` - don't queue the message at all, but handle it in its own thread as before.
+  Used for listen methods that block for a long time or wait on other messages,
+  and so would stall (or deadlock) every other message from the same sender.
+"""
+
+import queue
+import threading
+import traceback
+import typing
+from collections import Counter
+
+from autopilot import prefs
+
+POLICIES = ('block', 'drop', 'drop_oldest', 'thread')
+"""
+Policies that can be used when a worker's queue is full
+"""
+
+_STOP = object()
+
+
+class Dispatcher:
+    """
+    Bounded pool of worker threads that call listen methods, preserving order per ``order_key`` .
+
+    Args:
+        workers (int): Number of worker threads (default ``prefs.get('MSG_WORKERS')`` )
+        max_queue (int): Maximum number of messages waiting for each worker
+            (default ``prefs.get('MSG_QUEUE_SIZE')`` )
+        policies (dict): Policy (see :data:`.POLICIES` ) to use for specific message keys.
+        default_policy (str): Policy to use for keys not in ``policies``
+        name (str): Name used for the worker threads
+        logger (:class:`logging.Logger`): Logger used to report exceptions raised by listen methods,
+            if ``None`` , their tracebacks are printed. Either way the worker continues.
+
+    Attributes:
+        policies (dict): Policies for specific message keys
+        submitted (:class:`collections.Counter`): Number of messages submitted, by key
+        processed (:class:`collections.Counter`): Number of messages handled, by key
+        dropped (:class:`collections.Counter`): Number of messages dropped, by key
+        max_depth (int): Highest number of messages waiting for any one worker
+    """
+
+    def __init__(self,
+                 workers: typing.Optional[int] = None,
+                 max_queue: typing.Optional[int] = None,
+                 policies: typing.Optional[typing.Dict[str, str]] = None,
+                 default_policy: str = 'block',
+                 name: str = 'dispatch',
+                 logger=None):
+        if workers is None:
+            workers = prefs.get('MSG_WORKERS')
+        if max_queue is None:
+            max_queue = prefs.get('MSG_QUEUE_SIZE')
+
+        self.n_workers = max(int(workers), 1)
+        self.max_queue = max(int(max_queue), 1)
+        self.policies = {}
+        if policies is not None:
+            for key, policy in policies.items():
+                self.set_policy(key, policy)
+        self.default_policy = self._check_policy(default_policy)
+        self.name = name
+        self.logger = logger
+
+        self.submitted = Counter()
+        self.processed = Counter()
+        self.dropped = Counter()
+        self.max_depth = 0
+        self._lock = threading.Lock()
+
+        self._queues = [queue.Queue(maxsize=self.max_queue) for _ in range(self.n_workers)]
+        self._workers = []
+        for i, q in enumerate(self._queues):
+            worker = threading.Thread(target=self._work, args=(q,), name=f'{name}_{i}', daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    @staticmethod
+    def _check_policy(policy: str) -> str:
+        if policy not in POLICIES:
+            raise ValueError(f'Unknown dispatch policy {policy}, must be one of {POLICIES}')
+        return policy
+
+    def set_policy(self, key: str, policy: str):
+        """
+        Set the policy used for messages with a given key
+
+        Args:
+            key (str): :attr:`.Message.key`
+            policy (str): one of :data:`.POLICIES`
+        """
+        self.policies[key] = self._check_policy(policy)
+
+    def submit(self, order_key: typing.Hashable, key: str, fn: typing.Callable, *args) -> bool:
+        """
+        Call ``fn(*args)`` in a worker thread.
+
+        Args:
+            order_key: Messages with the same ``order_key`` are handled in order by the same worker
+            key (str): :attr:`.Message.key` , used to select the policy and to count messages
+            fn (callable): listen method
+            *args: passed to ``fn``
+
+        Returns:
+            bool: ``True`` if the message was queued (or given its own thread), ``False`` if it was dropped
+        """
+        policy = self.policies.get(key, self.default_policy)
+        with self._lock:
+            self.submitted[key] += 1
+
+        if policy == 'thread':
+            threading.Thread(target=self._call, args=(key, fn, args)).start()
+            return True
+
+        q = self._queues[hash(order_key) % self.n_workers]
+        item = (key, fn, args, order_key)
+        if policy == 'block':
+            q.put(item)
+        else:
+            try:
+                q.put_nowait(item)
+            except queue.Full:
+                if policy == 'drop' or not self._replace_oldest(q, item):
+                    self._drop(key)
+                    return False
+
+        depth = q.qsize()
+        if depth > self.max_depth:
+            self.max_depth = depth
+        return True
+
+    def _replace_oldest(self, q: queue.Queue, item: tuple) -> bool:
+        """
+        Replace the oldest queued message with the same key and ``order_key`` as ``item`` ,
+        so flooding one key can't evict messages with other keys or policies (or :data:`._STOP` ).
+
+        Returns:
+            bool: ``True`` if ``item`` was queued, ``False`` if there was nothing to replace.
+        """
+        key, order_key = item[0], item[3]
+        with q.mutex:
+            if len(q.queue) < q.maxsize:
+                # a message was taken while we were waiting for the lock
+                q.queue.append(item)
+                q.unfinished_tasks += 1
+                q.not_empty.notify()
+                return True
+            for i, queued in enumerate(q.queue):
+                if queued is not _STOP and queued[0] == key and queued[3] == order_key:
+                    del q.queue[i]
+                    q.queue.append(item)
+                    q.not_empty.notify()
+                    break
+            else:
+                return False
+        self._drop(key)
+        return True
+
+    def _drop(self, key: str):
+        with self._lock:
+            self.dropped[key] += 1
+        if self.logger:
+            self.logger.warning(f'Dispatch queue full, dropped {key} message')
+
+    def _call(self, key: str, fn: typing.Callable, args: tuple):
+        try:
+            fn(*args)
+        except Exception as e:
+            if self.logger:
+                self.logger.exception(f'Exception handling {key} message: {e}')
+            else:
+                traceback.print_exc()
+        finally:
+            with self._lock:
+                self.processed[key] += 1
+
+    def _work(self, q: queue.Queue):
+        while True:
+            item = q.get()
+            if item is _STOP:
+                break
+            self._call(*item[:3])
+
+    @property
+    def depths(self) -> typing.List[int]:
+        """
+        Number of messages currently waiting for each worker
+        """
+        return [q.qsize() for q in self._queues]
+
+    def stats(self) -> dict:
+        """
+        Queue depth and message counts.
+
+        Returns:
+            dict: with keys
+
+            * ``depths`` - list of messages waiting for each worker
+            * ``queued`` - total messages waiting
+            * ``max_depth`` - highest number of messages that have waited for any one worker
+            * ``submitted`` , ``processed`` , ``dropped`` - dicts of message counts by key
+        """
+        depths = self.depths
+        with self._lock:
+            return {
+                'depths': depths,
+                'queued': sum(depths),
+                'max_depth': self.max_depth,
+                'submitted': dict(self.submitted),
+                'processed': dict(self.processed),
+                'dropped': dict(self.dropped)
+            }
+
+    def stop(self, timeout: typing.Optional[float] = 1):
+        """
+        Stop the workers after they finish the messages already queued.
+
+        Args:
+            timeout (float): Seconds to wait for each worker to finish, ``None`` to wait indefinitely.
+        """
+        for q in self._queues:
+            try:
+                q.put(_STOP, timeout=timeout)
+            except queue.Full:
+                pass
+        for worker in self._workers:
+            if worker is not threading.current_thread():
+                worker.join(timeout)
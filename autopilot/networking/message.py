@@ -1,10 +1,104 @@
 import base64
 import datetime
 import json
+import struct
+import typing
 import numpy as np
 
 import blosc2 as blosc
 
+from autopilot.networking.serializers import Serializer, get_serializer
+from autopilot.networking.shm import Shm_Ring, read_shm
+
+FRAME_MAGIC = b'\x00AP'
+"""
+Prefix of the final frame of a multipart binary message (see :meth:`.Message.serialize_frames` ).
+
+Legacy messages are plain JSON and so always start with ``{`` , which lets receivers tell the two apart
+by peeking at the first bytes of the last frame.
+"""
+
+FRAME_VERSION = 1
+"""
+Version of the binary frame format, stored in the byte after :data:`.FRAME_MAGIC` .
+The next byte is the :attr:`.Serializer.code` of the serializer used for the header.
+"""
+
+_FRAME_PREFIX = struct.Struct('<3sBBII')
+# magic, version, serializer code, number of buffer frames that precede the header, length of the routing header
+
+FRAME_SHM = 0x80
+"""
+Bit set in the serializer byte of binary messages that have buffers in shared memory (see :mod:`.networking.shm` ),
+so they can be recognized without decoding them and materialized before they're forwarded off-host.
+"""
+
+HEADER_KEYS = ('id', 'to', 'sender', 'key', 'flags', 'ttl', 'timestamp')
+"""
+Message attributes that are serialized separately at the start of the header frame of binary messages,
+so that they can be read to route, confirm, or forward a message without decoding its body.
+"""
+
+
+def is_binary(frame: bytes) -> bool:
+    """
+    Check if a frame is the header of a multipart binary message
+
+    Args:
+        frame (bytes): The last frame of a received multipart message
+
+    Returns:
+        bool: ``True`` if the frame starts with :data:`.FRAME_MAGIC`
+    """
+    return bytes(frame[:len(FRAME_MAGIC)]) == FRAME_MAGIC
+
+
+def split_frames(frames: typing.List[bytes]) -> typing.Tuple[typing.List[bytes], typing.List[bytes]]:
+    """
+    Split a received multipart zmq message into its routing frames and its message frames.
+
+    Legacy messages are always a single frame at the end of the multipart message.
+    Binary messages are ``[buffer_0, ... buffer_n, header]`` , where the header
+    says how many buffer frames precede it.
+
+    Args:
+        frames (list): frames as received by ``on_recv``
+
+    Returns:
+        tuple: (routing frames, message frames)
+    """
+    n_frames = 1
+    if is_binary(frames[-1]):
+        n_frames += _FRAME_PREFIX.unpack_from(frames[-1])[3]
+    return frames[:-n_frames], frames[-n_frames:]
+
+
+def frame_serializer(frame: bytes) -> str:
+    """
+    Get the name of the serializer used to encode a binary message from its header frame
+
+    Args:
+        frame (bytes): header frame (the last frame) of a binary message
+
+    Returns:
+        str: :attr:`.Serializer.name`
+    """
+    return get_serializer(_FRAME_PREFIX.unpack_from(frame)[2] & ~FRAME_SHM).name
+
+
+def frame_has_shm(frame: bytes) -> bool:
+    """
+    Check if a binary message has buffers in shared memory from its header frame
+
+    Args:
+        frame (bytes): header frame (the last frame) of a binary message
+
+    Returns:
+        bool: ``True`` if the :data:`.FRAME_SHM` bit is set
+    """
+    return bool(_FRAME_PREFIX.unpack_from(frame)[2] & FRAME_SHM)
+
+
 
 class Message(object):
     """
@@ -16,6 +110,18 @@ class Message(object):
     Numpy arrays given in the value field are automatically serialized and deserialized
     when sending and receiving using bas64 encoding and blosc compression.
 
+    Alternatively, messages can be serialized as multiple binary frames with :meth:`.serialize_frames` ,
+    where the header carries array descriptors and the raw (optionally blosc-compressed)
+    array buffers are sent as separate zmq frames. The header can be encoded with any of the
+    :mod:`~autopilot.networking.serializers` , which receivers detect from the header.
+    Networking objects only use this format
+    with peers that have advertised they can receive it with the ``BINARY`` flag.
+
+    When a binary message is received, only the small routing header
+    (the attributes in :data:`.HEADER_KEYS` ) is decoded, and the rest of the message,
+    including the ``value`` , is decoded the first time it is accessed. Messages that are
+    just being routed, confirmed, or forwarded unchanged never have their body decoded.
+
     `id`, `to`, `sender`, and `key` are required attributes,
     but any other key-value pair passed on init is added to the message's attributes
     and included in the message. All arguments not indicated in the signature are passed in
@@ -39,17 +145,22 @@ class Message(object):
             * ``MINPRINT`` - don't print the value in logs (eg. when a large array is being sent)
             * ``NOREPEAT`` - sender will not seek, and recipients will not attempt to send message receipt confirmations
             * ``NOLOG`` - don't log this message! for streaming, or other instances where the constant printing of the logger is performance prohibitive
+            * ``BINARY`` - the sender can receive multipart binary messages made with :meth:`.serialize_frames` ,
+              the value is a list of the serializers it can decode.
     """
 
-    def __init__(self, msg=None, expand_arrays = False, blosc:bool=True,  **kwargs):
+    def __init__(self, msg=None, expand_arrays = False, blosc:typing.Union[bool, dict]=True,  **kwargs):
         """
         Args:
-            msg (str): A serialized message made with :meth:`.serialize`. Optional -- can be passed rather than
+            msg (str, list): A serialized message made with :meth:`.serialize`, or a list of frames made with
+                :meth:`.serialize_frames` . Optional -- can be passed rather than
                 the message attributes themselves if, for example, we're receiving and reconstituting this message.
             expand_arrays (bool): If given a serialized message, if ``True``, expand and deserialize the arrays.
                 Otherwise leave serialized. For speed of message forwarding -- don't deserialize if we're just forwarding
                 this message.
-            blosc (bool): If ``True`` (default), When serializing arrays, also compress with blosc. Stored as a flag
+            blosc (bool, dict): If ``True`` (default), When serializing arrays, also compress with blosc. Stored as a flag.
+                Can also be a dict of arguments to :func:`blosc2.pack_array` , eg. ``{'codec': 'lz4', 'clevel': 5}`` ,
+                where ``codec`` is the name of a :class:`blosc2.Codec` .
             *args:
             **kwargs:
         """
@@ -71,17 +182,42 @@ class Message(object):
 
         self.ttl = kwargs.get('ttl', 2)
 
-        if msg:
-            self.serialized = msg
-            if expand_arrays:
-                deserialized = json.loads(msg, object_pairs_hook=self._deserialize_numpy)
+        # buffer frames of a binary message, and the cached frames from serialize_frames
+        self._buffers = None
+        self._frames = None
+        # undecoded body of a binary message, whether to expand its arrays, and what to decode it with
+        self._body = None
+        self._expand = expand_arrays
+        self._serializer = None # type: typing.Optional[Serializer]
+        # ring to put large buffers in while serializing, and whether the received message has buffers in shared memory
+        self._shm_ring = None # type: typing.Optional[Shm_Ring]
+        self._shm = False
+
+        if isinstance(msg, (list, tuple)) and len(msg) == 1:
+            msg = msg[0]
+
+        if isinstance(msg, (list, tuple)):
+            deserialized = self._load_frames(msg)
+            kwargs.update(deserialized)
+        elif msg:
+            if is_binary(msg):
+                deserialized = self._load_frames([msg])
             else:
-                deserialized = json.loads(msg)
+                self.serialized = msg
+                if expand_arrays:
+                    deserialized = json.loads(msg, object_pairs_hook=self._deserialize_numpy)
+                else:
+                    deserialized = json.loads(msg)
             kwargs.update(deserialized)
 
         for k, v in kwargs.items():
             setattr(self, k, v)
 
+        if self._body is not None:
+            # don't shadow the attributes that will come from the body when it is decoded
+            del self.value
+            del self.blosc
+
         # if we're not a previous message being recreated, get a timestamp for our creation
         if 'timestamp' not in kwargs.keys():
             self.get_timestamp()
@@ -101,6 +237,19 @@ class Message(object):
 
         return me_string
 
+    def __getattr__(self, item):
+        """
+        Only called when an attribute isn't found normally --
+        decode the body of a lazily loaded binary message and try again.
+        """
+        if item.startswith('__') or self.__dict__.get('_body') is None:
+            raise AttributeError(item)
+        self._load_body()
+        try:
+            return self.__dict__[item]
+        except KeyError:
+            raise AttributeError(item)
+
     # enable dictionary-like behavior
     def __getitem__(self, key):
         """
@@ -109,6 +258,8 @@ class Message(object):
         """
         #value = self._check_dec(self.__dict__[key])
         # TODO: Recursively walk looking for 'NUMPY ARRAY' and expand before giving
+        if key not in self.__dict__:
+            self._load_body()
         return self.__dict__[key]
 
     def __setitem__(self, key, value):
@@ -133,21 +284,159 @@ class Message(object):
 
         """
         if self.blosc:
-            compressed = base64.b64encode(blosc.pack_array(array)).decode('ascii')
+            compressed = base64.b64encode(self._pack_array(array)).decode('ascii')
         else:
             compressed = base64.b64encode(array.tobytes()).decode('ascii')
         return {'NUMPY_ARRAY': compressed, 'DTYPE': str(array.dtype), 'SHAPE':array.shape}
 
 
+    def _serialize_buffer(self, array:np.ndarray) -> dict:
+        """
+        Stash a numpy array as a separate buffer frame for :meth:`.serialize_frames` ,
+        returning a descriptor to take its place in the JSON header.
+
+        Uncompressed arrays are passed as a :class:`memoryview` so they can be sent
+        without copying.
+
+        Args:
+            array (:class:`numpy.ndarray`): array to stash
+
+        Returns:
+            dict: {'NUMPY_BUFFER': index of buffer frame, 'DTYPE': dtype, 'SHAPE': shape, 'BLOSC': bool}
+        """
+        if self.blosc:
+            buffer = self._pack_array(array)
+        else:
+            buffer = memoryview(np.ascontiguousarray(array)).cast('B')
+
+        if self._shm_ring is not None:
+            shm_descriptor = self._shm_ring.write(buffer)
+            if shm_descriptor is not None:
+                self._shm = True
+                return {'NUMPY_SHM': shm_descriptor, 'DTYPE': str(array.dtype),
+                        'SHAPE': array.shape, 'BLOSC': bool(self.blosc)}
+
+        self._buffers.append(buffer)
+        return {'NUMPY_BUFFER': len(self._buffers)-1, 'DTYPE': str(array.dtype),
+                'SHAPE': array.shape, 'BLOSC': bool(self.blosc)}
+
+    def _pack_array(self, array:np.ndarray) -> bytes:
+        """
+        Compress an array with blosc, using the arguments in :attr:`.blosc` if it's a dict
+        """
+        if isinstance(self.blosc, dict):
+            kwargs = dict(self.blosc)
+            if isinstance(kwargs.get('codec'), str):
+                kwargs['codec'] = blosc.Codec[kwargs['codec'].upper()]
+            return blosc.pack_array(array, **kwargs)
+        return blosc.pack_array(array)
+
+    def _load_buffer(self, descriptor: dict) -> np.ndarray:
+        """
+        Recreate an array from a ``NUMPY_BUFFER`` or ``NUMPY_SHM`` descriptor made by :meth:`._serialize_buffer`
+        """
+        if 'NUMPY_SHM' in descriptor:
+            buffer = read_shm(descriptor['NUMPY_SHM'])
+        else:
+            buffer = self._buffers[descriptor['NUMPY_BUFFER']]
+        if descriptor['BLOSC']:
+            return blosc.unpack_array(bytes(buffer))
+        else:
+            return np.frombuffer(buffer, dtype=descriptor['DTYPE']).reshape(descriptor['SHAPE'])
+
+    def _load_frames(self, frames: typing.List[bytes]) -> dict:
+        """
+        Deserialize the routing header from the message frames made by :meth:`.serialize_frames` ,
+        stashing the body to be decoded by :meth:`._load_body` when it's needed.
+
+        The buffers are kept so that the message can be forwarded unchanged,
+        and if arrays are not expanded their descriptors are left in place.
+        """
+        header = frames[-1]
+        magic, version, code, n_buffers, head_len = _FRAME_PREFIX.unpack_from(header)
+        if version != FRAME_VERSION:
+            raise ValueError(f'Unknown binary message version {version}')
+        if n_buffers != len(frames) - 1:
+            raise ValueError(f'Binary message header expected {n_buffers} buffers, got {len(frames)-1}')
+
+        self._serializer = get_serializer(code & ~FRAME_SHM)
+        self._shm = bool(code & FRAME_SHM)
+        self._buffers = list(frames[:-1])
+        self._frames = list(frames)
+        head_end = _FRAME_PREFIX.size + head_len
+        self._body = bytes(header[head_end:])
+        return self._serializer.loads(bytes(header[_FRAME_PREFIX.size:head_end]))
+
+    def _load_body(self):
+        """
+        Decode the body of a binary message received by :meth:`._load_frames` ,
+        if it hasn't been already.
+
+        Attributes that have been set since the message was received are not overwritten.
+        """
+        body = self.__dict__.get('_body')
+        if body is None:
+            return
+        self._body = None
+
+        # only need to look for array descriptors if there are arrays
+        if self._expand and (self._buffers or self._shm):
+            deserialized = self._serializer.loads(body, self._restore_arrays)
+        else:
+            deserialized = self._serializer.loads(body)
+
+        for k, v in deserialized.items():
+            self.__dict__.setdefault(k, v)
+
+    def _expand_buffers(self):
+        """
+        Replace any unexpanded ``NUMPY_BUFFER`` or ``NUMPY_SHM`` descriptors with arrays,
+        eg. before reserializing a binary message in the legacy JSON format.
+        """
+        if not self._buffers and not self._shm:
+            return
+        self._load_body()
+
+        def _expand(obj):
+            if isinstance(obj, dict):
+                if 'NUMPY_BUFFER' in obj or 'NUMPY_SHM' in obj:
+                    return self._load_buffer(obj)
+                return {k: _expand(v) for k, v in obj.items()}
+            elif isinstance(obj, list):
+                return [_expand(v) for v in obj]
+            return obj
+
+        for k, v in self.__dict__.items():
+            if not k.startswith('_') and isinstance(v, (dict, list)):
+                self.__dict__[k] = _expand(v)
+        self._buffers = None
+        self._shm = False
+
+    def _restore_arrays(self, obj: dict):
+        """
+        Decoding hook for binary messages that replaces ``NUMPY_BUFFER`` and ``NUMPY_SHM`` descriptors with arrays
+        """
+        if 'NUMPY_BUFFER' in obj or 'NUMPY_SHM' in obj:
+            return self._load_buffer(obj)
+        return obj
+
     def _deserialize_numpy(self, obj_pairs):
         # print(len(obj_pairs), obj_pairs)
         if (len(obj_pairs) == 3) and obj_pairs[0][0] == "NUMPY_ARRAY":
             decode = base64.b64decode(obj_pairs[0][1])
-            try:
-                arr = blosc.unpack_array(decode)
-            except RuntimeError:
-                # cannot decompress, maybe because wasn't compressed
-                arr = np.frombuffer(decode, dtype=obj_pairs[1][1]).reshape(obj_pairs[2][1])
+            dtype = np.dtype(obj_pairs[1][1])
+            shape = obj_pairs[2][1]
+            # the legacy format doesn't say whether it was compressed,
+            # and blosc can crash rather than raise when given raw data, so
+            # only try to decompress if it isn't exactly the size of the raw array
+            if len(decode) == int(np.prod(shape)) * dtype.itemsize:
+                arr = np.frombuffer(decode, dtype=dtype).reshape(shape)
+            else:
+                try:
+                    arr = blosc.unpack_array(decode)
+                except (RuntimeError, ValueError):
+                    # cannot decompress, maybe because wasn't compressed
+                    arr = np.frombuffer(decode, dtype=dtype).reshape(shape)
 
             return arr
         else:
@@ -157,9 +446,25 @@ class Message(object):
         """
         Don't decompress numpy arrays by default for faster IO, explicitly expand them when needed
 
-        :return:
+        Replaces the array descriptors in a received message -- binary buffers or legacy
+        base64 encoded ``NUMPY_ARRAY`` s -- with arrays.
         """
-        pass
+        self._expand_buffers()
+
+        def _expand(obj):
+            if isinstance(obj, dict):
+                if 'NUMPY_ARRAY' in obj:
+                    return self._deserialize_numpy(list(obj.items()))
+                return {k: _expand(v) for k, v in obj.items()}
+            elif isinstance(obj, list):
+                return [_expand(v) for v in obj]
+            return obj
+
+        if not self._expand:
+            for k, v in self.__dict__.items():
+                if not k.startswith('_') and isinstance(v, (dict, list)):
+                    self.__dict__[k] = _expand(v)
+            self._expand = True
 
 
 
@@ -179,9 +484,11 @@ class Message(object):
         Args:
             key:
         """
+        self._load_body()
         return key in self.__dict__
 
     def __len__(self):
+        self._load_body()
         return len(self.__dict__)
 
     def get_timestamp(self):
@@ -225,17 +532,83 @@ class Message(object):
             Exception("""Message invalid at the time of serialization!\n {}""".format(str(self)))
             return False
 
-        msg = self.__dict__
-        # exclude 'serialized' so it's not in there twice
-        try:
-            del msg['serialized']
-        except KeyError:
-            pass
+        # arrays from a binary message need to be re-encoded inline
+        self._expand_buffers()
+        self._load_body()
 
         try:
-            msg_enc = json.dumps(msg, default=self._serialize_numpy).encode('utf-8')
+            msg_enc = json.dumps(self._public_dict(), default=self._serialize_numpy).encode('utf-8')
             self.serialized = msg_enc
+            self._frames = None
             self.changed=False
             return msg_enc
         except:
-            return False
\ No newline at end of file
+            return False
+
+    def serialize_frames(self, serializer: str = 'json', shm: typing.Optional[Shm_Ring] = None) -> typing.Union[typing.List[typing.Union[bytes, memoryview]], bool]:
+        """
+        Serialize as a list of zmq frames, ``[buffer_0, ... buffer_n, header]`` .
+
+        Numpy arrays are replaced in the JSON header by a descriptor that indexes
+        one of the preceding buffer frames, rather than being base64 encoded inline.
+        The header is prefixed with :data:`.FRAME_MAGIC` , the :data:`.FRAME_VERSION` ,
+        the number of buffer frames so that receivers can find where the message
+        starts with :func:`.split_frames` , and the length of the routing header.
+
+        The header frame is then the routing header (attributes in :data:`.HEADER_KEYS` )
+        followed by the body (everything else), so receivers can decode them separately.
+
+        Only send messages in this format to peers that have advertised the ``BINARY`` flag,
+        older versions of autopilot can't read them.
+
+        Args:
+            serializer (str): Name of the :class:`~.serializers.Serializer` to encode the header with.
+                Only use serializers that the peer has advertised in its ``BINARY`` flag.
+            shm (:class:`.Shm_Ring`): If provided, write large buffers to this shared memory ring rather than
+                sending them as frames. Only for peers on the same host that have advertised the ``SHM`` flag.
+
+        Returns:
+            list: frames to be appended to the routing frames of a multipart message.
+        """
+        serializer = get_serializer(serializer)
+        # buffers in shared memory can be overwritten, so don't reuse them
+        if not self.changed and self._frames and frame_serializer(self._frames[-1]) == serializer.name \
+                and shm is None and not frame_has_shm(self._frames[-1]):
+            return self._frames
+
+        valid = self.validate()
+        if not valid:
+            Exception("""Message invalid at the time of serialization!\n {}""".format(str(self)))
+            return False
+
+        self._expand_buffers()
+        self._load_body()
+        self._buffers = []
+        self._shm_ring = shm
+        try:
+            msg = self._public_dict()
+            head = serializer.dumps({k: msg.pop(k) for k in HEADER_KEYS if k in msg}, default=self._serialize_buffer)
+            body = serializer.dumps(msg, default=self._serialize_buffer)
+            code = serializer.code | FRAME_SHM if self._shm else serializer.code
+            frames = [*self._buffers,
+                      _FRAME_PREFIX.pack(FRAME_MAGIC, FRAME_VERSION, code,
+                                         len(self._buffers), len(head)) + head + body]
+        except:
+            return False
+        finally:
+            self._buffers = None
+            self._shm_ring = None
+            self._shm = False
+
+        self._frames = frames
+        self.serialized = None
+        self.changed = False
+        return frames
+
+    def _public_dict(self) -> dict:
+        """
+        The attributes that are sent over the wire --
+        excludes the cached serialization and private (underscored) attributes
+        """
+        return {k: v for k, v in self.__dict__.items()
+                if k != 'serialized' and not k.startswith('_')}
\ No newline at end of file
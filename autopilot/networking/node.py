@@ -4,7 +4,6 @@ import typing
 from copy import copy
 from itertools import count
 from typing import Union, Optional
-from collections import deque
 import socket
 
 import zmq
@@ -13,7 +12,11 @@ from zmq.eventloop.zmqstream import ZMQStream
 
 from autopilot import prefs
 from autopilot.utils.loggers import init_logger
-from autopilot.networking.message import Message
+from autopilot.networking.message import Message, split_frames
+from autopilot.networking.serializers import available_serializers, advertised_serializers
+from autopilot.networking.dispatch import Dispatcher
+from autopilot.networking.stream import Stream_Queue, Stream_Tuner
+from autopilot.networking.shm import Shm_Ring, host_id, ipc_endpoint, local_endpoint
 
 
 class Net_Node(object):
@@ -63,18 +66,30 @@ class Net_Node(object):
         port (int): The port that our upstream ROUTER socket is bound to
         listens (dict): Dictionary of functions to call for different types of messages. keys match the :attr:`.Message.key`.
         outbox (dict): Messages that have been sent but have not been confirmed
+        binary (bool): Whether we send binary multipart messages to peers that support them (``prefs.get('MSG_BINARY')``)
+        serializer (str): Name of the :class:`~.serializers.Serializer` to encode binary messages with,
+            if the peer supports it (``prefs.get('MSG_SERIALIZER')``)
+        binary_peers (dict): Identities of peers that have advertised they can receive binary messages
+            (see :meth:`.Message.serialize_frames` ), and the serializers they can decode
+        shm (bool): Whether we put large arrays in shared memory for peers on the same host
+            (``prefs.get('MSG_SHM')`` , see :mod:`.networking.shm` )
+        shm_peers (set): Identities of peers that have advertised they're on the same host and can read shared memory
         timers (dict): dict of :class:`threading.Timer` s that will check in on outbox messages
         logger (:class:`logging.Logger`): Used to log messages and network events.
         msg_counter (:class:`itertools.count`): counter to index our sent messages
         loop_thread (:class:`threading.Thread`): Thread that holds our loop. initialized with `daemon=True`
+        dispatcher (:class:`.Dispatcher`): Worker pool that calls listen methods, in order for each sender.
+            Policies for specific keys can be given with ``dispatch_policies``
     """
     repeat_interval = 5 # how many seconds to wait before trying to repeat a message
+    stream_poll_interval = 0.001 # seconds to wait for a stream's socket to finish sending before checking again
 
     def __init__(self, id: str, upstream: str, port: int,
                  listens: typing.Dict[str, typing.Callable],
                  instance:bool=True, upstream_ip:str='localhost',
                  router_port:Optional[int] = None,
-                 daemon:bool=True, expand_on_receive:bool=True):
+                 daemon:bool=True, expand_on_receive:bool=True,
+                 dispatch_policies:Optional[typing.Dict[str, str]] = None):
 
         if instance:
             self.context = zmq.Context.instance() # type: zmq.Context
@@ -101,6 +116,14 @@ class Net_Node(object):
         self.router = None # type: Optional[zmq.Socket]
         self.loop_thread = None  # type: Optional[threading.Thread]
         self.senders = {} # type: typing.Dict[bytes, str]
+        self.binary = bool(prefs.get('MSG_BINARY'))
+        self.serializer = prefs.get('MSG_SERIALIZER')
+        self.binary_peers = {} # type: typing.Dict[bytes, typing.List[str]]
+        self.shm = self.binary and bool(prefs.get('MSG_SHM'))
+        self.shm_peers = set() # type: typing.Set[bytes]
+        self._shm_ring = None # type: Optional[Shm_Ring]
+        self._shm_lock = threading.Lock()
+        self._host_id = host_id()
         self._ip = None
 
         # self.connected = False
@@ -108,6 +131,10 @@ class Net_Node(object):
         self.msgs_received = 0
         self.logger = init_logger(self)
 
+        if self.serializer not in available_serializers():
+            self.logger.warning(f'Serializer {self.serializer} is not available, using json')
+            self.serializer = 'json'
+
         # If we were given an explicit IP to connect to, stash it
         self.upstream_ip = upstream_ip
 
@@ -116,6 +143,8 @@ class Net_Node(object):
         self.outbox = {}
         self.timers = {}
         self.expand = expand_on_receive
+        self.dispatcher = Dispatcher(policies=dispatch_policies, name=f'{self.id}_dispatch',
+                                     logger=self.logger)
 
         if prefs.get( 'SUBJECT'):
             self.subject = prefs.get('SUBJECT').encode('utf-8')
@@ -137,7 +166,10 @@ class Net_Node(object):
         #self.sock.probe_router = 1
 
         # connect our dealer socket to "push" messages upstream
-        self.sock.connect('tcp://{}:{}'.format(self.upstream_ip, self.port))
+        if self.shm:
+            self.sock.connect(local_endpoint(self.upstream_ip, self.port))
+        else:
+            self.sock.connect('tcp://{}:{}'.format(self.upstream_ip, self.port))
         self.sock = ZMQStream(self.sock, self.loop)
         self.sock.on_recv(self.handle_listen)
 
@@ -146,6 +178,8 @@ class Net_Node(object):
             self.router = self.context.socket(zmq.ROUTER)
             self.router.setsockopt_string(zmq.IDENTITY, self.id)
             self.router.bind('tcp://*:{}'.format(self.router_port))
+            if self.shm and ipc_endpoint(self.router_port) is not None:
+                self.router.bind(ipc_endpoint(self.router_port))
             self.router = ZMQStream(self.router, self.loop)
             self.router.on_recv(self.handle_listen)
 
@@ -172,7 +206,7 @@ class Net_Node(object):
     def handle_listen(self, msg: typing.List[bytes]):
         """
         Upon receiving a message, call the appropriate listen method
-        in a new thread and send confirmation it was received.
+        with the :attr:`.dispatcher` and send confirmation it was received.
 
         Note:
             Unlike :meth:`.Station.handle_listen` , only the :attr:`.Message.value`
@@ -184,14 +218,19 @@ class Net_Node(object):
         """
         self.msgs_received += 1
 
+        route, frames = split_frames(msg)
+
         # if we have a router, check if this is a router msg and store
         # the sender if so
-        if self.router is not None and len(msg)>=2:
-            if msg[0] not in self.senders.keys():
-                self.senders[msg[0]] = ''
+        if self.router is not None and len(route)>=1:
+            if route[0] not in self.senders.keys():
+                self.senders[route[0]] = ''
+            hop = route[0]
+        else:
+            hop = self.upstream.encode('utf-8')
 
         # Nodes expand arrays by default as they're expected to
-        msg = Message(msg[-1], expand_arrays=self.expand)
+        msg = Message(frames, expand_arrays=self.expand)
 
         # Check if our listen was sent properly
         if not msg.validate():
@@ -199,22 +238,21 @@ class Net_Node(object):
                 self.logger.error('Message failed to validate:\n{}'.format(str(msg)))
             return
 
+        # only trust a capability advertisement from the peer that sent it to us directly
+        if 'BINARY' in msg.flags.keys() and hop.decode('utf-8') == msg.sender:
+            self.binary_peers[hop] = advertised_serializers(msg.flags['BINARY'])
+            if self.shm and msg.flags.get('SHM') == self._host_id:
+                self.shm_peers.add(hop)
+
         # unnest any list if it was a multihop message
         if isinstance(msg.to, list) and len(msg.to) == 1:
             msg.to = msg.to[0]
 
-        try:
-            listen_funk = self.listens[msg.key]
-            listen_thread = threading.Thread(target=listen_funk, args=(msg.value,))
-            listen_thread.start()
-        except KeyError:
-            if msg.key=="STREAM":
-                try:
-                    listen_thread = threading.Thread(target=self.l_stream, args=(msg,))
-                    listen_thread.start()
-                except Exception as e:
-                    self.logger.exception(e)
-
+        if msg.key in self.listens.keys():
+            self.dispatcher.submit(msg.sender, msg.key, self.listens[msg.key], msg.value)
+        elif msg.key == "STREAM":
+            self.dispatcher.submit(msg.sender, msg.key, self.l_stream, msg)
+        else:
             self.logger.exception('MSG ID {} - No listen function found for key: {}'.format(msg.id, msg.key))
 
         if (msg.key != "CONFIRM") and ('NOREPEAT' not in msg.flags.keys()) :
@@ -305,29 +343,32 @@ class Net_Node(object):
         if 'NOLOG' in msg.flags.keys():
             log_this = False
 
-        # encode message
-        msg_enc = msg.serialize()
-        if not msg_enc:
-            self.logger.error('Message could not be encoded:\n{}'.format(str(msg)))
-            return
-
         if isinstance(to, list):
             multipart = [bytes(hop, encoding='utf-8') for hop in to]
             multipart.append(recipient.encode('utf-8'))
-            multipart.append(msg_enc)
 
         else:
             # the first frame will be added below if needed...
-            multipart = [recipient.encode('utf-8'), msg_enc]
+            multipart = [recipient.encode('utf-8')]
             if force_to or to.encode('utf-8') in self.senders.keys():
                 multipart.insert(0, to.encode('utf-8'))
             else:
                 multipart.insert(0, self.upstream.encode('utf-8'))
 
         if self.router is not None and multipart[0] in self.senders.keys():
-            self.router.send_multipart(multipart)
+            socket = self.router
+            peer = multipart[0]
         else:
-            self.sock.send_multipart(multipart)
+            socket = self.sock
+            peer = self.upstream.encode('utf-8')
+
+        # encode message
+        msg_frames = self._serialize_for(msg, peer)
+        if not msg_frames:
+            self.logger.error('Message could not be encoded:\n{}'.format(str(msg)))
+            return
+
+        socket.send_multipart([*multipart, *msg_frames], copy=len(msg_frames) == 1)
 
         if self.logger and log_this:
             self.logger.debug("MESSAGE SENT - {}".format(str(msg)))
@@ -336,6 +377,43 @@ class Net_Node(object):
             # add to outbox and spawn timer to resend
             self.outbox[msg.id] = (time.time(), msg)
 
+    def _serialize_for(self, msg: Message, peer: bytes) -> typing.Union[list, bool]:
+        """
+        Serialize a message as binary frames if the ``peer`` we're sending it to
+        can receive them, otherwise as a single legacy JSON frame.
+
+        Args:
+            msg (:class:`.Message`): Message to serialize
+            peer (bytes): identity of the socket we are sending to directly
+
+        Returns:
+            list: message frames, or ``False`` if the message couldn't be serialized
+        """
+        serializer = self._peer_serializer(peer)
+        if serializer is not None:
+            if peer in self.shm_peers:
+                with self._shm_lock:
+                    if self._shm_ring is None:
+                        self._shm_ring = Shm_Ring(prefs.get('MSG_SHM_SIZE'))
+                return msg.serialize_frames(serializer, shm=self._shm_ring)
+            return msg.serialize_frames(serializer)
+
+        msg_enc = msg.serialize()
+        if not msg_enc:
+            return False
+        return [msg_enc]
+
+    def _peer_serializer(self, peer: bytes) -> typing.Optional[str]:
+        """
+        The serializer to use for binary messages to ``peer`` , or ``None``
+        if they should be sent in the legacy JSON format.
+        """
+        if not (self.binary and peer in self.binary_peers):
+            return None
+        if self.serializer in self.binary_peers[peer]:
+            return self.serializer
+        return 'json'
+
     def repeat(self):
         """
         Periodically (according to :attr:`~.repeat_interval`) resend messages that haven't been confirmed
@@ -462,6 +540,12 @@ class Net_Node(object):
         if not repeat:
             msg.flags['NOREPEAT'] = True
 
+        # advertise that we can receive binary messages, and what we can decode them with
+        if self.binary:
+            msg.flags['BINARY'] = available_serializers()
+        # and if we can read arrays from shared memory on this host
+        if self.shm:
+            msg.flags['SHM'] = self._host_id
 
         if flags:
             for k, v in flags.items():
@@ -470,13 +554,35 @@ class Net_Node(object):
 
         return msg
 
-    def get_stream(self, id, key, min_size=5, upstream=None, port = None, ip=None, subject=None, q_size:Optional[int]=None):
+    def get_stream(self, id, key, min_size=5, upstream=None, port = None, ip=None, subject=None,
+                   q_size:Optional[int]=None, max_latency:Optional[float]=None,
+                   adaptive:bool=False) -> Stream_Queue:
         """
 
         Make a queue that another object can dump data into that sends on its own socket.
         Smarter handling of continuous data than just hitting 'send' a shitload of times.
+
+        Args:
+            id (str): ID of the stream, appended to our :attr:`.id` to make the stream's socket identity
+            key (str): Key that the receiver will handle each item with
+            min_size (int): Number of items to batch together in each ``STREAM`` message.
+                If 1, each item is sent as its own message with ``key``
+            upstream (str): ID of the recipient (default :attr:`.upstream` )
+            port (int): Port of the recipient (default :attr:`.port` )
+            ip (str): IP of the recipient (default :attr:`.upstream_ip` )
+            subject (str): Subject to include in the message headers
+            q_size (int): Maximum number of items to hold before dropping the oldest, ``None`` for no limit.
+            max_latency (float): Maximum time (in ms) to wait for a batch to fill before sending what we have.
+                ``None`` (default) always waits for ``min_size`` items.
+            adaptive (bool): If ``True`` , tune the batch size (starting from ``min_size`` ) and compression
+                of each message from the measured item rate, serialization time and link throughput with a
+                :class:`.Stream_Tuner` . If ``max_latency`` is ``None`` , partial batches are sent after
+                :attr:`.Stream_Tuner.max_interval` .
+
         Returns:
-            Queue: Place to dump ur data
+            :class:`.Stream_Queue`: Place to dump ur data. ``append`` items to it, and
+            ``append('END')`` or ``close()`` it to end the stream. Its :attr:`~.Stream_Queue.stats`
+            report the stream's throughput, compression, latency and queue depth.
 
         """
         if upstream is None:
@@ -495,20 +601,20 @@ class Net_Node(object):
                 subject = prefs.get('SUBJECT')
 
         # make a queue
-        q = deque(maxlen=q_size)
+        q = Stream_Queue(maxlen=q_size)
 
         stream_thread = threading.Thread(target=self._stream,
-                                         args=(id, key, min_size, upstream, port, ip, subject, q))
+                                         args=(id, key, min_size, upstream, port, ip, subject, q, max_latency, adaptive))
         stream_thread.setDaemon(True)
         stream_thread.start()
         self.streams[id] = stream_thread
 
-        self.streams[id] = stream_thread
-
         self.logger.info(("Stream started with configuration:\n"+
                           "ID: {}\n".format(self.id+"_"+id)+
                           "Key: {}\n".format(key)+
                           "Min Chunk Size: {}\n".format(min_size)+
+                          "Max Latency: {}\n".format(max_latency)+
+                          "Adaptive: {}\n".format(adaptive)+
                           "Upstream ID: {}\n".format(upstream) +
                           "Port: {}\n".format(port) +
                           "IP: {}\n".format(ip) +
@@ -519,7 +625,8 @@ class Net_Node(object):
         return q
 
 
-    def _stream(self, id, msg_key, min_size, upstream, port, ip, subject, q):
+    def _stream(self, id, msg_key, min_size, upstream, port, ip, subject, q:Stream_Queue,
+                max_latency:Optional[float]=None, adaptive:bool=False):
 
 
 
@@ -530,7 +637,10 @@ class Net_Node(object):
         socket_id = "{}_{}".format(self.id, id)
         #socket.identity = socket_id
         socket.setsockopt_string(zmq.IDENTITY, socket_id)
-        socket.connect('tcp://{}:{}'.format(ip, port))
+        if self.shm:
+            socket.connect(local_endpoint(ip, port))
+        else:
+            socket.connect('tcp://{}:{}'.format(ip, port))
 
         socket = ZMQStream(socket, self.loop)
 
@@ -554,24 +664,89 @@ class Net_Node(object):
         msg_counter = count()
 
         pending_data = []
-
-        if min_size > 1:
-
-            while True:
-                try:
-                    data = q.popleft()
-                except IndexError:
-                    # normal, we might iterate faster than the source
+        pending_times = []
+        # time after which we send pending data even if we don't have min_size items
+        deadline = None
+        if max_latency is not None:
+            max_latency = max_latency / 1000
+
+        stats = q.stats
+        stats.batch_size = min_size
+        tuner = None
+        compression = True
+        if adaptive:
+            tuner = Stream_Tuner(batch_size=min_size)
+            compression = tuner.compression
+            if max_latency is None:
+                max_latency = tuner.max_interval
+        stats.compression = compression
+
+        # when and how big the last message was, to measure how long the socket takes to send it
+        sent_at = None
+        sent_bytes = 0
+        busy = False
+
+        if min_size > 1 or adaptive:
+
+            ending = False
+            while not ending:
+                sending = socket.sending()
+                if sending:
+                    busy = True
+                elif busy:
+                    if tuner is not None:
+                        tuner.observe_busy(sent_bytes, time.monotonic() - sent_at)
+                    busy = False
+
+                if len(pending_data) == 0:
+                    # wait as long as it takes for the source to give us something
+                    timeout = None
+                elif sending:
+                    # the last message is still going out, keep collecting in the meantime
+                    timeout = self.stream_poll_interval
+                elif len(pending_data) >= min_size:
+                    # already have a full batch (eg. the tuner shrank it while we were sending), don't wait for more
+                    timeout = 0
+                elif deadline is not None:
+                    timeout = max(deadline - time.monotonic(), 0)
+                else:
+                    timeout = None
+
+                if len(pending_data) == 0 and max_latency is not None:
+                    # start the clock on the first item
+                    data = q.drain(min_items=1, timeout=timeout, with_times=True)
+                else:
+                    data = q.drain(min_items=min_size - len(pending_data), timeout=timeout, with_times=True)
+                if len(pending_data) == 0 and len(data) > 0 and max_latency is not None:
+                    deadline = time.monotonic() + max_latency
+                if tuner is not None and len(data) > 0:
+                    tuner.observe_items(len(data))
+
+                for append_time, item in data:
+                    if isinstance(item, str) and item == 'END':
+                        ending = True
+                        break
+                    if isinstance(item, tuple):
+                        # tuples are immutable, so can't serialize numpy arrays they contain
+                        item = list(item)
+                    pending_data.append(item)
+                    pending_times.append(append_time)
+
+                if q.closed and len(q) == 0:
+                    ending = True
+
+                if len(pending_data) == 0 or (socket.sending() and not ending):
                     continue
-                if isinstance(data, str) and data == 'END':
-                    break
-                if isinstance(data, tuple):
-                    # tuples are immutable, so can't serialize numpy arrays they contain
-                    data = list(data)
 
-                pending_data.append(data)
+                if len(pending_data) >= min_size or ending or \
+                        (deadline is not None and time.monotonic() >= deadline):
+                    if tuner is not None:
+                        if not busy:
+                            tuner.observe_idle()
+                        min_size, compression = tuner.update(pending_data)
+                        stats.batch_size, stats.compression = min_size, compression
 
-                if not socket.sending() and len(pending_data)>=min_size:
+                    serialize_start = time.perf_counter()
                     msg = Message(to=upstream.decode('utf-8'), key="STREAM",
                                   value={'inner_key' : msg_key,
                                          'headers'   : {'subject': subject,
@@ -580,40 +755,54 @@ class Net_Node(object):
                                          'payload'   : pending_data},
                                   id="{}_{}".format(id, next(msg_counter)),
                                   flags={'NOREPEAT':True, 'MINPRINT':True},
-                                  sender=socket_id).serialize()
-                    last_msg = socket.send_multipart((upstream, upstream, msg),
-                                                     track=True, copy=True)
+                                  sender=socket_id,
+                                  blosc=compression)
+                    msg_frames = self._serialize_for(msg, upstream)
+                    serialize_time = time.perf_counter() - serialize_start
+
+                    last_msg = socket.send_multipart((upstream, upstream, *msg_frames),
+                                                     track=True, copy=len(msg_frames) == 1)
+                    sent_at = time.monotonic()
+                    sent_bytes = sum(len(f) if isinstance(f, bytes) else f.nbytes for f in msg_frames)
+
+                    stats.record(pending_times, pending_data, msg_frames, serialize_time)
 
                     self.logger.debug("STREAM {}: Sent {} items".format(self.id+'_'+id, len(pending_data)))
                     pending_data = []
+                    pending_times = []
+                    deadline = None
         else:
             # just send like normal messags
-            # just send like normal messags
-            while True:
-                try:
-                    data = q.popleft()
-                except IndexError:
-                    continue
-
-                if isinstance(data, str) and data == "END":
-                    break
-
-                if isinstance(data, tuple):
-                    # tuples are immutable, so can't serialize numpy arrays they contain
-                    data = list(data)
+            ending = False
+            while not ending:
+                for append_time, data in q.drain(with_times=True):
+                    if isinstance(data, str) and data == "END":
+                        ending = True
+                        break
+
+                    if isinstance(data, tuple):
+                        # tuples are immutable, so can't serialize numpy arrays they contain
+                        data = list(data)
+
+                    serialize_start = time.perf_counter()
+                    msg = Message(to=upstream.decode('utf-8'), key=msg_key,
+                                  subject=subject,
+                                  pilot=pilot,
+                                  continuous=True,
+                                  value=data,
+                                  flags={'NOREPEAT': True, 'MINPRINT': True},
+                                  id="{}_{}".format(id, next(msg_counter)),
+                                  sender=socket_id)
+                    msg_frames = self._serialize_for(msg, upstream)
+                    serialize_time = time.perf_counter() - serialize_start
+                    socket.send_multipart((upstream, upstream, *msg_frames),
+                                           track=False, copy=False)
+                    stats.record([append_time], data, msg_frames, serialize_time)
 
-                msg = Message(to=upstream.decode('utf-8'), key=msg_key,
-                              subject=subject,
-                              pilot=pilot,
-                              continuous=True,
-                              value=data,
-                              flags={'NOREPEAT': True, 'MINPRINT': True},
-                              id="{}_{}".format(id, next(msg_counter)),
-                              sender=socket_id).serialize()
-                socket.send_multipart((upstream, upstream, msg),
-                                       track=False, copy=False)
+                    self.logger.debug("STREAM {}: Sent 1 item".format(self.id + '_' + id))
 
-                self.logger.debug("STREAM {}: Sent 1 item".format(self.id + '_' + id))
+                if q.closed and len(q) == 0:
+                    ending = True
 
 
     @property
@@ -646,7 +835,10 @@ class Net_Node(object):
 
     def release(self):
         self.closing.set()
+        self.dispatcher.stop(timeout=0)
         self.sock.close()
         if self.router:
             self.router.close()
+        if self._shm_ring is not None:
+            self._shm_ring.close()
         self.loop.add_callback(lambda:IOLoop.current().stop())
\ No newline at end of file
@@ -0,0 +1,253 @@
+"""
+Retransmission scheduling for messages that have been sent but not confirmed.
+
+Messages are kept in a heap ordered by when they are next due to be resent, along with the frames
+they were originally sent as, so resending them doesn't reserialize them and checking the outbox only
+costs anything when a message is actually due. Confirming a message removes it from the index,
+and its heap entry is discarded when it comes up.
+"""
+
+import heapq
+import threading
+import time
+import typing
+from itertools import count
+
+
+class Outbox_Entry:
+    """
+    A message waiting for confirmation.
+
+    Attributes:
+        id (str): :attr:`.Message.id`
+        peer (bytes): identity of the socket the message was sent to
+        frames (list): the frames the message was sent as, including its route
+        socket (str): which of the owner's sockets the message was sent with (eg. ``'send'`` or ``'push'``)
+        ttl (int): remaining number of times the message will be resent
+        attempts (int): number of times the message has been resent
+        due (float): time the message will next be resent
+        message (:class:`.Message`): the message, for logging
+    """
+    __slots__ = ('id', 'peer', 'frames', 'socket', 'ttl', 'attempts', 'due', 'message')
+
+    def __init__(self, id: str, peer: bytes, frames: list, socket: str, ttl: int, due: float, message=None):
+        self.id = id
+        self.peer = peer
+        self.frames = frames
+        self.socket = socket
+        self.ttl = ttl
+        self.attempts = 0
+        self.due = due
+        self.message = message
+
+
+class Outbox:
+    """
+    Heap of unconfirmed messages keyed by the time they're next due to be resent.
+
+    Messages are first resent after ``first_interval`` seconds, and then after ``interval * backoff ** attempts``
+    seconds, up to ``max_interval`` , until their ttl runs out and they are dropped.
+
+    Args:
+        interval (float): Base seconds between resending a message
+        first_interval (float): Seconds to wait before resending a message the first time
+            (default ``interval * 2`` )
+        backoff (float): Factor to multiply the interval by after each resend
+        max_interval (float): Maximum seconds between resends
+        max_in_flight (int): Maximum number of unconfirmed messages to each peer.
+            When exceeded, the oldest message to that peer is dropped. ``None`` for no limit.
+
+    Attributes:
+        counters (dict): ``added`` , ``confirmed`` , ``retries`` , ``dropped`` (ran out of ttl) and
+            ``evicted`` (over ``max_in_flight`` ) message counts.
+    """
+
+    def __init__(self, interval: float = 5.0,
+                 first_interval: typing.Optional[float] = None,
+                 backoff: float = 2.0,
+                 max_interval: float = 60.0,
+                 max_in_flight: typing.Optional[int] = None):
+        self.interval = interval
+        self.first_interval = first_interval if first_interval is not None else interval * 2
+        self.backoff = backoff
+        self.max_interval = max_interval
+        self.max_in_flight = max_in_flight
+
+        self.counters = {'added': 0, 'confirmed': 0, 'retries': 0, 'dropped': 0, 'evicted': 0}
+
+        self._entries = {} # type: typing.Dict[str, Outbox_Entry]
+        self._peers = {} # type: typing.Dict[bytes, typing.Dict[str, None]]
+        self._heap = [] # type: typing.List[typing.Tuple[float, int, str]]
+        self._seq = count()
+        self._cond = threading.Condition()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, msg_id: str) -> bool:
+        return msg_id in self._entries
+
+    def add(self, msg_id: str, peer: bytes, frames: list, socket: str, ttl: int, message=None) -> typing.List[Outbox_Entry]:
+        """
+        Add a message that was just sent.
+
+        Args:
+            msg_id (str): :attr:`.Message.id`
+            peer (bytes): identity of the socket the message was sent to
+            frames (list): the frames the message was sent as, including its route
+            socket (str): which socket the message was sent with
+            ttl (int): number of times to resend the message
+            message (:class:`.Message`): the message, kept for logging
+
+        Returns:
+            list: :class:`.Outbox_Entry` s that were evicted to keep the peer under ``max_in_flight``
+        """
+        evicted = []
+        with self._cond:
+            if msg_id in self._entries:
+                self._remove(msg_id)
+
+            entry = Outbox_Entry(msg_id, peer, frames, socket, ttl,
+                                 due=time.monotonic() + self.first_interval, message=message)
+            self._entries[msg_id] = entry
+            peer_entries = self._peers.setdefault(peer, {})
+            peer_entries[msg_id] = None
+            self.counters['added'] += 1
+
+            if self.max_in_flight is not None:
+                while len(peer_entries) > self.max_in_flight:
+                    # dicts are ordered, so the first is the oldest
+                    evicted.append(self._remove(next(iter(peer_entries))))
+                    self.counters['evicted'] += 1
+
+            wake = len(self._heap) == 0 or entry.due < self._heap[0][0]
+            heapq.heappush(self._heap, (entry.due, next(self._seq), msg_id))
+            if wake:
+                self._cond.notify_all()
+        return evicted
+
+    def confirm(self, msg_id: str) -> bool:
+        """
+        Remove a message that was confirmed.
+
+        Args:
+            msg_id (str): :attr:`.Message.id`
+
+        Returns:
+            bool: ``True`` if the message was in the outbox
+        """
+        with self._cond:
+            if msg_id not in self._entries:
+                return False
+            self._remove(msg_id)
+            self.counters['confirmed'] += 1
+            return True
+
+    def _remove(self, msg_id: str) -> Outbox_Entry:
+        entry = self._entries.pop(msg_id)
+        peer_entries = self._peers[entry.peer]
+        del peer_entries[msg_id]
+        if len(peer_entries) == 0:
+            del self._peers[entry.peer]
+        return entry
+
+    def next_due(self) -> typing.Optional[float]:
+        """
+        :func:`time.monotonic` time the next message is due, or ``None`` if the outbox is empty
+        """
+        with self._cond:
+            self._discard_stale()
+            if len(self._heap) == 0:
+                return None
+            return self._heap[0][0]
+
+    def _discard_stale(self):
+        # drop heap entries for messages that were confirmed or rescheduled
+        while self._heap:
+            due, _, msg_id = self._heap[0]
+            entry = self._entries.get(msg_id)
+            if entry is not None and entry.due == due:
+                return
+            heapq.heappop(self._heap)
+
+    def pop_due(self, now: typing.Optional[float] = None) -> typing.Tuple[typing.List[Outbox_Entry], typing.List[Outbox_Entry]]:
+        """
+        Get the messages that are due to be resent, rescheduling them, and
+        remove the messages that are due but have run out of ttl.
+
+        Args:
+            now (float): :func:`time.monotonic` time to check against, default now.
+
+        Returns:
+            tuple: (list of entries to resend, list of dropped entries)
+        """
+        if now is None:
+            now = time.monotonic()
+
+        resend, dropped = [], []
+        with self._cond:
+            while True:
+                self._discard_stale()
+                if not self._heap or self._heap[0][0] > now:
+                    break
+                _, _, msg_id = heapq.heappop(self._heap)
+                entry = self._entries[msg_id]
+                if entry.ttl <= 0:
+                    dropped.append(self._remove(msg_id))
+                    self.counters['dropped'] += 1
+                    continue
+
+                entry.ttl -= 1
+                entry.attempts += 1
+                entry.due = now + min(self.interval * self.backoff ** entry.attempts, self.max_interval)
+                heapq.heappush(self._heap, (entry.due, next(self._seq), msg_id))
+                resend.append(entry)
+                self.counters['retries'] += 1
+        return resend, dropped
+
+    def wait(self, timeout: typing.Optional[float] = None):
+        """
+        Block until the next message is due, a message that is due sooner is added, or ``timeout`` .
+
+        Args:
+            timeout (float): maximum seconds to wait
+        """
+        with self._cond:
+            self._discard_stale()
+            if self._heap:
+                until_due = self._heap[0][0] - time.monotonic()
+                timeout = until_due if timeout is None else min(until_due, timeout)
+            if timeout is None or timeout > 0:
+                self._cond.wait(timeout)
+
+    def wake(self):
+        """
+        Wake any thread blocked in :meth:`.wait`
+        """
+        with self._cond:
+            self._cond.notify_all()
+
+    def in_flight(self, peer: typing.Optional[bytes] = None) -> typing.Union[int, typing.Dict[bytes, int]]:
+        """
+        Number of unconfirmed messages
+
+        Args:
+            peer (bytes): if given, only count messages to this peer
+
+        Returns:
+            int or dict: count for ``peer`` , or counts for all peers
+        """
+        with self._cond:
+            if peer is not None:
+                return len(self._peers.get(peer, {}))
+            return {p: len(entries) for p, entries in self._peers.items()}
+
+    def stats(self) -> dict:
+        """
+        Message counters, plus the number of messages ``pending`` and ``in_flight`` per peer
+        """
+        with self._cond:
+            stats = dict(self.counters)
+            stats['pending'] = len(self._entries)
+            stats['in_flight'] = {p: len(entries) for p, entries in self._peers.items()}
+            return stats
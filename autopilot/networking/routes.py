@@ -0,0 +1,229 @@
+"""
+Routing table used by :class:`.Station` to forward messages it isn't the recipient of.
+
+Routes map the ``bytes`` identity of the next hop in a message's routing frames to the
+socket it should be forwarded through and any routing frames to prepend, computed once when the
+route is learned, so forwarding a message is a single dict lookup without decoding any frames.
+
+Peers that send to the Station's router are learned as they are heard from. Peers that
+haven't been heard from for ``ttl`` seconds are moved out of the active table, but are still
+routed through the router (an idle peer may well still be connected, and pushing its messages
+upstream would lose them), and their route is restored the next time it's used.
+Evicted routes are forgotten once their peer hasn't been heard from for ``forget_ttl`` seconds,
+or when more than ``max_evicted`` are kept, oldest first, so the table stays bounded.
+Destinations that have never been heard from use the table's default route - upstream
+through the pusher if the Station has one, or else directly through the router.
+"""
+
+import time
+import typing
+from collections import OrderedDict
+
+
+class Route:
+    """
+    How to forward messages to a destination.
+
+    Attributes:
+        dest (bytes): identity of the destination, or ``None`` for a default route
+        peer (bytes): identity of the next hop, or ``None`` if it is the destination
+        socket (str): which of the owner's sockets to forward with, ``'send'`` for the router or ``'push'`` for the pusher
+        prefix (tuple): routing frames to send before the message's remaining routing frames
+        static (bool): if ``True`` , the route is never evicted
+        last_seen (float): :func:`time.monotonic` time we last received a message from ``dest``
+        received (int): number of messages received from ``dest``
+        forwarded (int): number of messages forwarded through this route
+    """
+    __slots__ = ('dest', 'peer', 'socket', 'prefix', 'static', 'last_seen', 'received', 'forwarded')
+
+    def __init__(self, dest: typing.Optional[bytes], peer: typing.Optional[bytes], socket: str,
+                 prefix: typing.Tuple[bytes, ...] = (), static: bool = False, last_seen: float = 0.0):
+        self.dest = dest
+        self.peer = peer
+        self.socket = socket
+        self.prefix = prefix
+        self.static = static
+        self.last_seen = last_seen
+        self.received = 0
+        self.forwarded = 0
+
+    def __repr__(self) -> str:
+        return f'Route(dest={self.dest}, peer={self.peer}, socket={self.socket}, forwarded={self.forwarded})'
+
+
+class Route_Table:
+    """
+    Table of :class:`.Route` s keyed by destination identity.
+
+    Args:
+        push_id (bytes): identity of the upstream router the owner's pusher is connected to,
+            or ``None`` if it doesn't have one. Destinations without a route are forwarded upstream if given,
+            otherwise directly through the router.
+        ttl (float): seconds since a learned peer was last heard from before its route is evicted
+            from the active table. ``None`` to never evict.
+        forget_ttl (float): seconds since an evicted peer was last heard from before its route is forgotten,
+            and messages to it use the default route. ``None`` to only forget past ``max_evicted`` .
+        max_evicted (int): maximum evicted routes to keep, the longest idle are forgotten past this
+        on_forget (callable): called with the identity of each peer whose route is forgotten
+
+    Attributes:
+        default (:class:`.Route`): route used for destinations that aren't in the table
+        counters (dict): ``learned`` , ``evicted`` , ``restored`` (evicted routes that were used again),
+            ``forgotten`` , ``forwarded`` (through a known route) and ``default`` (forwarded through the default route) counts.
+    """
+
+    def __init__(self, push_id: typing.Optional[bytes] = None, ttl: typing.Optional[float] = 600.0,
+                 forget_ttl: typing.Optional[float] = 3600.0, max_evicted: int = 1024,
+                 on_forget: typing.Optional[typing.Callable[[bytes], None]] = None):
+        self.push_id = push_id
+        self.ttl = ttl
+        self.forget_ttl = forget_ttl
+        self.max_evicted = max_evicted
+        self.on_forget = on_forget
+
+        self.counters = {'learned': 0, 'evicted': 0, 'restored': 0, 'forgotten': 0, 'forwarded': 0, 'default': 0}
+
+        self._routes = {} # type: typing.Dict[bytes, Route]
+        # in the order they were evicted, so the longest idle are forgotten first past max_evicted
+        self._evicted = OrderedDict() # type: typing.Dict[bytes, Route]
+        self._last_evict = time.monotonic()
+
+        if push_id is not None:
+            # the upstream router receives messages to it through the pusher as-is,
+            # and anything we don't know how to reach is pushed upstream addressed to it.
+            self._routes[push_id] = Route(push_id, push_id, 'push', static=True)
+            self.default = Route(None, push_id, 'push', prefix=(push_id,), static=True)
+        else:
+            self.default = Route(None, None, 'send', static=True)
+
+    def __len__(self) -> int:
+        return len(self._routes)
+
+    def __contains__(self, dest: bytes) -> bool:
+        return dest in self._routes
+
+    def learn(self, peer: bytes, now: typing.Optional[float] = None) -> Route:
+        """
+        Note that we received a message from a peer connected to our router,
+        adding a route to it if we don't have one.
+
+        When a new route is added, routes that have gone stale are evicted.
+
+        Args:
+            peer (bytes): identity of the peer
+            now (float): :func:`time.monotonic` time the message was received, default now.
+
+        Returns:
+            :class:`.Route` : the route to ``peer``
+        """
+        if now is None:
+            now = time.monotonic()
+
+        route = self._routes.get(peer)
+        if route is None:
+            route = self._restore(peer)
+        if route is None:
+            route = Route(peer, peer, 'send', last_seen=now)
+            self._routes[peer] = route
+            self.counters['learned'] += 1
+            if self.ttl is not None and now - self._last_evict > self.ttl / 4:
+                self.evict(now)
+
+        route.last_seen = now
+        route.received += 1
+        return route
+
+    def resolve(self, dest: bytes) -> Route:
+        """
+        Get the route to forward a message to ``dest`` through, counting the message as forwarded.
+
+        Args:
+            dest (bytes): identity of the next hop in the message's routing frames
+
+        Returns:
+            :class:`.Route` : the route to ``dest`` , or :attr:`.default`
+        """
+        route = self._routes.get(dest)
+        if route is None:
+            route = self._restore(dest)
+        if route is None:
+            route = self.default
+            self.counters['default'] += 1
+        else:
+            self.counters['forwarded'] += 1
+        route.forwarded += 1
+        return route
+
+    def evict(self, now: typing.Optional[float] = None) -> typing.List[Route]:
+        """
+        Remove routes to peers we haven't heard from in ``ttl`` seconds from the active table.
+
+        Peers aren't forgotten right away, since not having sent anything doesn't mean they have disconnected:
+        messages to an evicted peer are still sent through the router, restoring its route.
+        Evicted routes past ``forget_ttl`` or ``max_evicted`` are forgotten, see :meth:`.forget` .
+
+        Args:
+            now (float): :func:`time.monotonic` time to check against, default now.
+
+        Returns:
+            list: evicted :class:`.Route` s
+        """
+        if now is None:
+            now = time.monotonic()
+        self._last_evict = now
+        if self.ttl is None:
+            return []
+
+        evicted = sorted((route for route in self._routes.values()
+                          if not route.static and now - route.last_seen > self.ttl),
+                         key=lambda route: route.last_seen)
+        for route in evicted:
+            del self._routes[route.dest]
+            self._evicted[route.dest] = route
+        self.counters['evicted'] += len(evicted)
+        self.forget(now)
+        return evicted
+
+    def forget(self, now: typing.Optional[float] = None) -> typing.List[Route]:
+        """
+        Forget evicted routes to peers we haven't heard from in ``forget_ttl`` seconds,
+        and the longest idle past ``max_evicted`` , calling ``on_forget`` for each.
+
+        Args:
+            now (float): :func:`time.monotonic` time to check against, default now.
+
+        Returns:
+            list: forgotten :class:`.Route` s
+        """
+        if now is None:
+            now = time.monotonic()
+
+        forgotten = []
+        if self.forget_ttl is not None:
+            forgotten = [route for route in self._evicted.values() if now - route.last_seen > self.forget_ttl]
+            for route in forgotten:
+                del self._evicted[route.dest]
+        while len(self._evicted) > self.max_evicted:
+            forgotten.append(self._evicted.popitem(last=False)[1])
+
+        self.counters['forgotten'] += len(forgotten)
+        if self.on_forget is not None:
+            for route in forgotten:
+                self.on_forget(route.dest)
+        return forgotten
+
+    def _restore(self, dest: bytes) -> typing.Optional[Route]:
+        route = self._evicted.pop(dest, None)
+        if route is not None:
+            self._routes[dest] = route
+            self.counters['restored'] += 1
+        return route
+
+    def stats(self) -> dict:
+        """
+        Table counters, plus ``received`` and ``forwarded`` counts for each route
+        """
+        stats = dict(self.counters)
+        stats['routes'] = {dest: {'received': route.received, 'forwarded': route.forwarded}
+                           for dest, route in self._routes.items()}
+        return stats
@@ -0,0 +1,234 @@
+"""
+Serializers used to encode the header and body of binary :class:`.Message` s
+(see :meth:`.Message.serialize_frames` ).
+
+Each serializer has a one-byte :attr:`.Serializer.code` that is written into the header frame
+of binary messages so that receivers can detect which serializer to decode it with.
+Which serializer is used to send is selected with the ``MSG_SERIALIZER`` pref, and
+networking objects fall back to :class:`.JSON_Serializer` for peers that haven't advertised
+they can decode it.
+
+Messages sent in the legacy single-frame format are always JSON so that older agents can read them.
+
+Numpy arrays are always sent as separate buffer frames, so serializers only need to
+handle the descriptors that replace them, but all serializers also encode numpy scalars as
+python scalars and :class:`datetime.datetime` / :class:`datetime.date` objects as isoformatted strings.
+"""
+
+import datetime
+import json
+import typing
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+try:
+    import msgpack
+    MSGPACK = True
+except ImportError:
+    MSGPACK = False
+
+try:
+    import orjson
+    ORJSON = True
+except ImportError:
+    ORJSON = False
+
+
+def _default(obj, default: typing.Callable):
+    """
+    Encode types that all serializers share, passing everything else to the ``default`` hook
+    """
+    if isinstance(obj, np.generic):
+        return obj.item()
+    elif isinstance(obj, (datetime.datetime, datetime.date)):
+        return obj.isoformat()
+    return default(obj)
+
+
+def _walk(obj, hook: typing.Callable[[dict], typing.Any]):
+    """
+    Apply ``hook`` to every dict in a decoded object, innermost first,
+    for serializers that don't have an ``object_hook``
+    """
+    if isinstance(obj, dict):
+        return hook({k: _walk(v, hook) for k, v in obj.items()})
+    elif isinstance(obj, list):
+        return [_walk(v, hook) for v in obj]
+    return obj
+
+
+class Serializer(ABC):
+    """
+    Metaclass for message serializers.
+
+    Subclasses should be added to :data:`.SERIALIZERS` with :func:`.register_serializer`
+    """
+    name = None # type: str
+    """
+    Name used to select the serializer in the ``MSG_SERIALIZER`` pref
+    """
+    code = None # type: int
+    """
+    Byte written in the header of binary messages to identify the serializer
+    """
+    available = True # type: bool
+    """
+    Whether the serializer's dependencies could be imported
+    """
+
+    @abstractmethod
+    def dumps(self, obj, default: typing.Callable) -> bytes:
+        """
+        Serialize an object
+
+        Args:
+            obj: object to serialize
+            default (callable): Called for objects that can't otherwise be serialized, eg. numpy arrays.
+
+        Returns:
+            bytes: serialized object
+        """
+
+    @abstractmethod
+    def loads(self, data: bytes, hook: typing.Optional[typing.Callable[[dict], typing.Any]] = None):
+        """
+        Deserialize an object
+
+        Args:
+            data (bytes): serialized object
+            hook (callable): If provided, called with every decoded dict, and its return value used in its place.
+
+        Returns:
+            deserialized object
+        """
+
+
+class JSON_Serializer(Serializer):
+    """
+    The standard library :mod:`json` module. Always available.
+    """
+    name = 'json'
+    code = 0
+
+    def dumps(self, obj, default: typing.Callable) -> bytes:
+        return json.dumps(obj, default=lambda o: _default(o, default)).encode('utf-8')
+
+    def loads(self, data: bytes, hook: typing.Optional[typing.Callable[[dict], typing.Any]] = None):
+        if hook is None:
+            return json.loads(data)
+        return json.loads(data, object_hook=hook)
+
+
+class Msgpack_Serializer(Serializer):
+    """
+    `msgpack <https://msgpack.org/>`_ , a compact binary format.
+    """
+    name = 'msgpack'
+    code = 1
+    available = MSGPACK
+
+    def dumps(self, obj, default: typing.Callable) -> bytes:
+        return msgpack.packb(obj, default=lambda o: _default(o, default))
+
+    def loads(self, data: bytes, hook: typing.Optional[typing.Callable[[dict], typing.Any]] = None):
+        # tuples (eg. array shapes) are packed as arrays, unpack them as lists like json does
+        return msgpack.unpackb(data, object_hook=hook, use_list=True, strict_map_key=False)
+
+
+class Orjson_Serializer(Serializer):
+    """
+    `orjson <https://github.com/ijl/orjson>`_ , a fast JSON library.
+
+    Encodes datetimes natively. Produces ordinary JSON,
+    but since it has no decoding hooks, array descriptors are found by walking the decoded object.
+    """
+    name = 'orjson'
+    code = 2
+    available = ORJSON
+
+    def dumps(self, obj, default: typing.Callable) -> bytes:
+        return orjson.dumps(obj, default=lambda o: _default(o, default),
+                            option=orjson.OPT_NON_STR_KEYS)
+
+    def loads(self, data: bytes, hook: typing.Optional[typing.Callable[[dict], typing.Any]] = None):
+        obj = orjson.loads(data)
+        if hook is None:
+            return obj
+        return _walk(obj, hook)
+
+
+SERIALIZERS = {} # type: typing.Dict[str, Serializer]
+"""
+Registered serializers, keyed by their :attr:`.Serializer.name`
+"""
+
+_SERIALIZER_CODES = {} # type: typing.Dict[int, Serializer]
+
+
+def register_serializer(serializer: typing.Type[Serializer]) -> typing.Type[Serializer]:
+    """
+    Add a serializer to :data:`.SERIALIZERS` . Can be used as a class decorator.
+
+    Args:
+        serializer (:class:`.Serializer`): Serializer class to register
+
+    Returns:
+        the serializer class, unchanged.
+    """
+    if serializer.code in _SERIALIZER_CODES and _SERIALIZER_CODES[serializer.code].name != serializer.name:
+        raise ValueError(f'Serializer code {serializer.code} already used by {_SERIALIZER_CODES[serializer.code].name}')
+    instance = serializer()
+    SERIALIZERS[serializer.name] = instance
+    _SERIALIZER_CODES[serializer.code] = instance
+    return serializer
+
+
+for _serializer in (JSON_Serializer, Msgpack_Serializer, Orjson_Serializer):
+    register_serializer(_serializer)
+
+
+def get_serializer(serializer: typing.Union[str, int]) -> Serializer:
+    """
+    Get a registered serializer by its name or code
+
+    Args:
+        serializer (str, int): :attr:`.Serializer.name` or :attr:`.Serializer.code`
+
+    Returns:
+        :class:`.Serializer`
+    """
+    if isinstance(serializer, int):
+        found = _SERIALIZER_CODES.get(serializer)
+    else:
+        found = SERIALIZERS.get(serializer)
+
+    if found is None:
+        raise KeyError(f'No serializer registered as {serializer}, options are {list(SERIALIZERS.keys())}')
+    if not found.available:
+        raise ImportError(f'Serializer {found.name} is registered, but its dependencies could not be imported')
+    return found
+
+
+def available_serializers() -> typing.List[str]:
+    """
+    Names of the registered serializers whose dependencies could be imported,
+    which networking objects advertise with the ``BINARY`` message flag.
+    """
+    return [name for name, serializer in SERIALIZERS.items() if serializer.available]
+
+
+def advertised_serializers(flag: typing.Union[bool, typing.List[str]]) -> typing.List[str]:
+    """
+    Get the serializers a peer can decode from the value of the ``BINARY`` flag of a message it sent.
+
+    Args:
+        flag (list, bool): Value of ``msg.flags['BINARY']`` , a list of serializer names,
+            or ``True`` if the peer only advertised binary support in general.
+
+    Returns:
+        list: names of serializers
+    """
+    if isinstance(flag, (list, tuple)):
+        return list(flag)
+    return [JSON_Serializer.name]
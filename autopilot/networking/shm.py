@@ -0,0 +1,221 @@
+"""
+Same-host transport: large array buffers in shared memory, small descriptors over zmq.
+
+When two networking objects on the same machine have both enabled ``MSG_SHM`` , binary messages
+(see :meth:`.Message.serialize_frames` ) between them put array buffers larger than
+:data:`.SHM_MIN_BYTES` in the sender's :class:`.Shm_Ring` rather than in their own zmq frames,
+and the message header carries a ``NUMPY_SHM`` descriptor that the receiver reads them back with.
+Peers advertise they're on the same host with the ``SHM`` message flag, whose value is :func:`.host_id` .
+
+Sockets connecting to ``localhost`` also use an ``ipc://`` endpoint (see :func:`.ipc_endpoint` )
+rather than tcp loopback if the other end has bound one.
+
+The ring never blocks the sender -- old buffers are overwritten as new ones are written,
+so a receiver that falls a full ring behind gets a :class:`.Shm_Overwritten` error rather than corrupted data.
+"""
+
+import os
+import socket
+import struct
+import tempfile
+import threading
+import typing
+from multiprocessing import shared_memory
+
+try:
+    from multiprocessing import resource_tracker
+except ImportError: # pragma: no cover - windows
+    resource_tracker = None
+
+SHM_MIN_BYTES = 2 ** 14
+"""
+Buffers smaller than this are still sent as zmq frames, since the descriptor and lookup
+cost about as much as just copying them.
+"""
+
+_HEADER = struct.Struct('<QQ')
+# position of the next write, as the total number of bytes written to the ring, and the size of the ring
+_DATA_OFFSET = 64
+
+_ATTACHED = {} # type: typing.Dict[str, shared_memory.SharedMemory]
+# blocks this process has created or attached to, by name
+_ATTACH_LOCK = threading.Lock()
+
+
+class Shm_Overwritten(RuntimeError):
+    """
+    A buffer was overwritten by the sender before it could be read
+    """
+
+
+def host_id() -> str:
+    """
+    Identify this host (and boot, so stale descriptors aren't trusted across reboots)
+
+    Returns:
+        str: ``hostname:boot_id`` , or just the hostname if the boot id isn't available.
+    """
+    hostname = socket.gethostname()
+    try:
+        with open('/proc/sys/kernel/random/boot_id', 'r') as boot_file:
+            return f'{hostname}:{boot_file.read().strip()}'
+    except OSError:
+        return hostname
+
+
+def ipc_endpoint(port: typing.Union[int, str]) -> typing.Optional[str]:
+    """
+    The ``ipc://`` endpoint bound alongside a tcp port, or ``None`` if ipc isn't supported on this platform.
+
+    Args:
+        port (int): tcp port
+
+    Returns:
+        str: eg. ``'ipc:///tmp/autopilot_5560.ipc'``
+    """
+    if os.name == 'nt':
+        return None
+    return f'ipc://{ipc_path(port)}'
+
+
+def ipc_path(port: typing.Union[int, str]) -> str:
+    """
+    Path of the socket file for :func:`.ipc_endpoint`
+    """
+    return os.path.join(tempfile.gettempdir(), f'autopilot_{port}.ipc')
+
+
+def local_endpoint(ip: str, port: typing.Union[int, str]) -> str:
+    """
+    The endpoint to connect to a socket at ``ip`` and ``port`` -- the ipc endpoint if
+    ``ip`` is this machine and something is listening on it, otherwise tcp.
+
+    Args:
+        ip (str): IP address to connect to
+        port (int): tcp port
+
+    Returns:
+        str: zmq endpoint
+    """
+    if ip in ('localhost', '127.0.0.1') and ipc_endpoint(port) is not None \
+            and os.path.exists(ipc_path(port)):
+        # the socket file outlives processes that crash, so check someone is actually there
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(ipc_path(port))
+            return ipc_endpoint(port)
+        except OSError:
+            pass
+        finally:
+            probe.close()
+    return f'tcp://{ip}:{port}'
+
+
+class Shm_Ring:
+    """
+    Ring buffer in a :class:`multiprocessing.shared_memory.SharedMemory` block.
+
+    The first bytes of the block hold the write position -- the total number of bytes ever written --
+    and the size of the ring, which readers use to check that the buffer they're reading hasn't been overwritten.
+    Buffers are written contiguously, wrapping to the start of the ring if one doesn't fit at the end.
+
+    Only the process that created a ring writes to it.
+
+    Args:
+        size (int): Size of the ring in bytes
+        min_size (int): Buffers smaller than this aren't written (see :data:`.SHM_MIN_BYTES` )
+
+    Attributes:
+        name (str): Name of the shared memory block, for receivers to attach to
+        shm (:class:`multiprocessing.shared_memory.SharedMemory`): The shared memory block
+    """
+
+    def __init__(self, size: int, min_size: int = SHM_MIN_BYTES):
+        self.size = int(size)
+        self.min_size = min_size
+        self.shm = shared_memory.SharedMemory(create=True, size=self.size + _DATA_OFFSET)
+        self.name = self.shm.name
+        self._pos = 0
+        self._lock = threading.Lock()
+        _HEADER.pack_into(self.shm.buf, 0, 0, self.size)
+        with _ATTACH_LOCK:
+            _ATTACHED[self.name] = self.shm
+
+    def write(self, buffer: typing.Union[bytes, memoryview]) -> typing.Optional[list]:
+        """
+        Copy a buffer into the ring.
+
+        Args:
+            buffer (bytes, memoryview): bytes to write
+
+        Returns:
+            list: ``[name, position, n_bytes]`` descriptor to read the buffer back with :func:`.read_shm` ,
+            or ``None`` if the buffer is too small or too large to put in the ring.
+        """
+        n_bytes = len(buffer) if isinstance(buffer, bytes) else buffer.nbytes
+        if n_bytes < self.min_size or n_bytes > self.size:
+            return None
+
+        with self._lock:
+            pos = self._pos
+            if (pos % self.size) + n_bytes > self.size:
+                # doesn't fit before the end, skip to the start
+                pos += self.size - (pos % self.size)
+            self._pos = pos + n_bytes
+            # mark the region as taken before writing so readers can tell it changed
+            _HEADER.pack_into(self.shm.buf, 0, self._pos, self.size)
+            offset = _DATA_OFFSET + (pos % self.size)
+            self.shm.buf[offset:offset + n_bytes] = buffer
+        return [self.name, pos, n_bytes]
+
+    def close(self):
+        """
+        Close and unlink the shared memory block
+        """
+        with _ATTACH_LOCK:
+            _ATTACHED.pop(self.name, None)
+        try:
+            self.shm.close()
+            self.shm.unlink()
+        except (FileNotFoundError, BufferError):
+            pass
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    with _ATTACH_LOCK:
+        shm = _ATTACHED.get(name)
+        if shm is None:
+            shm = shared_memory.SharedMemory(name=name)
+            # the resource tracker would unlink the block when this process exits,
+            # but it belongs to the sender
+            if resource_tracker is not None:
+                try:
+                    resource_tracker.unregister(shm._name, 'shared_memory')
+                except Exception:
+                    pass
+            _ATTACHED[name] = shm
+        return shm
+
+
+def read_shm(descriptor: list) -> bytes:
+    """
+    Copy a buffer out of a :class:`.Shm_Ring`
+
+    Args:
+        descriptor (list): ``[name, position, n_bytes]`` from :meth:`.Shm_Ring.write`
+
+    Returns:
+        bytes: the buffer
+
+    Raises:
+        :class:`.Shm_Overwritten`: if the buffer was overwritten before it could be read
+    """
+    name, pos, n_bytes = descriptor
+    shm = _attach(name)
+    size = _HEADER.unpack_from(shm.buf, 0)[1]
+    offset = _DATA_OFFSET + (pos % size)
+    data = bytes(shm.buf[offset:offset + n_bytes])
+    written = _HEADER.unpack_from(shm.buf, 0)[0]
+    if written > pos + size:
+        raise Shm_Overwritten(f'Buffer at {pos} in {name} was overwritten before it was read')
+    return data
@@ -7,6 +7,7 @@ import socket
 from copy import copy
 from itertools import count
 import typing
+import warnings
 from typing import Optional, Union
 
 import zmq
@@ -15,7 +16,13 @@ from zmq.eventloop.zmqstream import ZMQStream
 
 from autopilot import prefs
 from autopilot.utils.loggers import init_logger
-from autopilot.networking.message import Message
+from autopilot.networking.message import Message, split_frames, is_binary, frame_serializer, frame_has_shm
+from autopilot.networking.serializers import available_serializers, advertised_serializers
+from autopilot.networking.dispatch import Dispatcher
+from autopilot.networking.outbox import Outbox, Outbox_Entry
+from autopilot.networking.routes import Route_Table
+from autopilot.networking.shm import host_id, ipc_endpoint, local_endpoint
+from autopilot.networking.transfer import File_Server, File_Cache
 
 
 class Station(multiprocessing.Process):
@@ -71,14 +78,38 @@ class Station(multiprocessing.Process):
         id (str): What are we known as? What do we set our :attr:`~zmq.Socket.identity` as?
         ip (str): Device IP
         listens (dict): Dictionary of functions to call for different types of messages. keys match the :attr:`.Message.key`.
-        senders (dict): Identities of other sockets (keys, ie. directly connected) and their state (values) if they keep one
-        push_outbox (dict): Messages that have been sent but have not been confirmed to our :attr:`Station.pusher`
-        send_outbox (dict): Messages that have been sent but have not been confirmed to our :attr:`Station.listener`
+        senders (dict): Identities of agents that have sent messages to us and their state (values) if they keep one
+        routes (:class:`.Route_Table`): Next hop for messages we forward, learned from the peers connected to our
+            :attr:`.listener` , and kept routed through it after :attr:`.route_ttl` of idleness,
+            until :attr:`.route_forget_ttl` . Created in :meth:`.run`
+        binary (bool): Whether we send binary multipart messages to peers that support them (``prefs.get('MSG_BINARY')``)
+        serializer (str): Name of the :class:`~.serializers.Serializer` to encode binary messages with,
+            if the peer supports it (``prefs.get('MSG_SERIALIZER')``)
+        binary_peers (dict): Identities of directly connected sockets that have advertised they can receive binary messages,
+            and the serializers they can decode.
+            Binary messages forwarded to peers that haven't are converted back to the JSON format.
+        shm (bool): Whether we bind an ipc endpoint and read arrays from shared memory sent by peers on the same host
+            (``prefs.get('MSG_SHM')`` , see :mod:`.networking.shm` )
+        shm_peers (set): Identities of directly connected sockets on the same host that can read shared memory.
+            Messages with arrays in shared memory forwarded to other peers have them copied back into frames.
+        outbox (:class:`.Outbox`): Messages that have been sent but have not been confirmed,
+            scheduled to be resent by :meth:`.repeat` . Created in :meth:`.run`
         timers (dict): dict of :class:`threading.Timer` s that will check in on outbox messages
         msg_counter (:class:`itertools.count`): counter to index our sent messages
         file_block (:class:`threading.Event`): Event to signal when a file is being received.
+        dispatcher (:class:`.Dispatcher`): Worker pool that calls listen methods, in order for each sender.
+            Created in :meth:`.run` , with policies for specific keys from :attr:`.dispatch_policies`
     """
     repeat_interval = 5.0 # seconds to wait before retrying messages
+    repeat_backoff = 2.0 # multiply the time between retries by this after each retry
+    repeat_max_interval = 60.0 # maximum seconds between retries
+    max_in_flight = 1000 # maximum unconfirmed messages per peer, the oldest are dropped past this
+    route_ttl = 600.0 # seconds without hearing from a peer before its route is evicted from the active table
+    route_forget_ttl = 3600.0 # seconds without hearing from a peer before its route and capabilities are forgotten
+    dispatch_policies = {} # type: typing.Dict[str, str]
+    """
+    :data:`~.dispatch.POLICIES` to use for specific message keys, keys not included use ``'block'``
+    """
 
     def __init__(self,
                  id: Optional[str] = None,
@@ -104,11 +135,22 @@ class Station(multiprocessing.Process):
         self.id = id
         self.repeat_thread = None
         self.senders = {}
-        self.push_outbox = {}
-        self.send_outbox = {}
+        self.outbox = None # type: Optional[Outbox]
         self.timers = {}
         self.child = False
-        self.routes = {}
+        self.routes = None # type: Optional[Route_Table]
+        self._own_ids = frozenset()
+        self._own_names = () # type: typing.Tuple[str, str]
+        self.dispatcher = None # type: Optional[Dispatcher]
+        self.binary = bool(prefs.get('MSG_BINARY'))
+        self.serializer = prefs.get('MSG_SERIALIZER')
+        if self.serializer not in available_serializers():
+            warnings.warn(f'Serializer {self.serializer} is not available, using json')
+            self.serializer = 'json'
+        self.binary_peers = {} # type: typing.Dict[bytes, typing.List[str]]
+        self.shm = self.binary and bool(prefs.get('MSG_SHM'))
+        self.shm_peers = set() # type: typing.Set[bytes]
+        self._host_id = host_id()
         self.msgs_received = multiprocessing.Value('i', lock=True)
         self.msgs_received.value = 0
 
@@ -156,6 +198,14 @@ class Station(multiprocessing.Process):
         """
         try:
             self.logger = init_logger(self)
+            self.dispatcher = Dispatcher(policies=self.dispatch_policies, name=f'{self.id}_dispatch',
+                                         logger=self.logger)
+            self.outbox = Outbox(interval=self.repeat_interval, backoff=self.repeat_backoff,
+                                 max_interval=self.repeat_max_interval, max_in_flight=self.max_in_flight)
+            self.routes = Route_Table(push_id=self.push_id if self.pusher else None, ttl=self.route_ttl,
+                                      forget_ttl=self.route_forget_ttl, on_forget=self._forget_peer)
+            self._own_names = (self.id, '_{}'.format(self.id))
+            self._own_ids = frozenset(name.encode('utf-8') for name in self._own_names)
             # init zmq objects
             self.context = zmq.Context()
             self.loop = IOLoop()
@@ -168,13 +218,18 @@ class Station(multiprocessing.Process):
             self.listener  = self.context.socket(zmq.ROUTER)
             self.listener.setsockopt_string(zmq.IDENTITY, self.id)
             self.listener.bind('tcp://*:{}'.format(self.listen_port))
+            if self.shm and ipc_endpoint(self.listen_port) is not None:
+                self.listener.bind(ipc_endpoint(self.listen_port))
             self.listener = ZMQStream(self.listener, self.loop)
             self.listener.on_recv(self.handle_listen)
 
             if self.pusher is True:
                 self.pusher = self.context.socket(zmq.DEALER)
                 self.pusher.setsockopt_string(zmq.IDENTITY, self.id)
-                self.pusher.connect('tcp://{}:{}'.format(self.push_ip, self.push_port))
+                if self.shm:
+                    self.pusher.connect(local_endpoint(self.push_ip, self.push_port))
+                else:
+                    self.pusher.connect('tcp://{}:{}'.format(self.push_ip, self.push_port))
                 self.pusher = ZMQStream(self.pusher, self.loop)
                 self.pusher.on_recv(self.handle_listen)
                 # TODO: Make sure handle_listen knows how to handle ID-less messages
@@ -191,6 +246,8 @@ class Station(multiprocessing.Process):
             self.logger.debug("Stopped with KeyboardInterrupt")
             pass
         finally:
+            if self.dispatcher is not None:
+                self.dispatcher.stop(timeout=0)
             self.context.destroy()
             self.loop.close()
             self.logger.debug("Reached finally, closing Station")
@@ -230,12 +287,74 @@ class Station(multiprocessing.Process):
         if not repeat:
             msg.flags['NOREPEAT'] = True
 
+        # advertise that we can receive binary messages, and what we can decode them with
+        if self.binary:
+            msg.flags['BINARY'] = available_serializers()
+        # and if we can read arrays from shared memory on this host
+        if self.shm:
+            msg.flags['SHM'] = self._host_id
+
         if flags:
             for k, v in flags.items():
                 msg.flags[k] = v
 
         return msg
 
+    def _serialize_for(self, msg: Message, peer: bytes) -> typing.Union[list, bool]:
+        """
+        Serialize a message as binary frames if the ``peer`` we're sending it to
+        can receive them, otherwise as a single legacy JSON frame.
+
+        Args:
+            msg (:class:`.Message`): Message to serialize
+            peer (bytes): identity of the socket we are sending to directly
+
+        Returns:
+            list: message frames, or ``False`` if the message couldn't be serialized
+        """
+        serializer = self._peer_serializer(peer)
+        if serializer is not None:
+            return msg.serialize_frames(serializer)
+
+        msg_enc = msg.serialize()
+        if not msg_enc:
+            return False
+        return [msg_enc]
+
+    def _peer_serializer(self, peer: bytes) -> typing.Optional[str]:
+        """
+        The serializer to use for binary messages to ``peer`` , or ``None``
+        if they should be sent in the legacy JSON format.
+        """
+        if not (self.binary and peer in self.binary_peers):
+            return None
+        if self.serializer in self.binary_peers[peer]:
+            return self.serializer
+        return 'json'
+
+    def _forward_frames(self, frames: typing.List[bytes], peer: bytes) -> typing.List[bytes]:
+        """
+        Forward the frames of a message we aren't the recipient of,
+        converting binary messages back to JSON if the next hop can't read them,
+        or reserializing them if the next hop can't decode their serializer
+        or can't read the shared memory their arrays are in.
+
+        Args:
+            frames (list): message frames from :func:`.split_frames`
+            peer (bytes): identity of the next hop
+
+        Returns:
+            list: message frames to send
+        """
+        if is_binary(frames[-1]):
+            serializer = self._peer_serializer(peer)
+            if serializer is None:
+                return [Message(frames).serialize()]
+            elif frame_serializer(frames[-1]) not in self.binary_peers[peer] or \
+                    (frame_has_shm(frames[-1]) and peer not in self.shm_peers):
+                return Message(frames).serialize_frames(serializer)
+        return frames
+
 
     def send(self, to=None, key=None, value=None, msg=None, repeat=True, flags=None):
         """
@@ -245,7 +364,7 @@ class Station(multiprocessing.Process):
         or at least `to` and `key` must be provided for a new message created
         by :meth:`~.Station.prepare_message` .
 
-        A :class:`threading.Timer` is created to resend the message using
+        The message is added to the :attr:`.outbox` to be resent by
         :meth:`~.Station.repeat` unless `repeat` is False.
 
         Args:
@@ -284,22 +403,22 @@ class Station(multiprocessing.Process):
         if not msg.validate():
             self.logger.exception('Message Invalid:\n{}'.format(str(msg)))
 
+        if manual_to:
+            route = [to.encode('utf-8')]
+        elif isinstance(msg.to, list):
+            route = [hop.encode('utf-8') for hop in to]
+        else:
+            route = [msg.to.encode('utf-8')]
+
         # encode message
-        msg_enc = msg.serialize()
+        msg_frames = self._serialize_for(msg, route[0])
 
-        if not msg_enc:
+        if not msg_frames:
             self.logger.exception('Message could not be encoded:\n{}'.format(str(msg)))
             return
 
-        if manual_to:
-            self.listener.send_multipart([to.encode('utf-8'), msg_enc])
-        else:
-
-            if isinstance(msg.to, list):
-
-                self.listener.send_multipart([*[hop.encode('utf-8') for hop in to], msg_enc])
-            else:
-                self.listener.send_multipart([msg.to.encode('utf-8'), msg_enc])
+        frames = [*route, *msg_frames]
+        self.listener.send_multipart(frames, copy=len(msg_frames) == 1)
 
         # messages can have a flag that says not to log
         # log_this = True
@@ -308,14 +427,11 @@ class Station(multiprocessing.Process):
 
 
         #if msg.key != "CONFIRM":
-        self.logger.debug('MESSAGE SENT - {}'.format(str(msg)))
+        self.logger.debug('MESSAGE SENT - %s', msg)
 
         if repeat and not msg.key == "CONFIRM":
-            # add to outbox and spawn timer to resend
-            self.send_outbox[msg.id] = (time.time(), msg)
-            # self.timers[msg.id] = threading.Timer(5.0, self.repeat, args=(msg.id,'send'))
-            # self.timers[msg.id].start()
-            #self.outbox.put((msg.id))
+            # add to outbox to resend
+            self._add_outbox(msg, route[0], frames, 'send')
 
     def push(self,  to=None, key = None, value = None, msg=None, repeat=True, flags=None):
         """
@@ -330,7 +446,7 @@ class Station(multiprocessing.Process):
         or at least `key` must be provided for a new message created
         by :meth:`~.Station.prepare_message` .
 
-        A :class:`threading.Timer` is created to resend the message using
+        The message is added to the :attr:`.outbox` to be resent by
         :meth:`~.Station.repeat` unless `repeat` is False.
 
         Args:
@@ -370,79 +486,67 @@ class Station(multiprocessing.Process):
             self.logger.error('Message Invalid:\n{}'.format(str(msg)))
 
         # encode message
-        msg_enc = msg.serialize()
+        msg_frames = self._serialize_for(msg, self.push_id)
 
-        if not msg_enc:
+        if not msg_frames:
             self.logger.error('Message could not be encoded:\n{}'.format(str(msg)))
             return
 
         # Even if the message is not to our upstream node, we still send it
         # upstream because presumably our target is upstream.
-        self.pusher.send_multipart([self.push_id, bytes(msg.to, encoding="utf-8"), msg_enc])
+        frames = [self.push_id, bytes(msg.to, encoding="utf-8"), *msg_frames]
+        self.pusher.send_multipart(frames, copy=len(msg_frames) == 1)
 
         if not (msg.key == "CONFIRM") and log_this:
-            self.logger.debug('MESSAGE PUSHED - {}'.format(str(msg)))
+            self.logger.debug('MESSAGE PUSHED - %s', msg)
 
         if repeat and not msg.key == 'CONFIRM':
-            # add to outbox and spawn timer to resend
-            self.push_outbox[msg.id] = (time.time(), msg)
-            #self.timers[msg.id] = threading.Timer(5.0, self.repeat, args=(msg.id, 'push'))
-            #self.timers[msg.id].start()
+            # add to outbox to resend
+            self._add_outbox(msg, self.push_id, frames, 'push')
 
-    def repeat(self):
+    def _add_outbox(self, msg: Message, peer: bytes, frames: list, socket: str):
         """
-        Periodically (according to :attr:`~.repeat_interval`) resend messages that haven't been confirmed
-
-        TTL is decremented, and messages are resent until their TTL is 0.
+        Add a sent message to the :attr:`.outbox` , logging any older messages
+        to the same peer that were dropped to keep it under :attr:`.max_in_flight`
 
+        Args:
+            msg (:class:`.Message`): sent message
+            peer (bytes): identity of the socket it was sent to
+            frames (list): frames it was sent as, which are resent as-is
+            socket (str): ``'send'`` for the :attr:`.listener` or ``'push'`` for the :attr:`.pusher`
         """
-        while not self.closing.is_set():
-            # make local copies
-            push_outbox = copy(self.push_outbox)
-            send_outbox = copy(self.send_outbox)
-
-            # try to send any outstanding messages and delete if too old
-            if len(push_outbox)>0:
-                for id in push_outbox.keys():
-                    if push_outbox[id][1].ttl <= 0:
-                        self.logger.warning('PUBLISH FAILED {} - {}'.format(id, str(push_outbox[id][1])))
-                        try:
-                            del self.push_outbox[id]
-                        except KeyError:
-                            # fine, already deleted
-                            pass
-                    else:
-                        # if we didn't just put this message in our outbox
-                        if (time.time() - push_outbox[id][0]) > self.repeat_interval*2:
-
-                            self.logger.debug('REPUBLISH {} - {}'.format(id, str(push_outbox[id][1])))
-                            self.pusher.send_multipart([self.push_id, push_outbox[id][1].serialize()])
-                            self.push_outbox[id][1].ttl -= 1
-
+        for entry in self.outbox.add(msg.id, peer, frames, socket, msg.ttl, message=msg):
+            self.logger.warning('PUBLISH DROPPED, too many unconfirmed messages to %s - %s', peer, entry.message)
 
+    def repeat(self):
+        """
+        Resend messages in the :attr:`.outbox` that haven't been confirmed when they come due.
 
-            if len(send_outbox)>0:
-                for id in send_outbox.keys():
-                    if send_outbox[id][1].ttl <= 0:
-                        self.logger.warning('PUBLISH FAILED {} - {}'.format(id, str(send_outbox[id][1])))
-                        try:
-                            del self.send_outbox[id]
-                        except KeyError:
-                            # fine, already deleted
-                            pass
-
-                    else:
-                        # if we didn't just put this message in our outbox
-                        if (time.time() - send_outbox[id][0]) > self.repeat_interval*2:
+        Messages are resent as the frames they were first sent as, with increasing intervals
+        (see :class:`.Outbox` ) until their TTL is 0. Sending is handed to the :attr:`.loop` ,
+        since zmq sockets aren't threadsafe.
+        """
+        while not self.closing.is_set():
+            resend, dropped = self.outbox.pop_due()
 
-                            self.logger.debug('REPUBLISH {} - {}'.format(id, str(send_outbox[id][1])))
-                            self.listener.send_multipart([bytes(send_outbox[id][1].to, encoding="utf-8"), send_outbox[id][1].serialize()])
-                            self.send_outbox[id][1].ttl -= 1
+            for entry in dropped:
+                self.logger.warning('PUBLISH FAILED %s - %s', entry.id, entry.message)
 
-            # wait to do it again
-            time.sleep(self.repeat_interval)
+            for entry in resend:
+                self.logger.debug('REPUBLISH %s - %s', entry.id, entry.message)
+                self.loop.add_callback(self._resend, entry)
 
+            # wait until the next message is due, checking periodically if we're closing
+            self.outbox.wait(self.repeat_interval)
 
+    def _resend(self, entry: Outbox_Entry):
+        """
+        Send the cached frames of an :class:`.Outbox_Entry` again through the socket it was sent with.
+        """
+        if entry.socket == 'push':
+            self.pusher.send_multipart(entry.frames, copy=False)
+        else:
+            self.listener.send_multipart(entry.frames, copy=False)
 
     def l_confirm(self, msg):
         """
@@ -455,14 +559,7 @@ class Station(multiprocessing.Process):
         # value should be the message id
 
         # delete message from outbox if we still have it
-        try:
-            if msg.value in self.send_outbox.keys():
-                del self.send_outbox[msg.value]
-            elif msg.value in self.push_outbox.keys():
-                del self.push_outbox[msg.value]
-        except KeyError:
-            # fine, already deleted
-            pass
+        self.outbox.confirm(msg.value)
 
         # if this is a message to our internal net_node, make sure it gets the memo that shit was confirmed too
         if msg.to == "_{}".format(self.id):
@@ -519,7 +616,7 @@ class Station(multiprocessing.Process):
     def handle_listen(self, msg:typing.List[bytes]):
         """
         Upon receiving a message, call the appropriate listen method
-        in a new thread.
+        with the :attr:`.dispatcher` .
 
         If the message is :attr:`~.Message.to` us, send confirmation.
 
@@ -537,68 +634,52 @@ class Station(multiprocessing.Process):
         if msg[-1] == b'CLOSING':
             self.loop.stop()
 
-        if len(msg)==1:
+        route, frames = split_frames(msg)
+
+        if len(route)==0:
             # from our dealer, these are always to us.
             send_type = 'dealer'
             #msg = json.loads(msg[0])
             #msg = Message(**msg)
-            msg = Message(msg[0])
-
-        elif len(msg)>=2:
+            msg = Message(frames)
+            if 'BINARY' in msg.flags.keys() and self.push_id is not None \
+                    and msg.sender == self.push_id.decode('utf-8'):
+                self.binary_peers[self.push_id] = advertised_serializers(msg.flags['BINARY'])
+                if self.shm and msg.flags.get('SHM') == self._host_id:
+                    self.shm_peers.add(self.push_id)
+
+        elif len(route)>=1:
             # from the router
             send_type = 'router'
-            sender = msg[0]
-
-            # if this message was a multihop message, store the route
-            if len(msg)>4:
-                self.routes[sender] = msg[0:-3]
+            sender = route[0]
 
-            # # if this is a new sender, add them to the list
-            if sender not in self.senders.keys():
-                self.senders[sender] = ""
-                self.senders[b'_' + sender] = ''
+            self.routes.learn(sender)
 
             # connection pings are blank frames,
             # respond to let them know we're alive
-            if msg[-1] == b'':
+            if frames[-1] == b'':
                 self.listener.send_multipart(msg)
                 return
 
             # if this message wasn't to us, forward without deserializing
             # the second to last should always be the intended recipient
-            unserialized_to = msg[-2]
-            if unserialized_to.decode('utf-8') not in [self.id, "_{}".format(self.id)]:
-                # forward it!!
-                if len(msg) > 4:
-                    # multihop message, just determine whether the next hop is through
-                    # our pusher or router
-                    if self.pusher and msg[2] not in self.senders.keys():
-                        self.pusher.send_multipart(msg[2:])
-                        self.logger.debug(f'FORWARDING (multihop dealer): {msg}')
-                    else:
-                        self.listener.send_multipart(msg[2:])
-                        self.logger.debug(f'FORWARDING (multihop router): {msg}')
-                else:
-                    if unserialized_to not in self.senders.keys() and self.pusher:
-                        # if we don't know who they are and we have a pusher, try to push it
-                        self.pusher.send_multipart([self.push_id, *msg[2:]])
-                        self.logger.debug(f'FORWARDING (dealer): {msg}')
-                    else:
-                        # if we know who they are or not, try to send it through router anyway.
-                        # send everything but the first two frames, which should be the ID of
-                        # the sender and us
-                        self.listener.send_multipart(msg[2:])
-                        self.logger.debug(f'FORWARDING (router): {msg}')
-
+            if route[-1] not in self._own_ids:
+                self._forward(route, frames)
                 return
 
-            msg = Message(msg[-1])
+            msg = Message(frames)
 
             # if this is a new sender, add them to the list
             if msg['sender'] not in self.senders.keys():
                 self.senders[msg['sender']] = ""
                 self.senders['_' + msg['sender']] = ''
 
+            # only trust a capability advertisement from the peer that sent it to us directly
+            if 'BINARY' in msg.flags.keys() and msg.sender == sender.decode('utf-8'):
+                self.binary_peers[sender] = advertised_serializers(msg.flags['BINARY'])
+                if self.shm and msg.flags.get('SHM') == self._host_id:
+                    self.shm_peers.add(sender)
+
         else:
             self.logger.error('Dont know what this message is:{}'.format(msg))
             return
@@ -612,15 +693,13 @@ class Station(multiprocessing.Process):
                 msg.to = msg.to[0]
 
         # if this message is to us, just handle it and return
-        if msg.to in [self.id, "_{}".format(self.id)]:
+        if msg.to in self._own_names:
             if (msg.key != "CONFIRM"):
-                self.logger.debug('RECEIVED: {}'.format(str(msg)))
-            # Log and spawn thread to respond to listen
-            try:
-                listen_funk = self.listens[msg.key]
-                listen_thread = threading.Thread(target=listen_funk, args=(msg,))
-                listen_thread.start()
-            except KeyError:
+                self.logger.debug('RECEIVED: %s', msg)
+            # Log and dispatch to listen
+            if msg.key in self.listens.keys():
+                self.dispatcher.submit(msg.sender, msg.key, self.listens[msg.key], msg)
+            else:
                 self.logger.exception('No function could be found for msg id {} with key: {}'.format(msg.id, msg.key))
 
 
@@ -671,6 +750,44 @@ class Station(multiprocessing.Process):
         #     elif send_type == 'dealer':
         #         self.push(msg.sender, 'CONFIRM', msg.id)
 
+    def _forward(self, route: typing.List[bytes], frames: typing.List[bytes]):
+        """
+        Forward a message we received on our router but aren't the recipient of
+        through the :attr:`.routes` entry for its next hop.
+
+        Args:
+            route (list): routing frames, ``[sender, our id, next hop, ... final recipient]``
+            frames (list): message frames from :func:`.split_frames`
+        """
+        hops = route[2:]
+        if len(hops) == 0:
+            self.logger.error(f'Cant forward message without a recipient: {route}')
+            return
+
+        next_hop = self.routes.resolve(hops[0])
+        peer = next_hop.peer if next_hop.peer is not None else hops[0]
+        out = [*next_hop.prefix, *hops, *self._forward_frames(frames, peer)]
+        if next_hop.socket == 'push':
+            self.pusher.send_multipart(out, copy=False)
+        else:
+            self.listener.send_multipart(out, copy=False)
+        self.logger.debug('FORWARDING (%s): %s', next_hop.socket, route)
+
+    def _forget_peer(self, peer: bytes):
+        """
+        A peer's route was forgotten by :attr:`.routes` , so stop keeping track of what it can receive,
+        and of it as a sender unless it keeps some state (eg. a pilot's handshake).
+
+        Args:
+            peer (bytes): identity of the peer
+        """
+        self.binary_peers.pop(peer, None)
+        self.shm_peers.discard(peer)
+        name = peer.decode('utf-8', errors='replace')
+        for sender in (name, '_' + name):
+            if self.senders.get(sender) == '':
+                del self.senders[sender]
+
     def get_ip(self):
         """
         Find our IP address
@@ -730,27 +847,33 @@ class Terminal_Station(Station):
 
     **Listens**
 
-    +-------------+-------------------------------------------+-----------------------------------------------+
-    | Key         | Method                                    | Description                                   |
-    +=============+===========================================+===============================================+
-    | 'PING'      | :meth:`~.Terminal_Station.l_ping`         | We are asked to confirm that we are alive     |
-    +-------------+-------------------------------------------+-----------------------------------------------+
-    | 'INIT'      | :meth:`~.Terminal_Station.l_init`         | Ask all pilots to confirm that they are alive |
-    +-------------+-------------------------------------------+-----------------------------------------------+
-    | 'CHANGE'    | :meth:`~.Terminal_Station.l_change`       | Change a parameter on the Pi                  |
-    +-------------+-------------------------------------------+-----------------------------------------------+
-    | 'STOPALL'   | :meth:`~.Terminal_Station.l_stopall`      | Stop all pilots and plots                     |
-    +-------------+-------------------------------------------+-----------------------------------------------+
-    | 'KILL'      | :meth:`~.Terminal_Station.l_kill`         | Terminal wants us to die :(                   |
-    +-------------+-------------------------------------------+-----------------------------------------------+
-    | 'DATA'      | :meth:`~.Terminal_Station.l_data`         | Stash incoming data from a Pilot              |
-    +-------------+-------------------------------------------+-----------------------------------------------+
-    | 'STATE'     | :meth:`~.Terminal_Station.l_state`        | A Pilot has changed state                     |
-    +-------------+-------------------------------------------+-----------------------------------------------+
-    | 'HANDSHAKE' | :meth:`~.Terminal_Station.l_handshake`    | A Pi is telling us it's alive and its IP      |
-    +-------------+-------------------------------------------+-----------------------------------------------+
-    | 'FILE'      | :meth:`~.Terminal_Station.l_file`         | The pi needs some file from us                |
-    +-------------+-------------------------------------------+-----------------------------------------------+
+    +---------------+-------------------------------------------+-----------------------------------------------+
+    | Key           | Method                                    | Description                                   |
+    +===============+===========================================+===============================================+
+    | 'PING'        | :meth:`~.Terminal_Station.l_ping`         | We are asked to confirm that we are alive     |
+    +---------------+-------------------------------------------+-----------------------------------------------+
+    | 'INIT'        | :meth:`~.Terminal_Station.l_init`         | Ask all pilots to confirm that they are alive |
+    +---------------+-------------------------------------------+-----------------------------------------------+
+    | 'CHANGE'      | :meth:`~.Terminal_Station.l_change`       | Change a parameter on the Pi                  |
+    +---------------+-------------------------------------------+-----------------------------------------------+
+    | 'STOPALL'     | :meth:`~.Terminal_Station.l_stopall`      | Stop all pilots and plots                     |
+    +---------------+-------------------------------------------+-----------------------------------------------+
+    | 'KILL'        | :meth:`~.Terminal_Station.l_kill`         | Terminal wants us to die :(                   |
+    +---------------+-------------------------------------------+-----------------------------------------------+
+    | 'DATA'        | :meth:`~.Terminal_Station.l_data`         | Stash incoming data from a Pilot              |
+    +---------------+-------------------------------------------+-----------------------------------------------+
+    | 'STATE'       | :meth:`~.Terminal_Station.l_state`        | A Pilot has changed state                     |
+    +---------------+-------------------------------------------+-----------------------------------------------+
+    | 'HANDSHAKE'   | :meth:`~.Terminal_Station.l_handshake`    | A Pi is telling us it's alive and its IP      |
+    +---------------+-------------------------------------------+-----------------------------------------------+
+    | 'FILE'        | :meth:`~.Terminal_Station.l_file`         | The pi needs some file from us                |
+    +---------------+-------------------------------------------+-----------------------------------------------+
+    | 'FILE_CHUNKS' | :meth:`~.Terminal_Station.l_file_chunks` | The pi needs some chunks of a file from us    |
+    +---------------+-------------------------------------------+-----------------------------------------------+
+    | 'STREAM'      | :meth:`~.Terminal_Station.l_stream`       | Batches of continuous data from a Pilot       |
+    +---------------+-------------------------------------------+-----------------------------------------------+
+    | 'CAMERA_STATS'| :meth:`~.Terminal_Station.l_camera_stats` | Timing statistics from a Pilot's camera       |
+    +---------------+-------------------------------------------+-----------------------------------------------+
 
     """
 
@@ -785,11 +908,16 @@ class Terminal_Station(Station):
             'STATE':     self.l_state,  # The Pi is confirming/notifying us that it has changed state
             'HANDSHAKE': self.l_handshake, # initial connection with some initial info
             'FILE':      self.l_file,  # The pi needs some file from us
+            'FILE_CHUNKS': self.l_file_chunks, # The pi needs some chunks of a file from us
+            'CAMERA_STATS': self.l_camera_stats, # a camera is reporting its timing statistics
         })
 
         # dictionary that keeps track of our pilots
         self.pilots = pilots
 
+        # files we send to pilots, hashed once and read a chunk at a time (see :mod:`.networking.transfer`)
+        self.file_server = File_Server(prefs.get('SOUNDDIR'))
+
         # start a timer at the draw FPS of the terminal -- only send
         if prefs.get( 'DRAWFPS'):
             self.data_fps = float(prefs.get('DRAWFPS'))
@@ -918,7 +1046,49 @@ class Terminal_Station(Station):
         # Send through to terminal
         #msg.value.update({'continuous':True})
         self.send(to='_T', msg=msg)
+        self._plot_continuous(msg)
+
+    def l_camera_stats(self, msg:Message):
+        """
+        Forward timing statistics from a :class:`.Camera` (see :meth:`.Camera.stats` ) to the Terminal,
+        and a copy to the pilot's plot.
+
+        Args:
+            msg (:class:`.Message`): ``CAMERA_STATS`` message
+        """
+        self.send(to='_T', msg=msg)
+        self.send(to='P_{}'.format(msg.value['pilot']), key='CAMERA_STATS', value=msg.value,
+                  flags={'NOLOG': True, 'NOREPEAT': True})
 
+    def l_stream(self, msg:Message):
+        """
+        Streams of continuous data are sent through to the terminal as a single batch
+        so they can be stored at once (see :meth:`.Subject._save_continuous_data` ),
+        and their most recent sample is sent to the plot.
+
+        Other streams are unpacked and handled message by message by :meth:`.Station.l_stream`
+
+        Args:
+            msg (:class:`.Message`): Compressed stream sent by :meth:`Net_Node._stream`
+        """
+        if msg.value['inner_key'] != 'CONTINUOUS':
+            super(Terminal_Station, self).l_stream(msg)
+            return
+
+        headers = msg.value.get('headers', {})
+        payload = msg.value['payload']
+        self.send(to='_T', key='CONTINUOUS', value={**headers, 'payload': payload}, repeat=False)
+
+        if len(payload) > 0 and isinstance(payload[-1], dict):
+            msg.key = 'CONTINUOUS'
+            msg.value = {**payload[-1], **headers}
+            self._plot_continuous(msg)
+
+    def _plot_continuous(self, msg:Message):
+        """
+        Send continuous data to the plot widget for the pilot it came from,
+        at most as often as ``prefs.get('DRAWFPS')``
+        """
         # Send to plot widget, which should be listening to "P_{pilot_name}"
         plot_id = 'P_{}'.format(msg.value['pilot'])
         if plot_id in self.senders.keys():
@@ -978,18 +1148,28 @@ class Terminal_Station(Station):
         """
         A Pilot needs some file from us.
 
-        Send it back after :meth:`base64.b64encode` ing it.
+        If the value is a ``dict`` (``{'path': path}``), the pilot can receive the file in chunks
+        (see :mod:`.networking.transfer`), so send back its ``FILE_INFO`` and wait for the pilot to
+        ask for chunks with ``FILE_CHUNKS`` .
 
-        TODO:
-            Split large files into multiple messages...
+        Otherwise, send the whole file back after :meth:`base64.b64encode` ing it.
 
         Args:
             msg (:class:`.Message`): The value field of the message should contain some
                 relative path to a file contained within `prefs.get('SOUNDDIR')` . eg.
                 `'/songs/sadone.wav'` would return `'os.path.join(prefs.get('SOUNDDIR')/songs.sadone.wav'`
         """
-        # The <target> pi has requested some file <value> from us, let's send it back
-        # This assumes the file is small, if this starts crashing we'll have to split the message...
+        if isinstance(msg.value, dict):
+            path = msg.value['path']
+            try:
+                info = self.file_server.source(path).info(path)
+            except (OSError, ValueError) as e:
+                self.logger.exception(f'Could not send file {path} to {msg.sender}: {e}')
+                info = {'path': path, 'error': str(e)}
+            self.send(msg.sender, 'FILE_INFO', info)
+            return
+
+        # The <target> pi has requested some file <value> from us, send it back in one message
 
         full_path = os.path.join(prefs.get('SOUNDDIR'), msg.value)
         with open(full_path, 'rb') as open_file:
@@ -1000,6 +1180,34 @@ class Terminal_Station(Station):
 
         self.send(msg.sender, 'FILE', file_message)
 
+    def l_file_chunks(self, msg:Message):
+        """
+        A Pilot needs some chunks of a file it was sent the ``FILE_INFO`` for.
+
+        Each chunk is sent in its own ``FILE_CHUNK`` message, which isn't repeated --
+        the pilot asks again for chunks that don't arrive. If the file has changed since the pilot
+        got its ``FILE_INFO`` , send the new one instead.
+
+        Args:
+            msg (:class:`.Message`): value is ``{'path': path, 'hash': hash, 'chunks': [indices]}``
+        """
+        path = msg.value['path']
+        try:
+            source = self.file_server.source(path)
+        except (OSError, ValueError) as e:
+            self.logger.exception(f'Could not send file {path} to {msg.sender}: {e}')
+            self.send(msg.sender, 'FILE_INFO', {'path': path, 'error': str(e)})
+            return
+
+        if source.hash != msg.value['hash']:
+            self.send(msg.sender, 'FILE_INFO', source.info(path))
+            return
+
+        for index, data in source.read_chunks(msg.value['chunks']):
+            self.send(msg.sender, 'FILE_CHUNK',
+                      {'path': path, 'hash': source.hash, 'index': index, 'data': data},
+                      repeat=False, flags={'MINPRINT': True})
+
 
 class Pilot_Station(Station):
     """
@@ -1011,19 +1219,27 @@ class Pilot_Station(Station):
 
     **Listens**
 
-    +-------------+-------------------------------------+-----------------------------------------------+
-    | Key         | Method                              | Description                                   |
-    +=============+=====================================+===============================================+
-    | 'STATE'     | :meth:`~.Pilot_Station.l_state`     | Pilot has changed state                       |
-    | 'COHERE'    | :meth:`~.Pilot_Station.l_cohere`    | Make sure our data and the Terminal's match.  |
-    | 'PING'      | :meth:`~.Pilot_Station.l_ping`      | The Terminal wants to know if we're listening |
-    | 'START'     | :meth:`~.Pilot_Station.l_start`     | We are being sent a task to start             |
-    | 'STOP'      | :meth:`~.Pilot_Station.l_stop`      | We are being told to stop the current task    |
-    | 'PARAM'     | :meth:`~.Pilot_Station.l_change`    | The Terminal is changing some task parameter  |
-    | 'FILE'      | :meth:`~.Pilot_Station.l_file`      | We are receiving a file                       |
-    +-------------+-------------------------------------+-----------------------------------------------+
+    +--------------+--------------------------------------+-----------------------------------------------+
+    | Key          | Method                               | Description                                   |
+    +==============+======================================+===============================================+
+    | 'STATE'      | :meth:`~.Pilot_Station.l_state`      | Pilot has changed state                       |
+    | 'COHERE'     | :meth:`~.Pilot_Station.l_cohere`     | Make sure our data and the Terminal's match.  |
+    | 'PING'       | :meth:`~.Pilot_Station.l_ping`       | The Terminal wants to know if we're listening |
+    | 'START'      | :meth:`~.Pilot_Station.l_start`      | We are being sent a task to start             |
+    | 'STOP'       | :meth:`~.Pilot_Station.l_stop`       | We are being told to stop the current task    |
+    | 'PARAM'      | :meth:`~.Pilot_Station.l_change`     | The Terminal is changing some task parameter  |
+    | 'FILE'       | :meth:`~.Pilot_Station.l_file`       | We are receiving a file                       |
+    | 'FILE_INFO'  | :meth:`~.Pilot_Station.l_file_info`  | We are being told about a file we requested   |
+    | 'FILE_CHUNK' | :meth:`~.Pilot_Station.l_file_chunk` | We are receiving a chunk of a file            |
+    +--------------+--------------------------------------+-----------------------------------------------+
 
     """
+    dispatch_policies = {
+        'START': 'thread' # waits for any FILEs it requests, which come from the same sender
+    }
+    file_window = 16 # maximum chunks of each file requested and not yet received
+    file_timeout = 5.0 # seconds without receiving a chunk before requesting the missing ones again
+    file_legacy_after = 3 # FILE_INFO timeouts before also requesting the whole file, unless the terminal has sent FILE_INFO before
     def __init__(self):
         # Pilot has a pusher - connects back to terminal
         super(Pilot_Station, self).__init__()
@@ -1055,6 +1271,13 @@ class Pilot_Station(Station):
         self.child = False # Are we acting as a child right now?
         self.parent = False # Are we acting as a parent right now?
 
+        # files requested from the terminal (see :mod:`.networking.transfer`), by path
+        self.file_cache = File_Cache()
+        self.file_transfers = {} # type: typing.Dict[str, dict]
+        self._file_lock = threading.Lock()
+        # whether the terminal has answered with FILE_INFO, so it can send files in chunks
+        self._chunked_terminal = False
+
 
         self.listens.update({
             'STATE': self.l_state,  # Confirm or notify terminal of state change
@@ -1064,6 +1287,8 @@ class Pilot_Station(Station):
             'STOP': self.l_stop,  # We are being told to stop the current task
             'PARAM': self.l_change,  # The Terminal is changing some task parameter
             'FILE': self.l_file,  # We are receiving a file
+            'FILE_INFO': self.l_file_info, # We are being told the hash and size of a file we requested
+            'FILE_CHUNK': self.l_file_chunk, # We are receiving a chunk of a file
             'CONTINUOUS': self.l_continuous, # we are sending continuous data to the terminal
             'CHILD': self.l_child,
             'HANDSHAKE': self.l_noop,
@@ -1186,17 +1411,18 @@ class Pilot_Station(Station):
                 f_sounds = []
 
             if len(f_sounds)>0:
-                # check to see if we have these files, if not, request them
+                # check to see if we have these files, if not, request them all at once
+                # and then wait for them to arrive
+                requested = []
                 for sound in f_sounds:
                     full_path = os.path.join(prefs.get('SOUNDDIR'), sound['path'])
-                    if not os.path.exists(full_path):
-                        # We ask the terminal to send us the file and then wait.
+                    if not os.path.exists(full_path) and sound['path'] not in requested:
                         self.logger.info('REQUESTING SOUND {}'.format(sound['path']))
-                        self.push(key='FILE', value=sound['path'])
-                        # wait here to get the sound,
-                        # the receiving thread will set() when we get it.
-                        self.file_block.clear()
-                        self.file_block.wait()
+                        self.request_file(sound['path'])
+                        requested.append(sound['path'])
+
+                for path in requested:
+                    self.wait_file(path)
 
         # If we're starting the task as a child, stash relevant params
         if 'child' in msg.value.keys():
@@ -1235,9 +1461,10 @@ class Pilot_Station(Station):
 
     def l_file(self, msg:Message):
         """
-        We are receiving a file.
+        We are receiving a whole file, in reply to a legacy (``str`` ) ``FILE`` request.
 
-        Decode from b64 and save. Set the file_block.
+        Decode from b64 and save. Finish any chunked transfer of the same file that was waiting on it,
+        and set the file_block.
 
         Args:
             msg (:class:`.Message`): value will have 'path' and 'file',
@@ -1260,6 +1487,149 @@ class Pilot_Station(Station):
         self.logger.info('SOUND RECEIVED {}'.format(msg.value['path']))
 
         # If we requested a file, some poor start fn is probably waiting on us
+        self._finish_file(msg.value['path'])
+
+    def request_file(self, path:str):
+        """
+        Ask the terminal for a file in chunks (see :mod:`.networking.transfer`)
+
+        Args:
+            path (str): path relative to `prefs.get('SOUNDDIR')`
+        """
+        with self._file_lock:
+            if path not in self.file_transfers:
+                self.file_transfers[path] = {'receiver': None, 'done': threading.Event(),
+                                             'requested': time.monotonic(), 'timeouts': 0}
+        self.push(key='FILE', value={'path': path})
+
+    def wait_file(self, path:str):
+        """
+        Wait for a file requested with :meth:`.request_file` ,
+        asking again for whatever hasn't arrived every :attr:`.file_timeout` seconds without progress.
+
+        A terminal that can't send files in chunks never answers with ``FILE_INFO`` , so if none arrives
+        after :attr:`.file_legacy_after` tries and the terminal has never sent one,
+        the file is also requested the legacy way, to be sent whole (see :meth:`.l_file` ).
+
+        Args:
+            path (str): path relative to `prefs.get('SOUNDDIR')`
+        """
+        transfer = self.file_transfers.get(path)
+        if transfer is None:
+            return
+
+        while not transfer['done'].wait(self.file_timeout):
+            receiver = transfer['receiver']
+            if receiver is None:
+                if time.monotonic() - transfer['requested'] > self.file_timeout:
+                    transfer['requested'] = time.monotonic()
+                    transfer['timeouts'] += 1
+                    self.push(key='FILE', value={'path': path})
+                    if not self._chunked_terminal and transfer['timeouts'] >= self.file_legacy_after:
+                        self.logger.warning(f'No FILE_INFO for {path}, requesting again in chunks and as a whole file')
+                        self.push(key='FILE', value=path)
+                    else:
+                        self.logger.warning(f'No FILE_INFO for {path}, requesting again')
+            elif time.monotonic() - receiver.last_progress > self.file_timeout:
+                self.logger.warning(f'Transfer of {path} stalled with {len(receiver.missing)} chunks missing, requesting again')
+                self._request_chunks(path, receiver, retry=True)
+
+    def l_file_info(self, msg:Message):
+        """
+        The terminal is telling us the hash and size of a file we requested.
+
+        If we already have a file with that hash in our :attr:`.file_cache` , link it to where it belongs,
+        otherwise start (or resume) receiving it.
+
+        Args:
+            msg (:class:`.Message`): value is a :attr:`.File_Source.info` dict, or has an ``'error'``
+        """
+        path = msg.value['path']
+        self._chunked_terminal = True
+        with self._file_lock:
+            transfer = self.file_transfers.setdefault(
+                path, {'receiver': None, 'done': threading.Event(), 'requested': time.monotonic(), 'timeouts': 0})
+
+        if 'error' in msg.value:
+            self.logger.exception(f"Terminal could not send {path}: {msg.value['error']}")
+            self._finish_file(path)
+            return
+
+        file_hash = msg.value['hash']
+        if file_hash in self.file_cache:
+            self.logger.info(f'SOUND {path} already cached')
+            self._finish_file(path, file_hash)
+            return
+
+        with self._file_lock:
+            receiver = transfer['receiver']
+            if receiver is not None and receiver.hash != file_hash:
+                # the file changed since we started receiving it
+                receiver.discard()
+                receiver = None
+            if receiver is None:
+                receiver = self.file_cache.receiver(msg.value)
+                transfer['receiver'] = receiver
+
+        if receiver.complete:
+            self._complete_file(path, receiver)
+        else:
+            self._request_chunks(path, receiver)
+
+    def l_file_chunk(self, msg:Message):
+        """
+        We are receiving a chunk of a file.
+
+        Write it, and request the next chunk, or if it was the last, check the file's hash and move it into place.
+
+        Args:
+            msg (:class:`.Message`): value is ``{'path': path, 'hash': hash, 'index': int, 'data': array}``
+        """
+        path = msg.value['path']
+        transfer = self.file_transfers.get(path)
+        if transfer is None or transfer['receiver'] is None or transfer['receiver'].hash != msg.value['hash']:
+            # a late duplicate of something we already have
+            return
+
+        receiver = transfer['receiver']
+        msg.expand()
+        receiver.write(msg.value['index'], msg.value['data'].tobytes())
+        if receiver.complete:
+            self._complete_file(path, receiver)
+        else:
+            self._request_chunks(path, receiver)
+
+    def _request_chunks(self, path:str, receiver, retry:bool=False):
+        chunks = receiver.next_chunks(self.file_window, retry=retry)
+        if chunks:
+            self.push(key='FILE_CHUNKS', value={'path': path, 'hash': receiver.hash, 'chunks': chunks},
+                      repeat=False)
+
+    def _complete_file(self, path:str, receiver):
+        with self._file_lock:
+            if self.file_transfers.get(path, {}).get('receiver') is not receiver:
+                # another chunk already completed it
+                return
+            self.file_transfers[path]['receiver'] = None
+
+        if receiver.finish():
+            self._finish_file(path, receiver.hash)
+        else:
+            self.logger.warning(f'Hash of {path} did not match, requesting it again')
+            self.push(key='FILE', value={'path': path})
+
+    def _finish_file(self, path:str, file_hash:typing.Optional[str]=None):
+        if file_hash is not None:
+            self.file_cache.link(file_hash, os.path.join(prefs.get('SOUNDDIR'), path))
+            self.logger.info('SOUND RECEIVED {}'.format(path))
+
+        with self._file_lock:
+            transfer = self.file_transfers.pop(path, None)
+        if transfer is not None:
+            if transfer['receiver'] is not None:
+                # finished some other way (eg. sent whole, or already cached), so late chunks have nowhere to go
+                transfer['receiver'].discard()
+            transfer['done'].set()
         self.file_block.set()
 
     def l_continuous(self, msg:Message):
@@ -0,0 +1,369 @@
+"""
+Queues used by :meth:`.Net_Node.get_stream` to pass data to a streaming thread,
+and the statistics and tuning of adaptive streams.
+"""
+
+import threading
+import time
+import typing
+from collections import deque
+
+import numpy as np
+import blosc2 as blosc
+
+
+class Stream_Queue:
+    """
+    Blocking ring buffer for streamed data.
+
+    Used like a :class:`collections.deque` by the object producing the data -- items are added with
+    :meth:`.append` , and if ``maxlen`` is given the oldest items are dropped when it's full -- but
+    the consumer can block until data is available, rather than polling, and take it in batches with :meth:`.drain` .
+
+    Args:
+        maxlen (int): Maximum number of items to hold, ``None`` for no limit.
+
+    Attributes:
+        dropped (int): Number of items dropped because the queue was full
+        closed (bool): Whether :meth:`.close` has been called
+        stats (:class:`.Stream_Stats`): Statistics of the stream sending this queue's items
+    """
+
+    def __init__(self, maxlen: typing.Optional[int] = None):
+        self.maxlen = maxlen
+        self.dropped = 0
+        self.closed = False
+        self.stats = Stream_Stats(self)
+        self._q = deque(maxlen=maxlen)
+        self._cond = threading.Condition(threading.Lock())
+
+    def __len__(self) -> int:
+        return len(self._q)
+
+    def append(self, item):
+        """
+        Add an item, waking the consumer if it's waiting for it.
+
+        Args:
+            item: anything
+        """
+        with self._cond:
+            if self.maxlen is not None and len(self._q) >= self.maxlen:
+                self.dropped += 1
+            self._q.append((time.monotonic(), item))
+            self._cond.notify()
+
+    def popleft(self, block: bool = False, timeout: typing.Optional[float] = None):
+        """
+        Remove and return the oldest item.
+
+        Args:
+            block (bool): If ``True`` , wait for an item rather than raising :class:`IndexError` when empty
+            timeout (float): If blocking, seconds to wait before raising :class:`IndexError` . ``None`` waits indefinitely.
+
+        Returns:
+            the oldest item
+        """
+        with self._cond:
+            if block:
+                self._cond.wait_for(lambda: self._q or self.closed, timeout)
+            return self._q.popleft()[1]
+
+    def drain(self, min_items: int = 1,
+              max_items: typing.Optional[int] = None,
+              timeout: typing.Optional[float] = None,
+              with_times: bool = False) -> list:
+        """
+        Wait until at least ``min_items`` are available, and then remove and return them.
+
+        Returns early with whatever is available (possibly nothing) after ``timeout``
+        or if the queue is :meth:`.close` d.
+
+        Args:
+            min_items (int): Number of items to wait for
+            max_items (int): Maximum number of items to return, ``None`` for all available
+            timeout (float): Maximum seconds to wait, ``None`` to wait indefinitely.
+            with_times (bool): If ``True`` , return ``(time, item)`` tuples with the
+                :func:`time.monotonic` time each item was appended.
+
+        Returns:
+            list: items, oldest first.
+        """
+        min_items = max(min_items, 1)
+        if self.maxlen is not None:
+            min_items = min(min_items, self.maxlen)
+
+        with self._cond:
+            if len(self._q) < min_items and not self.closed:
+                self._cond.wait_for(lambda: len(self._q) >= min_items or self.closed, timeout)
+
+            if max_items is None or max_items >= len(self._q):
+                items = list(self._q)
+                self._q.clear()
+            else:
+                items = [self._q.popleft() for _ in range(max_items)]
+        if with_times:
+            return items
+        return [item for _, item in items]
+
+    def close(self):
+        """
+        Mark the stream as finished. A consumer blocked in :meth:`.drain` returns
+        with what's left, and later calls return immediately.
+        """
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+
+def _array_nbytes(obj) -> int:
+    """
+    Total bytes of the numpy arrays in an object
+    """
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    elif isinstance(obj, dict):
+        return sum(_array_nbytes(v) for v in obj.values())
+    elif isinstance(obj, (list, tuple)):
+        return sum(_array_nbytes(v) for v in obj)
+    return 0
+
+
+def _largest_array(obj) -> typing.Optional[np.ndarray]:
+    """
+    The largest numpy array in an object, if any
+    """
+    if isinstance(obj, np.ndarray):
+        return obj
+    elif isinstance(obj, dict):
+        obj = obj.values()
+    elif not isinstance(obj, (list, tuple)):
+        return None
+    arrays = [a for a in (_largest_array(v) for v in obj) if a is not None]
+    if len(arrays) == 0:
+        return None
+    return max(arrays, key=lambda a: a.nbytes)
+
+
+class Stream_Stats:
+    """
+    Running statistics for a stream made by :meth:`.Net_Node.get_stream`
+
+    Args:
+        q (:class:`.Stream_Queue`): The stream's queue, to report its depth and dropped items
+
+    Attributes:
+        items (int): Number of items sent
+        messages (int): Number of messages sent
+        bytes_sent (int): Total size of sent messages
+        array_bytes (int): Size of the arrays in sent messages before compression
+        buffer_bytes (int): Size of the arrays in sent messages after compression
+        serialize_time (float): Total seconds spent serializing messages
+        latency (float): Moving average of the seconds items waited between being appended and sent
+        batch_size (int): Current target number of items per message
+        compression (bool, dict): Current compression, see :class:`.Message`
+    """
+
+    def __init__(self, q: 'Stream_Queue'):
+        self._q = q
+        self.items = 0
+        self.messages = 0
+        self.bytes_sent = 0
+        self.array_bytes = 0
+        self.buffer_bytes = 0
+        self.serialize_time = 0.0
+        self.latency = None # type: typing.Optional[float]
+        self.batch_size = None # type: typing.Optional[int]
+        self.compression = False
+        self._start = None # type: typing.Optional[float]
+        self._lock = threading.Lock()
+
+    def record(self, append_times: typing.List[float], payload, frames: list, serialize_time: float):
+        """
+        Record a sent message
+
+        Args:
+            append_times (list): :func:`time.monotonic` times the message's items were appended to the queue
+            payload: the items sent in the message
+            frames (list): the frames the message was sent as
+            serialize_time (float): seconds taken to serialize the message
+        """
+        now = time.monotonic()
+        array_bytes = _array_nbytes(payload)
+        if len(frames) > 1:
+            # binary message, arrays are in the frames before the header
+            buffer_bytes = sum(len(f) if isinstance(f, bytes) else f.nbytes for f in frames[:-1])
+        else:
+            # can't separate them from the rest of a JSON message
+            buffer_bytes = array_bytes
+        latency = now - (sum(append_times) / len(append_times)) if append_times else 0.0
+        with self._lock:
+            if self._start is None:
+                self._start = append_times[0] if append_times else now
+            self.items += len(append_times)
+            self.messages += 1
+            self.bytes_sent += sum(len(f) if isinstance(f, bytes) else f.nbytes for f in frames)
+            self.array_bytes += array_bytes
+            self.buffer_bytes += buffer_bytes
+            self.serialize_time += serialize_time
+            self.latency = latency if self.latency is None else 0.9 * self.latency + 0.1 * latency
+
+    def as_dict(self) -> dict:
+        """
+        Returns:
+            dict: ``bytes_per_s`` , ``items_per_s`` , ``messages`` , ``compression_ratio``
+            (uncompressed / compressed array size), ``serialize_ms`` (mean per message),
+            ``latency_ms`` (moving average time items wait to be sent), ``queue_depth`` ,
+            ``dropped`` , ``batch_size`` and ``compression``
+        """
+        with self._lock:
+            elapsed = time.monotonic() - self._start if self._start is not None else 0
+            return {
+                'bytes_per_s': self.bytes_sent / elapsed if elapsed > 0 else 0.0,
+                'items_per_s': self.items / elapsed if elapsed > 0 else 0.0,
+                'messages': self.messages,
+                'compression_ratio': self.array_bytes / self.buffer_bytes if self.buffer_bytes > 0 else 1.0,
+                'serialize_ms': self.serialize_time * 1000 / self.messages if self.messages > 0 else 0.0,
+                'latency_ms': self.latency * 1000 if self.latency is not None else None,
+                'queue_depth': len(self._q),
+                'dropped': self._q.dropped,
+                'batch_size': self.batch_size,
+                'compression': self.compression
+            }
+
+
+class Stream_Tuner:
+    """
+    Choose the batch size and compression of an adaptive stream from its measured rates.
+
+    * **Batch size** - aim to send a message every ``target_interval`` seconds given the rate items arrive,
+      growing the interval (up to ``max_interval`` ) while the socket is still busy sending the last message
+      and shrinking it back when it isn't.
+    * **Compression** - every ``explore_every`` messages, time compressing the largest array in the batch
+      with each of the :attr:`.COMPRESSION` options. Then use whichever has the lowest estimated cost per byte --
+      the time to compress it plus the time to send the compressed bytes at the measured link throughput.
+      Until the link is measured to be a bottleneck (ie. the socket is busy when a batch is ready), that's
+      no compression.
+
+    Args:
+        batch_size (int): initial batch size
+        max_size (int): maximum batch size
+        target_interval (float): seconds between messages to aim for
+        max_interval (float): maximum seconds between messages
+        explore_every (int): measure compression options every n messages
+
+    Attributes:
+        batch_size (int): current batch size
+        compression (bool, dict): current compression, passed as ``blosc`` to :class:`.Message`
+        throughput (float): moving average of measured link throughput, bytes/s, ``None`` if not yet measured
+    """
+
+    COMPRESSION = (
+        False,
+        {'codec': 'lz4', 'clevel': 1},
+        {'codec': 'lz4', 'clevel': 5},
+        {'codec': 'zstd', 'clevel': 3},
+    )
+    """
+    Compression options to choose between
+    """
+
+    def __init__(self, batch_size: int = 5, max_size: int = 100,
+                 target_interval: float = 0.05, max_interval: float = 0.5,
+                 explore_every: int = 50):
+        self.batch_size = max(int(batch_size), 1)
+        self.max_size = max(int(max_size), 1)
+        self.target_interval = target_interval
+        self.base_interval = target_interval
+        self.max_interval = max(max_interval, target_interval)
+        self.explore_every = explore_every
+        self.compression = False
+        self.throughput = None # type: typing.Optional[float]
+
+        self._item_rate = None # type: typing.Optional[float]
+        self._last_items = None # type: typing.Optional[float]
+        self._n_messages = 0
+        # seconds per byte to compress, and compressed / uncompressed size for each option
+        self._costs = {} # type: typing.Dict[int, typing.Tuple[float, float]]
+
+    @staticmethod
+    def _ewma(old: typing.Optional[float], new: float, alpha: float = 0.2) -> float:
+        return new if old is None else (1 - alpha) * old + alpha * new
+
+    def observe_items(self, n_items: int, now: typing.Optional[float] = None):
+        """
+        Update the rate items are arriving
+
+        Args:
+            n_items (int): number of items received since the last call
+            now (float): :func:`time.monotonic` time they were received
+        """
+        if now is None:
+            now = time.monotonic()
+        if self._last_items is not None and now > self._last_items:
+            self._item_rate = self._ewma(self._item_rate, n_items / (now - self._last_items))
+        self._last_items = now
+
+    def observe_busy(self, n_bytes: int, seconds: float):
+        """
+        Update the link throughput after the socket took ``seconds`` to finish sending a message of ``n_bytes``
+        """
+        if seconds > 0:
+            self.throughput = self._ewma(self.throughput, n_bytes / seconds)
+        self.target_interval = min(self.target_interval * 1.25, self.max_interval)
+
+    def observe_idle(self):
+        """
+        The socket was free when a batch was ready, relax back towards the base interval
+        """
+        self.target_interval = max(self.target_interval * 0.9, self.base_interval)
+
+    def update(self, payload: list) -> typing.Tuple[int, typing.Union[bool, dict]]:
+        """
+        Choose the batch size and compression for the next message.
+
+        Args:
+            payload (list): the items about to be sent, to measure compression with
+
+        Returns:
+            tuple: (batch size, compression)
+        """
+        if self._item_rate is not None:
+            size = int(round(self._item_rate * self.target_interval))
+            self.batch_size = min(max(size, 1), self.max_size)
+
+        if self._n_messages % self.explore_every == 0:
+            self._explore(payload)
+        self._n_messages += 1
+
+        if self._costs:
+            self.compression = self.COMPRESSION[min(self._costs.keys(), key=self._cost)]
+        return self.batch_size, self.compression
+
+    def _cost(self, option: int) -> float:
+        compress_time, ratio = self._costs[option]
+        if self.throughput is None:
+            return compress_time
+        return compress_time + ratio / self.throughput
+
+    def _explore(self, payload: list):
+        array = _largest_array(payload)
+        if array is None or array.nbytes == 0:
+            self._costs = {}
+            self.compression = False
+            return
+
+        for i, option in enumerate(self.COMPRESSION):
+            if option is False:
+                self._costs[i] = (0.0, 1.0)
+                continue
+            kwargs = dict(option)
+            kwargs['codec'] = blosc.Codec[kwargs['codec'].upper()]
+            start = time.perf_counter()
+            packed = blosc.pack_array(array, **kwargs)
+            elapsed = time.perf_counter() - start
+            # timing is noisy, but the ratio is just whatever the current data compresses to
+            compress_time = elapsed / array.nbytes
+            if i in self._costs:
+                compress_time = self._ewma(self._costs[i][0], compress_time, 0.5)
+            self._costs[i] = (compress_time, len(packed) / array.nbytes)
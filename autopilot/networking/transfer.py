@@ -0,0 +1,383 @@
+"""
+Chunked, resumable file transfer between stations, eg. sound files sent from the :class:`.Terminal_Station`
+to the :class:`.Pilot_Station` s that need them.
+
+Files are split into chunks of ``prefs.get('FILE_CHUNK_SIZE')`` bytes, sent as ``uint8`` arrays
+(so binary peers receive them as raw frames), and identified by the sha256 hash of their contents.
+The receiver asks for a sliding window of chunks at a time, so neither side ever holds more than a window
+of a file in memory, and a transfer to one pilot doesn't hold up messages to any other.
+
+The exchange, started by a ``FILE`` request with a ``dict`` value (a ``str`` value is the legacy
+request for the whole file base64 encoded in one message):
+
+* receiver -> sender: ``FILE`` - ``{'path': path}``
+* sender -> receiver: ``FILE_INFO`` - :attr:`.File_Source.info` , or ``{'path': path, 'error': str}``
+* receiver -> sender: ``FILE_CHUNKS`` - ``{'path': path, 'hash': hash, 'chunks': [indices]}``
+* sender -> receiver: ``FILE_CHUNK`` - ``{'path': path, 'hash': hash, 'index': index, 'data': array}`` for each
+  requested chunk. These aren't repeated -- the receiver asks again for any chunks that don't arrive.
+
+Received files are kept in a :class:`.File_Cache` , named by their hash, and linked to where they belong,
+so a file that's already been received (under any name) isn't sent again. Partially received files are kept
+alongside the cache, so a transfer that is interrupted (or a pilot that restarts) resumes from the chunks it already has.
+"""
+
+import hashlib
+import os
+import shutil
+import threading
+import time
+import typing
+
+import numpy as np
+
+from autopilot import prefs
+
+_HASH_BLOCK = 2 ** 20
+
+
+def file_hash(path: str) -> str:
+    """
+    sha256 hash of a file's contents, read a block at a time.
+
+    Args:
+        path (str): path to file
+
+    Returns:
+        str: hex digest
+    """
+    sha = hashlib.sha256()
+    with open(path, 'rb') as open_file:
+        for block in iter(lambda: open_file.read(_HASH_BLOCK), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+class File_Source:
+    """
+    A file being sent in chunks.
+
+    Args:
+        path (str): Absolute path to the file
+        chunk_size (int): Bytes per chunk (default ``prefs.get('FILE_CHUNK_SIZE')`` )
+
+    Attributes:
+        size (int): Size of the file in bytes
+        hash (str): sha256 hash of the file
+        n_chunks (int): Number of chunks the file is split into
+    """
+
+    def __init__(self, path: str, chunk_size: typing.Optional[int] = None):
+        if chunk_size is None:
+            chunk_size = prefs.get('FILE_CHUNK_SIZE')
+        self.path = path
+        self.chunk_size = int(chunk_size)
+        stat = os.stat(path)
+        self._stat = (stat.st_size, stat.st_mtime_ns)
+        self.size = stat.st_size
+        self.hash = file_hash(path)
+        self.n_chunks = -(-self.size // self.chunk_size)
+
+    def info(self, rel_path: str) -> dict:
+        """
+        Value of the ``FILE_INFO`` message describing this file
+
+        Args:
+            rel_path (str): the path the file was requested by
+        """
+        return {'path': rel_path, 'hash': self.hash, 'size': self.size,
+                'chunk_size': self.chunk_size, 'n_chunks': self.n_chunks}
+
+    @property
+    def stale(self) -> bool:
+        """
+        Whether the file has changed (or been removed) since it was hashed
+        """
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return True
+        return (stat.st_size, stat.st_mtime_ns) != self._stat
+
+    def read_chunks(self, indices: typing.Iterable[int]) -> typing.Iterator[typing.Tuple[int, np.ndarray]]:
+        """
+        Read chunks of the file, one at a time
+
+        Args:
+            indices (list): indices of chunks to read. Indices past the end of the file are skipped.
+
+        Yields:
+            tuple: (index, ``uint8`` array)
+        """
+        with open(self.path, 'rb') as open_file:
+            for index in indices:
+                index = int(index)
+                if index < 0 or index >= self.n_chunks:
+                    continue
+                open_file.seek(index * self.chunk_size)
+                yield index, np.frombuffer(open_file.read(self.chunk_size), dtype=np.uint8)
+
+
+class File_Server:
+    """
+    The :class:`.File_Source` s for files in a directory, hashed once and shared between every peer requesting them.
+
+    Args:
+        root (str): Directory files are requested relative to (eg. ``prefs.get('SOUNDDIR')`` )
+        chunk_size (int): Bytes per chunk (default ``prefs.get('FILE_CHUNK_SIZE')`` )
+    """
+
+    def __init__(self, root: str, chunk_size: typing.Optional[int] = None):
+        self.root = os.path.abspath(root)
+        self.chunk_size = chunk_size
+        self._sources = {} # type: typing.Dict[str, File_Source]
+        self._locks = {} # type: typing.Dict[str, threading.Lock]
+        self._lock = threading.Lock()
+
+    def resolve(self, rel_path: str) -> str:
+        """
+        Absolute path of a requested file
+
+        Raises:
+            ValueError: if the path is outside of :attr:`.root`
+        """
+        full_path = os.path.abspath(os.path.join(self.root, rel_path))
+        if os.path.commonpath([self.root, full_path]) != self.root:
+            raise ValueError(f'Requested file {rel_path} is outside of {self.root}')
+        return full_path
+
+    def source(self, rel_path: str) -> File_Source:
+        """
+        Get the source for a file, hashing it if it hasn't been requested before or has changed since.
+
+        Peers requesting the same file at the same time wait for it to be hashed once.
+
+        Args:
+            rel_path (str): path relative to :attr:`.root`
+
+        Raises:
+            ValueError: if the path is outside of :attr:`.root`
+            FileNotFoundError: if the file doesn't exist
+        """
+        full_path = self.resolve(rel_path)
+        with self._lock:
+            lock = self._locks.setdefault(full_path, threading.Lock())
+        with lock:
+            source = self._sources.get(full_path)
+            if source is None or source.stale:
+                source = File_Source(full_path, self.chunk_size)
+                self._sources[full_path] = source
+            return source
+
+
+class File_Receiver:
+    """
+    A file being received in chunks.
+
+    Chunks are written into ``<hash>.part`` in the cache directory as they arrive,
+    and marked off in ``<hash>.part.chunks`` (one byte per chunk), so a new receiver for the same file
+    picks up where the last one stopped.
+
+    Args:
+        cache (:class:`.File_Cache`): Cache to put the file in once it's complete
+        hash (str): sha256 hash of the file
+        size (int): Size of the file in bytes
+        chunk_size (int): Bytes per chunk
+        n_chunks (int): Number of chunks
+
+    Attributes:
+        received (:class:`numpy.ndarray`): boolean array of chunks that have been received
+        last_progress (float): :func:`time.monotonic` time the last chunk arrived
+    """
+
+    def __init__(self, cache: 'File_Cache', hash: str, size: int, chunk_size: int, n_chunks: int):
+        self.cache = cache
+        self.hash = hash
+        self.size = int(size)
+        self.chunk_size = int(chunk_size)
+        self.n_chunks = int(n_chunks)
+        self.part_path = cache.path(hash) + '.part'
+        self._state_path = self.part_path + '.chunks'
+        self._lock = threading.Lock()
+        self._requested = set() # type: typing.Set[int]
+        self.last_progress = time.monotonic()
+
+        self.received = np.zeros(self.n_chunks, dtype=bool)
+        resume = os.path.exists(self.part_path) and os.path.exists(self._state_path) \
+            and os.path.getsize(self.part_path) == self.size \
+            and os.path.getsize(self._state_path) == self.n_chunks
+        if resume:
+            with open(self._state_path, 'rb') as state_file:
+                self.received[:] = np.frombuffer(state_file.read(), dtype=np.uint8) > 0
+
+        self._file = open(self.part_path, 'r+b' if resume else 'w+b')
+        self._state = open(self._state_path, 'r+b' if resume else 'w+b')
+        if not resume:
+            self._file.truncate(self.size)
+            self._state.write(bytes(self.n_chunks))
+            self._state.flush()
+
+    @property
+    def complete(self) -> bool:
+        return bool(self.received.all())
+
+    @property
+    def missing(self) -> typing.List[int]:
+        """
+        Indices of chunks that haven't been received
+        """
+        return np.flatnonzero(~self.received).tolist()
+
+    def next_chunks(self, window: int, retry: bool = False) -> typing.List[int]:
+        """
+        Chunks to request next, keeping at most ``window`` requested and not yet received.
+
+        Args:
+            window (int): Maximum number of outstanding chunks
+            retry (bool): Forget about chunks that were requested but never arrived and request them again
+
+        Returns:
+            list: chunk indices, marked as requested
+        """
+        with self._lock:
+            if retry:
+                self._requested.clear()
+                self.last_progress = time.monotonic()
+            n = window - len(self._requested)
+            chunks = []
+            if n > 0:
+                for index in np.flatnonzero(~self.received).tolist():
+                    if index not in self._requested:
+                        chunks.append(index)
+                        if len(chunks) >= n:
+                            break
+            self._requested.update(chunks)
+            return chunks
+
+    def write(self, index: int, data: bytes) -> bool:
+        """
+        Write a chunk
+
+        Args:
+            index (int): chunk index
+            data (bytes): chunk contents
+
+        Returns:
+            bool: ``True`` if the chunk was new, ``False`` if it was a duplicate, didn't fit the file,
+            or the receiver was closed
+        """
+        index = int(index)
+        expected = min(self.chunk_size, self.size - index * self.chunk_size)
+        with self._lock:
+            if self._file.closed or index < 0 or index >= self.n_chunks or self.received[index] \
+                    or len(data) != expected:
+                return False
+            self._file.seek(index * self.chunk_size)
+            self._file.write(data)
+            self._file.flush()
+            # only mark the chunk once its data is written
+            self._state.seek(index)
+            self._state.write(b'\x01')
+            self._state.flush()
+            self.received[index] = True
+            self._requested.discard(index)
+            self.last_progress = time.monotonic()
+        return True
+
+    def finish(self) -> bool:
+        """
+        Check the hash of the completed file and move it into the cache.
+
+        If the hash doesn't match, the partial file is discarded so the transfer starts over.
+
+        Returns:
+            bool: ``True`` if the file is now in the cache
+        """
+        self.close()
+        if file_hash(self.part_path) == self.hash:
+            os.replace(self.part_path, self.cache.path(self.hash))
+            os.remove(self._state_path)
+            return True
+
+        self.discard()
+        return False
+
+    def close(self):
+        with self._lock:
+            for open_file in (self._file, self._state):
+                if not open_file.closed:
+                    open_file.close()
+
+    def discard(self):
+        """
+        Close and remove the partial file
+        """
+        self.close()
+        for path in (self.part_path, self._state_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+class File_Cache:
+    """
+    Content addressed store of received files, named by their sha256 hash.
+
+    Args:
+        cache_dir (str): Directory to keep files in (default ``prefs.get('FILE_CACHE_DIR')`` )
+    """
+
+    def __init__(self, cache_dir: typing.Optional[str] = None):
+        if cache_dir is None:
+            cache_dir = prefs.get('FILE_CACHE_DIR')
+        self.cache_dir = cache_dir
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def path(self, hash: str) -> str:
+        if not all(c in '0123456789abcdef' for c in hash):
+            raise ValueError(f'Invalid hash {hash}')
+        return os.path.join(self.cache_dir, hash)
+
+    def __contains__(self, hash: str) -> bool:
+        return os.path.exists(self.path(hash))
+
+    def add(self, path: str) -> str:
+        """
+        Add a file that's already on disk to the cache
+
+        Args:
+            path (str): path to the file
+
+        Returns:
+            str: its hash
+        """
+        hash = file_hash(path)
+        if hash not in self:
+            self._link(path, self.path(hash))
+        return hash
+
+    def link(self, hash: str, dest: str):
+        """
+        Put a cached file at ``dest`` -- a hard link if they're on the same filesystem, otherwise a copy.
+
+        Args:
+            hash (str): hash of the file
+            dest (str): path to put it at, any missing directories are created
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(dest)), exist_ok=True)
+        if os.path.exists(dest):
+            os.remove(dest)
+        self._link(self.path(hash), dest)
+
+    @staticmethod
+    def _link(src: str, dest: str):
+        try:
+            os.link(src, dest)
+        except OSError:
+            shutil.copyfile(src, dest)
+
+    def receiver(self, info: dict) -> File_Receiver:
+        """
+        Make a :class:`.File_Receiver` from a ``FILE_INFO`` message value, resuming any partial transfer of the same file
+        """
+        return File_Receiver(self, info['hash'], info['size'], info['chunk_size'], info['n_chunks'])
@@ -235,6 +235,52 @@ _DEFAULTS = odict({
         "default": "192.168.0.100",
         "scope": Scopes.COMMON
     },
+    'MSG_BINARY': {
+        'type': 'bool',
+        'text': 'Send numpy arrays in messages as raw binary frames to peers that support it (rather than base64 encoded JSON)',
+        'default': True,
+        'scope': Scopes.COMMON
+    },
+    'MSG_SERIALIZER': {
+        'type': 'choice',
+        'text': 'Serializer to encode binary messages with, if the receiving peer supports it',
+        'choices': ('json', 'msgpack', 'orjson'),
+        'default': 'json',
+        'depends': 'MSG_BINARY',
+        'scope': Scopes.COMMON
+    },
+    'MSG_SHM': {
+        'type': 'bool',
+        'text': 'Pass large arrays through shared memory (and connect over ipc) between agents on the same host',
+        'default': False,
+        'depends': 'MSG_BINARY',
+        'scope': Scopes.COMMON
+    },
+    'MSG_SHM_SIZE': {
+        'type': 'int',
+        'text': 'Size (in bytes) of the shared memory ring each sending agent uses for arrays',
+        'default': 2 ** 25, # 32MB
+        'depends': 'MSG_SHM',
+        'scope': Scopes.COMMON
+    },
+    'MSG_WORKERS': {
+        'type': 'int',
+        'text': 'Number of threads used to handle received messages (messages from each sender are handled in order by one thread)',
+        'default': 4,
+        'scope': Scopes.COMMON
+    },
+    'MSG_QUEUE_SIZE': {
+        'type': 'int',
+        'text': 'Maximum number of received messages waiting for each message handling thread',
+        'default': 1000,
+        'scope': Scopes.COMMON
+    },
+    'FILE_CHUNK_SIZE': {
+        'type': 'int',
+        'text': 'Size (in bytes) of the chunks files (eg. sounds) are sent to pilots in',
+        'default': 2 ** 18, # 256KB
+        'scope': Scopes.COMMON
+    },
     'LOGLEVEL': {
         'type': 'choice',
         "text": "Log Level:",
@@ -297,6 +343,12 @@ _DEFAULTS = odict({
         "default": str(_basedir / 'sounds'),
         "scope": Scopes.DIRECTORY
     },
+    'FILE_CACHE_DIR': {
+        'type': 'str',
+        "text": "Directory files received from the terminal are cached in, by their hash",
+        "default": str(_basedir / 'cache'),
+        "scope": Scopes.DIRECTORY
+    },
     'LOGDIR': {
         'type': 'str',
         "text": "Log Directory",
@@ -399,6 +451,12 @@ _DEFAULTS = odict({
         'depends': ('TERMINAL_WINSIZE_BEHAVIOR', 'custom'),
         'scope': Scopes.TERMINAL
     },
+    'SUBJECT_SERVICE': {
+        'type': 'bool',
+        'text': 'Access subjects through a separate storage process that owns their files, rather than from each Terminal thread',
+        'default': False,
+        'scope': Scopes.TERMINAL
+    },
     'LINEAGE': {
         'type': 'choice',
         "text": "Are we a parent or a child?",
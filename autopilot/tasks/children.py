@@ -70,8 +70,12 @@ class Video_Child(Child):
     PARAMS = odict()
     PARAMS['cams'] = {'tag': 'Dictionary of camera params, or list of dicts',
                       'type': ('dict', 'list')}
+    PARAMS['sync'] = {'tag': 'Capture from all cameras on a shared clock',
+                      'type': 'bool'}
+    PARAMS['sync_fps'] = {'tag': 'Rate of the shared clock (default: slowest camera framerate)',
+                          'type': 'float'}
 
-    def __init__(self, cams=None, stage_block = None, start_now=True, **kwargs):
+    def __init__(self, cams=None, stage_block = None, start_now=True, sync=False, sync_fps=None, **kwargs):
         """
         Args:
             cams (dict, list): Should be a dictionary of camera parameters or a list of dicts. Dicts should have, at least::
@@ -81,6 +85,11 @@ class Video_Child(Child):
                     'name': 'name_of_camera_in_task',
                     'param1': 'first_param'
                 }
+
+            sync (bool): if True, capture from the cameras with a :class:`.cameras.Capture_Coordinator`
+                so their frames are grabbed on a shared clock and tagged with a common wall clock timestamp,
+                sequence number, and monotonic tick time.
+            sync_fps (float): rate of the shared clock, if None, the slowest camera's framerate.
         """
         super(Video_Child, self).__init__(**kwargs)
 
@@ -112,6 +121,10 @@ class Video_Child(Child):
                 except AttributeError:
                     AttributeError("Camera type {} not found!".format(cam['type']))
 
+        self.coordinator = None
+        if sync:
+            self.coordinator = cameras.Capture_Coordinator(self.cams, fps=sync_fps)
+
         self.stages = cycle([self.noop])
         self.stage_block = stage_block
 
@@ -123,10 +136,18 @@ class Video_Child(Child):
         # self.thread.start()
 
     def start(self):
+        if self.coordinator is not None:
+            self.coordinator.capture()
+            return
+
         for cam in self.cams.values():
             cam.capture()
 
     def stop(self):
+        if self.coordinator is not None:
+            self.coordinator.release()
+            return
+
         for cam_name, cam in self.cams.items():
             try:
                 cam.release()
@@ -38,6 +38,26 @@ class Graduation(Autopilot_Object):
             :class:`~tables.tableextension.Row` : Trial row
         """
 
+    def checkpoint(self) -> typing.Optional[dict]:
+        """
+        JSON-serializable state that :meth:`.restore` can resume from,
+        so the subject doesn't need to read :attr:`.COLS` from the trial history each session.
+
+        Returns:
+            dict, or ``None`` (default) if this object can't be checkpointed
+        """
+        return None
+
+    def restore(self, checkpoint: dict):
+        """
+        Resume from the state returned by :meth:`.checkpoint` , after being instantiated
+        with empty :attr:`.COLS`
+
+        Args:
+            checkpoint (dict): state from :meth:`.checkpoint`
+        """
+        raise NotImplementedError(f'{self.__class__.__name__} does not support checkpoints')
+
 
 class Accuracy(Graduation):
     """
@@ -92,6 +112,16 @@ class Accuracy(Graduation):
         else:
             return False
 
+    def checkpoint(self) -> dict:
+        """
+        The last ``window`` corrects
+        """
+        return {'corrects': [int(correct) for correct in self.corrects]}
+
+    def restore(self, checkpoint: dict):
+        self.corrects.clear()
+        self.corrects.extend(checkpoint['corrects'])
+
 
 class NTrials(Graduation):
     """
@@ -142,3 +172,12 @@ class NTrials(Graduation):
         else:
             return False
 
+    def checkpoint(self) -> dict:
+        """
+        Nothing, the counter starts from ``current_trial``
+        """
+        return {}
+
+    def restore(self, checkpoint: dict):
+        pass
+
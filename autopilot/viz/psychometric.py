@@ -1,3 +1,4 @@
+import typing
 import altair as alt
 from sklearn.linear_model import LogisticRegression
 from autopilot.data.subject import Subject
@@ -39,7 +40,7 @@ def calc_psychometric(data, var_x, var_y='response'):
     return log_regress
 
 
-def plot_psychometric(subject_protocols):
+def plot_psychometric(subject_protocols, open_subject: typing.Callable = Subject):
     """
     Plot psychometric curves for selected subjects, steps, and variables
 
@@ -52,13 +53,16 @@ def plot_psychometric(subject_protocols):
             * step_name (str)
             * variable (str)
 
+        open_subject (callable): Called with a subject ID to open it, eg. :meth:`.Terminal.open_subject`
+            (default: :class:`.Subject` )
+
     Returns:
         :class:`altair.Chart`
     """
 
     for subject, step, var, n_trials in subject_protocols:
         # load subject dataframe and subset
-        asub = Subject(subject)
+        asub = open_subject(subject)
         sub_df = asub.get_trial_data(step)
 
         if n_trials>0:
@@ -8,6 +8,8 @@ Warning:
 # renders a standalone webpage with bokeh of trial data for all subjects in the data folder
 import sys
 import os
+import json
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 import autopilot.utils
 import autopilot.utils.common
@@ -23,55 +25,200 @@ from bokeh.transform import factor_cmap
 from bokeh.palettes import Spectral10
 from tqdm import tqdm
 from autopilot.data import subject
+from autopilot.utils.loggers import init_logger
 import colorcet as cc
 import numpy as np
+import pandas as pd
 
 
-def load_subject_data(data_dir, subject_name, steps=True, grad=True):
+# summaries of each subject's data are cached in this subdirectory of the data directory,
+# and reused until the subject's file changes
+CACHE_DIR = '.trial_viewer'
 
-    # pilot_db_fn = [fn for fn in os.listdir(data_dir) if fn == 'pilot_db.json'][0]
-    # pilot_db_fn = os.path.join(data_dir, pilot_db_fn)
-    pilot_db = autopilot.utils.common.load_pilotdb(reverse=True)
 
-    # find pilot for subject
-    pilot_name = pilot_db[subject_name]
+def load_step_history(sub):
+    """
+    Get the step changes from a subject's history table
+
+    Args:
+        sub (:class:`~.data.subject.Subject`): subject to load
+
+    Returns:
+        :class:`pandas.DataFrame`: with columns ``time`` , ``step_n`` , and ``name`` (how the step was changed)
+    """
+    history = sub.history
+    if not isinstance(history, pd.DataFrame):
+        history = history.to_df()
+    history = history[history['type'] == 'step']
+    return pd.DataFrame({
+        'time': history['time'].values,
+        'step_n': pd.to_numeric(history['value'], errors='coerce').values,
+        'name': history['name'].values
+    })
+
+
+def load_subject_data(data_dir, subject_name, steps=True, grad=True, pilot_db=None):
+    """
+    Load one subject's trial data and step history.
+
+    Args:
+        data_dir (str): directory with the subject's .h5 file
+        subject_name (str): subject ID
+        steps (bool): Whether to return trial data for each step
+        grad (bool): Whether to return step graduation history
+        pilot_db (dict): ``{subject: pilot}`` , if ``None`` , loaded with :func:`~.utils.common.load_pilotdb`
+
+    Returns:
+        tuple: ``(step_data, grad_data)`` dataframes, ``None`` if not requested
+    """
+    if pilot_db is None:
+        pilot_db = autopilot.utils.common.load_pilotdb(reverse=True)
+    step_data, grad_data = _load_subject_frames(data_dir, subject_name, steps, grad)
+    return _label(step_data, subject_name, pilot_db), _label(grad_data, subject_name, pilot_db)
+
+
+def _label(data, subject_name, pilot_db):
+    if data is None:
+        return None
+    data = data.copy()
+    data['subject'] = subject_name
+    data['pilot'] = pilot_db.get(subject_name)
+    return data
+
 
+def _load_subject_frames(data_dir, subject_name, steps=True, grad=True):
+    """
+    Load unlabeled step and graduation data from a subject's file
+    """
     amus = subject.Subject(subject_name, dir=data_dir)
 
     step_data = None
     grad_data = None
 
     if steps:
-        step_data = amus.get_trial_data()
-        step_data['subject'] = subject_name
-        step_data['pilot'] = pilot_name
+        step_data = amus.get_trial_data(validate=False)
+        if isinstance(step_data, list):
+            # one table per step, label the steps and stack them
+            for i, data in enumerate(step_data):
+                if 'step' not in data.columns:
+                    data['step'] = i
+            step_data = pd.concat(step_data, ignore_index=True)
 
     if grad:
-        # get historical graduation data
-        try:
-            grad_data = amus.get_step_history()
-        except:
-            grad_data = amus.get_step_history(use_history=False)
-
-        grad_data['subject'] = subject_name
-        grad_data['pilot'] = pilot_name
+        grad_data = load_step_history(amus)
 
     return step_data, grad_data
 
 
+def _file_stamp(path):
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
 
 
+def _cache_paths(data_dir, subject_name):
+    cache_dir = os.path.join(data_dir, CACHE_DIR)
+    return cache_dir, os.path.join(cache_dir, subject_name + '.json')
 
 
+def _save_frame(data, base):
+    """
+    Save a dataframe as parquet, or as a pickle if parquet isn't available or can't store its columns
+    """
+    try:
+        path = base + '.parquet'
+        data.to_parquet(path)
+    except Exception:
+        path = base + '.pkl'
+        data.to_pickle(path)
+    return os.path.basename(path)
+
 
-def load_subject_dir(data_dir, steps=True, grad=True, which = None):
+def _load_frame(path):
+    if path.endswith('.parquet'):
+        return pd.read_parquet(path)
+    return pd.read_pickle(path)
+
+
+def read_summary_cache(data_dir, subject_name, steps=True, grad=True):
     """
+    Get a subject's cached summary, if it was made from the current version of their file.
+
+    Args:
+        data_dir (str): data directory
+        subject_name (str): subject ID
+        steps (bool): whether the step data is needed
+        grad (bool): whether the graduation data is needed
+
+    Returns:
+        tuple: ``(step_data, grad_data)`` , or ``None`` if the cache is stale or missing a requested part
+    """
+    cache_dir, stamp_path = _cache_paths(data_dir, subject_name)
+    try:
+        with open(stamp_path, 'r') as stamp_file:
+            stamp = json.load(stamp_file)
+        if stamp['file'] != _file_stamp(os.path.join(data_dir, subject_name + '.h5')):
+            return None
+
+        parts = {}
+        for part, wanted in (('steps', steps), ('grad', grad)):
+            if not wanted:
+                parts[part] = None
+            elif part in stamp['parts']:
+                parts[part] = _load_frame(os.path.join(cache_dir, stamp['parts'][part]))
+            else:
+                return None
+    except (OSError, ValueError, KeyError, ImportError):
+        return None
+
+    return parts['steps'], parts['grad']
+
+
+def _load_and_cache(data_dir, subject_name, steps=True, grad=True, cache=True):
+    """
+    Load a subject's data and write its summary cache. Run in worker processes by :func:`.load_subject_dir` ,
+    so each worker only touches its own subject's files.
+    """
+    step_data, grad_data = _load_subject_frames(data_dir, subject_name, steps, grad)
+    if not cache:
+        return step_data, grad_data
+
+    cache_dir, stamp_path = _cache_paths(data_dir, subject_name)
+    os.makedirs(cache_dir, exist_ok=True)
+    base = os.path.join(cache_dir, subject_name)
+    parts = {}
+    if step_data is not None:
+        parts['steps'] = _save_frame(step_data, base + '.steps')
+    if grad_data is not None:
+        parts['grad'] = _save_frame(grad_data, base + '.grad')
+
+    # opening a subject writes to its file, so stamp it after loading
+    stamp = {'file': _file_stamp(os.path.join(data_dir, subject_name + '.h5')), 'parts': parts}
+    tmp_path = stamp_path + '.tmp'
+    with open(tmp_path, 'w') as stamp_file:
+        json.dump(stamp, stamp_file)
+    os.replace(tmp_path, stamp_path)
+
+    return step_data, grad_data
+
+
+def load_subject_dir(data_dir, steps=True, grad=True, which = None, processes=None, cache=True):
+    """
+    Load data for every subject in a directory.
+
+    Subjects whose files haven't changed since they were last loaded are read from their
+    summary cache (in :data:`.CACHE_DIR` ), and the rest are loaded in parallel, one file per worker process.
+    Subjects whose files can't be loaded are logged and left out.
+
     Args:
         data_dir (str): A path to a directory with :class:`~.data.subject.Subject` style hdf5 files
         steps (bool): Whether to return full trial-level data for each step
         grad (bool): Whether to return summarized step graduation data.
         which (list): A list of subjects to subset the loaded subjects to
+        processes (int): Number of worker processes, default the number of CPUs. ``1`` loads in this process.
+        cache (bool): Whether to read and write the summary cache
 
+    Returns:
+        tuple: ``(step_data, grad_data)`` dataframes of all subjects, or ``None`` if there were none
     """
 
     subject_fn = [os.path.splitext(fn)[0] for fn in os.listdir(data_dir) if fn.endswith('.h5')]
@@ -79,26 +226,46 @@ def load_subject_dir(data_dir, steps=True, grad=True, which = None):
     if isinstance(which, list):
         subject_fn = [fn for fn in subject_fn if (fn in which) or (fn.rstrip('.h5') in which)]
 
-    all_mice_steps = None
-    all_mice_grad = None
-
-    for subject_name in tqdm(subject_fn):
-        subject_name = os.path.splitext(subject_name)[0]
-        step_data, grad_data = load_subject_data(data_dir, subject_name, steps, grad)
-
-        if step_data is not None:
-            if all_mice_steps is not None:
-                all_mice_steps = all_mice_steps.append(step_data)
-            else:
-                all_mice_steps = step_data
-
-        if grad_data is not None:
-            if all_mice_grad is not None:
-                all_mice_grad = all_mice_grad.append(grad_data)
-            else:
-                all_mice_grad = grad_data
-
-    return all_mice_steps, all_mice_grad
+    try:
+        pilot_db = autopilot.utils.common.load_pilotdb(reverse=True)
+    except FileNotFoundError:
+        pilot_db = {}
+
+    loaded = {}
+    stale = []
+    for subject_name in subject_fn:
+        cached = read_summary_cache(data_dir, subject_name, steps, grad) if cache else None
+        if cached is None:
+            stale.append(subject_name)
+        else:
+            loaded[subject_name] = cached
+
+    logger = init_logger(module_name='viz', class_name='trial_viewer')
+    if processes == 1 or len(stale) <= 1:
+        for subject_name in tqdm(stale):
+            try:
+                loaded[subject_name] = _load_and_cache(data_dir, subject_name, steps, grad, cache)
+            except Exception as e:
+                logger.exception(f'Could not load subject {subject_name}, skipping: {e}')
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            futures = {pool.submit(_load_and_cache, data_dir, subject_name, steps, grad, cache): subject_name
+                       for subject_name in stale}
+            for future in tqdm(as_completed(futures), total=len(futures)):
+                try:
+                    loaded[futures[future]] = future.result()
+                except Exception as e:
+                    logger.exception(f'Could not load subject {futures[future]}, skipping: {e}')
+
+    # concatenate once, in the order the files were listed
+    subject_fn = [name for name in subject_fn if name in loaded]
+    all_mice_steps = [_label(loaded[name][0], name, pilot_db) for name in subject_fn]
+    all_mice_grad = [_label(loaded[name][1], name, pilot_db) for name in subject_fn]
+    all_mice_steps = [data for data in all_mice_steps if data is not None]
+    all_mice_grad = [data for data in all_mice_grad if data is not None]
+
+    return (pd.concat(all_mice_steps) if all_mice_steps else None,
+            pd.concat(all_mice_grad) if all_mice_grad else None)
 
 
 
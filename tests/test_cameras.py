@@ -0,0 +1,414 @@
+"""
+Test camera capture, buffering, and encoding without camera hardware
+"""
+import multiprocessing as mp
+import os
+import time
+import warnings
+
+import pytest
+import numpy as np
+
+from autopilot.hardware import cameras
+from autopilot.hardware.cameras import Frame_Ring, FFmpeg_Pipe_Encoder, SKVideo_Encoder, benchmark_encoders, \
+    Capture_Coordinator, Timing_Histogram, Camera_Stats, Stream_Preview
+
+
+class Fake_Camera(cameras.Camera):
+    """
+    Camera whose frames are filled with the number of frames it has grabbed
+    """
+
+    def __init__(self, delay: float = 0, **kwargs):
+        super(Fake_Camera, self).__init__(**kwargs)
+        self.delay = delay
+        self.n_grabbed = 0
+
+    def _grab(self):
+        if self.delay:
+            time.sleep(self.delay)
+        self.n_grabbed += 1
+        return self._timestamp(), np.full((4, 4), self.n_grabbed, dtype=np.uint8)
+
+    def _timestamp(self, frame=None):
+        return time.time()
+
+
+def _read_ring(spec: dict, q: mp.Queue, out: mp.Queue):
+    """
+    Read frames from a ring in another process, like the :class:`.Video_Writer`
+    """
+    ring = Frame_Ring.attach(**spec)
+    got = []
+    for slot, seq in iter(q.get, 'END'):
+        frame = ring.get(slot, seq)
+        if frame is not None:
+            got.append(int(frame[0, 0]))
+        ring.release(seq)
+    out.put((got, ring.stats()))
+    ring.close()
+
+
+def test_frame_ring():
+    """
+    Frames are put in and gotten from slots, new frames are dropped when the ring is full,
+    and frames overwritten before they're read are counted as overruns.
+    """
+    ring = Frame_Ring((4, 5), 'uint8', slots=3)
+    try:
+        assert ring.put(np.full((4, 5), 1)) == (0, 0)
+        assert ring.put(np.full((4, 5), 2)) == (1, 1)
+        assert ring.put(np.full((4, 5), 3)) == (2, 2)
+        # full, the new frame is dropped
+        assert ring.put(np.full((4, 5), 4)) is None
+        assert ring.stats() == {'written': 3, 'read': 0, 'dropped': 1, 'overruns': 0}
+
+        assert (ring.get(0, 0) == 1).all()
+        ring.release(0)
+        assert ring.put(np.full((4, 5), 5)) == (0, 3)
+        # the first frame's slot was reused
+        assert ring.get(0, 0) is None
+        assert ring.stats()['overruns'] == 1
+        assert (ring.get(0, 3) == 5).all()
+    finally:
+        ring.close()
+    # stats are kept after closing
+    assert ring.stats()['written'] == 4
+
+    ring = Frame_Ring((2,), 'int16', slots=2, overwrite=True)
+    try:
+        for i in range(5):
+            assert ring.put(np.array([i, i])) is not None
+        assert ring.stats()['dropped'] == 0
+        assert ring.get(0, 2) is None
+        assert ring.get(0, 4).tolist() == [4, 4]
+    finally:
+        ring.close()
+
+    # without a number of slots, as many as fit in ring_mb
+    ring = Frame_Ring((1080, 1920, 3))
+    assert ring.slots == (Frame_Ring.ring_mb * 2**20) // (1080 * 1920 * 3)
+    ring.close()
+
+
+def test_frame_ring_process():
+    """
+    Another process can attach to a ring with its spec and read the frames put in it
+    """
+    ring = Frame_Ring((4, 5), 'uint8', slots=4)
+    q, out = mp.Queue(), mp.Queue()
+    proc = mp.Process(target=_read_ring, args=(ring.spec, q, out))
+    proc.start()
+    try:
+        for i in range(10):
+            put = None
+            while put is None:
+                put = ring.put(np.full((4, 5), i))
+            q.put(put)
+        q.put('END')
+        got, stats = out.get(timeout=10)
+        proc.join(10)
+    finally:
+        ring.close()
+
+    assert got == list(range(10))
+    assert stats['written'] == stats['read'] == 10
+    assert ring.stats()['read'] == 10
+
+
+def test_encoder_command():
+    """
+    The pipe encoder's ffmpeg command reads raw frames of the right format,
+    and encodes the preview from the same input
+    """
+    encoder = FFmpeg_Pipe_Encoder('/tmp/video.mp4', 30)
+    cmd = encoder.command((480, 640, 3), np.dtype('uint8'))
+    assert cmd[:4] == ['ffmpeg', '-y', '-loglevel', 'warning']
+    assert cmd[cmd.index('-pix_fmt') + 1] == 'rgb24'
+    assert cmd[cmd.index('-s') + 1] == '640x480'
+    assert cmd[cmd.index('-i') + 1] == '-'
+    assert cmd[-1] == '/tmp/video.mp4'
+    assert cmd[cmd.index('-c:v') + 1] == 'libx264'
+
+    cmd = encoder.command((480, 640), np.dtype('uint16'))
+    assert cmd[cmd.index('-pix_fmt') + 1] == 'gray16le'
+
+    # pixel formats can be given for eg. BGR frames
+    encoder = FFmpeg_Pipe_Encoder('/tmp/video.mp4', 30, input_pix_fmt='bgr24')
+    cmd = encoder.command((480, 640, 3), np.dtype('uint8'))
+    assert cmd[cmd.index('-pix_fmt') + 1] == 'bgr24'
+
+    with pytest.raises(ValueError):
+        FFmpeg_Pipe_Encoder('/tmp/video.mp4', 30).command((480, 640, 2), np.dtype('uint8'))
+
+    # codecs can be given as a list of ffmpeg arguments
+    encoder = FFmpeg_Pipe_Encoder('/tmp/video.mov', 30, codec=['-c:v', 'prores', '-profile:v', 3])
+    cmd = encoder.command((480, 640, 3), np.dtype('uint8'))
+    assert cmd[-7:] == ['-c:v', 'prores', '-profile:v', '3', '-r', '30', '/tmp/video.mov']
+    assert encoder.path == '/tmp/video.mov'
+
+    encoder = FFmpeg_Pipe_Encoder('/tmp/video.mkv', 30, codec='ffv1', preview={'scale': 0.5, 'fps': 10})
+    assert encoder.preview['path'] == '/tmp/video_preview.mp4'
+    cmd = encoder.command((480, 640, 3), np.dtype('uint8'))
+    filter_complex = cmd[cmd.index('-filter_complex') + 1]
+    assert 'split=2' in filter_complex
+    assert 'scale=trunc(iw*0.5/2)*2:-2,fps=10' in filter_complex
+    assert cmd.count('-map') == 2
+    # full video with its codec, then the preview with x264
+    full, preview = cmd.index('/tmp/video.mkv'), cmd.index('/tmp/video_preview.mp4')
+    assert full < preview
+    assert cmd[full + 1:preview] == ['-map', '[small]', *cameras.CODECS['x264']['args']]
+    assert ' '.join(cameras.CODECS['ffv1']['args']) in ' '.join(cmd[:full])
+
+
+def test_encoder_fallback():
+    """
+    Videos are written to a container their codec supports, and unknown codecs are an error
+    """
+    with pytest.warns(UserWarning):
+        encoder = FFmpeg_Pipe_Encoder('/tmp/video.mp4', 30, codec='ffv1')
+    assert encoder.path == '/tmp/video.mkv'
+
+    with pytest.warns(UserWarning):
+        encoder = FFmpeg_Pipe_Encoder('/tmp/video.mkv', 30, preview={'path': '/tmp/small.mp4', 'codec': 'mjpeg'})
+    assert encoder.preview['path'] == '/tmp/small.avi'
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        assert FFmpeg_Pipe_Encoder('/tmp/video.avi', 30, codec='mjpeg').path == '/tmp/video.avi'
+
+    with pytest.raises(ValueError):
+        FFmpeg_Pipe_Encoder('/tmp/video.mp4', 30, codec='not_a_codec')
+
+    # encoders that can't write previews warn and don't
+    with pytest.warns(UserWarning):
+        encoder = SKVideo_Encoder('/tmp/video.mp4', 30, preview={})
+    assert encoder.preview is None
+
+
+def test_benchmark_encoders(tmp_path):
+    """
+    The encoder benchmark writes a video with each encoder and codec
+    """
+    try:
+        cameras._check_ffmpeg()
+    except ImportError:
+        pytest.skip('ffmpeg is not installed')
+
+    results = benchmark_encoders(shape=(32, 48, 3), n_frames=10, encoders=('pipe',),
+                                 codecs=('ffv1', 'mjpeg'), out_dir=str(tmp_path))
+    assert [(result['encoder'], result['codec']) for result in results] == [('pipe', 'ffv1'), ('pipe', 'mjpeg')]
+    # both codecs are built in to ffmpeg
+    for result in results:
+        assert result['error'] is None
+        assert result['fps'] > 0
+        assert result['bytes'] > 0
+    assert os.path.exists(tmp_path / 'benchmark_pipe_ffv1.mkv')
+
+
+def test_coordinator_bundles():
+    """
+    The coordinator grabs from every camera on each tick of its clock, and gives each camera
+    the frames it grabbed with the tick's wall clock timestamp
+    """
+    cams = [Fake_Camera(name='a'), Fake_Camera(name='b')]
+    for cam in cams:
+        cam.queue()
+    coordinator = Capture_Coordinator(cams, fps=50, timed=0.5)
+    coordinator.queue()
+
+    start = time.time()
+    coordinator.capture()
+    # stops itself after timed
+    deadline = time.monotonic() + 5
+    while coordinator.capturing.is_set() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert not coordinator.capturing.is_set()
+
+    bundles = []
+    while not coordinator.q.empty():
+        bundles.append(coordinator.q.get_nowait())
+    assert [bundle['seq'] for bundle in bundles] == list(range(25))
+    assert abs(bundles[0]['timestamp'] - start) < 1
+    for bundle in bundles:
+        assert bundle['timestamp'] == pytest.approx(bundles[0]['timestamp'] + bundle['seq'] * 0.02)
+        assert bundle['tick_time'] == pytest.approx(bundles[0]['tick_time'] + bundle['seq'] * 0.02)
+    assert any(len(bundle['frames']) == 2 for bundle in bundles)
+
+    stats = coordinator.stats()
+    assert stats['bundles'] == 25
+    for cam in cams:
+        frames = []
+        while not cam.q.empty():
+            frames.append(cam.q.get_nowait())
+        # each camera got its frames in order, timestamped with their bundle
+        assert [timestamp for timestamp, _ in frames] == \
+               [bundle['timestamp'] for bundle in bundles if cam.name in bundle['frames']]
+        assert [frame[0, 0] for _, frame in frames] == sorted(frame[0, 0] for _, frame in frames)
+        assert stats['cameras'][cam.name]['dropped'] == 25 - len(frames)
+        assert cam.frame_seq is None and cam.frame_tick_time is None
+
+
+def test_coordinator_tolerance():
+    """
+    Bundles wait up to the tolerance for every camera's frame, frames that miss their bundle are late,
+    and bundles without a camera's frame count as dropped for it
+    """
+    coordinator = Capture_Coordinator({'a': Fake_Camera(name='a'), 'b': Fake_Camera(name='b')},
+                                      fps=10, tolerance=0.05)
+    frame = np.zeros((4, 4), dtype=np.uint8)
+
+    # tick by hand rather than with the clock thread
+    now = time.monotonic()
+    coordinator._tick_times[0] = now
+    coordinator._deliver(0, 'a', (1.0, frame), now)
+    coordinator._emit_ready()
+    assert coordinator._ready.empty()
+    coordinator._deliver(0, 'b', (1.0, frame), now + 0.001)
+    bundle = coordinator._ready.get_nowait()
+    assert sorted(bundle['frames'].keys()) == ['a', 'b']
+
+    # b misses the next bundle
+    coordinator._tick_times[1] = time.monotonic()
+    coordinator._deliver(1, 'a', (1.0, frame), time.monotonic())
+    time.sleep(0.06)
+    coordinator._emit_ready()
+    bundle = coordinator._ready.get_nowait()
+    assert bundle['seq'] == 1
+    assert list(bundle['frames'].keys()) == ['a']
+    coordinator._deliver(1, 'b', (1.0, frame), time.monotonic())
+    assert coordinator._ready.empty()
+
+    # ticks nobody delivered a frame for are emitted empty
+    coordinator._tick_times[2] = time.monotonic()
+    coordinator._emit_ready(flush=True)
+    assert coordinator._ready.get_nowait()['frames'] == {}
+
+    stats = coordinator.stats()
+    assert stats['bundles'] == 3
+    assert stats['incomplete'] == 2
+    assert {k: stats['cameras']['a'][k] for k in ('dropped', 'late')} == {'dropped': 1, 'late': 0}
+    assert {k: stats['cameras']['b'][k] for k in ('dropped', 'late')} == {'dropped': 2, 'late': 1}
+    assert stats['skew']['max'] == pytest.approx(0.001)
+
+
+def test_timing_histogram():
+    """
+    Percentiles are estimated from log-spaced bins, no larger than the longest duration
+    """
+    histogram = Timing_Histogram()
+    assert histogram.percentile(50) is None
+    assert histogram.summary()['mean_ms'] is None
+
+    for _ in range(90):
+        histogram.add(1e-4)
+    for _ in range(10):
+        histogram.add(1e-2)
+
+    bin_width = 10 ** (1 / Timing_Histogram.bins_per_decade)
+    assert 1e-4 <= histogram.percentile(50) <= 1e-4 * bin_width
+    assert 1e-4 <= histogram.percentile(90) <= 1e-4 * bin_width
+    assert histogram.percentile(95) == histogram.percentile(99) == 1e-2
+
+    summary = histogram.summary(histogram=True)
+    assert summary['count'] == 100
+    assert summary['mean_ms'] == pytest.approx(0.9 * 0.1 + 0.1 * 10)
+    assert summary['max_ms'] == pytest.approx(10)
+    assert sum(summary['counts']) == 100
+    assert len(histogram.edges) == len(summary['counts']) + 1
+
+    # durations out of range go in the first and last bins
+    histogram.reset()
+    histogram.add(0)
+    histogram.add(1e6)
+    assert histogram.counts[0] == histogram.counts[-1] == 1
+
+
+def test_camera_stats():
+    """
+    Frames missed by the camera are estimated from gaps between frames, and stages are timed
+    """
+    stats = Camera_Stats(fps=100)
+    now = 0.0
+    for i in range(50):
+        # one gap of 5 frame periods, so 4 missed frames
+        now += 0.05 if i == 20 else 0.01
+        stats.frame(now)
+    stats.drop('grab')
+
+    timed = stats.timer('timestamp', lambda: 'timestamp')
+    assert timed() == 'timestamp'
+    timed()
+
+    summary = stats.summary()
+    assert summary['frames'] == 50
+    assert summary['dropped'] == {'grab': 1, 'queue': 0, 'gaps': 4}
+    assert summary['target_fps'] == 100
+    assert summary['mean_fps'] == pytest.approx(49 / 0.53)
+    # the last 2 seconds are all of them
+    assert summary['fps'] == pytest.approx(summary['mean_fps'])
+    assert summary['stages']['timestamp']['count'] == 2
+    assert summary['stages']['grab']['count'] == 0
+    assert 'bin_edges_ms' in stats.summary(histograms=True)
+
+    # without an expected framerate, gaps can't be estimated
+    stats.reset()
+    for now in (0, 1, 5):
+        stats.frame(now)
+    assert stats.dropped['gaps'] == 0
+    assert stats.frames == 3
+
+
+def test_stream_preview_due():
+    """
+    Previews are decimated to a maximum rate or every nth frame
+    """
+    preview = Stream_Preview(fps=10)
+    sent = [now for now in np.arange(0, 1, 1 / 60) if preview.due(now)]
+    assert len(sent) == 10
+    assert preview.stats() == {'sent': 10, 'skipped': 50}
+
+    preview = Stream_Preview(every=3)
+    assert [preview.due() for _ in range(6)] == [True, False, False, True, False, False]
+
+    # without either, every frame is sent
+    preview = Stream_Preview()
+    assert all(preview.due() for _ in range(5))
+
+    with pytest.raises(ValueError):
+        Stream_Preview(fps=0)
+    with pytest.raises(ValueError):
+        Stream_Preview(every=0)
+
+
+def test_stream_preview_process():
+    """
+    Preview frames are cropped, scaled, and converted to contiguous grayscale
+    """
+    frame = np.random.default_rng(0).integers(0, 255, (480, 640, 3), dtype=np.uint8)
+
+    processed = Stream_Preview(roi=(10, 20, 400, 300)).process(frame)
+    assert np.array_equal(processed, frame[20:320, 10:410])
+    assert processed.flags['C_CONTIGUOUS']
+
+    assert Stream_Preview(scale=0.25).process(frame).shape == (120, 160, 3)
+    assert Stream_Preview(scale=(320, 240)).process(frame).shape == (240, 320, 3)
+    assert Stream_Preview(roi=(0, 0, 400, 300), scale=0.5).process(frame).shape == (150, 200, 3)
+
+    gray = Stream_Preview(grayscale=True).process(frame)
+    assert gray.shape == (480, 640)
+    assert gray.dtype == np.uint8
+    # already grayscale frames are left alone
+    assert np.array_equal(Stream_Preview(grayscale=True).process(gray), gray)
+
+    # the first channel is red in RGB frames, weighted 0.299, and blue in BGR frames, weighted 0.114
+    red = np.zeros((4, 4, 3), dtype=np.uint8)
+    red[..., 0] = 200
+    assert abs(int(Stream_Preview(grayscale=True).process(red)[0, 0]) - 60) <= 1
+    assert abs(int(Stream_Preview(grayscale=True, color_order='BGR').process(red)[0, 0]) - 23) <= 1
+    with pytest.raises(ValueError):
+        Stream_Preview(color_order='HSV')
+
+    # cameras make previews in their color order
+    assert Fake_Camera.color_order == 'RGB'
+    assert cameras.Camera_CV.color_order == 'BGR'
@@ -0,0 +1,91 @@
+"""
+Test exporting subject data to NWB
+"""
+from datetime import datetime, timedelta
+
+import pytest
+import numpy as np
+import tables
+
+pytest.importorskip('pynwb')
+from pynwb import NWBHDF5IO
+
+from autopilot.data.interfaces.nwb import H5_Chunk_Iterator, export_subjects
+from autopilot.data.subject import Subject
+from autopilot.data.writer import Continuous_Writer
+from ..fixtures import dummy_biography
+
+
+def test_chunk_iterator(tmp_path):
+    """
+    Table columns and arrays are read a buffer at a time, transformed, and the file is only open while they are read
+    """
+    path = tmp_path / 'chunks.h5'
+    with tables.open_file(str(path), mode='w') as h5f:
+        table = h5f.create_table('/', 'trial_data', description={
+            'trial_num': tables.Int64Col(),
+            'timestamp': tables.StringCol(26)
+        })
+        rows = np.zeros(100, dtype=table.dtype)
+        rows['trial_num'] = np.arange(100)
+        rows['timestamp'] = b'2022-01-01T00:00:00'
+        table.append(rows)
+        earray = h5f.create_earray('/', 'data', atom=tables.Float64Atom(), shape=(0, 3))
+        earray.append(np.ones((50, 3)))
+
+    column = H5_Chunk_Iterator(path, '/trial_data', 'trial_num', buffer_shape=(10,), chunk_shape=(10,))
+    assert column.maxshape == (100,)
+    # the file isn't held open until buffers are read
+    assert column._h5f is None
+    assert np.array_equal(np.concatenate([chunk.data for chunk in column]), np.arange(100))
+    column.close()
+
+    shifted = H5_Chunk_Iterator(path, '/data', transform=lambda data: data * 2,
+                                buffer_shape=(20, 3), chunk_shape=(10, 3))
+    assert np.array_equal(np.concatenate([chunk.data for chunk in shifted]), np.full((50, 3), 2.0))
+    shifted.close()
+    assert shifted._h5f is None
+
+
+def test_export_subjects(tmp_path, dummy_biography):
+    """
+    Trial and continuous data are exported as TimeSeries, skipping trials without timestamps
+    """
+    (tmp_path / 'subjects').mkdir()
+    sub = Subject.new(dummy_biography, path=tmp_path / 'subjects' / f'{dummy_biography.id}.h5')
+    start = datetime(2022, 1, 1, 12)
+    with tables.open_file(str(sub.file), mode='r+') as h5f:
+        table = h5f.create_table('/data/protocol/step', 'trial_data', createparents=True, description={
+            'trial_num': tables.Int64Col(),
+            'correct': tables.BoolCol(),
+            'timestamp': tables.StringCol(26)
+        })
+        rows = np.zeros(10, dtype=table.dtype)
+        rows['trial_num'] = np.arange(10)
+        rows['correct'] = np.arange(10) % 2 == 0
+        rows['timestamp'] = [(start + timedelta(seconds=i)).isoformat().encode('utf-8') for i in range(10)]
+        rows['timestamp'][3] = b''
+        table.append(rows)
+
+        writer = Continuous_Writer(h5f, '/data/protocol/step/continuous_data/session_1')
+        writer.extend([{'timestamp': (start + timedelta(seconds=i)).isoformat(), 'wheel': float(i)}
+                       for i in range(20)])
+
+    out_dir = tmp_path / 'nwb'
+    results = export_subjects(tmp_path / 'subjects', out_dir, processes=1)
+    assert results == {sub.name: out_dir / f'{sub.name}.nwb'}
+
+    with NWBHDF5IO(str(results[sub.name]), mode='r') as io:
+        nwbfile = io.read()
+        module = nwbfile.processing['protocol']
+        assert sorted(module.data_interfaces) == ['step_correct', 'step_session_1_wheel', 'step_trial_num']
+
+        trials = [i for i in range(10) if i != 3]
+        trial_num = module['step_trial_num']
+        assert trial_num.data[:].tolist() == trials
+        assert np.allclose(trial_num.timestamps[:], trials)
+        assert module['step_correct'].data[:].tolist() == [i % 2 == 0 for i in trials]
+
+        wheel = module['step_session_1_wheel']
+        assert wheel.data[:].tolist() == [float(i) for i in range(20)]
+        assert np.allclose(wheel.timestamps[:], np.arange(20))
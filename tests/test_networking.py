@@ -10,9 +10,14 @@ Networking Tests.
 import pytest
 
 from autopilot.networking import Net_Node, Station, Message
+from autopilot.networking.message import split_frames, is_binary, frame_serializer
+from autopilot.networking.serializers import available_serializers
 import numpy as np
 import zmq
+import os
 import time
+import threading
+import datetime
 import multiprocessing as mp
 
 
@@ -266,3 +271,750 @@ def test_blosc(do_blosc, dtype):
 
 
 
+
+@pytest.mark.parametrize('serializer', available_serializers())
+@pytest.mark.parametrize('do_blosc', [True, False])
+@pytest.mark.parametrize('dtype', ['bool', 'uint8', 'int32', 'float64'])
+def test_binary_frames(do_blosc, dtype, serializer):
+    """
+    Messages serialized as binary frames should carry arrays as separate buffers,
+    be recoverable after routing frames are prepended,
+    and be convertible back to the legacy JSON format without expanding
+    """
+    arr = np.arange(100*250).reshape((100, 250)).astype(dtype)
+
+    msg = Message(to='test', sender='test', key='test', id='test',
+                  value={'arr': arr, 'nested': [arr, 1]}, blosc=do_blosc)
+    frames = msg.serialize_frames(serializer)
+    assert len(frames) == 3
+    assert is_binary(frames[-1])
+    assert frame_serializer(frames[-1]) == serializer
+
+    # header shouldn't contain the array itself
+    assert len(frames[-1]) < 1000
+
+    route, msg_frames = split_frames([b'sender', b'recipient', *[bytes(f) for f in frames]])
+    assert route == [b'sender', b'recipient']
+
+    msg_deserialized = Message(msg_frames, expand_arrays=True)
+    assert np.array_equal(msg_deserialized.value['arr'], arr)
+    assert msg_deserialized.value['arr'].dtype == arr.dtype
+    assert np.array_equal(msg_deserialized.value['nested'][0], arr)
+
+    # forwarding stations don't expand, but should be able to reserialize for old peers
+    msg_forwarded = Message(msg_frames)
+    legacy = Message(msg_forwarded.serialize(), expand_arrays=True)
+    assert np.array_equal(legacy.value['arr'], arr)
+
+
+def test_binary_negotiation(node_params):
+    """
+    :class:`.Net_Node` s only send binary messages after the peer has advertised
+    it can receive them, and arrays survive the trip either way.
+    """
+    received = []
+    def l_array(value):
+        received.append(value)
+
+    node_1_params = node_params(
+        id="bin_a",
+        router_port=np.random.randint(*PORTRANGE),
+        listens={'ARRAY': l_array}
+    )
+    node_2_params = node_params(
+        id='bin_b',
+        upstream='bin_a',
+        port=node_1_params['router_port'],
+        listens={'ARRAY': l_array}
+    )
+    node_1 = Net_Node(**node_1_params)
+    node_2 = Net_Node(**node_2_params)
+    arr = np.random.rand(50, 50)
+
+    try:
+        time.sleep(0.1)
+        # neither knows the other yet, so the first message is JSON
+        node_2.send(to='bin_a', key='ARRAY', value=arr)
+        time.sleep(0.1)
+        assert b'bin_b' in node_1.binary_peers
+
+        node_1.send(to='bin_b', key='ARRAY', value=arr)
+        time.sleep(0.1)
+        assert b'bin_a' in node_2.binary_peers
+        assert len(received) == 2
+        for value in received:
+            assert np.array_equal(value, arr)
+    finally:
+        node_1.release()
+        node_2.release()
+
+
+def test_lazy_message():
+    """
+    Binary messages only decode their routing header on receipt,
+    the body is decoded when it's first accessed,
+    and unchanged messages can be forwarded without reserializing.
+    """
+    arr = np.random.rand(10, 10)
+    msg = Message(to='test', sender='sender', key='DATA', id='sender_0',
+                  value={'arr': arr, 'pilot': 'pilot'}, flags={'NOREPEAT': True},
+                  subject='subject')
+    frames = [bytes(f) for f in msg.serialize_frames()]
+
+    received = Message(frames)
+    assert received.validate()
+    assert received.to == 'test'
+    assert received['sender'] == 'sender'
+    assert 'NOREPEAT' in received.flags.keys()
+    # body is still undecoded
+    assert 'value' not in received.__dict__
+    assert received.serialize_frames() == frames
+
+    # access decodes
+    assert received.value['pilot'] == 'pilot'
+    assert received.subject == 'subject'
+    assert 'value' in received.__dict__
+
+    # attributes set before the body is decoded are kept
+    received = Message(frames, expand_arrays=True)
+    received.value = 'replaced'
+    assert received.subject == 'subject'
+    assert received.value == 'replaced'
+
+    received = Message(frames, expand_arrays=True)
+    assert np.array_equal(received.value['arr'], arr)
+
+
+def _benchmark_payloads() -> dict:
+    """
+    Realistic message values for the kinds of messages that make up most traffic
+    """
+    timestamp = datetime.datetime.now().isoformat()
+    return {
+        'DATA': {'trial_num': 1052, 'target': 'L', 'response': 'R', 'correct': 0,
+                 'RQ_timestamp': timestamp, 'DC_timestamp': timestamp,
+                 'bailed': 0, 'stim': 'tone_4000', 'pilot': 'pilot_1', 'subject': 'subject_1'},
+        'CONTINUOUS': {'accel': np.random.rand(3), 'gyro': np.random.rand(3),
+                       'timestamp': timestamp, 'pilot': 'pilot_1', 'subject': 'subject_1',
+                       'continuous': True},
+        'STREAM': {'inner_key': 'CONTINUOUS',
+                   'headers': {'subject': 'subject_1', 'pilot': 'pilot_1', 'continuous': True},
+                   'payload': [{'picam': np.random.randint(0, 255, (120, 160), dtype=np.uint8),
+                                'timestamp': timestamp} for _ in range(5)]}
+    }
+
+
+def _assert_value_equal(a, b):
+    if isinstance(a, dict):
+        assert a.keys() == b.keys()
+        for k in a.keys():
+            _assert_value_equal(a[k], b[k])
+    elif isinstance(a, list):
+        assert len(a) == len(b)
+        for a_item, b_item in zip(a, b):
+            _assert_value_equal(a_item, b_item)
+    elif isinstance(a, np.ndarray):
+        assert np.array_equal(a, b)
+    else:
+        assert a == b
+
+
+@pytest.mark.parametrize('key', ['DATA', 'CONTINUOUS', 'STREAM'])
+def test_serializer_benchmark(key, capsys):
+    """
+    Compare the serializers on realistic payloads, against the legacy JSON format.
+
+    Reports the time to serialize and deserialize and the size of each message,
+    and checks that the value survives the round trip.
+    """
+    value = _benchmark_payloads()[key]
+    n_iters = 200
+    results = {}
+
+    def _legacy(msg):
+        return [msg.serialize()]
+
+    methods = {'legacy': _legacy}
+    for serializer in available_serializers():
+        methods[serializer] = lambda msg, serializer=serializer: msg.serialize_frames(serializer)
+
+    for name, method in methods.items():
+        start = time.perf_counter()
+        for i in range(n_iters):
+            msg = Message(to='T', sender='pilot_1', key=key, id=f'pilot_1_{i}',
+                          value=value, flags={'NOREPEAT': True}, blosc=False)
+            frames = method(msg)
+            received = Message([bytes(f) for f in frames], expand_arrays=True)
+            received_value = received.value
+        elapsed = (time.perf_counter() - start) / n_iters
+
+        _assert_value_equal(value, received_value)
+        results[name] = (elapsed, sum(len(f) for f in frames))
+
+    with capsys.disabled():
+        print(f'\n{key} serializer benchmark ({n_iters} round trips)')
+        for name, (elapsed, size) in results.items():
+            print(f'  {name:<8} {elapsed*1e6:>10.1f} us/msg {size:>10d} bytes')
+
+
+def test_dispatcher_order():
+    """
+    Messages with the same order key should be handled in order, by a bounded number of threads
+    """
+    from autopilot.networking.dispatch import Dispatcher
+    dispatcher = Dispatcher(workers=3, max_queue=10)
+
+    received = {'a': [], 'b': [], 'c': []}
+    threads = set()
+
+    def handler(sender, i):
+        threads.add(threading.current_thread().name)
+        received[sender].append(i)
+
+    n_threads = threading.active_count()
+    for i in range(500):
+        for sender in received.keys():
+            dispatcher.submit(sender, 'DATA', handler, sender, i)
+
+    assert threading.active_count() == n_threads
+    dispatcher.stop(timeout=5)
+
+    for sender_received in received.values():
+        assert sender_received == list(range(500))
+    assert len(threads) <= 3
+    stats = dispatcher.stats()
+    assert stats['submitted']['DATA'] == stats['processed']['DATA'] == 1500
+    assert stats['queued'] == 0
+    assert 0 < stats['max_depth'] <= 10
+
+
+@pytest.mark.parametrize('policy', ['drop', 'drop_oldest'])
+def test_dispatcher_drop(policy):
+    """
+    When a worker's queue is full, drop the newest or oldest messages according to the policy
+    """
+    from autopilot.networking.dispatch import Dispatcher
+    dispatcher = Dispatcher(workers=1, max_queue=5, policies={'CONTINUOUS': policy})
+
+    block = threading.Event()
+    received = []
+    dispatcher.submit('a', 'BLOCK', block.wait)
+    # wait for the worker to take the blocking call
+    while dispatcher.stats()['queued'] > 0:
+        time.sleep(0.001)
+
+    for i in range(10):
+        dispatcher.submit('a', 'CONTINUOUS', received.append, i)
+    assert dispatcher.stats()['queued'] == 5
+
+    block.set()
+    dispatcher.stop(timeout=5)
+
+    assert dispatcher.stats()['dropped']['CONTINUOUS'] == 5
+    if policy == 'drop':
+        assert received == [0, 1, 2, 3, 4]
+    else:
+        assert received == [5, 6, 7, 8, 9]
+
+    with pytest.raises(ValueError):
+        dispatcher.set_policy('CONTINUOUS', 'not_a_policy')
+
+
+def test_dispatcher_drop_oldest_mixed():
+    """
+    A flood of drop_oldest messages should only evict older messages with the same key and order key,
+    never blocking messages queued for the same worker or the stop sentinel
+    """
+    from autopilot.networking.dispatch import Dispatcher
+    dispatcher = Dispatcher(workers=1, max_queue=5, policies={'CONTINUOUS': 'drop_oldest'})
+
+    block = threading.Event()
+    received = []
+    dispatcher.submit('a', 'BLOCK', block.wait)
+    while dispatcher.stats()['queued'] > 0:
+        time.sleep(0.001)
+
+    dispatcher.submit('b', 'DATA', received.append, 'data')
+    for i in range(3):
+        dispatcher.submit('a', 'CONTINUOUS', received.append, i)
+    dispatcher.submit('b', 'CONTINUOUS', received.append, 'b')
+    for i in range(3, 10):
+        dispatcher.submit('a', 'CONTINUOUS', received.append, i)
+    assert dispatcher.stats()['queued'] == 5
+
+    block.set()
+    dispatcher.stop(timeout=5)
+
+    assert received == ['data', 'b', 7, 8, 9]
+    stats = dispatcher.stats()
+    assert stats['dropped'] == {'CONTINUOUS': 7}
+    assert stats['processed']['DATA'] == 1
+    assert all(not worker.is_alive() for worker in dispatcher._workers)
+
+    # with nothing of the same key to replace, the new message is dropped
+    dispatcher = Dispatcher(workers=1, max_queue=2, policies={'CONTINUOUS': 'drop_oldest'})
+    block = threading.Event()
+    dispatcher.submit('a', 'BLOCK', block.wait)
+    while dispatcher.stats()['queued'] > 0:
+        time.sleep(0.001)
+    dispatcher.submit('a', 'DATA', received.append, 'data')
+    dispatcher.submit('b', 'DATA', received.append, 'data')
+    assert not dispatcher.submit('a', 'CONTINUOUS', received.append, 'dropped')
+    block.set()
+    dispatcher.stop(timeout=5)
+    assert dispatcher.stats()['dropped'] == {'CONTINUOUS': 1}
+
+
+def test_outbox():
+    """
+    Messages in the outbox should only be returned when due, with exponential backoff,
+    until they are confirmed or run out of ttl, and peers should be limited in how many
+    messages can be in flight.
+    """
+    from autopilot.networking.outbox import Outbox
+    outbox = Outbox(interval=1, backoff=2, max_interval=3, max_in_flight=3)
+    start = time.monotonic()
+
+    for i in range(4):
+        evicted = outbox.add(f'msg_{i}', b'peer_a', [b'peer_a', f'msg_{i}'.encode()], 'send', ttl=3)
+    # the oldest message to peer_a is dropped when the fourth is added
+    assert [entry.id for entry in evicted] == ['msg_0']
+    outbox.add('msg_b', b'peer_b', [b'peer_b', b'msg_b'], 'push', ttl=1)
+    assert outbox.in_flight() == {b'peer_a': 3, b'peer_b': 1}
+
+    # nothing is due before the first interval
+    assert outbox.pop_due(start + 1.5) == ([], [])
+    assert outbox.confirm('msg_1')
+    assert not outbox.confirm('msg_1')
+
+    resend, dropped = outbox.pop_due(start + 2.5)
+    assert sorted(entry.id for entry in resend) == ['msg_2', 'msg_3', 'msg_b']
+    assert resend[0].frames[1] == resend[0].id.encode()
+    assert dropped == []
+
+    # the second resend waits twice as long
+    assert outbox.pop_due(start + 4) == ([], [])
+    resend, dropped = outbox.pop_due(start + 4.6)
+    assert sorted(entry.id for entry in resend) == ['msg_2', 'msg_3']
+    assert [entry.id for entry in dropped] == ['msg_b']
+
+    # third is capped at max_interval
+    resend, _ = outbox.pop_due(start + 7.7)
+    assert len(resend) == 2
+    # and then they've run out of ttl
+    resend, dropped = outbox.pop_due(start + 100)
+    assert resend == []
+    assert sorted(entry.id for entry in dropped) == ['msg_2', 'msg_3']
+
+    assert len(outbox) == 0
+    assert outbox.next_due() is None
+    assert outbox.stats() == {'added': 5, 'confirmed': 1, 'retries': 7, 'dropped': 3, 'evicted': 1,
+                              'pending': 0, 'in_flight': {}}
+
+
+def test_route_table():
+    """
+    Peers on the router are learned and routed to directly, everything else goes upstream,
+    and peers we haven't heard from in ``ttl`` are evicted, but still routed through the router until they're forgotten.
+    """
+    from autopilot.networking.routes import Route_Table
+    routes = Route_Table(push_id=b'T', ttl=10)
+    start = time.monotonic()
+
+    routes.learn(b'child_a', now=start)
+    routes.learn(b'child_a', now=start + 1)
+    assert routes.resolve(b'child_a').socket == 'send'
+    assert routes.resolve(b'child_a').prefix == ()
+
+    # the upstream router is addressed by the first frame already
+    upstream = routes.resolve(b'T')
+    assert (upstream.socket, upstream.prefix) == ('push', ())
+    # unknown destinations are pushed upstream addressed to it
+    unknown = routes.resolve(b'somebody')
+    assert (unknown.socket, unknown.prefix) == ('push', (b'T',))
+
+    # learning a new peer evicts the stale ones, but never the upstream route
+    routes.learn(b'child_b', now=start + 20)
+    assert b'child_a' not in routes
+    assert b'T' in routes
+    # an idle peer may still be connected, so it's still sent through the router rather than upstream
+    idle = routes.resolve(b'child_a')
+    assert idle is not routes.default
+    assert (idle.socket, idle.prefix) == ('send', ())
+    assert b'child_a' in routes
+
+    stats = routes.stats()
+    assert stats['routes'][b'child_b'] == {'received': 1, 'forwarded': 0}
+    assert stats['routes'][b'child_a'] == {'received': 2, 'forwarded': 3}
+    assert {k: stats[k] for k in ('learned', 'evicted', 'restored', 'forwarded', 'default')} == \
+           {'learned': 2, 'evicted': 1, 'restored': 1, 'forwarded': 4, 'default': 1}
+
+    # evicted routes are forgotten after forget_ttl, or the longest idle past max_evicted
+    forgotten = []
+    routes = Route_Table(push_id=b'T', ttl=10, forget_ttl=100, max_evicted=2, on_forget=forgotten.append)
+    for i, peer in enumerate((b'a', b'b', b'c', b'd')):
+        routes.learn(peer, now=start + i)
+    routes.learn(b'e', now=start + 50)
+    assert forgotten == [b'a', b'b']
+    assert routes.resolve(b'a') is routes.default
+    assert routes.resolve(b'c') is not routes.default
+    # being sent to isn't being heard from
+    routes.learn(b'f', now=start + 200)
+    assert sorted(forgotten) == [b'a', b'b', b'c', b'd', b'e']
+    assert routes.stats()['forgotten'] == 5
+
+    # without a pusher, unknown destinations are sent through the router as-is
+    routes = Route_Table(push_id=None)
+    assert routes.resolve(b'somebody').socket == 'send'
+    assert routes.resolve(b'somebody').prefix == ()
+
+
+def test_stream_queue():
+    """
+    Stream queues should block until enough items are available, time out with partial batches,
+    drop the oldest items when full, and wake waiting consumers when closed.
+    """
+    from autopilot.networking.stream import Stream_Queue
+    q = Stream_Queue(maxlen=5)
+
+    start = time.monotonic()
+    assert q.drain(min_items=1, timeout=0.05) == []
+    assert time.monotonic() - start >= 0.05
+
+    def _produce():
+        for i in range(3):
+            time.sleep(0.01)
+            q.append(i)
+    threading.Thread(target=_produce).start()
+    assert q.drain(min_items=3, timeout=1) == [0, 1, 2]
+
+    q.append(3)
+    assert q.drain(min_items=2, timeout=0.01) == [3]
+
+    for i in range(8):
+        q.append(i)
+    assert q.dropped == 3
+    assert q.drain(max_items=2) == [3, 4]
+    assert q.popleft() == 5
+
+    with pytest.raises(IndexError):
+        Stream_Queue().popleft()
+
+    threading.Timer(0.05, q.close).start()
+    assert q.drain(min_items=5) == [6, 7]
+    assert q.drain(min_items=5) == []
+
+
+def test_stream_latency(node_params):
+    """
+    Streams should send partial batches after ``max_latency`` , and not spin while idle
+    """
+    received = []
+    def l_array(value):
+        received.append(value)
+
+    node_1_params = node_params(
+        id="stream_a",
+        router_port=np.random.randint(*PORTRANGE),
+        listens={'ARRAY': l_array}
+    )
+    node_2_params = node_params(
+        id='stream_b',
+        upstream='stream_a',
+        port=node_1_params['router_port'],
+        listens={}
+    )
+    node_1 = Net_Node(**node_1_params)
+    node_2 = Net_Node(**node_2_params)
+
+    try:
+        q = node_2.get_stream('test', 'ARRAY', min_size=5, upstream='stream_a',
+                              port=node_1_params['router_port'], ip='localhost', max_latency=50)
+        # idle streams wait rather than polling the queue
+        cpu_start = time.process_time()
+        time.sleep(0.5)
+        assert time.process_time() - cpu_start < 0.25
+
+        for i in range(2):
+            q.append({'i': i, 'arr': np.random.rand(10)})
+        time.sleep(0.2)
+        assert [value['i'] for value in received] == [0, 1]
+
+        for i in range(2, 7):
+            q.append({'i': i, 'arr': np.random.rand(10)})
+        q.append('END')
+        time.sleep(0.2)
+        assert [value['i'] for value in received] == list(range(7))
+        node_2.streams['test'].join(1)
+        assert not node_2.streams['test'].is_alive()
+    finally:
+        node_1.release()
+        node_2.release()
+
+
+@pytest.mark.parametrize('codec', ['lz4', 'zstd'])
+def test_blosc_codec(codec):
+    """
+    Arrays can be compressed with specific blosc codecs and levels in both message formats
+    """
+    arr = np.tile(np.arange(100, dtype=np.uint16), (50, 1))
+    msg = Message(to='test', sender='test', key='test', id='test', value={'arr': arr},
+                  blosc={'codec': codec, 'clevel': 5})
+    frames = msg.serialize_frames()
+    assert len(frames[0]) < arr.nbytes
+    assert np.array_equal(Message(frames, expand_arrays=True).value['arr'], arr)
+    assert np.array_equal(Message(msg.serialize(), expand_arrays=True).value['arr'], arr)
+
+
+def test_stream_tuner():
+    """
+    Adaptive streams batch items to hit their target message rate,
+    and only compress once the link is a bottleneck
+    """
+    from autopilot.networking.stream import Stream_Tuner
+    tuner = Stream_Tuner(batch_size=5, max_size=50, target_interval=0.1, explore_every=1)
+    payload = [{'frame': np.zeros((100, 100), dtype=np.uint8)}]
+
+    # 200 items/s * 0.1s
+    for i in range(20):
+        tuner.observe_items(20, now=i * 0.1)
+    batch_size, compression = tuner.update(payload)
+    assert batch_size == 20
+    assert compression is False
+
+    # a slow link makes compression worth it, and lengthens the interval
+    tuner.observe_busy(100000, 1)
+    batch_size, compression = tuner.update(payload)
+    assert isinstance(compression, dict)
+    assert batch_size == 25
+
+    # but incompressible data is still sent raw
+    noise = [{'frame': np.random.randint(0, 256, (100, 100), dtype=np.uint8)}]
+    _, compression = tuner.update(noise)
+    assert compression is False
+
+
+def test_stream_adaptive(node_params):
+    """
+    Adaptive streams deliver all their items and report their statistics
+    """
+    received = []
+    node_1_params = node_params(
+        id="adaptive_a",
+        router_port=np.random.randint(*PORTRANGE),
+        listens={'FRAME': received.append}
+    )
+    node_2_params = node_params(
+        id='adaptive_b',
+        upstream='adaptive_a',
+        port=node_1_params['router_port'],
+    )
+    node_1 = Net_Node(**node_1_params)
+    node_2 = Net_Node(**node_2_params)
+
+    try:
+        q = node_2.get_stream('test', 'FRAME', min_size=2, upstream='adaptive_a',
+                              port=node_1_params['router_port'], ip='localhost', adaptive=True)
+        for i in range(100):
+            q.append({'i': i, 'frame': np.full((64, 64), i, dtype=np.uint8)})
+            time.sleep(0.002)
+        q.close()
+        node_2.streams['test'].join(2)
+        time.sleep(0.2)
+
+        assert [value['i'] for value in received] == list(range(100))
+        assert np.array_equal(received[-1]['frame'], np.full((64, 64), 99, dtype=np.uint8))
+
+        stats = q.stats.as_dict()
+        assert stats['messages'] > 0
+        assert stats['bytes_per_s'] > 0
+        assert stats['items_per_s'] > 0
+        assert stats['latency_ms'] is not None
+        assert stats['queue_depth'] == 0
+        assert stats['dropped'] == 0
+        if stats['compression']:
+            assert stats['compression_ratio'] > 1
+    finally:
+        node_1.release()
+        node_2.release()
+
+
+def test_shm_ring():
+    """
+    Buffers written to a shared memory ring can be read back until they're overwritten,
+    and small or oversized buffers are left to be sent as frames.
+    """
+    from autopilot.networking.shm import Shm_Ring, read_shm, Shm_Overwritten
+    ring = Shm_Ring(2 ** 16, min_size=1024)
+    try:
+        assert ring.write(b'small') is None
+        assert ring.write(bytes(2 ** 17)) is None
+
+        buffers = [np.random.bytes(20000) for _ in range(4)]
+        descriptors = [ring.write(memoryview(buffer)) for buffer in buffers]
+        # the fourth didn't fit at the end and wrapped, overwriting the first
+        assert descriptors[3][1] == 2 ** 16
+        with pytest.raises(Shm_Overwritten):
+            read_shm(descriptors[0])
+        for buffer, descriptor in zip(buffers[1:], descriptors[1:]):
+            assert read_shm(descriptor) == buffer
+    finally:
+        ring.close()
+
+
+def test_shm_message():
+    """
+    Messages can carry large arrays in shared memory, leaving small ones as frames,
+    and be converted back to self-contained messages for peers off the host.
+    """
+    from autopilot.networking.shm import Shm_Ring
+    from autopilot.networking.message import frame_has_shm
+    ring = Shm_Ring(2 ** 20)
+    big = np.random.rand(100, 100)
+    small = np.arange(10)
+    try:
+        msg = Message(to='test', sender='test', key='test', id='test',
+                      value={'big': big, 'small': small}, blosc=False)
+        frames = msg.serialize_frames(shm=ring)
+        # only the small array is sent as a frame
+        assert len(frames) == 2
+        assert frame_has_shm(frames[-1])
+        assert sum(len(f) if isinstance(f, bytes) else f.nbytes for f in frames) < big.nbytes
+
+        received = Message([bytes(f) for f in frames], expand_arrays=True)
+        assert np.array_equal(received.value['big'], big)
+        assert np.array_equal(received.value['small'], small)
+
+        # unexpanded messages can be materialized for forwarding
+        forwarded = Message([bytes(f) for f in frames]).serialize_frames()
+        assert len(forwarded) == 3
+        assert not frame_has_shm(forwarded[-1])
+        assert np.array_equal(Message(forwarded, expand_arrays=True).value['big'], big)
+        legacy = Message([bytes(f) for f in frames]).serialize()
+        assert np.array_equal(Message(legacy, expand_arrays=True).value['big'], big)
+
+        # frames with shared memory aren't reused
+        assert msg.serialize_frames() is not frames
+    finally:
+        ring.close()
+
+
+def test_shm_negotiation(node_params):
+    """
+    Nodes on the same host with ``MSG_SHM`` enabled send large arrays through shared memory
+    """
+    from autopilot import prefs
+    prefs.set('MSG_SHM', True)
+
+    received = []
+    port = np.random.randint(*PORTRANGE)
+    try:
+        node_1 = Net_Node(**node_params(id='shm_a', router_port=port, listens={'ARRAY': received.append}))
+        node_2 = Net_Node(**node_params(id='shm_b', upstream='shm_a', port=port, listens={'ARRAY': received.append}))
+    finally:
+        prefs.set('MSG_SHM', False)
+
+    arr = np.random.rand(200, 200)
+    try:
+        time.sleep(0.1)
+        node_2.send(to='shm_a', key='ARRAY', value=arr)
+        time.sleep(0.1)
+        assert b'shm_b' in node_1.shm_peers
+        assert node_1._shm_ring is None
+
+        node_1.send(to='shm_b', key='ARRAY', value=arr)
+        time.sleep(0.1)
+        assert node_1._shm_ring is not None
+        assert len(received) == 2
+        for value in received:
+            assert np.array_equal(value, arr)
+    finally:
+        node_1.release()
+        node_2.release()
+
+
+def test_file_transfer(tmp_path):
+    """
+    Files should be sent in chunks that can arrive in any order, resume after being interrupted,
+    be checked against their hash, and be cached by their hash on the receiving end.
+    """
+    from autopilot.networking.transfer import File_Server, File_Cache, file_hash
+
+    root = tmp_path / 'sounds'
+    (root / 'sub').mkdir(parents=True)
+    contents = np.random.default_rng(0).integers(0, 255, 10000, dtype=np.uint8).tobytes()
+    (root / 'sub' / 'sound.wav').write_bytes(contents)
+
+    server = File_Server(str(root), chunk_size=1024)
+    source = server.source('sub/sound.wav')
+    assert server.source('sub/sound.wav') is source
+    info = source.info('sub/sound.wav')
+    assert info['n_chunks'] == 10
+    assert info['hash'] == file_hash(str(root / 'sub' / 'sound.wav'))
+    with pytest.raises(ValueError):
+        server.source('../sounds_outside.wav')
+
+    cache = File_Cache(str(tmp_path / 'cache'))
+    receiver = cache.receiver(info)
+    chunks = receiver.next_chunks(4)
+    assert chunks == [0, 1, 2, 3]
+    # nothing more until some arrive
+    assert receiver.next_chunks(4) == []
+    for index, data in reversed(list(source.read_chunks(chunks))):
+        assert receiver.write(index, data.tobytes())
+    # duplicates are ignored
+    assert not receiver.write(0, contents[:1024])
+    receiver.close()
+
+    # a new receiver resumes from the chunks that were written
+    receiver = cache.receiver(info)
+    assert receiver.missing == list(range(4, 10))
+    assert receiver.next_chunks(100) == list(range(4, 10))
+    for index, data in source.read_chunks(receiver.next_chunks(100, retry=True)):
+        receiver.write(index, data.tobytes())
+    assert receiver.complete
+    assert receiver.finish()
+    assert info['hash'] in cache
+
+    dest = tmp_path / 'pilot_sounds' / 'sub' / 'sound.wav'
+    cache.link(info['hash'], str(dest))
+    assert dest.read_bytes() == contents
+
+    # corrupted files are discarded
+    (root / 'sub' / 'sound.wav').write_bytes(contents[::-1])
+    changed = server.source('sub/sound.wav')
+    assert changed is not source and changed.hash != source.hash
+    receiver = cache.receiver(changed.info('sub/sound.wav'))
+    for index, data in changed.read_chunks(range(changed.n_chunks)):
+        receiver.write(index, bytes(len(data)))
+    assert not receiver.finish()
+    assert changed.hash not in cache
+    assert cache.receiver(changed.info('sub/sound.wav')).missing == list(range(10))
+
+    # discarded receivers ignore late chunks and leave no partial files behind
+    receiver = cache.receiver(changed.info('sub/sound.wav'))
+    receiver.discard()
+    assert not receiver.write(0, bytes(1024))
+    assert not os.path.exists(receiver.part_path)
+    assert not os.path.exists(receiver.part_path + '.chunks')
+
+
+def test_message_expand():
+    """
+    Arrays in received messages should be expanded on request, whether they were sent as binary or legacy JSON
+    """
+    data = np.frombuffer(bytes(range(256)) * 4, dtype=np.uint8)
+    msg = Message(to='test', sender='test', key='FILE_CHUNK', id='test',
+                  value={'path': 'a.wav', 'index': 0, 'data': data}, flags={'MINPRINT': True})
+
+    legacy = Message(msg.serialize())
+    assert isinstance(legacy.value['data'], dict)
+    legacy.expand()
+    assert np.array_equal(legacy.value['data'], data)
+
+    _, frames = split_frames([b'test', *[bytes(f) for f in msg.serialize_frames()]])
+    binary = Message(frames)
+    binary.expand()
+    assert np.array_equal(binary.value['data'], data)
+    assert binary.value['path'] == 'a.wav'
+    assert 'VALUE' not in str(binary)
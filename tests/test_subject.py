@@ -72,6 +72,311 @@ def test_assign(dummy_subject:Subject, dummy_protocol_file:Path):
     assert str(protocol_list) == history['value'][0]
     assert '0' == history['value'][1]
 
+def test_protocol_cache(dummy_subject:Subject, dummy_protocol_file:Path):
+    """
+    Protocol status is cached, setters write through to the file, and changes made by
+    another object with the same file are picked up.
+    """
+    dummy_subject.assign_protocol(dummy_protocol_file.stem)
+    other = Subject(file=dummy_subject.file)
+
+    dummy_subject.current_trial = 10
+    dummy_subject.session = 2
+    assert dummy_subject.protocol.current_trial == 10
+    assert other.current_trial == 10
+    assert other.session == 2
+
+    # modifying the returned status doesn't change the cache
+    status = other.protocol
+    status.current_trial = 100
+    assert other.current_trial == 10
+
+    other.step = 1
+    assert dummy_subject.step == 1
+    assert dummy_subject.task == dummy_subject.protocol.protocol[1]
+    assert dummy_subject.history.dict()['type'][-1] == 'step'
+
+    # a fresh subject object reads the same status from disk
+    assert Subject(file=dummy_subject.file).protocol.dict() == dummy_subject.protocol.dict()
+
+def test_trial_writer(tmp_path):
+    """
+    Trial data is buffered and appended in bulk, completed rows can be returned to,
+    and unflushed data can be recovered from the journal.
+    """
+    import numpy as np
+    import tables
+    from autopilot.data.writer import Trial_Writer, read_journal
+
+    h5f = tables.open_file(str(tmp_path / 'writer.h5'), mode='w')
+    table = h5f.create_table('/', 'trial_data', description={
+        'trial_num': tables.Int64Col(),
+        'correct': tables.Int8Col(),
+        'session': tables.Int64Col(),
+    })
+    journal = tmp_path / 'writer.journal'
+    writer = Trial_Writer(table, defaults={'session': 3, 'not_a_column': 1}, journal=journal,
+                          context={'trial_table': '/trial_data'}, max_rows=3)
+
+    for i in range(2):
+        writer.journal({'trial_num': i, 'correct': 1})
+        writer.set('trial_num', i)
+        writer.set('correct', 1)
+        assert writer.complete
+        writer.append()
+    # nothing written until max_rows
+    assert table.nrows == 0 and writer.pending == 2
+    assert len(read_journal(journal)[0][1]) == 2
+
+    # return to a buffered row
+    writer.set('trial_num', 2)
+    assert writer.seek('trial_num', 0) == 1
+    assert writer.returned and writer.is_set('correct')
+    writer.set('correct', 0)
+    writer.append()
+    # and then back to the row we were filling
+    assert not writer.returned
+    assert writer.get('trial_num') == 2
+    writer.append()
+    assert table.nrows == 3 and writer.pending == 0
+    assert table.col('correct').tolist() == [0, 1, 0]
+    assert (table.col('session') == 3).all()
+    # only the header is left in the journal
+    assert read_journal(journal) == [({'trial_table': '/trial_data'}, [])]
+
+    # and to a row in the table
+    assert writer.seek('trial_num', 1) == 1
+    writer.set('correct', 0)
+    writer.append()
+    assert table.col('correct').tolist() == [0, 0, 0]
+
+    writer.set('trial_num', np.int64(3))
+    writer.close()
+    assert table.nrows == 4
+    assert not journal.exists()
+    h5f.close()
+
+def test_journal(tmp_path):
+    """
+    The binary journal keeps records until they are discarded, survives a torn last record,
+    and is locked while open.
+    """
+    from autopilot.data.writer import Journal, read_journal, journal_in_use, fcntl
+
+    path = tmp_path / 'subject.h5.session.journal'
+    journal = Journal(path, context={'trial_table': '/trial_data'}, sync_interval=0)
+    seqs = [journal.append({'trial_num': i}) for i in range(3)]
+    assert seqs == [1, 2, 3]
+    assert read_journal(path) == [({'trial_table': '/trial_data'}, [{'trial_num': i} for i in range(3)])]
+    if fcntl is not None:
+        assert journal_in_use(path)
+
+    # stored records are dropped
+    journal.discard(3)
+    assert read_journal(path)[0][1] == [{'trial_num': 2}]
+    journal.close(remove=True)
+    # not removed while it has records left
+    assert path.exists() and not journal_in_use(path)
+
+    # a torn record and anything after it are ignored
+    with open(path, 'ab') as jfile:
+        jfile.write(b'\x10\x00\x00\x00partial')
+    assert read_journal(path)[0][1] == [{'trial_num': 2}]
+
+def test_recover_journal(dummy_subject:Subject, dummy_protocol_file:Path):
+    """
+    Journaled trials are written once, even if the session crashed after flushing some of them
+    to the table but before discarding them from the journal, and data missing from the flushed rows is filled in.
+    """
+    import tables
+    from autopilot.data.writer import Journal, Trial_Writer
+
+    dummy_subject.assign_protocol(dummy_protocol_file.stem)
+    with tables.open_file(str(dummy_subject.file), 'r') as h5f:
+        trial_table_path = [node._v_pathname for node in h5f.walk_nodes('/', classname='Table')
+                            if node.name == 'trial_data'][0]
+
+    session = {'session': 1, 'session_uuid': 'crashed'}
+    journal = Journal(dummy_subject.file.with_name(f'{dummy_subject.file.name}.crashed.journal'),
+                      context={'trial_table': trial_table_path, **session}, sync_interval=10)
+    for data in ({'trial_num': 0}, {'trial_num': 0, 'target': 'L', 'TRIAL_END': True},
+                 {'trial_num': 1, 'target': 'R', 'TRIAL_END': True}, {'trial_num': 2, 'target': 'L'}):
+        journal.append(data)
+    # the last records wait to be synced until they're due
+    assert 0 < journal.sync_due() <= 10
+    journal.sync()
+    assert journal.sync_due() is None
+    journal.close(remove=False)
+
+    # the first trial was flushed before we crashed, but not everything for it
+    with tables.open_file(str(dummy_subject.file), 'a') as h5f:
+        writer = Trial_Writer(h5f.get_node(trial_table_path), defaults=session)
+        writer.set('trial_num', 0)
+        writer.close()
+
+    dummy_subject._recover_journal()
+    # recovering again doesn't find anything
+    dummy_subject._recover_journal()
+    assert not journal.path.exists()
+
+    with tables.open_file(str(dummy_subject.file), 'r') as h5f:
+        rows = h5f.get_node(trial_table_path).read_where('session_uuid == b"crashed"')
+    assert rows['trial_num'].tolist() == [0, 1, 2]
+    assert rows['target'].tolist() == [b'L', b'R', b'L']
+
+def test_trial_writer_index(tmp_path):
+    """
+    Rows from this session are returned to from the index map, and rows from other sessions aren't returned to.
+    """
+    import tables
+    from autopilot.data.writer import Trial_Writer
+
+    h5f = tables.open_file(str(tmp_path / 'writer_index.h5'), mode='w')
+    table = h5f.create_table('/', 'trial_data', description={
+        'trial_num': tables.Int64Col(),
+        'correct': tables.Int8Col(),
+        'session_uuid': tables.StringCol(64),
+    })
+    table.cols.trial_num.create_index()
+
+    old = Trial_Writer(table, defaults={'session_uuid': 'old'}, max_rows=1)
+    old.set('trial_num', 5)
+    old.append()
+
+    writer = Trial_Writer(table, defaults={'session_uuid': 'new'}, max_rows=2,
+                          index='trial_num', index_size=2, scope=('session_uuid',))
+    for i in range(3):
+        writer.set('trial_num', i)
+        writer.append()
+
+    # the oldest is evicted from the map, but still found in the table
+    assert list(writer._recent.keys()) == [1, 2]
+    assert writer.seek('trial_num', 0) == 1
+    writer.append()
+    # buffered rows are found from the map
+    assert writer.seek('trial_num', 2) == 1
+    writer.set('correct', 1)
+    writer.append()
+    # rows from another session aren't
+    assert writer.seek('trial_num', 5) == 0
+    writer.close()
+
+    assert table.col('correct').tolist() == [0, 0, 0, 1]
+    h5f.close()
+
+def test_continuous_writer(tmp_path):
+    """
+    Continuous data is stored in per-channel earrays with epoch timestamps,
+    and can be read back by time range.
+    """
+    import numpy as np
+    import tables
+    from datetime import datetime, timedelta
+    from autopilot.data.writer import Continuous_Writer, read_continuous, search_sorted
+
+    h5f = tables.open_file(str(tmp_path / 'continuous.h5'), mode='w')
+    writer = Continuous_Writer(h5f, '/continuous_data/session_1', chunk_rows=16)
+
+    start = datetime.now()
+    writer.append({'timestamp': start.isoformat(), 'wheel': 0.0, 'frame': np.zeros((4, 4), dtype=np.uint8),
+                   'subject': 'sub', 'continuous': True})
+    writer.extend([{'timestamp': (start + timedelta(seconds=i)).isoformat(),
+                    'wheel': float(i), 'frame': np.full((4, 4), i, dtype=np.uint8)} for i in range(1, 100)])
+    assert writer.counters == {'wheel': 100, 'frame': 100}
+    assert 'subject' not in h5f.root.continuous_data.session_1
+
+    frames = h5f.root.continuous_data.session_1.frame.data
+    assert frames.shape == (100, 4, 4)
+    assert frames.chunkshape == (16, 4, 4)
+
+    timestamps, wheel = read_continuous(h5f, '/continuous_data/session_1/wheel',
+                                        start=start + timedelta(seconds=10),
+                                        stop=(start + timedelta(seconds=19)).timestamp())
+    assert wheel.tolist() == [float(i) for i in range(10, 20)]
+    assert timestamps[0] == (start + timedelta(seconds=10)).timestamp()
+
+    timestamps, frames = read_continuous(h5f, '/continuous_data/session_1/frame', start=start + timedelta(seconds=98))
+    assert frames.shape == (2, 4, 4)
+    assert (frames[-1] == 99).all()
+
+    # the timestamp range is found without reading every chunk, and matches numpy
+    times = h5f.create_earray('/', 'times', atom=tables.Float64Atom(), shape=(0,), chunkshape=(4,))
+    values = np.repeat(np.arange(15, dtype=np.float64), 2)
+    times.append(values)
+    for value in (-1, 0, 3, 3.5, 7, 14, 15):
+        for side in ('left', 'right'):
+            assert search_sorted(times, value, side) == np.searchsorted(values, value, side)
+    h5f.close()
+
+def test_trial_query(tmp_path):
+    """
+    Filters are pushed down to the table and selected columns are converted without validation
+    """
+    import numpy as np
+    import tables
+    from autopilot.data.query import Trial_Query, rows_to_frame
+
+    h5f = tables.open_file(str(tmp_path / 'query.h5'), mode='w')
+    table = h5f.create_table('/', 'trial_data', description={
+        'trial_num': tables.Int64Col(),
+        'session': tables.Int64Col(),
+        'session_uuid': tables.StringCol(36),
+        'timestamp': tables.StringCol(26),
+        'response': tables.StringCol(8),
+    })
+    rows = np.zeros(10, dtype=table.dtype)
+    rows['trial_num'] = np.arange(10)
+    rows['session'] = np.arange(10) // 5
+    rows['session_uuid'] = [b'a'] * 5 + [b'b'] * 5
+    rows['timestamp'] = [f'2022-01-{i+1:02d}T12:00:00.000000'.encode() for i in range(10)]
+    rows['response'] = [b'L', b'R'] * 5
+    table.append(rows)
+    table.flush()
+
+    df = rows_to_frame(Trial_Query(columns=['trial_num', 'response'], session=1).read(table))
+    assert list(df.columns) == ['trial_num', 'response']
+    assert df['trial_num'].tolist() == [5, 6, 7, 8, 9]
+    assert df['response'].tolist() == ['R', 'L', 'R', 'L', 'R']
+
+    query = Trial_Query(session_uuid='a', trials=(1, None), stop='2022-01-04')
+    assert query.read(table)['trial_num'].tolist() == [1, 2]
+
+    query = Trial_Query(columns=['trial_num'], trials=(2, 7))
+    chunks = list(query.iter(table, chunksize=4))
+    assert [chunk['trial_num'].tolist() for chunk in chunks] == [[2, 3], [4, 5, 6, 7]]
+
+    with pytest.raises(ValueError):
+        Trial_Query(columns=['not_a_column']).read(table)
+    h5f.close()
+
+def test_subject_service(dummy_subject:Subject, dummy_protocol_file:Path):
+    """
+    Subjects can be read, written, and called through the storage service process
+    """
+    from autopilot.data.service import Subject_Service, Subject_Dict
+
+    service = Subject_Service(dir=dummy_subject.file.parent, timeout=10)
+    service.start()
+    try:
+        sub = service.subject(dummy_subject.name)
+        assert sub.info == dummy_subject.info
+
+        sub.assign_protocol(dummy_protocol_file.stem)
+        assert sub.protocol_name == dummy_protocol_file.stem
+        sub.step = 1
+        assert sub.step == 1
+
+        with pytest.raises(AttributeError):
+            sub.not_a_method()
+
+        # subjects put in a service dict are replaced with proxies
+        subjects = Subject_Dict(service)
+        subjects[dummy_subject.name] = dummy_subject
+        assert subjects[dummy_subject.name].step == 1
+    finally:
+        service.stop()
+    assert not service.is_alive()
+
 def test_history():
     """
     We correctly store changes in step, protocol, in the history table and can retreive them
@@ -141,6 +446,24 @@ def test_graduation_filtration():
     After assigning steps out of order, test that we correctly filter data given to the graduation object
     """
 
+def test_graduation_checkpoint():
+    """
+    Graduation objects can be restored from a checkpoint rather than the trial history
+    """
+    import json
+    from autopilot.tasks.graduation import Accuracy, NTrials
+
+    grad = Accuracy(threshold=0.5, window=3, correct=[1, 0, 1, 1])
+    checkpoint = json.loads(json.dumps(grad.checkpoint()))
+    assert checkpoint == {'corrects': [0, 1, 1]}
+
+    restored = Accuracy(threshold=0.5, window=3, correct=[])
+    restored.restore(checkpoint)
+    assert list(restored.corrects) == list(grad.corrects)
+    assert restored.update({'correct': 1}) == grad.update({'correct': 1}) == True
+
+    assert NTrials(n_trials=10).checkpoint() == {}
+
 def test_get_data_no_plugin():
     """
     We are able to load data from the subject even when we no longer have the plugin source in the plugin directory
@@ -0,0 +1,57 @@
+"""
+Test loading and summarizing data for visualization
+"""
+import os
+
+import pytest
+import pandas as pd
+
+pytest.importorskip('bokeh')
+pytest.importorskip('colorcet')
+
+import autopilot.utils.common
+from autopilot.viz import trial_viewer
+
+
+def test_load_subject_dir_cache(tmp_path, monkeypatch):
+    """
+    Subjects are only loaded again when their files change, and subjects that can't be loaded are skipped
+    """
+    loads = []
+
+    def load_frames(data_dir, subject_name, steps=True, grad=True):
+        loads.append(subject_name)
+        if subject_name == 'broken':
+            raise ValueError(f'Could not read {subject_name}')
+        return (pd.DataFrame({'trial_num': [1, 2], 'correct': [0, 1]}),
+                pd.DataFrame({'time': ['2022-01-01T00:00:00'], 'step_n': [0], 'name': ['assigned']}))
+
+    monkeypatch.setattr(trial_viewer, '_load_subject_frames', load_frames)
+    monkeypatch.setattr(autopilot.utils.common, 'load_pilotdb', lambda reverse=False: {'a': 'pilot_1'})
+    for name in ('a', 'b'):
+        (tmp_path / f'{name}.h5').write_bytes(b'data')
+
+    step_data, grad_data = trial_viewer.load_subject_dir(str(tmp_path), processes=1)
+    assert sorted(loads) == ['a', 'b']
+    assert sorted(step_data['subject'].unique()) == ['a', 'b']
+    assert step_data[step_data['subject'] == 'a']['pilot'].tolist() == ['pilot_1', 'pilot_1']
+    assert len(grad_data) == 2
+
+    # unchanged files aren't opened again
+    loads.clear()
+    cached_steps, cached_grad = trial_viewer.load_subject_dir(str(tmp_path), processes=1)
+    assert loads == []
+    pd.testing.assert_frame_equal(cached_steps.reset_index(drop=True), step_data.reset_index(drop=True))
+    pd.testing.assert_frame_equal(cached_grad.reset_index(drop=True), grad_data.reset_index(drop=True))
+
+    # only a changed file is
+    stat = os.stat(tmp_path / 'b.h5')
+    os.utime(tmp_path / 'b.h5', ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    trial_viewer.load_subject_dir(str(tmp_path), processes=1)
+    assert loads == ['b']
+
+    loads.clear()
+    (tmp_path / 'broken.h5').write_bytes(b'data')
+    step_data, _ = trial_viewer.load_subject_dir(str(tmp_path), processes=1)
+    assert loads == ['broken']
+    assert sorted(step_data['subject'].unique()) == ['a', 'b']